@@ -3,8 +3,9 @@ Return a random dog picture, from https://random.dog
 
 see: https://github.com/AdenFlorian/random.dog
 """
-from jjmojojjmojo.circuitbreaker import RedisCircuitBreaker, errors
-from jjmojojjmojo.circuitbreaker.tests.util import IntermittentFailer, Failure
+from jjmojojjmojo.circuitbreaker import errors
+from jjmojojjmojo.circuitbreaker.adapters import mount
+from jjmojojjmojo.circuitbreaker.tests.util import IntermittentFailer
 import requests
 from webob import Request, Response
 from webob.static import DirectoryApp
@@ -15,15 +16,7 @@ import logging
 # assets.
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 
-def random_dog():
-    """
-    Super-simple remote web request using the requests library.
-    
-    Returns a dictionary that contans a single member 'url', 
-    containing a direct link to a random picture or video of a dog.
-    """
-    r = requests.get("https://random.dog/woof.json")
-    return r.json()
+DOG_URL = "https://random.dog/woof.json"
 
 class App:
     """
@@ -31,22 +24,47 @@ class App:
     """
     def __init__(self, redis_url):
         """
-        Constructor - sets up the RedisCircuitBreaker using an IntermittentFailer
-        to ensure it fails at a predictable rate.
+        Constructor - mounts a breaker adapter on a requests Session, so every
+        request to random.dog goes through a breaker for its host, stored in
+        redis.
+        
+        The adapter's requests are sent through an IntermittentFailer, to 
+        ensure they fail (with a connection error) at a predictable rate.
         
         You may want to fiddle with the configuration of the failer to produce 
         different failure patterns.
         """
-        self.random_dog = RedisCircuitBreaker(
-            subject=IntermittentFailer(random_dog, 5, 8),
-            redis_url=redis_url,
-            key="random.dog",
+        self.session = requests.Session()
+        
+        self.adapter = mount(
+            self.session,
+            f"{redis_url}?expires=300",
             failures=5,
-            timeout=10,
-            expires=300)
+            timeout=10)
+        
+        # fail 8 requests out of every 12, before they reach the network
+        send = self.adapter.breakers.subject
+        failer = IntermittentFailer(True, 5, 8, on_fail=requests.ConnectionError)
+        
+        def flaky_send(request, **kwargs):
+            failer()
+            return send(request, **kwargs)
+        
+        self.adapter.breakers.subject = flaky_send
         
         # a cache for the last dog that was successfully retrieved.
         self.last_dog = None
+    
+    def random_dog(self):
+        """
+        Super-simple remote web request using the requests library.
+        
+        Returns a dictionary that contans a single member 'url', 
+        containing a direct link to a random picture or video of a dog.
+        """
+        r = self.session.get(DOG_URL)
+        r.raise_for_status()
+        return r.json()
             
     def front_end(self):
         """
@@ -89,7 +107,7 @@ class App:
         response.json = {
             'dog': self.last_dog,
             'status': status,
-            'cb': self.random_dog.dict()
+            'cb': self.adapter.breaker(DOG_URL).dict()
         }
         
         return response
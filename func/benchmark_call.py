@@ -0,0 +1,59 @@
+"""
+Measure the cost of a single call through a breaker, from one thread, with
+and without coalescing (see the singleflight module).
+
+Each row is the best of several runs of `calls` calls, in microseconds per
+call. "bare" is the subject called directly, the rest go through a breaker on
+a MemoryDriver, where there is no I/O to hide the breaker's own overhead:
+
+    $ python func/benchmark_call.py --calls 100000 --runs 10
+
+Doesn't need a redis server.
+"""
+
+import argparse
+import sys
+import time
+
+from jjmojojjmojo.circuitbreaker import CircuitBreaker
+from jjmojojjmojo.circuitbreaker.drivers import MemoryDriver
+
+def subject():
+    return True
+
+def measure(func, calls, runs):
+    """
+    Call func `calls` times, `runs` times over, return the fastest run's
+    microseconds per call.
+    """
+    best = None
+
+    for run in range(runs):
+        start = time.perf_counter()
+        for i in range(calls):
+            func()
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best / calls * 1e6
+
+parser = argparse.ArgumentParser(description='Measure the per-call cost of a breaker, with and without coalescing.')
+parser.add_argument('-c', '--calls', type=int, default=100000, help="Calls per run")
+parser.add_argument('-n', '--runs', type=int, default=10, help="Runs, the fastest is reported")
+
+if __name__ == '__main__':
+    opts = parser.parse_args()
+
+    rows = [
+        ("bare", subject),
+        ("default", CircuitBreaker(MemoryDriver(), subject, "breaker")),
+        ("off", CircuitBreaker(MemoryDriver(), subject, "breaker", coalesce=False)),
+        ("on", CircuitBreaker(MemoryDriver(), subject, "breaker", coalesce=True)),
+    ]
+
+    sys.stdout.write(f"{'coalesce':>8} {'us per call':>12}\n")
+
+    for label, func in rows:
+        sys.stdout.write(f"{label:>8} {measure(func, opts.calls, opts.runs):>12.2f}\n")
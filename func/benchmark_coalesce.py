@@ -0,0 +1,96 @@
+"""
+Measure the back-end reads made by a burst of concurrent calls to one breaker,
+with and without coalescing (see the singleflight module).
+
+Every burst starts `threads` calls to the same breaker at once, and counts the
+loads that reach redis. Without coalescing that's one per thread, with it it
+should be close to one per burst.
+
+    $ python func/benchmark_coalesce.py --redis-url redis://localhost:6379/9 --threads 64 --bursts 50
+
+Requires a running redis server. Only keys under the benchmark prefix are
+written, and they are deleted when the run finishes.
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+import redis
+
+from jjmojojjmojo.circuitbreaker import CircuitBreaker
+from jjmojojjmojo.circuitbreaker.drivers import RedisDriver
+
+class CountingRedisDriver(RedisDriver):
+    """
+    Counts the loads that reach redis.
+    """
+    def __init__(self, *args, **kwargs):
+        RedisDriver.__init__(self, *args, **kwargs)
+        self.loads = 0
+        self._count_lock = threading.Lock()
+
+    def load(self, key):
+        with self._count_lock:
+            self.loads += 1
+        return RedisDriver.load(self, key)
+
+def subject():
+    return True
+
+def benchmark(connection, coalesce, threads, bursts, out=sys.stdout):
+    """
+    Run `bursts` bursts of `threads` concurrent calls through one breaker.
+    """
+    driver = CountingRedisDriver(redis_connection=connection, prefix="rcb-bench-coalesce:")
+    breaker = CircuitBreaker(driver, subject, "breaker", coalesce=coalesce)
+
+    barrier = threading.Barrier(threads + 1)
+    stop = False
+
+    def worker():
+        while True:
+            barrier.wait()
+            if stop:
+                return
+            breaker()
+            barrier.wait()
+
+    pool = [threading.Thread(target=worker) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+
+    try:
+        elapsed = 0
+
+        for i in range(bursts):
+            start = time.perf_counter()
+            barrier.wait()
+            barrier.wait()
+            elapsed += time.perf_counter() - start
+
+        stop = True
+        barrier.wait()
+    finally:
+        for thread in pool:
+            thread.join()
+        driver.delete_many(["breaker"])
+
+    label = "on" if coalesce else "off"
+    out.write(f"{label:>8} {driver.loads / bursts:>16.2f} {elapsed / bursts * 1000:>12.2f}\n")
+
+parser = argparse.ArgumentParser(description='Count the back-end reads made by bursts of concurrent calls, with and without coalescing.')
+parser.add_argument('-r', '--redis-url', type=str, default="redis://localhost:6379/9", help="Redis connection URL")
+parser.add_argument('-t', '--threads', type=int, default=64, help="Concurrent calls per burst")
+parser.add_argument('-b', '--bursts', type=int, default=50, help="Number of bursts")
+
+if __name__ == '__main__':
+    opts = parser.parse_args()
+
+    connection = redis.StrictRedis.from_url(opts.redis_url, max_connections=opts.threads * 2)
+
+    sys.stdout.write(f"{'coalesce':>8} {'reads per burst':>16} {'burst ms':>12}\n")
+
+    for coalesce in (False, True):
+        benchmark(connection, coalesce, opts.threads, opts.bursts)
@@ -0,0 +1,70 @@
+"""
+Compare the hash and packed RedisDriver encodings.
+
+Writes the same breakers in both encodings, then reports the redis memory used
+per key (MEMORY USAGE) and the time it takes the client to decode each one.
+
+    $ python func/benchmark_encoding.py --redis-url redis://localhost:6379/9 --count 10000
+
+Requires a running redis server. Only keys under the benchmark prefixes are
+written, and they are deleted when the run finishes.
+"""
+
+import argparse
+import sys
+import time
+import timeit
+
+import redis
+
+from jjmojojjmojo.circuitbreaker.drivers import RedisDriver
+
+def benchmark(connection, encoding, count, out=sys.stdout):
+    """
+    Write, measure, and clean up `count` breakers in the given encoding.
+    """
+    prefix = f"rcb-bench-{encoding}:"
+    driver = RedisDriver(redis_connection=connection, prefix=prefix, encoding=encoding)
+    keys = [f"breaker-{i}" for i in range(count)]
+    
+    for i in range(0, count, 1000):
+        driver.reset_many(keys[i:i+1000])
+        
+    for key in keys[::10]:
+        driver.failure(key)
+    
+    try:
+        sample = keys[::max(1, count // 1000)]
+        memory = sum(connection.memory_usage(driver.key(key)) for key in sample) / len(sample)
+        
+        if encoding == "hash":
+            raw = connection.hgetall(driver.key(keys[0]))
+        else:
+            raw = connection.get(driver.key(keys[0]))
+            
+        number = 200000
+        decode = min(timeit.repeat(lambda: driver._decode(raw), number=number, repeat=5)) / number
+        
+        start = time.perf_counter()
+        for i in range(0, count, 1000):
+            driver.load_many(keys[i:i+1000])
+        load_many = (time.perf_counter() - start) / count
+        
+        out.write(f"{encoding:>8} {memory:>12.1f} {decode*1e6:>12.3f} {load_many*1e6:>14.2f}\n")
+    finally:
+        for i in range(0, count, 1000):
+            driver.delete_many(keys[i:i+1000])
+
+parser = argparse.ArgumentParser(description='Compare the memory use and decode time of the RedisDriver encodings.')
+parser.add_argument('-r', '--redis-url', type=str, default="redis://localhost:6379/9", help="Redis connection URL")
+parser.add_argument('-c', '--count', type=int, default=10000, help="Number of breakers to write per encoding")
+
+if __name__ == '__main__':
+    opts = parser.parse_args()
+    
+    connection = redis.StrictRedis.from_url(opts.redis_url)
+    
+    sys.stdout.write(f"{'encoding':>8} {'bytes/key':>12} {'decode us':>12} {'load_many us':>14}\n")
+    
+    for encoding in ("hash", "packed"):
+        benchmark(connection, encoding, opts.count)
@@ -0,0 +1,93 @@
+"""
+Compare the redis memory used by breakers stored one per key (RedisDriver, in
+both encodings) and grouped in hashes (GroupedRedisDriver).
+
+Writes the same breakers with each driver, and reports the growth of redis'
+used_memory per breaker, and the time load_many() takes per breaker.
+
+    $ python func/benchmark_grouped.py --redis-url redis://localhost:6379/9 --count 100000 --group-size 100
+
+Requires a running redis server, ideally one that nothing else is writing to,
+since used_memory covers the whole server. Only keys under the benchmark
+prefixes are written, and they are deleted after each layout is measured.
+"""
+
+import argparse
+import sys
+import time
+
+import redis
+
+from jjmojojjmojo.circuitbreaker.drivers import RedisDriver, GroupedRedisDriver
+
+def used_memory(connection):
+    return connection.info("memory")["used_memory"]
+
+def settle(connection, timeout=10):
+    """
+    Wait until used_memory stops changing: redis shrinks the tables of
+    deleted keys in the background, which would be counted against the next
+    layout.
+    """
+    start = time.time()
+    last = used_memory(connection)
+
+    while time.time() - start < timeout:
+        time.sleep(1)
+        current = used_memory(connection)
+
+        if current == last:
+            return current
+
+        last = current
+
+    return last
+
+def benchmark(connection, name, driver, keys, out=sys.stdout):
+    """
+    Write, measure, and clean up the given breakers with the given driver.
+    """
+    before = settle(connection)
+
+    for i in range(0, len(keys), 1000):
+        driver.reset_many(keys[i:i+1000])
+
+    for key in keys[::10]:
+        driver.failure(key)
+
+    try:
+        memory = (used_memory(connection) - before) / len(keys)
+
+        start = time.perf_counter()
+        for i in range(0, len(keys), 1000):
+            driver.load_many(keys[i:i+1000])
+        load_many = (time.perf_counter() - start) / len(keys)
+
+        out.write(f"{name:>8} {memory:>14.1f} {load_many*1e6:>14.2f}\n")
+    finally:
+        for i in range(0, len(keys), 1000):
+            driver.delete_many(keys[i:i+1000])
+
+parser = argparse.ArgumentParser(description='Compare the redis memory used by breakers stored one per key, and grouped in hashes.')
+parser.add_argument('-r', '--redis-url', type=str, default="redis://localhost:6379/9", help="Redis connection URL")
+parser.add_argument('-c', '--count', type=int, default=100000, help="Number of breakers to write per layout")
+parser.add_argument('-g', '--group-size', type=int, default=100, help="Number of breakers in each group")
+
+if __name__ == '__main__':
+    opts = parser.parse_args()
+
+    connection = redis.StrictRedis.from_url(opts.redis_url)
+
+    keys = [f"service-{i // opts.group_size}:tenant-{i}" for i in range(opts.count)]
+
+    drivers = {
+        'hash': RedisDriver(redis_connection=connection, prefix="rcb-bench-hash:", expires=3600),
+        'packed': RedisDriver(redis_connection=connection, prefix="rcb-bench-packed:", encoding="packed", expires=3600),
+        'grouped': GroupedRedisDriver(redis_connection=connection, prefix="rcb-bench-grouped:", expires=3600)
+    }
+
+    sys.stdout.write(f"{opts.count} breakers, {opts.group_size} per group, redis {connection.info('server')['redis_version']}\n")
+    sys.stdout.write(f"{'layout':>8} {'bytes/breaker':>14} {'load_many us':>14}\n")
+
+    for name, driver in drivers.items():
+        benchmark(connection, name, driver, keys)
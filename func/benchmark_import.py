@@ -0,0 +1,59 @@
+"""
+Measure the cold import cost of the library.
+
+Each case runs in a fresh interpreter, several times, and the fastest run is
+reported (with -X importtime, so only import time is counted):
+
+    - memory: import the package, create a MemoryDriver breaker.
+    - redis: the same, plus a RedisDriver (which imports the redis client).
+
+    $ python func/benchmark_import.py --runs 10
+
+Doesn't need a redis server: the RedisDriver never connects.
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+
+CASES = {
+    'memory': "import jjmojojjmojo.circuitbreaker as cb; cb.MemoryCircuitBreaker('key', print)",
+    'redis': "import jjmojojjmojo.circuitbreaker as cb; cb.MemoryCircuitBreaker('key', print); cb.RedisDriver(redis_url='redis://localhost')",
+}
+
+def import_time(code):
+    """
+    Run code in a new interpreter, return the total import time in
+    microseconds and the number of modules imported.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+
+    total = 0
+    modules = 0
+
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)", line)
+        if match is None:
+            continue
+
+        modules += 1
+
+        # top-level imports are the ones indented by a single space
+        if len(match.group(3)) == 1:
+            total += int(match.group(2))
+
+    return total, modules
+
+parser = argparse.ArgumentParser(description='Measure the cold import time of the library, with and without redis.')
+parser.add_argument('-n', '--runs', type=int, default=10, help="Runs per case, the fastest is reported")
+
+if __name__ == '__main__':
+    opts = parser.parse_args()
+
+    sys.stdout.write(f"{'case':>8} {'import ms':>10} {'modules':>8}\n")
+
+    for name, code in CASES.items():
+        runs = [import_time(code) for i in range(opts.runs)]
+        total, modules = min(runs)
+        sys.stdout.write(f"{name:>8} {total / 1000:>10.1f} {modules:>8}\n")
@@ -0,0 +1,45 @@
+"""
+Measure how long the simulation takes to replay an hour of traffic: a 30
+minute outage, with 1000 clients calling once a minute each.
+
+The replay is run several times, and the fastest run is reported. It should
+take well under a second; the script exits with an error if the fastest run
+takes longer than --limit seconds:
+
+    $ python func/benchmark_simulation.py --runs 5 --clients 1000 --limit 1
+
+Doesn't need a redis server, the simulation uses a MemoryDriver.
+"""
+
+import argparse
+import sys
+import time
+
+from jjmojojjmojo.circuitbreaker.simulation import Simulation, Outage
+
+def replay(clients):
+    """
+    Run the simulation once, return the seconds it took and the result.
+    """
+    simulation = Simulation(Outage(600, 2400), clients=clients, interval=60, duration=3600, seed=1)
+
+    start = time.perf_counter()
+    result = simulation.run()
+
+    return time.perf_counter() - start, result
+
+parser = argparse.ArgumentParser(description='Measure how long the simulation takes to replay an hour of traffic.')
+parser.add_argument('-n', '--runs', type=int, default=5, help="Runs, the fastest is reported")
+parser.add_argument('-c', '--clients', type=int, default=1000, help="Number of virtual clients")
+parser.add_argument('-l', '--limit', type=float, default=1, help="Seconds the fastest run must take less than")
+
+if __name__ == '__main__':
+    opts = parser.parse_args()
+
+    runs = [replay(opts.clients) for i in range(opts.runs)]
+    elapsed, result = min(runs, key=lambda run: run[0])
+
+    sys.stdout.write(f"{opts.clients} clients, {result.calls} calls in {elapsed:.3f}s ({elapsed / result.calls * 1e6:.2f} us/call)\n")
+
+    if elapsed >= opts.limit:
+        sys.exit(f"Too slow: the replay took {elapsed:.3f}s, the limit is {opts.limit}s")
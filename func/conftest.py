@@ -53,6 +53,33 @@ def redis_url():
     
     p.terminate()
     
+@pytest.fixture(scope="session")
+def redis_replica_url(redis_url):
+    """
+    Starts up a redis server replicating the one from redis_url, returns a 
+    connection string, once the replica is in sync.
+    """
+    port = 6381
+    db = 9
+    
+    p = subprocess.Popen(f"redis-server --port {port} --replicaof 127.0.0.1 6380 --repl-ping-replica-period 1".split())
+    
+    wait_for_port(port)
+    
+    replica_url = f"redis://127.0.0.1:{port}/{db}"
+    
+    con = redis.StrictRedis.from_url(replica_url)
+    
+    start = time.time()
+    while con.info("replication").get("master_link_status") != "up":
+        if time.time() - start > 10:
+            raise Exception("Something is wrong. Timeout waiting for the replica to sync")
+        time.sleep(0.1)
+    
+    yield replica_url
+    
+    p.terminate()
+    
 @pytest.fixture(scope="module")
 def normal_app(redis_url):
     """
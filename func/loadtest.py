@@ -0,0 +1,315 @@
+"""
+Open-loop load harness for the functional test server.
+
+Starts a redis server and server.py (with N gunicorn workers), then sends
+requests at a fixed rate from several client processes, regardless of how
+fast the server responds (an "open-loop" load). Latency is measured from the
+moment each request was *scheduled* to be sent, so a stalled server shows up as
+latency instead of quietly lowering the request rate.
+
+At the end, a report is printed with overall p50/p99/p99.9 latency and
+throughput, followed by a time series of throughput, p99, redis operations per
+second and breaker transitions.
+
+Transitions (opens, closes and ramp-ups) are counted from the event log the
+server writes to a redis stream, not from the responses: with the memory
+back-end every gunicorn worker has a breaker of its own, so the statuses seen by
+the clients flip back and forth between workers even when no breaker changed.
+With the memory back-end the count is the total over all of the workers'
+breakers.
+
+Run it with both back-ends to compare them:
+
+    $ python func/loadtest.py --backend both --rate 500 --duration 30 --workers 8
+
+Requires redis-server on your $PATH, and func/requirements.txt installed.
+"""
+
+import argparse
+import concurrent.futures
+import http.client
+import json
+import math
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+import redis
+
+from conftest import wait_for_port
+from jjmojojjmojo.circuitbreaker.events import RedisStreamEventLog, EVENT_OPEN, EVENT_CLOSE, EVENT_RAMP
+
+EVENT_STREAM = "rcb:loadtest:events"
+TRANSITIONS = (EVENT_OPEN, EVENT_CLOSE, EVENT_RAMP)
+
+module_dir = os.path.dirname(os.path.realpath(__file__))
+
+def percentile(values, q):
+    """
+    Return the q-th quantile (0-1) of a sorted list, using the nearest rank.
+    """
+    if not values:
+        return float("nan")
+    index = min(len(values), max(1, math.ceil(q * len(values)))) - 1
+    return values[index]
+
+class Client:
+    """
+    Sends requests over a keep-alive connection, one per thread.
+    """
+    def __init__(self, url, timeout):
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def request(self):
+        """
+        POST to the server, return the decoded JSON response (or None on error).
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.local.connection = connection
+
+        try:
+            connection.request("POST", "/", body=b"")
+            return json.loads(connection.getresponse().read())
+        except (OSError, http.client.HTTPException, ValueError):
+            connection.close()
+            self.local.connection = None
+            return None
+
+def client_process(url, rate, start, duration, threads, timeout, results):
+    """
+    Body of each client process.
+
+    Schedules `rate` requests per second, starting at `start` (a time.time()
+    value shared by every process) for `duration` seconds. Puts a list of
+    (scheduled, latency, code, status) tuples on the results queue.
+    """
+    client = Client(url, timeout)
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+    futures = []
+
+    def call(scheduled):
+        out = client.request()
+        latency = time.time() - scheduled
+
+        if out is None:
+            return (scheduled, latency, "client-error", None)
+
+        return (scheduled, latency, out['code'], out['breaker-info']['status'])
+
+    count = int(rate * duration)
+
+    for i in range(count):
+        scheduled = start + i / rate
+        delay = scheduled - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        futures.append(pool.submit(call, scheduled))
+
+    results.put([future.result() for future in futures])
+    pool.shutdown()
+
+class RedisMonitor(threading.Thread):
+    """
+    Samples redis' total_commands_processed once per interval.
+    """
+    def __init__(self, redis_url, interval):
+        threading.Thread.__init__(self, daemon=True)
+        self.connection = redis.StrictRedis.from_url(redis_url)
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            info = self.connection.info("stats")
+            self.samples.append((time.time(), info["total_commands_processed"]))
+            self.stopped.wait(self.interval)
+
+    def rate_at(self, t):
+        """
+        Redis operations per second during the sample interval containing t.
+        """
+        for (t1, c1), (t2, c2) in zip(self.samples, self.samples[1:]):
+            if t1 <= t < t2:
+                return (c2 - c1) / (t2 - t1)
+        return float("nan")
+
+def run_load(url, opts, redis_url=None):
+    """
+    Drive the load against a running server, return the combined results and
+    the redis monitor (or None).
+    """
+    monitor = None
+    if redis_url is not None:
+        monitor = RedisMonitor(redis_url, opts.interval)
+        monitor.start()
+
+    results = multiprocessing.Queue()
+    per_process = opts.rate / opts.processes
+    start = time.time() + 1
+
+    processes = [
+        multiprocessing.Process(
+            target=client_process,
+            args=(url, per_process, start, opts.duration, opts.threads, opts.request_timeout, results))
+        for i in range(opts.processes)
+    ]
+
+    for p in processes:
+        p.start()
+
+    combined = []
+    for p in processes:
+        combined.extend(results.get())
+
+    for p in processes:
+        p.join()
+
+    if monitor is not None:
+        time.sleep(opts.interval)
+        monitor.stopped.set()
+        monitor.join()
+
+    combined.sort()
+
+    return start, combined, monitor
+
+def read_events(redis_url, stream, start, wait=1):
+    """
+    Return the transitions the server recorded in the stream since start.
+
+    Waits a moment first, so the server's event log has flushed.
+    """
+    time.sleep(wait)
+
+    events = RedisStreamEventLog(redis_url=redis_url, stream=stream).range(start=start)
+
+    return [event for event in events if event['event'] in TRANSITIONS]
+
+def report(name, start, results, monitor, opts, events=None, out=sys.stdout):
+    """
+    Print the summary and the time series for a run.
+
+    events: list of transition events (see read_events()), or None if there is
+            no event log to count them from.
+    """
+    latencies = sorted(r[1] for r in results)
+    elapsed = max(r[0] + r[1] for r in results) - start
+    codes = {}
+    for r in results:
+        codes[r[2]] = codes.get(r[2], 0) + 1
+
+    out.write(f"\n== {name} ==\n")
+    out.write(f"requests: {len(results)}  throughput: {len(results)/elapsed:.1f}/s\n")
+    out.write("latency p50: {:.2f}ms  p99: {:.2f}ms  p99.9: {:.2f}ms  max: {:.2f}ms\n".format(
+        percentile(latencies, 0.5) * 1000,
+        percentile(latencies, 0.99) * 1000,
+        percentile(latencies, 0.999) * 1000,
+        latencies[-1] * 1000))
+    out.write("codes: " + ", ".join(f"{k}={v}" for k, v in sorted(codes.items())) + "\n\n")
+
+    out.write(f"{'t':>6} {'req/s':>8} {'p99 ms':>9} {'redis op/s':>11} {'transitions':>12}\n")
+
+    buckets = int(opts.duration / opts.interval) + 1
+
+    for b in range(buckets):
+        low = start + b * opts.interval
+        high = low + opts.interval
+        bucket = [r for r in results if low <= r[0] < high]
+
+        if not bucket:
+            continue
+
+        if events is None:
+            transitions = "-"
+        else:
+            transitions = sum(1 for event in events if low <= event['timestamp'] < high)
+
+        p99 = percentile(sorted(r[1] for r in bucket), 0.99) * 1000
+        ops = monitor.rate_at(low + opts.interval / 2) if monitor is not None else float("nan")
+
+        out.write(f"{b*opts.interval:>6.1f} {len(bucket)/opts.interval:>8.1f} {p99:>9.2f} {ops:>11.1f} {transitions:>12}\n")
+
+def run_backend(backend, opts):
+    """
+    Start redis and the test server for the given back-end, run the load, and
+    print the report.
+    """
+    redis_url = f"redis://127.0.0.1:{opts.redis_port}/9"
+    url = f"http://127.0.0.1:{opts.app_port}"
+
+    redis_process = subprocess.Popen(["redis-server", "--port", str(opts.redis_port), "--save", "", "--appendonly", "no"])
+
+    try:
+        wait_for_port(opts.redis_port)
+        redis.StrictRedis.from_url(redis_url).flushdb()
+
+        app_process = subprocess.Popen(
+            [sys.executable, f"{module_dir}/server.py",
+             "-l", "warning",
+             "-w", str(opts.workers),
+             "-r", redis_url,
+             "-p", str(opts.app_port),
+             "-b", backend,
+             "--events", EVENT_STREAM,
+             "-t", str(opts.cb_timeout),
+             "--fail-freq", str(opts.fail_freq),
+             "--fail-count", str(opts.fail_count),
+             "failing"])
+
+        try:
+            wait_for_port(opts.app_port)
+            start, results, monitor = run_load(url, opts, redis_url if backend == "redis" else None)
+            events = read_events(redis_url, EVENT_STREAM, start)
+        finally:
+            app_process.terminate()
+            app_process.wait()
+    finally:
+        redis_process.terminate()
+        redis_process.wait()
+
+    report(f"{backend} back-end, {opts.workers} workers, {opts.rate} req/s", start, results, monitor, opts, events)
+
+parser = argparse.ArgumentParser(description='Open-loop load harness for the circuit breaker test server.')
+parser.add_argument('-b', '--backend', type=str, default="both", choices=["redis", "memory", "both"], help="Back-end(s) to test.")
+parser.add_argument('-r', '--rate', type=float, default=200, help="Total requests per second, across all client processes")
+parser.add_argument('-d', '--duration', type=float, default=20, help="Seconds to generate load for")
+parser.add_argument('-c', '--processes', type=int, default=4, help="Number of client processes")
+parser.add_argument('--threads', type=int, default=32, help="Maximum concurrent requests per client process")
+parser.add_argument('-w', '--workers', type=int, default=4, help="Number of gunicorn workers")
+parser.add_argument('-i', '--interval', type=float, default=1, help="Seconds per row in the time series")
+parser.add_argument('-t', '--cb-timeout', type=int, default=5, help="Breaker timeout passed to server.py")
+parser.add_argument('--fail-freq', type=int, default=50, help="Passed to server.py")
+parser.add_argument('--fail-count', type=int, default=20, help="Passed to server.py")
+parser.add_argument('--request-timeout', type=float, default=10, help="Client socket timeout")
+parser.add_argument('--app-port', type=int, default=9234, help="Port for server.py")
+parser.add_argument('--redis-port', type=int, default=6380, help="Port for redis-server")
+parser.add_argument('--url', type=str, default=None, help="Test an already-running server instead of starting one")
+parser.add_argument('--redis-url', type=str, default=None, help="With --url, a redis server to monitor")
+parser.add_argument('--events', type=str, default=None, help="With --url and --redis-url, the stream the server records events to (server.py --events)")
+
+if __name__ == '__main__':
+    opts = parser.parse_args()
+
+    if opts.url is not None:
+        start, results, monitor = run_load(opts.url, opts, opts.redis_url)
+
+        events = None
+        if opts.redis_url is not None and opts.events is not None:
+            events = read_events(opts.redis_url, opts.events, start)
+
+        report(opts.url, start, results, monitor, opts, events)
+    else:
+        backends = ["memory", "redis"] if opts.backend == "both" else [opts.backend]
+        for backend in backends:
+            run_backend(backend, opts)
@@ -7,6 +7,7 @@ The server uses the gunicorn API to act as a robust but stand-alone service.
 import gunicorn.app.base
 from jjmojojjmojo.circuitbreaker import RedisCircuitBreaker, MemoryCircuitBreaker
 from jjmojojjmojo.circuitbreaker.errors import CircuitBreakerOpen
+from jjmojojjmojo.circuitbreaker.events import RedisStreamEventLog
 from jjmojojjmojo.circuitbreaker.tests.util import IntermittentFailer, Failure
 import logging
 import argparse
@@ -131,6 +132,7 @@ parser.add_argument('--fail-count', type=int, default=6, help="The number of cal
 parser.add_argument('-w', '--workers', type=int, default=1, help="The number of web process workers to spawn.")
 parser.add_argument('-j', '--jitter', type=int, default=0, help="The amount of jitter when deciding if the timeout has been reached. Note this is always a fixed amount")
 parser.add_argument('-b', '--backend', type=str, default="redis", choices=["redis", "memory"], help="Indicate a specific back-end to use.")
+parser.add_argument('--events', type=str, default=None, help="Record breaker transitions to this redis stream (on --redis-url), whatever the back-end")
 parser.add_argument('server', type=str, default="normal", choices=["normal", "failing"], help="Should be server always work, or should it intermittently fail?")
 
 if __name__ == '__main__':
@@ -163,6 +165,9 @@ if __name__ == '__main__':
         breaker_class = MemoryCircuitBreaker
     else:
         raise AssertionError("Unknown backend")
+    
+    if opts.events is not None:
+        breaker_options["events"] = RedisStreamEventLog(redis_url=opts.redis_url, stream=opts.events, flush_interval=0.1)
         
     if opts.server == "failing":
         failer = IntermittentFailer(
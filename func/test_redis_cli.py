@@ -0,0 +1,81 @@
+"""
+Functional tests for the command-line tool against a redis back-end.
+"""
+
+from jjmojojjmojo.circuitbreaker import STATUS_OPEN, STATUS_CLOSED
+from jjmojojjmojo.circuitbreaker.cli import main
+from jjmojojjmojo.circuitbreaker.drivers import RedisDriver
+import io
+import json
+import time
+from util import PREFIX
+
+def run(redis_url, *argv):
+    """
+    Run the tool against the test redis, return the exit status and output.
+    """
+    out = io.StringIO()
+    status = main(["-r", redis_url, "-p", PREFIX] + list(argv), out=out)
+    return status, out.getvalue()
+
+def test_list_preloaded(redis_url, conn_with_preload_data):
+    """
+    List the preloaded breakers.
+    """
+    status, out = run(redis_url, "-j", "list", "ftest*")
+    
+    rows = json.loads(out)
+    
+    assert status == 0
+    assert len(rows) == 10
+    assert all(row['status'] == "OPEN" for row in rows)
+
+def test_bulk_reset(redis_url, conn_with_preload_data):
+    """
+    Open and reset 50,000 breakers in a few seconds.
+    """
+    conn, checkin = conn_with_preload_data
+    
+    driver = RedisDriver(redis_connection=conn, prefix=PREFIX)
+    
+    keys = [f"payments-{i}" for i in range(50000)]
+    
+    for i in range(0, len(keys), 1000):
+        driver.open_many(keys[i:i+1000])
+        
+    start = time.time()
+    status, out = run(redis_url, "reset", "payments-*")
+    elapsed = time.time() - start
+    
+    assert status == 0
+    assert out == "reset 50000 breakers\n"
+    assert elapsed < 10
+    
+    info = driver.load_many(keys[:100])
+    assert all(i['status'] == STATUS_CLOSED for i in info.values())
+    
+    status, out = run(redis_url, "delete", "payments-*")
+    
+    assert out == "deleted 50000 breakers\n"
+    assert list(driver.keys("payments-*")) == []
+    
+def test_migrate(redis_url, conn_with_preload_data):
+    """
+    Migrate breakers to the packed encoding and back.
+    """
+    conn, checkin = conn_with_preload_data
+    
+    status, out = run(redis_url, "--encoding", "packed", "migrate", "ftest*")
+    
+    assert status == 0
+    assert out == "migrated 10 breakers to packed\n"
+    assert conn.type(f"{PREFIX}ftest1") == b"string"
+    
+    status, out = run(redis_url, "-j", "--encoding", "packed", "list", "ftest*")
+    
+    assert all(row['status'] == "OPEN" for row in json.loads(out))
+    
+    status, out = run(redis_url, "migrate", "ftest*")
+    
+    assert out == "migrated 10 breakers to hash\n"
+    assert conn.type(f"{PREFIX}ftest1") == b"hash"
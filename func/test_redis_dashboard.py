@@ -0,0 +1,46 @@
+"""
+Functional tests for the status dashboard against a redis back-end.
+"""
+
+from jjmojojjmojo.circuitbreaker import STATUS_OPEN
+from jjmojojjmojo.circuitbreaker.drivers import RedisDriver
+from jjmojojjmojo.circuitbreaker.dashboard import Dashboard
+from jjmojojjmojo.circuitbreaker.tests.test_dashboard import request
+import json
+from util import PREFIX
+
+def test_enumeration(conn_with_preload_data):
+    """
+    SCAN + pipelined HGETALL finds every preloaded breaker.
+    """
+    conn, checkin = conn_with_preload_data
+    
+    driver = RedisDriver(redis_connection=conn, prefix=PREFIX)
+    
+    assert sorted(driver.keys("ftest*")) == sorted(f"ftest{i}" for i in range(1, 11))
+    
+    info = driver.load_many(["test1", "ftest4", "missing"])
+    
+    assert set(info) == {"test1", "ftest4"}
+    assert info["ftest4"]["failures"] == 2
+    assert info["ftest4"]["status"] == STATUS_OPEN
+    
+def test_many_keys(conn_with_preload_data):
+    """
+    List a few thousand breakers through the dashboard.
+    """
+    conn, checkin = conn_with_preload_data
+    
+    driver = RedisDriver(redis_connection=conn, prefix=PREFIX)
+    
+    pipeline = conn.pipeline(transaction=False)
+    for i in range(5000):
+        pipeline.hmset(f"{PREFIX}bulk{i}", driver.default())
+    pipeline.execute()
+    
+    app = Dashboard(driver, pattern="bulk*", batch_size=1000)
+    
+    status, headers, body = request(app, "/breakers.json")
+    
+    assert status == "200 OK"
+    assert len(json.loads(body)) == 5000
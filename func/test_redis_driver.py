@@ -2,11 +2,14 @@
 Functional tests for the redis driver backend.
 """
 
-from jjmojojjmojo.circuitbreaker import STATUS_OPEN, STATUS_CLOSED
+from jjmojojjmojo.circuitbreaker import STATUS_OPEN, STATUS_CLOSED, STATUS_RAMPING
 from jjmojojjmojo.circuitbreaker.drivers import RedisDriver
 from jjmojojjmojo.circuitbreaker.errors import DistributedBackendProblem, BackendKeyNotFound
+from jjmojojjmojo.circuitbreaker.clock import ManualClock
+from jjmojojjmojo.circuitbreaker.stress import Stress
 import pytest
 from util import PREFIX
+import threading
 import time
 
 
@@ -52,6 +55,8 @@ def test_failure(conn_with_preload_data):
     
     assert info["failures"] == 1
     
+    assert driver.failure("test1", 3) == 4
+    
 def test_open(conn_with_preload_data):
     """
     Test opening a breaker, data exists.
@@ -106,4 +111,245 @@ def test_expiry(conn_with_preload_data):
     time.sleep(1.5)
     
     with pytest.raises(BackendKeyNotFound):
-        driver.load("expireme")
\ No newline at end of file
+        driver.load("expireme")
+
+def test_server_time(redis_url):
+    """
+    Read the time from redis, and sync the driver's clock to it.
+    """
+    driver = RedisDriver(redis_url=redis_url)
+    
+    assert abs(driver.server_time() - time.time()) < 1
+    
+    clock = driver.sync_clock()
+    driver.now()
+    
+    assert clock.stats()['syncs'] == 1
+    assert abs(clock.skew) < 1
+    
+def test_packed(conn_with_preload_data):
+    """
+    Create, fail, open, close and batch-load breakers in the packed encoding.
+    """
+    conn, checkin = conn_with_preload_data
+    
+    driver = RedisDriver(expires=20, redis_connection=conn, prefix=PREFIX, encoding="packed")
+    
+    info = driver.new("packed")
+    
+    assert conn.type(f"{PREFIX}packed") == b"string"
+    assert conn.strlen(f"{PREFIX}packed") == 13
+    assert 0 < conn.ttl(f"{PREFIX}packed") <= 20
+    assert driver.load("packed")['checkin'] == pytest.approx(info['checkin'], abs=1e-6)
+    
+    assert driver.failure("packed") == 1
+    assert driver.failure("packed", 2) == 3
+    
+    driver.open("packed")
+    
+    info = driver.load("packed")
+    assert info['status'] == STATUS_OPEN
+    assert info['failures'] == 3
+    
+    driver.close("packed")
+    driver.reset_many(["packed"])
+    
+    assert driver.load_many(["packed", "missing"]) == {'packed': driver.load("packed")}
+    assert driver.load("packed")['failures'] == 0
+    
+@pytest.mark.parametrize("encoding", ["hash", "packed"])
+def test_missing_breaker_writes(conn_with_preload_data, encoding):
+    """
+    Writing part of a breaker that has expired stores a whole one, and a
+    failure doesn't bring it back at all.
+    """
+    conn, checkin = conn_with_preload_data
+    
+    driver = RedisDriver(expires=20, redis_connection=conn, prefix=PREFIX, encoding=encoding)
+    
+    with pytest.raises(BackendKeyNotFound):
+        driver.failure("gone")
+        
+    assert not conn.exists(f"{PREFIX}gone")
+    
+    driver.update("gone", failures=3)
+    info = driver.load("gone")
+    
+    assert info['failures'] == 3
+    assert info['status'] == STATUS_CLOSED
+    assert info['checkin'] == pytest.approx(time.time(), abs=5)
+    
+    driver.open_many(["gone-too"])
+    info = driver.load("gone-too")
+    
+    assert info['failures'] == 0
+    assert info['status'] == STATUS_OPEN
+    
+    if encoding == "packed":
+        assert conn.strlen(f"{PREFIX}gone") == 13
+        assert 0 < conn.ttl(f"{PREFIX}gone-too") <= 20
+    
+def test_packed_lazy_conversion(conn_with_preload_data):
+    """
+    A packed driver converts hash breakers as it touches them, keeping their
+    TTL, and a hash driver can read them back.
+    """
+    conn, checkin = conn_with_preload_data
+    
+    hashed = RedisDriver(redis_connection=conn, prefix=PREFIX)
+    packed = RedisDriver(redis_connection=conn, prefix=PREFIX, encoding="packed")
+    
+    before = hashed.load("ftest8")
+    
+    assert packed.load("ftest8") == pytest.approx(before)
+    assert conn.type(f"{PREFIX}ftest8") == b"string"
+    assert 0 < conn.ttl(f"{PREFIX}ftest8") <= 20
+    
+    assert packed.failure("ftest9") == 4
+    packed.open_many(["ftest10", "test1"])
+    
+    loaded = packed.load_many(["ftest10", "test1", "test2"])
+    assert loaded["test1"]['status'] == STATUS_OPEN
+    assert loaded["test2"]['status'] == STATUS_CLOSED
+    
+    assert hashed.load("ftest9")['failures'] == 4
+    assert conn.type(f"{PREFIX}ftest9") == b"hash"
+    
+def test_migrate(conn_with_preload_data):
+    """
+    Convert everything at once. Running it again does nothing.
+    """
+    conn, checkin = conn_with_preload_data
+    
+    packed = RedisDriver(redis_connection=conn, prefix=PREFIX, encoding="packed")
+    
+    assert packed.migrate("*test*") == 20
+    assert packed.migrate("*test*") == 0
+    
+    assert all(conn.type(f"{PREFIX}test{i}") == b"string" for i in range(1, 11))
+    assert packed.load("ftest10")['failures'] == 3
+    
+def test_take_tokens(conn_with_preload_data):
+    """
+    Take tokens from a bucket, from several threads at once.
+    """
+    conn, checkin = conn_with_preload_data
+    
+    driver = RedisDriver(redis_connection=conn, prefix=PREFIX)
+    
+    assert driver.take_tokens("budget", 3, 5) == (3, 2)
+    assert driver.take_tokens("budget", 3, 5) == (2, 0)
+    assert driver.take_tokens("budget", 0, 5, deposit=1.5) == (0, 1.5)
+    
+    # buckets don't look like breakers
+    assert list(driver.keys("budget*")) == []
+    assert conn.exists(f"bucket:{PREFIX}budget")
+    
+    granted = []
+    
+    def take():
+        for i in range(200):
+            granted.append(driver.take_tokens("shared", 1, 1000)[0])
+            
+    threads = [threading.Thread(target=take) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+        
+    assert sum(granted) == 1000
+    
+    driver.take_tokens("refills", 1, 10, rate=5)
+    
+    assert 0 < conn.pttl(f"bucket:{PREFIX}refills") <= 3000
+    
+def test_load_and_take(conn_with_preload_data):
+    """
+    Load a breaker and lease tokens in one pipeline, even right after the
+    script cache was flushed.
+    """
+    conn, checkin = conn_with_preload_data
+    
+    driver = RedisDriver(redis_connection=conn, prefix=PREFIX)
+    
+    conn.script_flush()
+    
+    info, granted = driver.load_and_take("ftest2", "ftest2-rate", 5, 3, rate=1)
+    
+    assert info['failures'] == 1
+    assert info['status'] == STATUS_OPEN
+    assert granted == 3
+    
+    info, granted = driver.load_and_take("missing", "ftest2-rate", 5, 3, rate=1)
+    
+    assert info is None
+    assert granted == 0
+    
+def test_merge_histogram(conn_with_preload_data):
+    """
+    Histogram counts are added up across drivers, per window.
+    """
+    conn, checkin = conn_with_preload_data
+    
+    clock = ManualClock(600)
+    first = RedisDriver(redis_connection=conn, prefix=PREFIX, clock=clock)
+    second = RedisDriver(redis_connection=conn, prefix=PREFIX, clock=clock)
+    
+    assert first.merge_histogram("ftest1", {10: 2, 200: 1}, 60) == {10: 2, 200: 1}
+    assert second.merge_histogram("ftest1", {10: 1}, 60) == {10: 3, 200: 1}
+    assert first.merge_histogram("ftest1", {}, 60) == {10: 3, 200: 1}
+    
+    assert 0 < conn.pttl(f"latency:{PREFIX}ftest1:10") <= 120000
+    
+    # histograms don't look like breakers
+    assert sorted(first.keys("ftest1*")) == ["ftest1", "ftest10"]
+    
+    clock.advance(60)
+    assert first.merge_histogram("ftest1", {}, 60) == {}
+    
+    clock.advance(-60)
+    second.clear_histogram("ftest1", 60)
+    assert first.merge_histogram("ftest1", {}, 60) == {}
+    
+def test_transition(conn_with_preload_data):
+    """
+    Transitions are a compare-and-set, in both encodings, and convert keys 
+    stored in the other one.
+    """
+    conn, checkin = conn_with_preload_data
+    
+    for encoding, key in (("hash", "ftest4"), ("packed", "ftest5")):
+        driver = RedisDriver(expires=20, redis_connection=conn, prefix=PREFIX, encoding=encoding)
+        
+        assert driver.transition(key, (STATUS_CLOSED,), STATUS_OPEN) is False
+        assert driver.transition(key, (STATUS_OPEN,), STATUS_CLOSED) is True
+        assert driver.transition(key, (STATUS_OPEN,), STATUS_CLOSED) is False
+        
+        info = driver.load(key)
+        assert info['status'] == STATUS_CLOSED
+        assert info['failures'] == 2
+        assert info['checkin'] > checkin
+        
+        assert driver.transition(key, (STATUS_CLOSED, STATUS_RAMPING), STATUS_OPEN, failures=0) is True
+        assert driver.load(key)['failures'] == 0
+        assert driver.load(key)['status'] == STATUS_OPEN
+        
+        # missing breakers count as new, closed ones
+        assert driver.transition(f"new-{encoding}", (STATUS_CLOSED,), STATUS_OPEN) is True
+        assert driver.load(f"new-{encoding}")['failures'] == 0
+        assert 0 < conn.ttl(f"{PREFIX}new-{encoding}") <= 20
+    
+    assert conn.type(f"{PREFIX}ftest5") == b"string"
+    
+def test_stress(redis_url):
+    """
+    No lost increments or double transitions, from threads and processes.
+    """
+    stress = Stress(url=f"{redis_url}?prefix={PREFIX}", operations=200, seed=1)
+    
+    for processes in (False, True):
+        history = stress.run(4, processes=processes)
+        
+        assert len(history.operations) == 800
+        assert history.errors == 0
+        assert history.check() == []
@@ -0,0 +1,74 @@
+"""
+Functional tests for the redis stream event log.
+"""
+
+from jjmojojjmojo.circuitbreaker import RedisCircuitBreaker
+from jjmojojjmojo.circuitbreaker.events import RedisStreamEventLog, EVENT_OPEN, EVENT_CLOSE
+from jjmojojjmojo.circuitbreaker.errors import CircuitBreakerOpen
+from jjmojojjmojo.circuitbreaker.tests.util import fail, succeed
+import pytest
+import redis
+import time
+from util import PREFIX
+
+@pytest.fixture
+def event_log(redis_url):
+    """
+    An event log writing to a fresh stream.
+    """
+    connection = redis.StrictRedis.from_url(redis_url)
+    connection.delete(f"{PREFIX}events")
+    
+    log = RedisStreamEventLog(redis_connection=connection, stream=f"{PREFIX}events", maxlen=100, flush_interval=0.05)
+    
+    yield log
+    
+    log.stop()
+    connection.delete(f"{PREFIX}events")
+
+def test_transitions(redis_url, event_log):
+    """
+    Breaker transitions end up in the stream.
+    """
+    breaker = RedisCircuitBreaker(
+        key="events-test",
+        subject=fail,
+        failures=1,
+        timeout=0,
+        jitter=0,
+        redis_url=redis_url,
+        prefix=PREFIX,
+        events=event_log)
+    
+    with pytest.raises(Exception):
+        breaker()
+        
+    with pytest.raises(CircuitBreakerOpen):
+        breaker()
+        
+    breaker.subject = succeed
+    
+    assert breaker() == True
+    
+    event_log.flush()
+    
+    events = event_log.tail()
+    
+    assert [e['event'] for e in events] == [EVENT_OPEN, EVENT_CLOSE]
+    assert events[0]['key'] == "events-test"
+    assert events[0]['failures'] == 1
+    
+def test_bounded(redis_url, event_log):
+    """
+    The stream is capped at (roughly) maxlen entries.
+    """
+    start = time.time()
+    
+    for i in range(1000):
+        event_log.record(EVENT_OPEN, "key", i, time.time())
+        
+    event_log.flush()
+    
+    assert event_log.redis.xlen(event_log.stream) < 300
+    assert event_log.tail(1)[0]['failures'] == 999
+    assert len(event_log.range(start, time.time() + 1, count=10)) == 10
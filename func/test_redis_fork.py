@@ -0,0 +1,67 @@
+"""
+Functional tests for drivers shared with forked workers, as with gunicorn's
+--preload.
+"""
+
+from jjmojojjmojo.circuitbreaker.drivers import RedisDriver
+import os
+import pytest
+from util import PREFIX
+
+WORKERS = 8
+CALLS = 500
+
+def worker(driver, index):
+    """
+    Hammer the shared breaker, checking every reply. Returns the exit status.
+    """
+    for i in range(CALLS):
+        failures = driver.failure("shared")
+        
+        if not isinstance(failures, int) or failures < 1:
+            return 1
+        
+        # a reply meant for another process would have the wrong shape
+        info = driver.load(f"worker-{index}")
+        
+        if info['failures'] != index:
+            return 1
+        
+    return 0
+
+@pytest.mark.parametrize("encoding", ["hash", "packed"])
+def test_forked_workers(conn_with_preload_data, encoding):
+    """
+    Fork workers after the driver has opened a connection. Every worker gets 
+    its own connection: no corrupted replies, and no lost increments.
+    """
+    conn, checkin = conn_with_preload_data
+    
+    driver = RedisDriver(redis_connection=conn, prefix=PREFIX, encoding=encoding)
+    
+    driver.new("shared")
+    for index in range(WORKERS):
+        driver.new(f"worker-{index}")
+        driver.update(f"worker-{index}", failures=index)
+        
+    pids = []
+    
+    for index in range(WORKERS):
+        pid = os.fork()
+        
+        if pid == 0:
+            status = 1
+            try:
+                status = worker(driver, index)
+            finally:
+                os._exit(status)
+                
+        pids.append(pid)
+        
+    statuses = [os.waitpid(pid, 0)[1] for pid in pids]
+    
+    assert statuses == [0] * WORKERS
+    assert driver.load("shared")['failures'] == WORKERS * CALLS
+    
+    # the parent's connection still works
+    assert driver.ping()
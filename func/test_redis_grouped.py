@@ -0,0 +1,231 @@
+"""
+Functional tests for the grouped redis driver backend.
+"""
+
+from jjmojojjmojo.circuitbreaker import CircuitBreaker, STATUS_OPEN, STATUS_CLOSED
+from jjmojojjmojo.circuitbreaker.drivers import GroupedRedisDriver
+from jjmojojjmojo.circuitbreaker.errors import BackendKeyNotFound, CircuitBreakerOpen
+from jjmojojjmojo.circuitbreaker.clock import ManualClock
+from jjmojojjmojo.circuitbreaker.stress import Stress
+import pytest
+import redis
+from util import PREFIX
+
+@pytest.fixture
+def conn(redis_url):
+    connection = redis.StrictRedis.from_url(redis_url)
+
+    yield connection
+
+    connection.flushdb()
+
+def test_breaker_fields(conn):
+    """
+    Breakers of a group share a hash, with a field each.
+    """
+    driver = GroupedRedisDriver(redis_connection=conn, prefix=PREFIX, expires=60)
+
+    with pytest.raises(BackendKeyNotFound):
+        driver.load("payments:tenant-1")
+
+    info = driver.new("payments:tenant-1")
+    driver.new("payments:tenant-2")
+
+    assert driver.load("payments:tenant-1") == info
+    assert driver.failure("payments:tenant-1") == 1
+    assert driver.failure("payments:tenant-1", 2) == 3
+
+    driver.update("payments:tenant-2", status=STATUS_OPEN)
+
+    assert conn.hlen(f"{PREFIX}payments") == 2
+    assert conn.hget(f"{PREFIX}payments", "payments:tenant-1") == f"3 {STATUS_CLOSED} {info['checkin']!r}".encode()
+    assert 0 < conn.pttl(f"{PREFIX}payments") <= 60000
+
+    assert driver.load("payments:tenant-2")['status'] == STATUS_OPEN
+
+    assert driver.transition("payments:tenant-1", (STATUS_CLOSED,), STATUS_OPEN)
+    assert not driver.transition("payments:tenant-1", (STATUS_CLOSED,), STATUS_OPEN)
+    assert driver.transition("payments:tenant-1", (STATUS_OPEN,), STATUS_CLOSED, failures=0)
+    assert driver.load("payments:tenant-1")['failures'] == 0
+
+    # a breaker that isn't stored counts as closed, and is created
+    assert driver.transition("payments:tenant-3", (STATUS_CLOSED,), STATUS_OPEN)
+    assert driver.load("payments:tenant-3")['failures'] == 0
+
+    # an update creates a whole breaker
+    driver.update("payments:tenant-4", failures=2)
+    assert driver.load("payments:tenant-4")['status'] == STATUS_CLOSED
+
+    driver.delete("payments:tenant-1")
+
+    with pytest.raises(BackendKeyNotFound):
+        driver.load("payments:tenant-1")
+
+    # a failure doesn't create half a breaker
+    with pytest.raises(BackendKeyNotFound):
+        driver.failure("payments:tenant-1")
+
+    assert not conn.hexists(f"{PREFIX}payments", "payments:tenant-1")
+    assert conn.hlen(f"{PREFIX}payments") == 3
+
+def test_many(conn):
+    """
+    Bulk operations, one command per group.
+    """
+    driver = GroupedRedisDriver(redis_connection=conn, prefix=PREFIX)
+
+    keys = [f"{group}:tenant-{i}" for group in ("payments", "search") for i in range(50)]
+
+    driver.reset_many(keys)
+    driver.open_many(keys[::2])
+
+    loaded = driver.load_many(keys + ["payments:nothere", "nothere"])
+
+    assert sorted(loaded) == sorted(keys)
+    assert loaded["payments:tenant-0"]['status'] == STATUS_OPEN
+    assert loaded["payments:tenant-1"]['status'] == STATUS_CLOSED
+
+    assert sorted(driver.keys()) == sorted(keys)
+    assert sorted(driver.keys("search:*")) == sorted(keys[50:])
+    assert sorted(driver.keys("*:tenant-1")) == ["payments:tenant-1", "search:tenant-1"]
+    assert driver.migrate() == 0
+
+    driver.delete_many(keys[:60])
+
+    assert sorted(driver.load_many(keys)) == sorted(keys[60:])
+    assert not conn.exists(f"{PREFIX}payments")
+
+def test_sweep(conn):
+    """
+    Breakers that haven't checked in for `expires` seconds are swept.
+    """
+    clock = ManualClock(1000)
+    driver = GroupedRedisDriver(redis_connection=conn, prefix=PREFIX, clock=clock, expires=60, sweep_interval=None)
+
+    driver.reset_many([f"payments:old-{i}" for i in range(300)])
+
+    clock.advance(30)
+    driver.new("payments:new")
+    driver.new("search:new")
+
+    assert driver.sweep(count=50) == 0
+
+    clock.advance(40)
+
+    assert driver.sweep(count=50) == 300
+    assert sorted(driver.keys()) == ["payments:new", "search:new"]
+
+    # a breaker is removed when it's loaded again after it expired
+    breaker = CircuitBreaker(driver, lambda: True, "payments:new")
+
+    assert breaker() is True
+
+    clock.advance(60)
+
+    assert breaker() is True
+    assert driver.load("payments:new")['checkin'] == clock.now()
+
+def test_sweep_on_write(conn):
+    """
+    Groups that are written to are swept every sweep_interval seconds, so
+    breakers nobody uses are removed without calling sweep().
+    """
+    clock = ManualClock(1000)
+    driver = GroupedRedisDriver(redis_connection=conn, prefix=PREFIX, clock=clock, expires=60, sweep_interval=30)
+
+    driver.reset_many([f"payments:old-{i}" for i in range(100)])
+    driver.new("search:old")
+
+    clock.advance(70)
+    driver.new("payments:new")
+
+    assert sorted(driver.keys()) == ["payments:new", "search:old"]
+
+    # swept 10 seconds ago, not again until 30 seconds have passed
+    clock.advance(10)
+    driver.update("payments:old-1", checkin=1000)
+
+    assert sorted(driver.keys()) == ["payments:new", "payments:old-1", "search:old"]
+
+    clock.advance(20)
+    driver.failure("payments:new")
+
+    assert sorted(driver.keys()) == ["payments:new", "search:old"]
+
+def test_sweep_batches(conn):
+    """
+    A big group is swept a batch per write, never all at once.
+    """
+    clock = ManualClock(1000)
+    driver = GroupedRedisDriver(redis_connection=conn, prefix=PREFIX, clock=clock, expires=60, sweep_interval=30, sweep_batch=50)
+
+    # past hash-max-listpack-entries, so HSCAN honours COUNT
+    driver.reset_many([f"payments:old-{i}" for i in range(2000)])
+
+    clock.advance(70)
+    driver.new("payments:new")
+
+    writes = 1
+    left = conn.hlen(driver.key("payments:new"))
+
+    while left > 1:
+        driver.failure("payments:new")
+        writes += 1
+
+        now = conn.hlen(driver.key("payments:new"))
+
+        # about a batch each time (HSCAN's COUNT is a hint)
+        assert left - now < 200
+        left = now
+
+    assert writes > 10
+    assert list(driver.keys("payments:*")) == ["payments:new"]
+
+def test_swept_breaker(conn):
+    """
+    A breaker swept between its load and a failure is created again.
+    """
+    clock = ManualClock(1000)
+    driver = GroupedRedisDriver(redis_connection=conn, prefix=PREFIX, clock=clock, expires=60)
+
+    def fail():
+        driver.delete("payments:tenant-1")
+        raise Exception("fail")
+
+    breaker = CircuitBreaker(driver, fail, "payments:tenant-1")
+
+    with pytest.raises(Exception, match="fail"):
+        breaker()
+
+    assert driver.load("payments:tenant-1")['failures'] == 1
+
+def test_breaker(conn):
+    """
+    Breakers open and close through the grouped driver.
+    """
+    driver = GroupedRedisDriver(redis_connection=conn, prefix=PREFIX)
+
+    def fail():
+        raise Exception("fail")
+
+    breaker = CircuitBreaker(driver, fail, "payments:tenant-1", failures=2)
+
+    for i in range(2):
+        with pytest.raises(Exception):
+            breaker()
+
+    with pytest.raises(CircuitBreakerOpen):
+        breaker()
+
+    assert driver.load("payments:tenant-1")['status'] == STATUS_OPEN
+
+def test_stress(redis_url):
+    """
+    No lost increments or double transitions.
+    """
+    stress = Stress(url=f"{redis_url}?layout=grouped&prefix={PREFIX}", key="stress:tenant", operations=200, seed=1)
+
+    history = stress.run(4)
+
+    assert history.errors == 0
+    assert history.check() == []
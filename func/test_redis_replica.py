@@ -0,0 +1,94 @@
+"""
+Functional tests for reading breakers from a redis replica.
+"""
+
+from jjmojojjmojo.circuitbreaker import STATUS_OPEN, STATUS_CLOSED
+from jjmojojjmojo.circuitbreaker.drivers import RedisDriver
+from jjmojojjmojo.circuitbreaker.registry import from_url
+import pytest
+import redis
+from util import PREFIX
+import time
+
+def wait_for_replica(replica_url, key, status=None):
+    """
+    Block until a key written to the primary shows up on the replica (with
+    the given status).
+    """
+    con = redis.StrictRedis.from_url(replica_url)
+
+    start = time.time()
+    while not con.exists(key) or (status is not None and int(con.hget(key, "status")) != status):
+        if time.time() - start > 5:
+            raise Exception(f"Something is wrong. Timeout waiting for {key} on the replica")
+        time.sleep(0.05)
+
+def test_load_from_replica(conn_with_preload_data, redis_replica_url):
+    conn, checkin = conn_with_preload_data
+    wait_for_replica(redis_replica_url, f"{PREFIX}test10")
+
+    driver = RedisDriver(redis_connection=conn, prefix=PREFIX, replica_urls=[redis_replica_url])
+
+    info = driver.load("ftest4")
+
+    assert info == {'failures': 2, 'status': STATUS_OPEN, 'checkin': checkin}
+    assert set(driver.load_many(["test1", "ftest1", "nothere"])) == {"test1", "ftest1"}
+
+    replica = driver.replicas[0]
+
+    assert replica.healthy
+    assert replica.reads == 2
+    assert replica.lag <= driver.max_lag
+
+def test_writes_stay_on_primary(conn_with_preload_data, redis_replica_url):
+    """
+    Writes go to the primary (the replica is read-only), and the driver reads
+    its own writes back from it.
+    """
+    conn, checkin = conn_with_preload_data
+    wait_for_replica(redis_replica_url, f"{PREFIX}test10")
+
+    driver = RedisDriver(redis_connection=conn, prefix=PREFIX, replica_urls=[redis_replica_url])
+
+    assert driver.failure("test2") == 1
+    assert driver.transition("test2", (STATUS_CLOSED,), STATUS_OPEN)
+
+    info = driver.load("test2")
+
+    assert info['failures'] == 1
+    assert info['status'] == STATUS_OPEN
+    assert driver.replicas[0].reads == 0
+
+    # once replicated, other clients read the change from the replica
+    wait_for_replica(redis_replica_url, f"{PREFIX}test2", STATUS_OPEN)
+
+    other = RedisDriver(redis_connection=conn, prefix=PREFIX, replica_urls=[redis_replica_url])
+
+    assert other.load("test2")['status'] == STATUS_OPEN
+    assert other.replicas[0].reads == 1
+
+def test_replica_down(conn_with_preload_data):
+    """
+    Loads fall back to the primary when the replica can't be reached.
+    """
+    conn, checkin = conn_with_preload_data
+
+    driver = RedisDriver(redis_connection=conn, prefix=PREFIX, replica_urls=["redis://127.0.0.1:6399/9?socket_connect_timeout=0.1"])
+
+    assert driver.load("test1")['status'] == STATUS_CLOSED
+    assert driver.load("test1")['status'] == STATUS_CLOSED
+
+    replica = driver.replicas[0]
+
+    assert not replica.healthy
+    assert replica.errors == 1
+    assert replica.reads == 0
+
+def test_url(redis_url, redis_replica_url):
+    driver = from_url(f"{redis_url}?replica={redis_replica_url}&max_lag=3", prefix=PREFIX)
+
+    driver.reset("url-test")
+
+    assert driver.load("url-test")['status'] == STATUS_CLOSED
+    assert driver.replicas[0].name == redis_replica_url
+    assert driver.max_lag == 3
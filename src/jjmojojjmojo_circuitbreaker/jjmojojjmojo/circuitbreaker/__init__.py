@@ -11,12 +11,27 @@ created.
 
 The library acts as a "wrapper" around any callable so robust versions of 
 existing functions can be easily built.
+
+The redis client is only imported when RedisDriver (or RedisCircuitBreaker) is
+first used.
 """
 
-from .base import CircuitBreaker, STATUS_OPEN, STATUS_CLOSED
-from .drivers import RedisDriver, MemoryDriver
+from .base import CircuitBreaker, STATUS_OPEN, STATUS_CLOSED, STATUS_RAMPING, request_scope
+from .drivers import MemoryDriver
+from .retry import RetryBudget
+from .ratelimit import RateLimiter
+from .latency import LatencyMonitor
+from .policy import FailurePolicy
+from .tracing import Tracer
+
+def __getattr__(name):
+    if name == "RedisDriver":
+        from .drivers.redis import RedisDriver
+        return RedisDriver
+    
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def MemoryCircuitBreaker(key, subject, expires=180, failures=5, timeout=10, jitter=None):
+def MemoryCircuitBreaker(key, subject, expires=180, failures=5, timeout=10, jitter=None, parent=None, events=None, limiter=None):
     """
     Create a ready-to-go CircuitBreaker with a MemoryDriver driver.
     """
@@ -28,11 +43,14 @@ def MemoryCircuitBreaker(key, subject, expires=180, failures=5, timeout=10, jitt
         key=key,
         failures=failures,
         timeout=timeout,
-        jitter=jitter)
+        jitter=jitter,
+        parent=parent,
+        events=events,
+        limiter=limiter)
     
     return breaker
 
-def RedisCircuitBreaker(key, subject, expires=180, failures=5, timeout=10, jitter=None, redis_url=None, redis_connection=None, prefix="rcb:"):
+def RedisCircuitBreaker(key, subject, expires=180, failures=5, timeout=10, jitter=None, redis_url=None, redis_connection=None, prefix="rcb:", parent=None, events=None, encoding="hash", limiter=None):
     """
     Create and configure a CircuitBreaker with a RedisDriver back-end.
     
@@ -40,12 +58,16 @@ def RedisCircuitBreaker(key, subject, expires=180, failures=5, timeout=10, jitte
        - redis_url: string, see RedisDriver
        - redis_connection: StrictRedis object, see RedisDriver
        - prefix: a string to help group the circuit breaker keys in redis.
+       - encoding: string, "hash" or "packed", see RedisDriver
     """
+    from .drivers.redis import RedisDriver
+    
     driver = RedisDriver(
         redis_url=redis_url, 
         redis_connection=redis_connection, 
         expires=expires, 
-        prefix=prefix)
+        prefix=prefix,
+        encoding=encoding)
         
     breaker = CircuitBreaker(
         driver=driver, 
@@ -53,6 +75,9 @@ def RedisCircuitBreaker(key, subject, expires=180, failures=5, timeout=10, jitte
         key=key, 
         failures=failures, 
         timeout=timeout,
-        jitter=jitter)
+        jitter=jitter,
+        parent=parent,
+        events=events,
+        limiter=limiter)
     
     return breaker
\ No newline at end of file
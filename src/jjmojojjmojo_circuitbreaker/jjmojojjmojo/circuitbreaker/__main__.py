@@ -0,0 +1,8 @@
+"""
+Allows the command-line tool to be run with `python -m jjmojojjmojo.circuitbreaker`.
+"""
+
+import sys
+from .cli import main
+
+sys.exit(main())
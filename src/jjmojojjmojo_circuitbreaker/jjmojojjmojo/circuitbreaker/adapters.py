@@ -0,0 +1,97 @@
+"""
+A transport adapter for requests, that puts every request behind a breaker
+for its host.
+
+    import requests
+    from jjmojojjmojo.circuitbreaker.adapters import mount
+
+    session = requests.Session()
+    mount(session, "redis://localhost:6379/0?expires=300")
+
+    session.get("https://partner.example.com/v1/orders")
+
+Every origin (scheme, host and port) gets its own breaker the first time it's
+seen, all sharing one driver (see the hosts module). By default 5xx responses,
+connection errors and timeouts count as failures; 5xx responses are still
+returned to the caller. While a host's breaker is open, requests to it raise
+CircuitBreakerOpen before a connection is taken from the pool or opened.
+
+BreakerAdapter is an HTTPAdapter, so connections are pooled and re-used just
+like without it, and its keyword arguments (pool_connections, pool_maxsize,
+max_retries...) are the same. Mount one adapter for both http:// and https://
+(mount() does) so they share the breakers.
+"""
+
+import functools
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .hosts import HostBreakers
+from .policy import FailurePolicy
+
+def server_error(response):
+    """
+    Return True if the response has a 5xx status.
+    """
+    return response.status_code >= 500
+
+def default_policy():
+    """
+    Count connection errors, timeouts and 5xx responses as failures.
+    """
+    return FailurePolicy(
+        include=(requests.ConnectionError, requests.Timeout),
+        result=server_error)
+
+class BreakerAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter that sends every request through the breaker for its host.
+    """
+    def __init__(self, driver, failures=5, timeout=10, prefix="http:", policy=None, breaker_options=None, **kwargs):
+        """
+        driver: Driver object, or a driver URL (see the registry module).
+        failures: int, number of failures that open a host's breaker.
+        timeout: int, seconds a host's breaker stays open.
+        prefix: string, put in front of the origin to make the breaker keys.
+        policy: FailurePolicy object, defaults to default_policy().
+        breaker_options: dictionary, other arguments for every CircuitBreaker
+                         (jitter, ramp, events, tracer...).
+
+        Other keyword arguments are passed to HTTPAdapter.
+        """
+        HTTPAdapter.__init__(self, **kwargs)
+
+        self.breakers = HostBreakers(
+            driver,
+            functools.partial(HTTPAdapter.send, self),
+            failures=failures,
+            timeout=timeout,
+            prefix=prefix,
+            policy=default_policy() if policy is None else policy,
+            **(breaker_options or {}))
+
+    def breaker(self, url):
+        """
+        Return the breaker for the origin of the given URL.
+        """
+        return self.breakers.for_url(url)
+
+    def send(self, request, **kwargs):
+        """
+        Send the request through its host's breaker. Raises CircuitBreakerOpen
+        if the breaker is open.
+        """
+        return self.breakers.for_url(request.url)(request, **kwargs)
+
+def mount(session, driver, prefixes=("http://", "https://"), **kwargs):
+    """
+    Mount one BreakerAdapter on the session for the given URL prefixes, and
+    return it. Keyword arguments are passed to BreakerAdapter.
+    """
+    adapter = BreakerAdapter(driver, **kwargs)
+
+    for prefix in prefixes:
+        session.mount(prefix, adapter)
+
+    return adapter
@@ -2,15 +2,44 @@
 Base class for the CircuitBreaker.
 """
 
-import time
 import logging
 import random
+import threading
+import time
+import contextlib
+import concurrent.futures
 
 STATUS_OPEN = 0
 STATUS_CLOSED = 1
+STATUS_RAMPING = 2
+
+STATUS_NAMES = {
+    STATUS_OPEN: "OPEN",
+    STATUS_CLOSED: "CLOSED",
+    STATUS_RAMPING: "RAMPING"
+}
 
 from .errors import CircuitBreakerOpen, BackendKeyNotFound
 from .drivers import Driver
+from .events import EVENT_OPEN, EVENT_CLOSE, EVENT_RESET, EVENT_RAMP
+
+def linear_ramp(progress):
+    """
+    Admit a fraction of calls that grows evenly over the ramp.
+    """
+    return progress
+
+def exponential_ramp(progress):
+    """
+    Admit 1% of calls at the start of the ramp, doubling at a steady pace up to 
+    all of them at the end.
+    """
+    return 0.01 ** (1 - progress)
+
+RAMPS = {
+    "linear": linear_ramp,
+    "exponential": exponential_ramp
+}
 
 def rand_int_jitter():
     """
@@ -18,6 +47,27 @@ def rand_int_jitter():
     """
     return random.randint(0, 10)
 
+_scope = threading.local()
+
+@contextlib.contextmanager
+def request_scope():
+    """
+    Context manager that marks the boundaries of a single request.
+    
+    Within the scope, the state of a parent breaker is loaded at most once, 
+    no matter how many of its children are called. Scopes are per-thread, 
+    nested scopes share the outermost one.
+    """
+    if getattr(_scope, "loaded", None) is not None:
+        yield
+        return
+    
+    _scope.loaded = set()
+    try:
+        yield
+    finally:
+        _scope.loaded = None
+
 class CircuitBreaker:
     """
     A wrapper class for external services. When a service call (passed as a 
@@ -30,7 +80,7 @@ class CircuitBreaker:
     failure count is reset to 0, and all future calls will go directly to the 
     service, until there are errors again.
     """
-    def __init__(self, driver, subject, key, failures=5, timeout=10, jitter=None):
+    def __init__(self, driver, subject, key, failures=5, timeout=10, jitter=None, parent=None, events=None, limiter=None, ramp=0, ramp_mode="linear", latency=None, policy=None, coalesce=None, tracer=None):
         """
         Constructor.
         
@@ -50,6 +100,40 @@ class CircuitBreaker:
             - jitter: callable or fixed value to add jitter to the timeout, 
               prevents "stampeding herd" issues. Callable takes no params, returns 
               a number to add to the timeout check.
+            - parent: CircuitBreaker object, optional. Failures of this breaker 
+              are also counted against the parent, and while the parent is open,
+              calls are rejected without loading this breaker's state. Useful 
+              for grouping endpoints that share a host.
+            - events: EventLog object, optional. Every open, close and reset is
+              recorded to it (see the events module).
+            - limiter: RateLimiter object, optional. Every call takes a token 
+              from it, and raises RateLimitExceeded if there isn't one (see 
+              the ratelimit module). Calls turned away because the breaker 
+              is open give their token back.
+            - ramp: number, defaults to 0 - seconds to ramp traffic back up 
+              after a successful retry. While the breaker is "ramping", only a 
+              growing fraction of calls are let through, the rest raise 
+              CircuitBreakerOpen without touching the back-end, and any failure
+              opens the breaker again. 0 closes it right away.
+            - ramp_mode: string or callable, how the fraction of calls let 
+              through grows during the ramp: "linear", "exponential", or a 
+              callable that takes the progress through the ramp (0 to 1) and 
+              returns the fraction.
+            - latency: LatencyMonitor object, optional. Every call is timed, 
+              and the breaker opens when the calls get too slow (see the 
+              latency module). The call that trips it still returns its result.
+            - policy: FailurePolicy object, optional. Decides which exceptions
+              and return values count as failures, and how much (see the 
+              policy module). By default every exception counts once.
+            - coalesce: boolean, optional - threads that load this breaker's
+              state at the same time share one read from the back-end (see
+              Driver.load_shared()). Defaults to the driver's 
+              coalesce_loads: on for redis, off for the MemoryDriver, where 
+              a load is cheaper than sharing it.
+            - tracer: Tracer object, optional. Every call is recorded as a 
+              span, with the subject in a span of its own (see the tracing 
+              module). Wrap the driver in a TracedDriver with the same tracer
+              to record the driver operations too.
         """
         self.subject = subject
         self.key = key
@@ -61,8 +145,32 @@ class CircuitBreaker:
         else:
             raise AttributeError("'driver' parameter must be derived from the Driver base class")
         
+        if parent is not None and not isinstance(parent, CircuitBreaker):
+            raise AttributeError("'parent' parameter must be a CircuitBreaker")
+        
+        self.parent = parent
+        self.events = events
+        self.limiter = limiter
+        self.ramp = ramp
+        self.latency = latency
+        self.policy = policy
+        
+        if coalesce is None:
+            self.coalesce = driver.coalesce_loads
+        else:
+            self.coalesce = coalesce
+            
+        self.tracer = tracer
+        
+        if callable(ramp_mode):
+            self._ramp = ramp_mode
+        elif ramp_mode in RAMPS:
+            self._ramp = RAMPS[ramp_mode]
+        else:
+            raise AttributeError(f"'ramp_mode' must be a callable or one of {tuple(RAMPS)}")
+        
         self.failures = 0
-        self.checkin = time.time()
+        self.checkin = self.driver.now()
         self.status = STATUS_CLOSED
         
         self.key = key
@@ -75,6 +183,7 @@ class CircuitBreaker:
             self._jitter = jitter
             
         self._last_jitter = None
+        self._random = random.random
         
     @property
     def jitter(self):
@@ -108,7 +217,10 @@ class CircuitBreaker:
         self.logger.debug("Loading %s", self.key)
         
         try:
-            info = self.driver.load(self.key)
+            if self.coalesce:
+                info = self.driver.load_shared(self.key)
+            else:
+                info = self.driver.load(self.key)
             self.logger.debug("%s found", self.key)
         except BackendKeyNotFound:
             self.logger.debug("Entry %s not found, creating a new one", self.key)
@@ -117,13 +229,132 @@ class CircuitBreaker:
         self.failures = info["failures"]
         self.checkin = info["checkin"]
         self.status = info["status"]
+    
+    def _load_and_take(self, limiter):
+        """
+        Like load(), but also takes a lease of tokens for the given RateLimiter,
+        in the same round trip. Returns the number of tokens granted.
+        """
+        self.driver.expire(self.key, self.checkin)
+        
+        info, granted = self.driver.load_and_take(self.key, limiter.key, limiter.lease, limiter.burst, limiter.rate)
+        
+        if info is None:
+            self.logger.debug("Entry %s not found, creating a new one", self.key)
+            info = self.driver.new(self.key)
+            
+        self.failures = info["failures"]
+        self.checkin = info["checkin"]
+        self.status = info["status"]
+        
+        return granted
+    
+    def _load_scoped(self):
+        """
+        Like load(), but only loads once within a request_scope().
+        """
+        loaded = getattr(_scope, "loaded", None)
+        
+        if loaded is None:
+            self.load()
+        elif id(self) not in loaded:
+            self.load()
+            loaded.add(id(self))
+    
+    def _check_as_parent(self):
+        """
+        Check this breaker's state on behalf of a child that is about to be called.
+        
+        Raises CircuitBreakerOpen if this breaker (or one of its own parents) is 
+        open and not ready to be retried, or has just been opened.
+        """
+        if self.parent is not None:
+            self.parent._check_as_parent()
+        
+        self._load_scoped()
+        
+        if self.status == STATUS_RAMPING:
+            if not self._ramp_admits():
+                self.logger.debug("Parent breaker %s is RAMPING, call rejected", self.key)
+                raise CircuitBreakerOpen()
+            return
+        
+        if self.status == STATUS_OPEN:
+            if self.driver.now() - self.checkin >= self.timeout+self.jitter:
+                self.logger.info("Timeout reached. Child call will retry %s. Jitter %s", self.key, self._last_jitter)
+                return
+            self.logger.debug("Parent breaker %s is OPEN", self.key)
+            raise CircuitBreakerOpen()
         
-    def failure(self):
+        if self.failures >= self.max_failures:
+            self.logger.debug("Maximum failures %s exceeded for parent %s.", self.max_failures, self.key)
+            self.open()
+            raise CircuitBreakerOpen()
+        
+    def failure(self, amount=1):
         """
-        Log a single failure.
+        Log a single failure, counting for amount.
+        
+        If the breaker was removed from the back-end since it was loaded (it 
+        expired, or was swept), it's created again.
         """
         self.logger.debug("Logging failure for %s", self.key)
-        self.failures = self.driver.failure(self.key)
+        try:
+            self.failures = self.driver.failure(self.key, amount)
+        except BackendKeyNotFound:
+            self.logger.debug("Entry %s not found, creating a new one", self.key)
+            self.driver.new(self.key)
+            self.failures = self.driver.failure(self.key, amount)
+        
+    def _failed(self, amount=1):
+        """
+        Log a failure of a call made through this breaker. A failure while
+        ramping opens the breaker again right away.
+        """
+        self.failure(amount)
+        
+        if self.status == STATUS_RAMPING:
+            self.logger.info("Failure while ramping up %s", self.key)
+            self.open()
+    
+    def _recovered(self):
+        """
+        A call made through this breaker succeeded. Close the breaker, or start
+        ramping up if it was open and a ramp is configured. A ramping breaker 
+        is closed once the ramp is over.
+        """
+        if self.status == STATUS_OPEN and self.ramp:
+            self.ramp_up()
+        elif self.status == STATUS_RAMPING:
+            if self.driver.now() - self.checkin >= self.ramp:
+                self.close()
+        else:
+            self.close()
+    
+    def _ramp_admits(self):
+        """
+        Decide whether a call is let through while ramping. 
+        
+        The progress through the ramp is measured from the shared checkin, so 
+        every client ramps up together.
+        """
+        progress = (self.driver.now() - self.checkin) / self.ramp if self.ramp else 1
+        
+        if progress >= 1:
+            return True
+        
+        return self._random() < self._ramp(max(0, progress))
+        
+    def _timed(self, start):
+        """
+        Pass the time taken by a call that started at the given 
+        time.perf_counter() reading to the latency monitor, and open the 
+        breaker if the calls are too slow.
+        """
+        if self.latency is not None:
+            if self.latency.record(time.perf_counter() - start):
+                self.logger.info("Calls to %s are too slow", self.key)
+                self.open()
         
     def reset(self):
         """
@@ -132,49 +363,165 @@ class CircuitBreaker:
         self.logger.debug("Resetting %s", self.key)
         self.driver.reset(self.key)
         
+        if self.latency is not None:
+            self.latency.reset()
+        
+        if self.events is not None:
+            self.events.record(EVENT_RESET, self.key, self.failures, self.driver.now())
+        
     def open(self):
         """
         Open the breaker.
+        
+        The change is a compare-and-set in the driver (see 
+        Driver.transition()): when several clients open the breaker at once, 
+        only one of them opens it, and records the event.
         """
-        if self.status == STATUS_CLOSED:
-            self.logger.info("Opening %s", self.key)
-            self.driver.open(self.key)
+        if self.status in (STATUS_CLOSED, STATUS_RAMPING):
+            opened = self.driver.transition(self.key, (STATUS_CLOSED, STATUS_RAMPING), STATUS_OPEN)
             self.status = STATUS_OPEN
             self.checkin = self.driver.now()
+            
+            if not opened:
+                self.logger.debug("%s was already opened by another client", self.key)
+                return
+            
+            self.logger.info("Opening %s", self.key)
+            
+            if self.events is not None:
+                self.events.record(EVENT_OPEN, self.key, self.failures, self.checkin)
+    
+    def ramp_up(self):
+        """
+        Start ramping traffic back up. The checkin marks the start of the ramp.
+        
+        Only an open breaker starts ramping. If another client has already 
+        started the ramp, or closed the breaker, nothing is changed, and the 
+        breaker's state is loaded again.
+        """
+        ramping = self.driver.transition(self.key, (STATUS_OPEN,), STATUS_RAMPING, failures=0)
+        
+        if not ramping:
+            self.logger.debug("%s is no longer open, not ramping up", self.key)
+            self.load()
+            return
+        
+        self.status = STATUS_RAMPING
+        self.failures = 0
+        self.checkin = self.driver.now()
+        
+        if self.latency is not None:
+            self.latency.reset()
+        
+
+        self.logger.info("Ramping up %s over %ss", self.key, self.ramp)
+        
+        if self.events is not None:
+            self.events.record(EVENT_RAMP, self.key, self.failures, self.checkin)
     
     def close(self):
         """
-        Close the breaker
+        Close the breaker. Like open(), only one of the clients closing it at
+        once records the event.
         """
-        if self.status == STATUS_OPEN:
-            self.logger.info("Closing %s", self.key)
-            self.driver.close(self.key)
+        if self.status in (STATUS_OPEN, STATUS_RAMPING):
+            closed = self.driver.transition(self.key, (STATUS_OPEN, STATUS_RAMPING), STATUS_CLOSED, failures=0)
             self.status = STATUS_CLOSED
+            
+            if self.latency is not None:
+                self.latency.reset()
+            
+            if not closed:
+                self.logger.debug("%s was already closed by another client", self.key)
+                return
+            
+            self.logger.info("Closing %s", self.key)
+            
+            if self.events is not None:
+                self.events.record(EVENT_CLOSE, self.key, self.failures, self.driver.now())
     
-    def _try_or_open(self, *args, **kwargs):
+    def _try_or_open(self, subject, args, kwargs, settle=None):
         """
         Helper method. 
         
-        Attempts to call self.subject. If it throws an exception, it logs the 
+        Attempts to call subject (self.subject, or a wrapper that traces it)
+        with the given positional and keyword arguments. If it throws an exception, it logs the 
         failure. If it doesn't, it closes the breaker and returns the result.
         
         If a failure is logged, the number of failures is checked, and if it 
         exceeds self.max_failures, the breaker is opened. 
         
+        If there is a latency monitor, the call is timed, and the breaker is 
+        opened if the calls have become too slow.
+        
+        If there is a failure policy, it decides which exceptions (and return
+        values) are failures, and how much they count for. Outcomes it ignores
+        leave the breaker alone. The policy is consulted once per call.
+        
+        settle: callable, optional. Records the outcome, instead of 
+                self._settle(). Takes the same arguments.
+        
         Raises CircuitBreakerOpen if the breaker has flipped.
         """
         self.logger.debug("Trying to execute service for %s", self.key)
         
+        if settle is None:
+            settle = self._settle
+        
+        start = time.perf_counter()
+        
         try:
-            result = self.subject(*args, **kwargs)
-            self.close()
-            return result
+            result = subject(*args, **kwargs)
         except Exception as e:
+            weight = 1 if self.policy is None else self.policy.weight(e)
+            
+            if not weight:
+                self.logger.debug("Ignoring error from %s: %r", self.key, e)
+                raise
+            
             self.logger.error("Error detected accessing %s: %s", self.key, e)
-            self.failure()
+            settle(weight, start)
             
             self.logger.debug("Maximum failures %s *not* exceeded. Re-raising", self.max_failures)
             raise
+        
+        weight = 0 if self.policy is None else self.policy.result_failure(result)
+        
+        if weight:
+            self.logger.error("Failed result from %s: %r", self.key, result)
+            
+        settle(weight, start)
+        
+        return result
+    
+    def _settle(self, weight, start):
+        """
+        Record the outcome of a call that started at start (a 
+        time.perf_counter() value): a failure counting for weight, or a 
+        success if weight is 0.
+        """
+        if weight:
+            self._count_failure(weight)
+        else:
+            self._recovered()
+            
+            parent = self.parent
+            while parent is not None:
+                parent._recovered()
+                parent = parent.parent
+        
+        self._timed(start)
+        
+    def _count_failure(self, amount):
+        """
+        Log a failed call against this breaker and its parents.
+        """
+        self._failed(amount)
+        
+        parent = self.parent
+        while parent is not None:
+            parent._failed(amount)
+            parent = parent.parent
     
     def __call__(self, *args, **kwargs):
         """
@@ -187,23 +534,142 @@ class CircuitBreaker:
         All positional and keyword arguments are passed verbatim to the subject
         callable.
         """
-        self.load()
+        if self.tracer is None:
+            return self._call(self.subject, args, kwargs)
+        
+        return self._traced_call(args, kwargs)
+    
+    def _traced_call(self, args, kwargs):
+        """
+        Make a call in a "circuitbreaker.call" span, and the subject in a 
+        "circuitbreaker.subject" span. The status the call left the breaker in
+        is recorded as the "circuitbreaker.status" attribute.
+        """
+        with self.tracer.span("circuitbreaker.call", self.key) as span:
+            subject = self.tracer.wrap(self.subject, "circuitbreaker.subject", self.key)
+            
+            try:
+                return self._call(subject, args, kwargs)
+            finally:
+                if span is not None:
+                    span.set_attribute("circuitbreaker.status", STATUS_NAMES.get(self.status, "UNKNOWN"))
+    
+    def _call(self, subject, args, kwargs):
+        """
+        The circuit breaker logic of __call__(), calling the given subject.
+        """
+        admitted = False
+        
+        if self.status == STATUS_RAMPING:
+            # decided before any I/O, from the last state seen
+            if not self._ramp_admits():
+                self.logger.debug("Breaker %s is RAMPING, call rejected", self.key)
+                raise CircuitBreakerOpen()
+            admitted = True
+        
+        if self.parent is not None:
+            self.parent._check_as_parent()
+        
+        if self.limiter is None:
+            self.load()
+        else:
+            self.limiter.load_breaker(self)
+        
+        if self.status == STATUS_RAMPING:
+            if not admitted and not self._ramp_admits():
+                self.logger.debug("Breaker %s is RAMPING, call rejected", self.key)
+                self._refund()
+                raise CircuitBreakerOpen()
+            return self._try_or_open(subject, args, kwargs)
         
         if self.status == STATUS_OPEN:
             self.logger.debug("Breaker %s is OPEN", self.key)
             if self.driver.now() - self.checkin >= self.timeout+self.jitter:
                 self.logger.info("Timeout reached. Retrying %s. Jitter %s", self.key, self._last_jitter)
-                return self._try_or_open(*args, **kwargs)
+                return self._try_or_open(subject, args, kwargs)
             else:
+                self._refund()
                 raise CircuitBreakerOpen()
         
         if self.status == STATUS_CLOSED:
             if self.failures >= self.max_failures:
                 self.logger.debug("Maximum failures %s exceeded.", self.max_failures)
+                self._refund()
                 self.open()
                 raise CircuitBreakerOpen()
             self.logger.debug(f"Breaker %s is CLOSED", self.key)
-            return self._try_or_open(*args, **kwargs)
+            return self._try_or_open(subject, args, kwargs)
+            
+    def _refund(self):
+        """
+        Give the rate limiter's token back, for a call turned away after it 
+        was taken.
+        """
+        if self.limiter is not None:
+            self.limiter.refund()
+    
+    def guard(self, refresh=1):
+        """
+        Return a Guard for making many calls through this breaker, with the 
+        state loaded once per refresh interval instead of on every call:
+        
+            with breaker.guard() as guard:
+                for record in records:
+                    guard(record)
+        
+        refresh: number, maximum seconds between loads of the breaker's state.
+        """
+        return Guard(self, refresh)
+    
+    def map(self, arguments, concurrency=1, refresh=1):
+        """
+        Call the subject once for each item in arguments, through a guard().
+        
+        Returns a list, in the same order as arguments, holding either the 
+        result of each call or the exception it raised. Once the breaker trips,
+        the remaining calls are not made: their entries are CircuitBreakerOpen
+        exceptions.
+        
+        arguments: iterable of tuples, positional arguments for each call.
+        concurrency: int, number of calls to make at once, from a thread pool.
+        refresh: number, see guard().
+        """
+        results = []
+        
+        with self.guard(refresh) as guard:
+            def call(index, args):
+                try:
+                    results[index] = guard(*args)
+                except Exception as e:
+                    results[index] = e
+            
+            if concurrency <= 1:
+                for index, args in enumerate(arguments):
+                    results.append(None)
+                    call(index, args)
+                    
+                return results
+            
+            slots = threading.Semaphore(concurrency)
+            
+            def run(index, args):
+                try:
+                    call(index, args)
+                finally:
+                    slots.release()
+            
+            with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="CircuitBreaker-map") as pool:
+                for index, args in enumerate(arguments):
+                    results.append(None)
+                    
+                    if guard.tripped:
+                        results[index] = CircuitBreakerOpen()
+                        continue
+                    
+                    slots.acquire()
+                    pool.submit(run, index, args)
+                    
+        return results
             
     def dict(self):
         """
@@ -216,7 +682,12 @@ class CircuitBreaker:
             'timeout': self.timeout,
             'checkin': self.checkin,
             'jitter': self._last_jitter,
-            'max_failures': self.max_failures
+            'max_failures': self.max_failures,
+            'parent': None if self.parent is None else self.parent.key,
+            'limiter': None if self.limiter is None else self.limiter.key,
+            'ramp': self.ramp,
+            'latency': None if self.latency is None else self.latency.key,
+            'tracer': None if self.tracer is None else self.tracer.dict()
         }
         
             
@@ -225,10 +696,144 @@ class CircuitBreaker:
         A representation of this object for use when printing - handy for interpreter
         use.
         """
-        if self.status == STATUS_CLOSED:
-            status = "CLOSED"
-        elif self.status == STATUS_OPEN:
-            status = "OPEN"
-        else:
-            status = "UNKNOWN"
+        status = STATUS_NAMES.get(self.status, "UNKNOWN")
         return f"<{self.__class__.__name__} [{self.key}] status={status} failures={self.failures} checkin={self.checkin}, jitter={self._last_jitter}>"
+
+class Guard:
+    """
+    Makes many calls through one CircuitBreaker, loading its state at most once
+    per refresh interval instead of on every call. Created by 
+    CircuitBreaker.guard(). Safe to call from several threads at once.
+    
+    Failures are still counted in the back-end as they happen, and the count
+    returned by the driver keeps the local state current in between loads.
+    
+    Once the breaker trips (it opens, is found open, or a retry after the 
+    timeout fails), the guard stops: every later call raises 
+    CircuitBreakerOpen without touching the back-end. Use a new guard to try 
+    again.
+    
+    If the breaker has a rate limiter, every call takes a token from it (and 
+    gives it back if the guard turns the call away). Calls over the limit 
+    raise RateLimitExceeded, but don't stop the guard. Calls 
+    turned away while the breaker is ramping up raise CircuitBreakerOpen, and 
+    don't stop it either. Outcomes ignored by the breaker's failure policy 
+    don't count against it.
+    """
+    def __init__(self, breaker, refresh=1):
+        """
+        breaker: CircuitBreaker object, the breaker to call through.
+        refresh: number, maximum seconds between loads of the breaker's state.
+        """
+        self.breaker = breaker
+        self.refresh = refresh
+        self.tripped = False
+        self.loads = 0
+        
+        self._loaded = None
+        self._probing = False
+        self._lock = threading.Lock()
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
+    
+    def _trip(self):
+        """
+        Stop the guard, and reject the current call.
+        """
+        self.tripped = True
+        raise CircuitBreakerOpen()
+    
+    def _admit(self):
+        """
+        Decide whether a call can go through, loading the state if it's stale. 
+        
+        Returns True if the call is the retry of an open breaker. Raises 
+        CircuitBreakerOpen if the call can't be made.
+        """
+        breaker = self.breaker
+        
+        with self._lock:
+            if self.tripped:
+                raise CircuitBreakerOpen()
+            
+            now = breaker.driver.now()
+            
+            if self._loaded is None or now - self._loaded >= self.refresh:
+                try:
+                    if breaker.parent is not None:
+                        breaker.parent._check_as_parent()
+                    breaker.load()
+                except CircuitBreakerOpen:
+                    self._trip()
+                    
+                self._loaded = now
+                self.loads += 1
+                
+            if breaker.status == STATUS_RAMPING:
+                if not breaker._ramp_admits():
+                    raise CircuitBreakerOpen()
+                return False
+                
+            if breaker.status == STATUS_OPEN:
+                if self._probing:
+                    raise CircuitBreakerOpen()
+                
+                if now - breaker.checkin >= breaker.timeout+breaker.jitter:
+                    breaker.logger.info("Timeout reached. Retrying %s. Jitter %s", breaker.key, breaker._last_jitter)
+                    self._probing = True
+                    return True
+                
+                self._trip()
+                
+            if breaker.failures >= breaker.max_failures:
+                breaker.logger.debug("Maximum failures %s exceeded.", breaker.max_failures)
+                breaker.open()
+                self._trip()
+                
+            return False
+    
+    def _settle(self, probe, weight, start):
+        """
+        Record the outcome of a call on the breaker (see 
+        CircuitBreaker._settle()). If it failed, stop the guard if it was a 
+        retry, or the breaker has opened or reached its failure threshold.
+        
+        The breaker's state is only changed with the lock held, so calls 
+        settling at the same time don't interleave their updates, or race 
+        with a load in _admit().
+        """
+        breaker = self.breaker
+        
+        with self._lock:
+            breaker._settle(weight, start)
+            
+            if weight and (probe or breaker.status == STATUS_OPEN or breaker.failures >= breaker.max_failures):
+                breaker.open()
+                self.tripped = True
+    
+    def __call__(self, *args, **kwargs):
+        """
+        Call the breaker's subject with the given arguments.
+        """
+        if self.breaker.limiter is not None:
+            self.breaker.limiter.check()
+        
+        try:
+            probe = self._admit()
+        except CircuitBreakerOpen:
+            self.breaker._refund()
+            raise
+        
+        try:
+            return self.breaker._try_or_open(
+                self.breaker.subject, args, kwargs,
+                lambda weight, start: self._settle(probe, weight, start))
+        finally:
+            if probe:
+                with self._lock:
+                    self._probing = False
+                    self._loaded = None
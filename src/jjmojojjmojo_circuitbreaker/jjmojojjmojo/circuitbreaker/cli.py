@@ -0,0 +1,255 @@
+"""
+Command-line tool for inspecting and managing circuit breakers.
+
+Run it with `python -m jjmojojjmojo.circuitbreaker`. For example:
+
+    $ python -m jjmojojjmojo.circuitbreaker -r redis://localhost:6379/0 list 'payments-*'
+    $ python -m jjmojojjmojo.circuitbreaker -r redis://localhost:6379/0 reset 'payments-*'
+
+Keys are given as glob-style patterns. Patterns are expanded with
+Driver.keys() (SCAN for redis), and the resulting keys are processed in batches
+with the Driver.*_many() methods (pipelines for redis).
+"""
+
+from .base import STATUS_NAMES
+from . import registry
+from .errors import CircuitBreakerException
+import argparse
+import datetime
+import json
+import logging
+import sys
+
+def has_magic(pattern):
+    """
+    Return True if the pattern contains glob characters.
+    """
+    return any(c in pattern for c in "*?[")
+
+def expand(driver, patterns, batch_size):
+    """
+    Expand the given patterns into batches (lists) of keys.
+
+    Patterns without glob characters are passed through verbatim, whether or
+    not the breaker exists.
+    """
+    batch = []
+    seen = set()
+
+    for pattern in patterns:
+        if has_magic(pattern):
+            keys = driver.keys(pattern)
+        else:
+            keys = [pattern]
+
+        for key in keys:
+            if key in seen:
+                continue
+            seen.add(key)
+            batch.append(key)
+
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+    if batch:
+        yield batch
+
+def describe(key, info):
+    """
+    Convert breaker info into something easy to print or serialize.
+    """
+    return {
+        'key': key,
+        'status': STATUS_NAMES.get(info['status'], "UNKNOWN"),
+        'failures': info['failures'],
+        'checkin': info['checkin']
+    }
+
+def format_row(row):
+    """
+    Format a described breaker as a line of text.
+    """
+    checkin = datetime.datetime.fromtimestamp(row['checkin']).isoformat(sep=" ", timespec="seconds")
+    return f"{row['key']}\t{row['status']}\t{row['failures']}\t{checkin}"
+
+def cmd_list(driver, opts, out):
+    """
+    Show every breaker matching the patterns.
+    """
+    rows = []
+
+    for batch in expand(driver, opts.patterns or ["*"], opts.batch_size):
+        for key, info in driver.load_many(batch).items():
+            rows.append(describe(key, info))
+
+    rows.sort(key=lambda row: row['key'])
+
+    if opts.json:
+        json.dump(rows, out, indent=2)
+        out.write("\n")
+    else:
+        for row in rows:
+            out.write(format_row(row) + "\n")
+
+    return 0
+
+def cmd_show(driver, opts, out):
+    """
+    Show the given breakers.
+    """
+    found = driver.load_many(opts.keys)
+    missing = [key for key in opts.keys if key not in found]
+
+    rows = [describe(key, found[key]) for key in opts.keys if key in found]
+
+    if opts.json:
+        json.dump(rows, out, indent=2)
+        out.write("\n")
+    else:
+        for row in rows:
+            out.write(format_row(row) + "\n")
+
+    for key in missing:
+        sys.stderr.write(f"{key}: not found\n")
+
+    return 1 if missing else 0
+
+def batch_command(method, verb, description):
+    """
+    Build a command that applies one of the Driver.*_many() methods to every
+    key matching the patterns.
+    """
+    def command(driver, opts, out):
+        count = 0
+
+        for batch in expand(driver, opts.patterns, opts.batch_size):
+            getattr(driver, method)(batch)
+            count += len(batch)
+
+        if opts.json:
+            json.dump({verb: count}, out)
+            out.write("\n")
+        else:
+            out.write(f"{verb} {count} breakers\n")
+
+        return 0
+
+    command.__doc__ = description
+    return command
+
+def cmd_migrate(driver, opts, out):
+    """
+    Convert breakers matching the patterns to the driver's encoding (--encoding).
+    """
+    if not hasattr(driver, "migrate"):
+        sys.stderr.write("This back-end has only one encoding\n")
+        return 1
+    
+    count = 0
+    
+    for pattern in opts.patterns or ["*"]:
+        count += driver.migrate(pattern)
+        
+    if opts.json:
+        json.dump({'migrated': count}, out)
+        out.write("\n")
+    else:
+        out.write(f"migrated {count} breakers to {driver.encoding}\n")
+        
+    return 0
+
+def cmd_sweep(driver, opts, out):
+    """
+    Remove breakers that have expired (--expires) now.
+    """
+    if not hasattr(driver, "sweep"):
+        sys.stderr.write("This back-end expires breakers on its own\n")
+        return 1
+    
+    count = driver.sweep()
+    
+    if opts.json:
+        json.dump({'swept': count}, out)
+        out.write("\n")
+    else:
+        out.write(f"swept {count} breakers\n")
+        
+    return 0
+
+COMMANDS = {
+    'list': cmd_list,
+    'show': cmd_show,
+    'reset': batch_command("reset_many", "reset", "Reset every breaker matching the patterns."),
+    'open': batch_command("open_many", "opened", "Force every breaker matching the patterns open."),
+    'delete': batch_command("delete_many", "deleted", "Delete every breaker matching the patterns."),
+    'migrate': cmd_migrate,
+    'sweep': cmd_sweep
+}
+
+parser = argparse.ArgumentParser(prog="python -m jjmojojjmojo.circuitbreaker", description='Inspect and manage circuit breakers.')
+parser.add_argument('-r', '--redis-url', type=str, default="redis://localhost:6379/0", help="Redis connection URL")
+parser.add_argument('-u', '--url', type=str, default=None, help="Driver URL, e.g. memory:// or redis://localhost:6379/0?prefix=rcb:. Overrides --backend and --redis-url.")
+parser.add_argument('-b', '--backend', type=str, default="redis", choices=["redis", "memory"], help="Indicate a specific back-end to use.")
+parser.add_argument('-p', '--prefix', type=str, default="rcb:", help="Prefix of the circuit breaker keys in redis")
+parser.add_argument('--encoding', type=str, default="hash", choices=["hash", "packed"], help="How breakers are stored in redis")
+parser.add_argument('-e', '--expires', type=int, default=None, help="Time to live to set on reset breakers")
+parser.add_argument('--batch-size', type=int, default=1000, help="Number of breakers per round trip")
+parser.add_argument('-j', '--json', action="store_true", help="Output JSON")
+parser.add_argument('-l', '--log-level', type=str, default="warning", help="Set the logging level. Options are the constants in the logging module.")
+
+subparsers = parser.add_subparsers(dest="command", metavar="command")
+subparsers.required = True
+
+subparsers.add_parser('list', help=cmd_list.__doc__.strip()).add_argument('patterns', nargs="*", help="Glob-style key patterns. Defaults to everything.")
+subparsers.add_parser('show', help=cmd_show.__doc__.strip()).add_argument('keys', nargs="+", help="Breaker keys")
+
+for name in ("reset", "open", "delete"):
+    subparsers.add_parser(name, help=COMMANDS[name].__doc__).add_argument('patterns', nargs="+", help="Glob-style key patterns")
+
+subparsers.add_parser('migrate', help=cmd_migrate.__doc__.strip()).add_argument('patterns', nargs="*", help="Glob-style key patterns. Defaults to everything.")
+subparsers.add_parser('sweep', help=cmd_sweep.__doc__.strip())
+
+def make_driver(opts):
+    """
+    Create the driver described by the command-line options.
+    """
+    options = {}
+
+    if opts.expires is not None:
+        options['expires'] = opts.expires
+
+    if opts.url is not None:
+        return registry.from_url(opts.url, **options)
+
+    if opts.backend == "memory":
+        return registry.from_url("memory://", **options)
+
+    return registry.from_url(opts.redis_url, prefix=opts.prefix, encoding=opts.encoding, **options)
+
+def main(argv=None, driver=None, out=None):
+    """
+    Entry point. Returns the exit status.
+
+    argv: list of strings, the command-line arguments (defaults to sys.argv).
+    driver: Driver object, use this driver instead of creating one from the
+            options.
+    out: file-like object to write output to (defaults to sys.stdout).
+    """
+    opts = parser.parse_args(argv)
+
+    if out is None:
+        out = sys.stdout
+
+    logging.basicConfig(
+        format="[%(asctime)s] [%(name)s] [%(levelname)s] %(message)s",
+        level=getattr(logging, opts.log_level.upper()))
+
+    if driver is None:
+        driver = make_driver(opts)
+
+    try:
+        return COMMANDS[opts.command](driver, opts, out)
+    except CircuitBreakerException as e:
+        sys.stderr.write(f"Back-end problem: {e!r}\n")
+        return 2
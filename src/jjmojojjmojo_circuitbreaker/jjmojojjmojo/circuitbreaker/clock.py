@@ -0,0 +1,167 @@
+"""
+Sources of time for drivers and breakers.
+
+Every timestamp the library uses comes from a Driver's clock (see Driver.now()).
+By default that's the system clock, but any object with now() and sleep()
+methods can be passed in instead. ManualClock makes timing tests (and the
+simulator in the simulation module) run in virtual time, and SyncedClock
+corrects for skew between hosts by tracking the back-end's clock.
+"""
+
+from . import fork
+import logging
+import threading
+import time
+
+class Clock:
+    """
+    The system clock. Uses time.time().
+    """
+    def now(self):
+        """
+        Return the current time in seconds since the epoch, as a float.
+        """
+        return time.time()
+
+    def sleep(self, seconds):
+        """
+        Wait for the given number of seconds.
+        """
+        time.sleep(seconds)
+
+class ManualClock(Clock):
+    """
+    A clock that only moves when told to.
+
+    sleep() advances the clock instead of blocking, so code that waits on this
+    clock runs instantly.
+    """
+    def __init__(self, start=0.0):
+        """
+        start: number, the initial time.
+        """
+        self.time = start
+
+    def now(self):
+        return self.time
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        """
+        Move the clock forward.
+        """
+        self.time += seconds
+
+SYSTEM_CLOCK = Clock()
+
+class SyncedClock(Clock):
+    """
+    A clock corrected to a shared reference, usually the back-end's clock.
+
+    Breakers on different hosts compare a checkin written by one host against
+    the time on another. With a few seconds of skew between them, some hosts
+    retry an open breaker far too early and others far too late. A SyncedClock
+    measures the offset between the local clock and the reference, and adds
+    it to every reading, so every host shares one time base.
+
+    The reference is only consulted once per interval (the first call to now()
+    after the interval has passed does the sync), so reading the time doesn't
+    cost a round trip.
+    """
+    def __init__(self, source, interval=60, samples=3, local=None):
+        """
+        source: callable, returns the reference time as a float (e.g.
+                Driver.server_time).
+        interval: number, seconds between syncs.
+        samples: int, reference readings per sync. The reading with the
+                 shortest round trip is used.
+        local: Clock object, the clock being corrected. Defaults to the system
+               clock.
+        """
+        self.source = source
+        self.interval = interval
+        self.samples = samples
+
+        if local is None:
+            self.local = SYSTEM_CLOCK
+        else:
+            self.local = local
+
+        self.offset = 0.0
+        self.rtt = None
+        self.last_sync = None
+        self.syncs = 0
+        self.errors = 0
+
+        self.logger = logging.getLogger("CircuitBreaker:SyncedClock")
+        self._lock = threading.Lock()
+
+        fork.register(self)
+
+    def after_fork(self):
+        """
+        The lock may have been held by another thread when the process forked.
+        """
+        self._lock = threading.Lock()
+
+    @property
+    def skew(self):
+        """
+        Measured difference between the reference and the local clock, in
+        seconds. Positive when the local clock is behind.
+        """
+        return self.offset
+
+    def sync(self):
+        """
+        Measure the offset to the reference clock now.
+
+        The reference reading is assumed to have been taken halfway through
+        the round trip.
+        """
+        best = None
+
+        for i in range(self.samples):
+            before = self.local.now()
+            reference = self.source()
+            after = self.local.now()
+
+            rtt = after - before
+            if best is None or rtt < best[0]:
+                best = (rtt, reference - (before + after) / 2)
+
+        self.rtt, self.offset = best
+        self.syncs += 1
+
+        self.logger.debug("Clock skew %.6fs (round trip %.6fs)", self.offset, self.rtt)
+
+    def now(self):
+        local = self.local.now()
+
+        if self.last_sync is None or local - self.last_sync >= self.interval:
+            if self._lock.acquire(blocking=False):
+                try:
+                    self.last_sync = local
+                    self.sync()
+                except Exception as e:
+                    self.errors += 1
+                    self.logger.warning("Unable to sync clock, keeping offset %.6fs: %r", self.offset, e)
+                finally:
+                    self._lock.release()
+                local = self.local.now()
+
+        return local + self.offset
+
+    def stats(self):
+        """
+        Return the clock's metrics as a dictionary.
+        """
+        return {
+            'skew': self.offset,
+            'rtt': self.rtt,
+            'last_sync': self.last_sync,
+            'syncs': self.syncs,
+            'errors': self.errors
+        }
@@ -0,0 +1,348 @@
+"""
+Status dashboard for circuit breakers.
+
+A small, dependency-free WSGI application that lists every breaker a driver
+knows about, and allows them to be reset or forced open. It can be run on its
+own, or mounted inside an existing WSGI application (it respects SCRIPT_NAME).
+
+Enumeration goes through Driver.keys() and Driver.load_many(). For redis, that
+means SCAN and pipelined HGETALL, never KEYS. The result is cached for a short
+time, so several people watching the dashboard during an incident don't add
+load to the redis server the breakers depend on.
+
+The dashboard can change the state of any breaker, so it must not be exposed
+outside the network of the people who operate the service. POSTs from another
+origin (cross-site request forgery) are always refused, and a token can be
+required for them as well.
+"""
+
+from .base import STATUS_OPEN, STATUS_NAMES
+from .errors import CircuitBreakerException
+import hmac
+import html
+import json
+import logging
+import threading
+import urllib.parse
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Circuit Breakers</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; }}
+th, td {{ padding: 0.25em 1em; border-bottom: 1px solid #ccc; text-align: left; }}
+tr.OPEN td {{ background: #fdd; }}
+form {{ display: inline; }}
+</style>
+</head>
+<body>
+<h1>Circuit Breakers</h1>
+<form method="get" action="{base}/">
+<input type="text" name="pattern" value="{pattern}">{hidden}
+<input type="submit" value="Filter">
+</form>
+<p>{summary}</p>
+<table>
+<tr><th>Key</th><th>Status</th><th>Failures</th><th>Checkin</th><th>Time To Probe</th><th></th></tr>
+{rows}
+</table>
+</body>
+</html>
+"""
+
+ROW = """<tr class="{status}"><td>{key}</td><td>{status}</td><td>{failures}</td><td>{checkin}</td><td>{probe}</td>
+<td><form method="post" action="{base}/reset/{quoted}">{hidden}<input type="submit" value="Reset"></form>
+<form method="post" action="{base}/open/{quoted}">{hidden}<input type="submit" value="Open"></form></td></tr>"""
+
+HIDDEN = """<input type="hidden" name="token" value="{token}">"""
+
+class Dashboard:
+    """
+    WSGI application showing the state of all breakers for a driver.
+
+    Routes:
+
+        - GET /: HTML page. Takes an optional "pattern" query parameter.
+        - GET /breakers.json: the same information, as JSON.
+        - POST /reset/<key>: reset the breaker.
+        - POST /open/<key>: force the breaker open.
+
+    POSTs with an Origin (or Referer) header that doesn't match the host are
+    refused with a 403. If a token is set, POSTs must also carry it, in an
+    X-Dashboard-Token header or a "token" form field. The page only includes
+    the token in its forms when it was requested with ?token=<token>.
+    """
+    def __init__(self, driver, pattern="*", timeout=10, cache_ttl=2, batch_size=500, limit=1000, token=None):
+        """
+        driver: Driver object, where the breaker state is stored.
+        pattern: string, default glob-style pattern for the keys to show.
+        timeout: number, the timeout the breakers are configured with. Used to
+                 calculate when an open breaker will be probed next.
+        cache_ttl: number, seconds to reuse the result of an enumeration.
+        batch_size: int, number of breakers fetched per round trip.
+        limit: int, maximum number of rows shown on the HTML page. The JSON
+               output is not limited.
+        token: string, secret required to reset or open breakers. If None,
+               only the same-origin check is done.
+        """
+        self.driver = driver
+        self.pattern = pattern
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.batch_size = batch_size
+        self.limit = limit
+        self.token = token
+
+        self.logger = logging.getLogger("CircuitBreaker:Dashboard")
+
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._refill = threading.Lock()
+
+    def breakers(self, pattern=None):
+        """
+        Return a list of dictionaries describing every breaker that matches the
+        pattern, sorted by key.
+
+        Results are cached for cache_ttl seconds (per pattern). Only one
+        enumeration runs at a time: requests that miss the cache while another
+        one is refilling it wait for it, and use its result.
+        """
+        if pattern is None:
+            pattern = self.pattern
+
+        rows = self._cached(pattern, self.driver.now())
+        if rows is not None:
+            return rows
+
+        with self._refill:
+            now = self.driver.now()
+
+            rows = self._cached(pattern, now)
+            if rows is not None:
+                return rows
+
+            rows = self._enumerate(pattern, now)
+
+            with self._lock:
+                # drop the patterns nobody has asked for lately
+                self._cache = {
+                    key: value for key, value in self._cache.items()
+                    if now - value[0] < self.cache_ttl}
+                self._cache[pattern] = (now, rows)
+
+        return rows
+
+    def _cached(self, pattern, now):
+        """
+        Return the cached rows for the pattern, or None if there are none or
+        they are too old.
+        """
+        with self._lock:
+            cached = self._cache.get(pattern)
+            if cached is not None and now - cached[0] < self.cache_ttl:
+                return cached[1]
+
+        return None
+
+    def _enumerate(self, pattern, now):
+        """
+        Load every breaker matching the pattern, in batches.
+        """
+        self.logger.debug("Enumerating breakers matching '%s'", pattern)
+
+        rows = []
+        batch = []
+
+        for key in self.driver.keys(pattern):
+            batch.append(key)
+            if len(batch) >= self.batch_size:
+                rows.extend(self._rows(batch, now))
+                batch = []
+
+        if batch:
+            rows.extend(self._rows(batch, now))
+
+        rows.sort(key=lambda row: row['key'])
+
+        return rows
+
+    def _rows(self, keys, now):
+        """
+        Load a batch of breakers, and convert them to dashboard rows.
+        """
+        for key, info in self.driver.load_many(keys).items():
+            if info['status'] == STATUS_OPEN:
+                probe = max(0, info['checkin'] + self.timeout - now)
+            else:
+                probe = None
+
+            yield {
+                'key': key,
+                'status': STATUS_NAMES.get(info['status'], "UNKNOWN"),
+                'failures': info['failures'],
+                'checkin': info['checkin'],
+                'time_to_probe': probe
+            }
+
+    def invalidate(self):
+        """
+        Throw away the cached enumeration.
+        """
+        with self._lock:
+            self._cache = {}
+
+    def _same_origin(self, environ):
+        """
+        Return False if the Origin (or Referer) header names another site.
+        Requests without either header don't come from a browser form.
+        """
+        source = environ.get("HTTP_ORIGIN") or environ.get("HTTP_REFERER")
+        if not source:
+            return True
+
+        source = urllib.parse.urlsplit(source)
+        host = environ.get("HTTP_HOST") or f"{environ.get('SERVER_NAME', '')}:{environ.get('SERVER_PORT', '')}"
+        scheme = environ.get("wsgi.url_scheme", "http")
+        default = {"http": "80", "https": "443"}.get(scheme)
+
+        def netloc(value):
+            value = value.lower()
+            if default and value.endswith(f":{default}"):
+                value = value[:-len(default) - 1]
+            return value
+
+        return source.scheme == scheme and netloc(source.netloc) == netloc(host)
+
+    def _token_ok(self, supplied):
+        """
+        Return True if no token is required, or the supplied one matches.
+        """
+        if self.token is None:
+            return True
+
+        return supplied is not None and hmac.compare_digest(supplied.encode(), self.token.encode())
+
+    def _form_token(self, environ):
+        """
+        Return the token from the X-Dashboard-Token header, or from the
+        url-encoded POST body.
+        """
+        token = environ.get("HTTP_X_DASHBOARD_TOKEN")
+        if token is not None:
+            return token
+
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+
+        if length <= 0 or "wsgi.input" not in environ:
+            return None
+
+        form = urllib.parse.parse_qs(environ["wsgi.input"].read(length).decode("utf-8", "replace"))
+
+        return form.get("token", [None])[0]
+
+    def render(self, rows, pattern, base, token=None):
+        """
+        Produce the HTML page. The token, if given, is put in the forms.
+        """
+        shown = rows[:self.limit]
+
+        if token is None:
+            hidden = ""
+        else:
+            hidden = HIDDEN.format(token=html.escape(token))
+
+        out = []
+        for row in shown:
+            if row['time_to_probe'] is None:
+                probe = ""
+            else:
+                probe = f"{row['time_to_probe']:.1f}s"
+
+            out.append(ROW.format(
+                base=html.escape(base),
+                hidden=hidden,
+                key=html.escape(row['key']),
+                quoted=urllib.parse.quote(row['key'], safe=""),
+                status=row['status'],
+                failures=row['failures'],
+                checkin=f"{row['checkin']:.3f}",
+                probe=probe))
+
+        opened = sum(1 for row in rows if row['status'] == "OPEN")
+        summary = f"{len(rows)} breakers, {opened} open."
+        if len(rows) > len(shown):
+            summary += f" Showing the first {len(shown)}."
+
+        return PAGE.format(
+            base=html.escape(base),
+            pattern=html.escape(pattern),
+            hidden=hidden,
+            summary=summary,
+            rows="\n".join(out))
+
+    def __call__(self, environ, start_response):
+        method = environ.get("REQUEST_METHOD", "GET")
+        path = environ.get("PATH_INFO", "") or "/"
+        base = environ.get("SCRIPT_NAME", "")
+
+        query = urllib.parse.parse_qs(environ.get("QUERY_STRING", ""))
+        pattern = query.get("pattern", [self.pattern])[0] or self.pattern
+
+        try:
+            if method == "POST" and path.startswith(("/reset/", "/open/")):
+                action, key = path[1:].split("/", 1)
+                key = urllib.parse.unquote(key)
+
+                token = self._form_token(environ)
+
+                if not self._same_origin(environ) or not self._token_ok(token):
+                    self.logger.warning("Refused dashboard action '%s' on %s", action, key)
+                    start_response("403 Forbidden", [("Content-Type", "text/plain")])
+                    return [b"Forbidden"]
+
+                self.logger.info("Dashboard action '%s' on %s", action, key)
+
+                if action == "reset":
+                    self.driver.reset(key)
+                else:
+                    self.driver.open(key)
+
+                self.invalidate()
+
+                location = f"{base}/"
+                if self.token is not None:
+                    location += "?" + urllib.parse.urlencode({"token": token})
+
+                start_response("303 See Other", [("Location", location)])
+                return [b""]
+
+            if method == "GET" and path == "/breakers.json":
+                body = json.dumps(self.breakers(pattern)).encode()
+                content_type = "application/json"
+            elif method == "GET" and path == "/":
+                token = query.get("token", [None])[0]
+                if self.token is None or not self._token_ok(token):
+                    token = None
+
+                body = self.render(self.breakers(pattern), pattern, base, token).encode()
+                content_type = "text/html; charset=utf-8"
+            else:
+                start_response("404 Not Found", [("Content-Type", "text/plain")])
+                return [b"Not Found"]
+        except CircuitBreakerException as e:
+            self.logger.error("Back-end problem: %r", e)
+            start_response("503 Service Unavailable", [("Content-Type", "text/plain")])
+            return [b"Back-end unavailable"]
+
+        start_response("200 OK", [
+            ("Content-Type", content_type),
+            ("Content-Length", str(len(body)))])
+
+        return [body]
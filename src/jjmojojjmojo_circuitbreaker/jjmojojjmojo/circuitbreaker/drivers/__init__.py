@@ -1,7 +1,27 @@
 """
 Drivers for the CircuitBreaker class.
+
+RedisDriver and GroupedRedisDriver are imported on first use, so programs that
+only use the MemoryDriver don't pay for importing the redis client.
 """
 
 from .base import Driver
 from .memory import MemoryDriver
-from .redis import RedisDriver
\ No newline at end of file
+from .guarded import GuardedDriver
+from .traced import TracedDriver
+
+__all__ = ["Driver", "MemoryDriver", "GuardedDriver", "TracedDriver", "RedisDriver", "GroupedRedisDriver"]
+
+def __getattr__(name):
+    if name == "RedisDriver":
+        from .redis import RedisDriver
+        return RedisDriver
+    
+    if name == "GroupedRedisDriver":
+        from .grouped import GroupedRedisDriver
+        return GroupedRedisDriver
+    
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + ["RedisDriver", "GroupedRedisDriver"])
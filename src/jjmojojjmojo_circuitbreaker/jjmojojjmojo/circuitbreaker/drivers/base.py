@@ -3,12 +3,46 @@ Base class for all CircuitBreaker Drivers.
 """
 
 import logging
-from ..base import STATUS_OPEN, STATUS_CLOSED
-from ..errors import BackendKeyNotFound, BackendKeyHasExpired
-import time
+import os
+from .. import fork
+from ..base import STATUS_OPEN, STATUS_CLOSED, STATUS_RAMPING
+from ..errors import BackendKeyNotFound, BackendKeyHasExpired, BackendUnsupportedOperation
+from ..clock import SYSTEM_CLOCK, SyncedClock
+from ..singleflight import SingleFlight
+
+def take_from_bucket(bucket, now, requested, capacity, rate=0, deposit=0):
+    """
+    Token bucket arithmetic, shared by drivers that keep buckets in-process.
+    
+    bucket: dict with 'tokens' and 'updated' keys, modified in place. An empty
+            dict is treated as a new, full bucket.
+    
+    See Driver.take_tokens() for the other parameters and the return value.
+    """
+    if not bucket:
+        bucket['tokens'] = capacity
+        bucket['updated'] = now
+    
+    tokens = bucket['tokens']
+    
+    if now > bucket['updated']:
+        tokens += (now - bucket['updated']) * rate
+        bucket['updated'] = now
+        
+    tokens = min(capacity, tokens + deposit)
+    granted = max(0, min(requested, int(tokens)))
+    
+    bucket['tokens'] = tokens - granted
+    
+    return granted, bucket['tokens']
 
 class Driver:
-    def __init__(self, expires=None):
+    # Whether breakers should share concurrent loads (see load_shared()) by
+    # default. Only worth it for drivers that do I/O: sharing costs more than
+    # an in-process load.
+    coalesce_loads = False
+    
+    def __init__(self, expires=None, clock=None):
         """
         Constructor. 
         
@@ -17,9 +51,46 @@ class Driver:
         
         expires: int, number of seconds before the back-end deletes the circuitbreaker
                  data.
+        clock: Clock object, source of all timestamps (see the clock module). 
+               Defaults to the system clock.
         """
         self.expires = expires
+        
+        if clock is None:
+            self.clock = SYSTEM_CLOCK
+        else:
+            self.clock = clock
+        
         self.logger = logging.getLogger(f"CircuitBreaker:{self.__class__.__name__}")
+        
+        self.flights = SingleFlight()
+        
+        self.pid = os.getpid()
+        fork.register(self)
+        
+    def after_fork(self):
+        """
+        Called in the child process after a fork (see the fork module).
+        
+        Sub-classes override this to rebuild anything that can't be shared 
+        between processes, and call the base class.
+        """
+        self.pid = os.getpid()
+        
+        # loads in flight belong to threads that don't exist in the child
+        self.flights = SingleFlight()
+        
+    def check_fork(self):
+        """
+        Call after_fork() if the process has forked since the driver was created
+        (or last checked), for servers that fork without running Python's 
+        at-fork hooks.
+        
+        Drivers call it at the start of their public methods, before they 
+        touch a lock, a connection or the state.
+        """
+        if self.pid != os.getpid():
+            self.after_fork()
     
     def default(self):
         """
@@ -33,9 +104,27 @@ class Driver:
     
     def now(self):
         """
-        Generate a timestamp. Returns a float.
+        Generate a timestamp from the driver's clock. Returns a float.
+        """
+        return self.clock.now()
+    
+    def server_time(self):
+        """
+        Return the back-end's idea of the current time, as a float.
+        
+        Drivers without a clock of their own return the local system time.
+        """
+        return SYSTEM_CLOCK.now()
+    
+    def sync_clock(self, interval=60):
+        """
+        Replace this driver's clock with a SyncedClock that corrects it to the 
+        back-end's clock (see server_time()), re-syncing every interval seconds.
+        
+        Returns the new clock, which reports the measured skew.
         """
-        return time.time()
+        self.clock = SyncedClock(self.server_time, interval=interval, local=self.clock)
+        return self.clock
         
     def new(self, key):
         """
@@ -62,14 +151,15 @@ class Driver:
             if self.now() - checkin >= self.expires:
                 self.delete(key)
     
-    def failure(self, key):
+    def failure(self, key, amount=1):
         """
-        Log a single failure.
+        Log a single failure. Returns the new failure count.
         
         Provided so that back-ends can utilize more efficient queries than 
         self.update() might use.
         
         key: string, name of the circuit breaker to log a failure for.
+        amount: int, how much the failure counts for (see the policy module).
         """
         pass
     
@@ -91,7 +181,7 @@ class Driver:
         
         key: string, circuit breaker to update
         failures: int, number of failures to set the failure count to.
-        status: int, one of STATUS_OPEN or STATUS_CLOSED
+        status: int, one of STATUS_OPEN, STATUS_CLOSED or STATUS_RAMPING
         checkin: number, timestamp to track when the service that the 
                  breaker wraps is retried.
         """
@@ -109,16 +199,194 @@ class Driver:
         """
         self.update(key, status=STATUS_OPEN, checkin=self.now())
         
+    def ramp(self, key):
+        """
+        Start ramping the given breaker back up. Update the checkin, reset the 
+        failure count to 0.
+        """
+        self.update(key, status=STATUS_RAMPING, failures=0, checkin=self.now())
+        
     def reset(self, key):
         """
         Close the breaker, update checkin, reset the failure count to 0.
         """
         self.update(key, failures=0, status=STATUS_CLOSED, checkin=self.now())
     
+    def transition(self, key, expected, status, failures=None):
+        """
+        Change the status of the given breaker, but only if it's currently in 
+        one of the expected statuses (compare-and-set). The checkin is updated
+        along with it, and the failure count if one is given.
+        
+        Returns True if the status was changed, False if the breaker was found
+        in another status (another client got there first). A breaker that 
+        isn't stored counts as a new, closed one.
+        
+        The base implementation loads, then updates, so it isn't atomic. 
+        Drivers shared between threads or processes override it.
+        
+        key: string, circuit breaker to change.
+        expected: tuple of ints, the statuses the change is allowed from.
+        status: int, the new status.
+        failures: int, number of failures to set the failure count to.
+        """
+        try:
+            current = self.load(key)['status']
+        except BackendKeyNotFound:
+            current = STATUS_CLOSED
+            
+        if current not in expected:
+            return False
+        
+        self.update(key, failures=failures, status=status, checkin=self.now())
+        
+        return True
+    
     def load(self, key):
         """
         Retrieve the given breaker info from the back-end store.
         
         Raises BackendKeyNotFound if no existing info is present.
         """
-        pass
\ No newline at end of file
+        pass
+    
+    def load_shared(self, key):
+        """
+        Like load(), but concurrent calls for the same key share one call to 
+        load(): while it's in flight, other threads wait for its result instead
+        of issuing their own (see the singleflight module).
+        
+        The info returned is shared between the threads, don't modify it.
+        """
+        self.check_fork()
+        
+        return self.flights.do(key, self.load, key)
+    
+    def keys(self, pattern="*"):
+        """
+        Iterate over the keys of all stored breakers that match the given 
+        glob-style pattern.
+        
+        Drivers that can't enumerate their keys yield nothing.
+        """
+        return iter(())
+    
+    def load_many(self, keys):
+        """
+        Retrieve the info for several breakers at once. 
+        
+        Returns a dictionary of key -> info. Keys that aren't found are left out.
+        
+        Provided so that back-ends can fetch many records in one round trip.
+        """
+        out = {}
+        for key in keys:
+            try:
+                out[key] = self.load(key)
+            except BackendKeyNotFound:
+                pass
+        return out
+    
+    def reset_many(self, keys):
+        """
+        Reset several breakers at once.
+        
+        Provided so that back-ends can batch the writes.
+        """
+        for key in keys:
+            self.reset(key)
+    
+    def open_many(self, keys):
+        """
+        Open several breakers at once.
+        """
+        for key in keys:
+            self.open(key)
+    
+    def delete_many(self, keys):
+        """
+        Remove the data for several breakers at once. Missing keys are ignored.
+        """
+        for key in keys:
+            try:
+                self.delete(key)
+            except BackendKeyNotFound:
+                pass
+    
+    def ping(self):
+        """
+        Check that the back-end is reachable. 
+        
+        Returns True, or raises DistributedBackendProblem.
+        """
+        return True
+    
+    def take_tokens(self, key, requested, capacity, rate=0, deposit=0):
+        """
+        Take whole tokens from a token bucket, atomically.
+        
+        Buckets are stored separately from breakers, and start out full. The 
+        bucket is refilled at `rate` tokens per second since it was last used, 
+        then `deposit` tokens are added, up to `capacity`. Then as many of the 
+        requested tokens as are available are taken. 
+        
+        Returns a tuple: the number of tokens granted (0 to requested), and the
+        number of tokens left in the bucket. Drivers without token buckets 
+        raise BackendUnsupportedOperation, a DistributedBackendProblem.
+        
+        key: string, name of the bucket.
+        requested: int, number of tokens wanted. Can be 0, to just deposit.
+        capacity: number, maximum tokens the bucket can hold.
+        rate: number, tokens added per second.
+        deposit: number, tokens to add before taking.
+        """
+        raise BackendUnsupportedOperation(f"{self.__class__.__name__} doesn't support token buckets")
+    
+    def load_and_take(self, key, bucket, requested, capacity, rate=0):
+        """
+        Load a breaker and take tokens from a bucket at once (see load() and 
+        take_tokens()).
+        
+        Returns a tuple: the breaker's info (or None if it wasn't found), and
+        the number of tokens granted.
+        
+        Provided so that back-ends can do both in one round trip.
+        """
+        try:
+            info = self.load(key)
+        except BackendKeyNotFound:
+            info = None
+            
+        granted, tokens = self.take_tokens(bucket, requested, capacity, rate)
+        
+        return info, granted
+    
+    def histogram_window(self, window):
+        """
+        Return the number of the current histogram window (see 
+        merge_histogram()). Windows are counted from the epoch, so every client
+        agrees on when one starts.
+        """
+        return int(self.now() // window)
+    
+    def merge_histogram(self, key, counts, window):
+        """
+        Add bucket counts to a shared histogram (see the latency module), and 
+        return the histogram's counts, as a dictionary of bucket -> count.
+        
+        Histograms are stored separately from breakers. A histogram only holds
+        the counts added during the current window: a new window starts empty.
+        Drivers without histograms raise BackendUnsupportedOperation, a 
+        DistributedBackendProblem.
+        
+        key: string, name of the histogram.
+        counts: dictionary, bucket number -> count. Can be empty, to just read.
+        window: number, seconds each window lasts.
+        """
+        raise BackendUnsupportedOperation(f"{self.__class__.__name__} doesn't support histograms")
+    
+    def clear_histogram(self, key, window):
+        """
+        Empty the shared histogram for the current window.
+        """
+        raise BackendUnsupportedOperation(f"{self.__class__.__name__} doesn't support histograms")
\ No newline at end of file
@@ -0,0 +1,639 @@
+"""
+Redis-backed Driver that stores many breakers in one hash.
+
+RedisDriver stores every breaker in its own key, with its own EXPIRE. With
+hundreds of thousands of breakers (one per tenant, for example) most of the
+memory goes to per-key overhead. GroupedRedisDriver stores all the breakers of
+a group in one hash instead, with one field each, holding the failures, status
+and checkin separated by spaces:
+
+    rcbg:payments
+        payments:tenant-1  0 1 1500000000.25
+        payments:tenant-2  3 0 1500000090.5
+        ...
+
+By default a breaker's group is the part of its key before the first ":"
+(so all the "payments:..." breakers share a hash), see the group parameter.
+Hashes of up to hash-max-listpack-entries fields (hash-max-ziplist-entries
+before redis 7, 512 by default) are stored very compactly by redis, so groups
+should stay under that many breakers. Bigger groups still work, and still use
+less memory than a key per breaker, but lose most of the saving.
+
+Reads are single HGET/HMGET commands. Writes that change part of a breaker run
+a lua script, so the record is read and written atomically. failure() raises
+BackendKeyNotFound when the breaker isn't stored, like the MemoryDriver,
+instead of creating half a record.
+
+Redis can't expire single fields on older versions, so expiry works in two
+steps:
+
+    - every write sets the driver's expiry on the whole hash, so a group
+      that isn't used at all disappears on its own.
+    - breakers that haven't checked in for `expires` seconds are removed by
+      a lua script that walks a group with HSCAN, a batch at a time. Every
+      sweep_interval seconds, the driver starts sweeping each group it writes
+      to. A write that's due does one batch (sweep_batch fields), and saves
+      the cursor for the next one, so groups that are in use don't keep
+      breakers that aren't, and no write pays for more than one batch.
+      sweep() walks every group at once, for cron or the command-line tool's
+      sweep command. A breaker that is loaded after it expired is removed at
+      that point, like with the MemoryDriver.
+
+Loading many breakers (load_many()) takes one HMGET per group, all in one
+round trip. Read replicas, token buckets and histograms work as they do with
+RedisDriver.
+"""
+
+from .base import Driver, STATUS_OPEN, STATUS_CLOSED
+from .redis import RedisDriver
+from ..errors import DistributedBackendProblem, BackendKeyNotFound
+import collections
+import redis
+import threading
+
+LAYOUT_GROUPED = "grouped"
+
+# groups whose sweep progress is remembered, the least recently written are
+# forgotten (and swept again sweep_interval seconds after their next write)
+SWEPT_GROUPS = 10000
+
+# Change some of the values of breakers in a group hash. ARGV[1] is the expiry
+# of the hash in milliseconds (0 for none), ARGV[2] and ARGV[3] the status and
+# checkin of breakers that aren't stored yet. Then, for each breaker, its key
+# and the new failures, status and checkin ("" to leave a value alone).
+UPDATE = """
+local ttl = tonumber(ARGV[1])
+
+for i = 4, #ARGV, 4 do
+    local failures, status, checkin = "0", ARGV[2], ARGV[3]
+    local current = redis.call("HGET", KEYS[1], ARGV[i])
+
+    if current then
+        failures, status, checkin = string.match(current, "^(%S+) (%S+) (%S+)$")
+    end
+
+    if ARGV[i + 1] ~= "" then
+        failures = ARGV[i + 1]
+    end
+
+    if ARGV[i + 2] ~= "" then
+        status = ARGV[i + 2]
+    end
+
+    if ARGV[i + 3] ~= "" then
+        checkin = ARGV[i + 3]
+    end
+
+    redis.call("HSET", KEYS[1], ARGV[i], failures .. " " .. status .. " " .. checkin)
+end
+
+if ttl > 0 then
+    redis.call("PEXPIRE", KEYS[1], ttl)
+end
+
+return 1
+"""
+
+# Add ARGV[2] to the failures of breaker ARGV[1]. Returns the new count, or
+# nil if the breaker isn't stored.
+FAILURE = """
+local current = redis.call("HGET", KEYS[1], ARGV[1])
+
+if not current then
+    return nil
+end
+
+local failures, status, checkin = string.match(current, "^(%S+) (%S+) (%S+)$")
+failures = tonumber(failures) + tonumber(ARGV[2])
+
+redis.call("HSET", KEYS[1], ARGV[1], failures .. " " .. status .. " " .. checkin)
+
+if tonumber(ARGV[3]) > 0 then
+    redis.call("PEXPIRE", KEYS[1], ARGV[3])
+end
+
+return failures
+"""
+
+# Compare-and-set of a breaker's status in a group hash, see
+# Driver.transition(). Returns 1 if the status was changed, 0 if it wasn't in
+# one of the expected statuses.
+TRANSITION = """
+local key = ARGV[1]
+local status = ARGV[2]
+local checkin = ARGV[3]
+local failures = ARGV[4]
+local ttl = tonumber(ARGV[5])
+local current = redis.call("HGET", KEYS[1], key)
+local stored_failures = "0"
+local stored_status = tonumber(ARGV[6])
+
+if current then
+    local s
+    stored_failures, s = string.match(current, "^(%S+) (%S+) ")
+    stored_status = tonumber(s)
+end
+
+local allowed = false
+
+for i = 7, #ARGV do
+    if tonumber(ARGV[i]) == stored_status then
+        allowed = true
+    end
+end
+
+if not allowed then
+    return 0
+end
+
+if failures == "" then
+    failures = stored_failures
+end
+
+redis.call("HSET", KEYS[1], key, failures .. " " .. status .. " " .. checkin)
+
+if ttl > 0 then
+    redis.call("PEXPIRE", KEYS[1], ttl)
+end
+
+return 1
+"""
+
+# Remove the breakers of a group hash that checked in before ARGV[3], looking
+# at about ARGV[2] fields from the HSCAN cursor ARGV[1]. Returns the next
+# cursor (0 when the whole hash has been walked) and the number of breakers
+# removed. Needs redis 5 or later, where scripts are replicated by effect.
+SWEEP = """
+local cutoff = tonumber(ARGV[3])
+local reply = redis.call("HSCAN", KEYS[1], ARGV[1], "COUNT", ARGV[2])
+local fields = reply[2]
+local removed = 0
+
+for i = 1, #fields, 2 do
+    local checkin = tonumber(string.match(fields[i + 1], "(%S+)$"))
+
+    if checkin ~= nil and checkin < cutoff then
+        redis.call("HDEL", KEYS[1], fields[i])
+        removed = removed + 1
+    end
+end
+
+return {reply[1], removed}
+"""
+
+def _has_magic(pattern):
+    """
+    Return True if the pattern contains glob characters.
+    """
+    return any(c in pattern for c in "*?[")
+
+def _value(value):
+    """
+    Convert an optional value into a script argument, "" for None.
+    """
+    return "" if value is None else value
+
+class GroupedRedisDriver(RedisDriver):
+    """
+    A back-end for CircuitBreaker that stores breakers in redis, in one hash
+    per group of breakers.
+    """
+    def __init__(self, expires=None, redis_connection=None, redis_url=None, prefix="rcbg:", clock=None, separator=":", group=None, sweep_interval=60, sweep_batch=100, **kwargs):
+        """
+        prefix: string, put in front of the group name to make the hash's key.
+        separator: string, a breaker's group is the part of its key before the
+                   first separator (or the whole key, if there's none).
+        group: callable, takes a breaker key and returns its group, instead of
+               splitting on the separator.
+        sweep_interval: number, seconds between sweeps of each group this
+                        driver writes to, when there's an expiry. None or 0 to
+                        only sweep when sweep() is called.
+        sweep_batch: int, about how many fields of a group a write that's
+                     due for a sweep looks at. One batch per write.
+
+        Other arguments are the same as RedisDriver's (except encoding).
+        """
+        RedisDriver.__init__(self, expires=expires, redis_connection=redis_connection, redis_url=redis_url, prefix=prefix, clock=clock, **kwargs)
+
+        self.encoding = LAYOUT_GROUPED
+        self.separator = separator
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+
+        if group is not None:
+            self.group = group
+
+        self._custom_group = group is not None
+        # group -> (HSCAN cursor, when the last sweep finished)
+        self._swept = collections.OrderedDict()
+        self._sweeping = set()
+        self._sweep_lock = threading.Lock()
+
+        self._update = self.redis.register_script(UPDATE)
+        self._failure = self.redis.register_script(FAILURE)
+        self._transition = self.redis.register_script(TRANSITION)
+        self._sweep = self.redis.register_script(SWEEP)
+
+    def after_fork(self):
+        RedisDriver.after_fork(self)
+
+        # sweeps in flight belong to threads that don't exist in the child
+        self._sweeping = set()
+        self._sweep_lock = threading.Lock()
+
+    def group(self, key):
+        """
+        Return the group a breaker key belongs to.
+        """
+        return key.split(self.separator, 1)[0]
+
+    def key(self, key):
+        """
+        Generate the redis key of the hash the breaker is stored in.
+        """
+        return f"{self.prefix}{self.group(key)}"
+
+    def _encode(self, info):
+        """
+        Convert a breaker info dictionary into the value of its field.
+        """
+        return f"{int(info['failures'])} {int(info['status'])} {float(info['checkin'])!r}"
+
+    def _decode(self, raw):
+        """
+        Convert the value of a breaker's field into a breaker info dictionary.
+        """
+        failures, status, checkin = raw.split()
+
+        return {
+            'failures': int(failures),
+            'status': int(status),
+            'checkin': float(checkin)
+        }
+
+    def _by_group(self, keys):
+        """
+        Sort breaker keys by the hash they're stored in. Returns a dictionary
+        of redis key -> list of breaker keys.
+        """
+        groups = {}
+
+        for key in keys:
+            groups.setdefault(self.key(key), []).append(key)
+
+        return groups
+
+    def _run(self, script, keys, args):
+        """
+        Run a lua script, converting redis errors.
+        """
+        try:
+            return script(keys=keys, args=args)
+        except redis.RedisError as e:
+            self.logger.error(str(e))
+            raise DistributedBackendProblem()
+
+    def _wrote_groups(self, names):
+        """
+        Sweep one batch of the first of the given groups that is due: one that
+        is part way through a sweep, or hasn't been swept for sweep_interval
+        seconds. A group seen for the first time is due after sweep_interval.
+
+        The write has already succeeded, so a sweep that fails is only logged.
+        """
+        if self.expires is None or not self.sweep_interval:
+            return
+
+        now = self.now()
+
+        with self._sweep_lock:
+            for name in names:
+                if name in self._sweeping:
+                    continue
+
+                cursor, finished = self._swept.get(name, (0, now))
+
+                if name not in self._swept:
+                    self._remember_sweep(name, cursor, finished)
+
+                if cursor or now - finished >= self.sweep_interval:
+                    self._sweeping.add(name)
+                    break
+            else:
+                return
+
+        try:
+            cursor, swept = self._run(self._sweep, [name], [cursor, self.sweep_batch, now - self.expires])
+        except DistributedBackendProblem:
+            self.logger.warning("Unable to sweep %s", name)
+            cursor = int(cursor)
+        else:
+            cursor = int(cursor)
+            self.logger.debug("Swept %s expired breakers from %s", swept, name)
+
+            if cursor == 0:
+                finished = now
+
+        with self._sweep_lock:
+            self._sweeping.discard(name)
+            self._remember_sweep(name, cursor, finished)
+
+    def _remember_sweep(self, name, cursor, finished):
+        """
+        Save the sweep progress of a group, forgetting the least recently
+        written groups past SWEPT_GROUPS. Called with the sweep lock held.
+        """
+        self._swept[name] = (cursor, finished)
+        self._swept.move_to_end(name)
+
+        while len(self._swept) > SWEPT_GROUPS:
+            self._swept.popitem(last=False)
+
+    def _set_many(self, keys, info):
+        """
+        Store the same info for many breakers, with one HSET per group.
+        """
+        keys = list(keys)
+        self._wrote(*keys)
+
+        value = self._encode(info)
+        groups = self._by_group(keys)
+        ttl = self._ttl()
+
+        pipeline = self.redis.pipeline(transaction=False)
+
+        for name, members in groups.items():
+            pipeline.hset(name, mapping={key: value for key in members})
+
+            if ttl is not None:
+                pipeline.pexpire(name, ttl)
+
+        if groups:
+            try:
+                pipeline.execute()
+            except redis.RedisError as e:
+                self.logger.error(str(e))
+                raise DistributedBackendProblem()
+
+        self._wrote_groups(groups)
+
+    def _update_many(self, keys, failures=None, status=None, checkin=None):
+        """
+        Change some of the values of many breakers, creating the ones that
+        aren't stored. One script call per group.
+        """
+        keys = list(keys)
+        self._wrote(*keys)
+
+        now = self.now()
+        groups = self._by_group(keys)
+
+        for name, members in groups.items():
+            args = [self._ttl() or 0, STATUS_CLOSED, repr(float(now))]
+
+            for key in members:
+                args.extend([key, _value(failures), _value(status), "" if checkin is None else repr(float(checkin))])
+
+            self._run(self._update, [name], args)
+
+        self._wrote_groups(groups)
+
+    def new(self, key):
+        self.check_fork()
+
+        info = self.default()
+        self._set_many([key], info)
+
+        return info
+
+    def reset(self, key):
+        self.new(key)
+
+    def expire(self, key, checkin):
+        """
+        Remove the breaker if it has expired. Fields can't expire on their
+        own, see sweep().
+        """
+        Driver.expire(self, key, checkin)
+
+    def _queue_load(self, pipeline, key):
+        pipeline.hget(self.key(key), key)
+
+    def _stored(self, info):
+        return info is not None and not isinstance(info, redis.RedisError)
+
+    def load(self, key):
+        self.check_fork()
+
+        self.logger.debug("Loading %s...", key)
+
+        if self.replicas:
+            info = self._read_replica([key]).get(key)
+
+            if info:
+                return self._decode(info)
+
+        info = self._catch_redis_error("hget", self.key(key), key)
+
+        if not self._stored(info):
+            self.logger.debug("Could not find '%s'", key)
+            raise BackendKeyNotFound(f"{key} not in database")
+
+        return self._decode(info)
+
+    def load_many(self, keys):
+        """
+        Fetch many breakers with one HMGET per group, in a single pipelined
+        round trip.
+        """
+        self.check_fork()
+
+        keys = list(keys)
+        found = {}
+
+        if self.replicas:
+            found = {key: self._decode(info) for key, info in self._read_replica(keys).items()}
+            keys = [key for key in keys if key not in found]
+
+        if not keys:
+            return found
+
+        groups = self._by_group(keys)
+        pipeline = self.redis.pipeline(transaction=False)
+
+        for name, members in groups.items():
+            pipeline.hmget(name, members)
+
+        try:
+            replies = pipeline.execute()
+        except redis.RedisError as e:
+            self.logger.error(str(e))
+            raise DistributedBackendProblem()
+
+        for members, values in zip(groups.values(), replies):
+            for key, info in zip(members, values):
+                if self._stored(info):
+                    found[key] = self._decode(info)
+
+        return found
+
+    def keys(self, pattern="*"):
+        """
+        Iterate over breaker keys with SCAN and HSCAN. When the pattern names
+        a single group, only that group's hash is scanned.
+        """
+        self.check_fork()
+
+        if not self._custom_group and not _has_magic(self.group(pattern)):
+            names = [self.key(pattern)]
+        else:
+            names = self.redis.scan_iter(match=f"{self.prefix}*", count=1000)
+
+        try:
+            for name in names:
+                for field, value in self.redis.hscan_iter(name, match=pattern, count=1000):
+                    if isinstance(field, bytes):
+                        field = field.decode()
+                    yield field
+        except redis.RedisError as e:
+            self.logger.error(str(e))
+            raise DistributedBackendProblem()
+
+    def convert(self, key):
+        """
+        There is only one way to store grouped breakers, nothing is converted.
+        """
+        return False
+
+    def reset_many(self, keys):
+        self.check_fork()
+
+        self._set_many(keys, {'failures': 0, 'status': STATUS_CLOSED, 'checkin': self.now()})
+
+    def open_many(self, keys):
+        self.check_fork()
+
+        self._update_many(keys, status=STATUS_OPEN, checkin=self.now())
+
+    def delete_many(self, keys):
+        self.check_fork()
+
+        keys = list(keys)
+        self._wrote(*keys)
+
+        groups = self._by_group(keys)
+        pipeline = self.redis.pipeline(transaction=False)
+
+        for name, members in groups.items():
+            pipeline.hdel(name, *members)
+
+        if groups:
+            try:
+                pipeline.execute()
+            except redis.RedisError as e:
+                self.logger.error(str(e))
+                raise DistributedBackendProblem()
+
+    def delete(self, key):
+        self.check_fork()
+
+        self.logger.debug("Deleting '%s'...", key)
+        self._wrote(key)
+        self._catch_redis_error("hdel", self.key(key), key)
+
+    def update(self, key, failures=None, status=None, checkin=None):
+        self.check_fork()
+
+        self.logger.debug("Updating '%s'...", key)
+
+        if failures is None and status is None and checkin is None:
+            raise ValueError("You must specify one of failures, status, or checkin")
+
+        self._update_many([key], failures=failures, status=status, checkin=checkin)
+
+    def transition(self, key, expected, status, failures=None):
+        """
+        Runs a lua script, so the check and the change are atomic, and take
+        one round trip.
+        """
+        self.check_fork()
+
+        self._wrote(key)
+
+        args = [
+            key,
+            status,
+            repr(float(self.now())),
+            _value(failures),
+            self._ttl() or 0,
+            STATUS_CLOSED,
+            *expected]
+
+        changed = self._run(self._transition, [self.key(key)], args) == 1
+
+        self._wrote_groups([self.key(key)])
+
+        return changed
+
+    def failure(self, key, amount=1):
+        """
+        Raises BackendKeyNotFound if the breaker isn't stored (e.g. it was
+        swept): half a breaker would be lost by the next new().
+        """
+        self.check_fork()
+
+        self._wrote(key)
+
+        failures = self._run(self._failure, [self.key(key)], [key, amount, self._ttl() or 0])
+
+        if failures is None:
+            raise BackendKeyNotFound(f"{key} not in database")
+
+        self._wrote_groups([self.key(key)])
+
+        self.logger.debug("Failure. Count for %s: %s", key, failures)
+        return int(failures)
+
+    def _sweep_group(self, name, count, cutoff):
+        """
+        Remove the breakers of one group that checked in before the cutoff.
+        Returns the number of breakers removed.
+        """
+        cursor = 0
+        removed = 0
+
+        while True:
+            cursor, swept = self._run(self._sweep, [name], [cursor, count, cutoff])
+            removed += int(swept)
+            cursor = int(cursor)
+
+            if cursor == 0:
+                return removed
+
+    def sweep(self, count=1000):
+        """
+        Remove the breakers that haven't checked in for `expires` seconds,
+        from every group. Returns the number of breakers removed.
+
+        Each script call looks at about `count` fields, so the server is never
+        blocked for long.
+        """
+        self.check_fork()
+
+        if self.expires is None:
+            return 0
+
+        cutoff = self.now() - self.expires
+        removed = 0
+
+        try:
+            names = list(self.redis.scan_iter(match=f"{self.prefix}*", count=1000))
+        except redis.RedisError as e:
+            self.logger.error(str(e))
+            raise DistributedBackendProblem()
+
+        for name in names:
+            removed += self._sweep_group(name, count, cutoff)
+
+        self.logger.debug("Swept %s expired breakers", removed)
+        return removed
@@ -0,0 +1,440 @@
+"""
+A Driver that protects the CircuitBreaker from its own back-end.
+
+When the back-end (redis, etc) is slow or down, every operation would
+otherwise wait for a socket timeout before raising DistributedBackendProblem.
+The GuardedDriver wraps another driver in a small circuit breaker of its own,
+so a back-end outage costs at most one deadline, not one per call.
+"""
+
+from .base import Driver
+from .memory import MemoryDriver, FORK_KEEP
+from ..errors import DistributedBackendProblem, BackendKeyNotFound, BackendUnsupportedOperation
+import concurrent.futures
+import inspect
+import threading
+
+POLICY_LAST_KNOWN = "last-known"
+POLICY_FAIL_OPEN = "fail-open"
+POLICY_FAIL_CLOSED = "fail-closed"
+
+POLICIES = (POLICY_LAST_KNOWN, POLICY_FAIL_OPEN, POLICY_FAIL_CLOSED)
+
+class GuardedDriver(Driver):
+    """
+    Wraps another Driver, enforcing a deadline on every operation.
+
+    If an operation misses its deadline or raises DistributedBackendProblem,
+    the back-end is marked unhealthy. While it is unhealthy, no operations are
+    sent to it at all, and the degraded policy decides what happens instead:
+
+        - "last-known": state is served from (and written to) an in-memory copy
+          of the last state seen for each key.
+        - "fail-open": every breaker looks closed, calls go through to the
+          service.
+        - "fail-closed": DistributedBackendProblem is raised right away, which
+          the caller sees as an open breaker.
+
+    The back-end stays unhealthy for at least fail_fast seconds. After that, a
+    background thread pings it every recovery_interval seconds, and marks it
+    healthy when a ping succeeds. Pings run on a worker of their own, so they
+    don't wait behind hung operations. Callers never pay for recovery checks.
+    """
+    @property
+    def coalesce_loads(self):
+        return self.driver.coalesce_loads
+
+    def __init__(self, driver, deadline=0.1, fail_fast=5, policy=POLICY_LAST_KNOWN, recovery_interval=1, workers=8, mirror_size=10000):
+        """
+        driver: Driver object, the driver to protect.
+        deadline: number, seconds each operation is allowed to take. If None,
+                  operations run in the calling thread and rely on the wrapped
+                  driver's own timeouts (e.g. socket_timeout in a redis url).
+        fail_fast: number, minimum seconds to skip the back-end once it has
+                   been marked unhealthy.
+        policy: string, one of "last-known", "fail-open" or "fail-closed".
+        recovery_interval: number, seconds between background health checks.
+        workers: int, size of the thread pool used to enforce the deadline.
+        mirror_size: int, the most breakers kept in the in-memory copy used 
+                     by the "last-known" policy, the least recently used are
+                     evicted. None for no limit.
+        """
+        if not isinstance(driver, Driver):
+            raise AttributeError("'driver' parameter must be derived from the Driver base class")
+
+        if policy not in POLICIES:
+            raise ValueError(f"'policy' must be one of {POLICIES}")
+
+        Driver.__init__(self, expires=driver.expires, clock=driver.clock)
+
+        self.driver = driver
+        self.deadline = deadline
+        self.fail_fast = fail_fast
+        self.policy = policy
+        self.recovery_interval = recovery_interval
+        self.workers = workers
+        self.mirror_size = mirror_size
+
+        # the mirror is a copy of shared state, so it stays valid after a fork
+        self.local = MemoryDriver(expires=driver.expires, clock=driver.clock, fork=FORK_KEEP, max_entries=mirror_size)
+
+        self.healthy = True
+        self.trips = 0
+
+        self._start_threads()
+
+    def _start_threads(self):
+        """
+        Create the locks and the thread pool. 
+        """
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._recovery = None
+
+        if self.deadline is None:
+            self._executor = None
+            self._pinger = None
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="GuardedDriver")
+            self._pinger = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix="GuardedDriver-ping")
+
+    def after_fork(self):
+        """
+        Threads don't survive a fork: replace the thread pool (and the recovery
+        thread, if the back-end is unhealthy).
+        """
+        Driver.after_fork(self)
+        self._start_threads()
+
+        if not self.healthy:
+            self._start_recovery()
+
+    def now(self):
+        return self.driver.now()
+
+    def server_time(self):
+        if not self.healthy:
+            raise DistributedBackendProblem()
+        return self._call("server_time")
+
+    def sync_clock(self, interval=60):
+        """
+        Sync the wrapped driver's clock (which now() reads) and the in-memory
+        copy's to the back-end. The syncs go through server_time() above, so a
+        slow back-end can't stall a caller reading the time.
+        """
+        clock = Driver.sync_clock(self, interval=interval)
+        self.driver.clock = clock
+        self.local.clock = clock
+        return clock
+
+    def _call(self, name, *args, **kwargs):
+        """
+        Run the named method of the wrapped driver within the deadline.
+
+        Raises DistributedBackendProblem if the deadline passes or the wrapped
+        driver raises it. Either way, the back-end is marked unhealthy, unless
+        the wrapped driver just doesn't support the operation 
+        (BackendUnsupportedOperation).
+
+        Generators (e.g. keys()) are drained within the deadline too, and
+        returned as lists.
+        """
+        method = getattr(self.driver, name)
+
+        def run():
+            result = method(*args, **kwargs)
+            if inspect.isgenerator(result):
+                result = list(result)
+            return result
+
+        self.check_fork()
+
+        try:
+            if self._executor is None:
+                return run()
+
+            future = self._executor.submit(run)
+
+            try:
+                return future.result(timeout=self.deadline)
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                self.logger.error("'%s' missed the %ss deadline", name, self.deadline)
+                raise DistributedBackendProblem()
+        except BackendUnsupportedOperation:
+            raise
+        except DistributedBackendProblem:
+            self._trip()
+            raise
+
+    def _trip(self):
+        """
+        Mark the back-end unhealthy, and start the background recovery check.
+        """
+        with self._lock:
+            if not self.healthy:
+                return
+
+            self.logger.warning("Back-end marked unhealthy, using the '%s' policy for %ss", self.policy, self.fail_fast)
+
+            self.healthy = False
+            self.trips += 1
+
+            self._start_recovery()
+
+    def _start_recovery(self):
+        """
+        Start the background recovery check.
+        """
+        self._recovery = threading.Thread(
+            target=self._recover,
+            name="GuardedDriver-recovery",
+            daemon=True)
+        self._recovery.start()
+
+    def _recover(self):
+        """
+        Body of the background recovery thread.
+
+        Waits out the fail-fast period, then pings the back-end until it responds.
+        """
+        if self._stop.wait(self.fail_fast):
+            return
+
+        while True:
+            try:
+                self.logger.debug("Checking if the back-end has recovered")
+                if self._pinger is None:
+                    self.driver.ping()
+                else:
+                    self._pinger.submit(self.driver.ping).result(timeout=self.deadline)
+            except Exception as e:
+                self.logger.debug("Back-end still unhealthy: %r", e)
+                if self._stop.wait(self.recovery_interval):
+                    return
+            else:
+                self.logger.warning("Back-end has recovered")
+                with self._lock:
+                    self.healthy = True
+                return
+
+    def stop(self):
+        """
+        Shut down the recovery thread and the thread pool.
+        """
+        self._stop.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._pinger.shutdown(wait=False)
+
+    def _degraded(self, name, key, **kwargs):
+        """
+        Apply the degraded policy in place of the named driver method.
+        """
+        self.logger.debug("Back-end unhealthy, '%s' for %s handled by the '%s' policy", name, key, self.policy)
+
+        if self.policy == POLICY_FAIL_CLOSED:
+            raise DistributedBackendProblem()
+
+        if self.policy == POLICY_FAIL_OPEN:
+            if name in ("load", "new"):
+                return self.default()
+            if name == "failure":
+                return 0
+            if name == "transition":
+                return True
+            return None
+
+        if name == "load":
+            return dict(self.local.load(key))
+
+        if name == "failure":
+            try:
+                return self.local.failure(key, **kwargs)
+            except BackendKeyNotFound:
+                self.local.new(key)
+                return self.local.failure(key, **kwargs)
+
+        if name == "delete":
+            self._forget(key)
+            return None
+
+        return getattr(self.local, name)(key, **kwargs)
+
+    def _guarded(self, name, key, **kwargs):
+        """
+        Run the named method against the back-end if it's healthy, falling back
+        to the degraded policy if it isn't, or if the call fails.
+        """
+        if self.healthy:
+            try:
+                return self._call(name, key, **kwargs)
+            except DistributedBackendProblem:
+                pass
+
+        return self._degraded(name, key, **kwargs)
+
+    def _forget(self, key):
+        """
+        Remove a breaker from the in-memory copy, if it's there.
+        """
+        try:
+            self.local.delete(key)
+        except BackendKeyNotFound:
+            pass
+
+    def load(self, key):
+        info = self._guarded("load", key)
+        if self.healthy:
+            self.local.store(key, info)
+        return info
+
+    def new(self, key):
+        info = self._guarded("new", key)
+        if self.healthy:
+            self.local.store(key, info)
+        return info
+
+    def update(self, key, failures=None, status=None, checkin=None):
+        self._guarded("update", key, failures=failures, status=status, checkin=checkin)
+        if self.healthy:
+            self.local.update(key, failures=failures, status=status, checkin=checkin)
+
+    def failure(self, key, amount=1):
+        failures = self._guarded("failure", key, amount=amount)
+        if self.healthy:
+            self.local.update(key, failures=failures)
+        return failures
+
+    def delete(self, key):
+        self._guarded("delete", key)
+        self._forget(key)
+
+    def expire(self, key, checkin):
+        if self.healthy:
+            try:
+                self._call("expire", key, checkin)
+            except DistributedBackendProblem:
+                pass
+
+        try:
+            self.local.expire(key, checkin)
+        except BackendKeyNotFound:
+            pass
+
+    def open(self, key):
+        self._guarded("open", key)
+        if self.healthy:
+            self.local.open(key)
+
+    def close(self, key):
+        self._guarded("close", key)
+        if self.healthy:
+            self.local.close(key)
+
+    def ramp(self, key):
+        self._guarded("ramp", key)
+        if self.healthy:
+            self.local.ramp(key)
+
+    def reset(self, key):
+        self._guarded("reset", key)
+        if self.healthy:
+            self.local.reset(key)
+
+    def transition(self, key, expected, status, failures=None):
+        changed = self._guarded("transition", key, expected=expected, status=status, failures=failures)
+        if self.healthy and changed:
+            self.local.update(key, failures=failures, status=status, checkin=self.now())
+        return changed
+
+    def keys(self, pattern="*"):
+        if self.healthy:
+            try:
+                return self._call("keys", pattern)
+            except DistributedBackendProblem:
+                pass
+
+        return self.local.keys(pattern)
+
+    def load_many(self, keys):
+        keys = list(keys)
+
+        if self.healthy:
+            try:
+                return self._call("load_many", keys)
+            except DistributedBackendProblem:
+                pass
+
+        if self.policy == POLICY_FAIL_CLOSED:
+            raise DistributedBackendProblem()
+
+        if self.policy == POLICY_FAIL_OPEN:
+            return {}
+
+        return self.local.load_many(keys)
+
+    def take_tokens(self, key, requested, capacity, rate=0, deposit=0):
+        if self.healthy:
+            try:
+                return self._call("take_tokens", key, requested, capacity, rate, deposit)
+            except DistributedBackendProblem:
+                pass
+
+        if self.policy == POLICY_FAIL_CLOSED:
+            raise DistributedBackendProblem()
+
+        if self.policy == POLICY_FAIL_OPEN:
+            return requested, capacity
+
+        return self.local.take_tokens(key, requested, capacity, rate, deposit)
+
+    def load_and_take(self, key, bucket, requested, capacity, rate=0):
+        if self.healthy:
+            try:
+                info, granted = self._call("load_and_take", key, bucket, requested, capacity, rate)
+            except DistributedBackendProblem:
+                pass
+            else:
+                if info is not None:
+                    self.local.store(key, info)
+                return info, granted
+
+        return Driver.load_and_take(self, key, bucket, requested, capacity, rate)
+
+    def merge_histogram(self, key, counts, window):
+        if self.healthy:
+            try:
+                return self._call("merge_histogram", key, counts, window)
+            except DistributedBackendProblem:
+                pass
+
+        if self.policy == POLICY_FAIL_CLOSED:
+            raise DistributedBackendProblem()
+
+        if self.policy == POLICY_FAIL_OPEN:
+            return {}
+
+        return self.local.merge_histogram(key, counts, window)
+
+    def clear_histogram(self, key, window):
+        self.local.clear_histogram(key, window)
+
+        if self.healthy:
+            try:
+                return self._call("clear_histogram", key, window)
+            except DistributedBackendProblem:
+                pass
+
+        if self.policy == POLICY_FAIL_CLOSED:
+            raise DistributedBackendProblem()
+
+    def ping(self):
+        if not self.healthy:
+            raise DistributedBackendProblem()
+        return self._call("ping")
@@ -2,34 +2,428 @@
 A simple in-memory implementation of a CircuitBreaker Driver class.
 """
 
-from .base import Driver, STATUS_OPEN, STATUS_CLOSED
+from .base import Driver, STATUS_OPEN, STATUS_CLOSED, take_from_bucket
+from . import snapshot as snapshots
+from .wheel import TimingWheel
 from ..errors import BackendKeyNotFound
 import time
+import atexit
+import collections
 import logging
+import fnmatch
+import struct
+import sys
+import threading
+import weakref
+
+FORK_RESET = "reset"
+FORK_KEEP = "keep"
+
+# tags for the token buckets and histograms on the timing wheel, breakers are
+# plain keys
+BUCKET = "bucket"
+HISTOGRAM = "histogram"
+
+def _save_at_exit(ref):
+    """
+    atexit hook, saves the snapshot of a driver that still exists.
+    """
+    driver = ref()
+    if driver is not None:
+        driver.stop()
 
 class MemoryDriver(Driver):
     """
     Simple in-memory storage.
     
     Uses an internal dictionary to store circuit breaker state.
+    
+    The state belongs to one process. After a fork, the child starts with an 
+    empty state by default, instead of a copy of the parent's that silently 
+    drifts away from it.
+    
+    To survive restarts, the state can be saved to a snapshot file (see the 
+    snapshot module) every snapshot_interval seconds, from a background 
+    thread, and when the process exits. The snapshot is loaded when the driver
+    is created, skipping expired breakers, so breakers that were open stay 
+    open across a deploy. Only breakers are saved, not token buckets or 
+    histograms.
+    
+    With an expiry, breakers are scheduled on a timing wheel (see the wheel 
+    module) when they're created. Every read and write moves the wheel along,
+    and removes the breakers whose checkin is older than the expiry, so 
+    breakers that are never used again don't pile up, even when no new ones 
+    are created. This is O(1) work per breaker removed, on average; between 
+    ticks it's a single comparison. sweep() does it on demand.
+    
+    Token buckets and histograms go on the same wheel: an idle bucket is 
+    dropped once it would have refilled completely, which is the same as 
+    starting over with a new one. Buckets that don't refill on their own use
+    the expiry. A histogram is dropped when its window ends.
+    
+    With max_entries, the least recently used breakers are evicted to make 
+    room for new ones, and the same goes for token buckets and histograms, 
+    each counted separately. stats() reports the counts and the memory used.
     """
-    def __init__(self, expires=None):
-        Driver.__init__(self, expires)
-        self.state = {}
+    def __init__(self, expires=None, clock=None, fork=FORK_RESET, snapshot=None, snapshot_interval=5, max_entries=None, expiry_tick=1):
+        """
+        fork: string, what the child process does with the state after a fork:
+              "reset" to start empty (or with the snapshot, if there is one), 
+              or "keep" to start with a copy.
+        snapshot: string, path of the snapshot file, optional. Processes that
+                  share a file each write all of their state, the last write 
+                  wins.
+        snapshot_interval: number, seconds between saves. Nothing is written 
+                           if the state hasn't changed.
+        max_entries: int, the most breakers (and, separately, token buckets
+                     and histograms) to keep, optional. The least recently 
+                     used ones are evicted.
+        expiry_tick: number, resolution of the expiry, in seconds. Breakers
+                     are removed up to one tick after they expire.
+        """
+        if fork not in (FORK_RESET, FORK_KEEP):
+            raise ValueError(f"'fork' must be one of {(FORK_RESET, FORK_KEEP)}")
+        
+        if max_entries is not None and max_entries < 1:
+            raise ValueError("'max_entries' must be at least 1")
+        
+        Driver.__init__(self, expires, clock)
+        self.fork = fork
+        self.max_entries = max_entries
+        self.expiry_tick = expiry_tick
+        self.evicted = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._clear()
+        
+        self.snapshot = snapshot
+        self.snapshot_interval = snapshot_interval
+        self._dirty = False
+        self._saver = None
+        
+        if snapshot is not None:
+            self.load_snapshot()
+            self._start_saver()
+            atexit.register(_save_at_exit, weakref.ref(self))
         
-    def failure(self, key):
+    def after_fork(self):
+        Driver.after_fork(self)
+        
+        self._lock = threading.Lock()
+        
+        if self.fork == FORK_RESET:
+            self.logger.debug("Forked, dropping %s inherited breakers", len(self.state))
+            self._clear()
+            
+            if self.snapshot is not None:
+                self.load_snapshot()
+        
+        if self.snapshot is not None:
+            self._start_saver()
+    
+    def _locked(self):
+        """
+        Return the lock, to take before touching the state. Checks for a fork
+        first (see Driver.check_fork()): a child forked without the at-fork 
+        hooks could inherit the lock while another thread held it.
+        """
+        self.check_fork()
+        return self._lock
+    
+    def _clear(self):
+        """
+        Start with an empty state.
+        """
+        self.state = collections.OrderedDict()
+        self.buckets = collections.OrderedDict()
+        self.histograms = collections.OrderedDict()
+        self.wheel = TimingWheel(tick=self.expiry_tick, now=self.now())
+    
+    def _add(self, key, info):
+        """
+        Store a new breaker, schedule its expiry, and make room for it: remove
+        the breakers that have expired, then evict the least recently used 
+        ones if there are still too many. Call with the lock held.
+        """
+        self._expire_due()
+        
+        self.state[key] = info
+        self._dirty = True
+        
+        if self.expires is not None:
+            self.wheel.schedule(key, info['checkin'] + self.expires)
+            
+        if self.max_entries is not None:
+            while len(self.state) > self.max_entries:
+                evicted, _ = self.state.popitem(last=False)
+                self.evicted += 1
+                self.wheel.cancel(evicted)
+                self.logger.debug("Evicted '%s'", evicted)
+                
+        return info
+    
+    def _keep(self, table, tag, key, deadline):
+        """
+        Schedule a token bucket or a histogram to be dropped at its deadline 
+        (None to keep it), mark it recently used, and evict the least recently
+        used ones if there are too many. Call with the lock held.
+        """
+        table[key]['deadline'] = deadline
+        
+        if deadline is None:
+            self.wheel.cancel((tag, key))
+        else:
+            self.wheel.schedule((tag, key), deadline)
+            
+        if self.max_entries is not None:
+            table.move_to_end(key)
+            
+            while len(table) > self.max_entries:
+                evicted, _ = table.popitem(last=False)
+                self.wheel.cancel((tag, evicted))
+    
+    def _touch(self, key):
+        """
+        Mark a breaker as recently used.
+        """
         try:
-            self.state[key]['failures'] += 1
+            self.state.move_to_end(key)
         except KeyError:
-            raise BackendKeyNotFound(f"{key} not in internal store")
+            pass
+    
+    def _expire_due(self):
+        """
+        Move the timing wheel to now, and remove the breakers (and token 
+        buckets and histograms) that have expired. Breakers that checked in since they were
+        scheduled are scheduled again. Call with the lock held. Returns the 
+        number of breakers removed.
+        """
+        now = self.now()
+        
+        if now // self.wheel.tick <= self.wheel.current:
+            return 0
+        
+        removed = 0
+        
+        for key in self.wheel.advance(now):
+            if isinstance(key, tuple):
+                self._drop_due(key, now)
+                continue
+            
+            info = self.state.get(key)
             
-        return self.state[key]['failures']
+            if info is None:
+                continue
+            
+            deadline = info['checkin'] + self.expires
+            
+            if now >= deadline:
+                del self.state[key]
+                removed += 1
+            else:
+                self.wheel.schedule(key, deadline)
+                
+        if removed:
+            self.expired += removed
+            self._dirty = True
+            self.logger.debug("Expired %s breakers", removed)
+            
+        return removed
+    
+    def _drop_due(self, entry, now):
+        """
+        Drop a token bucket or a histogram that has come due, or schedule it 
+        again if its deadline is further than the wheel reaches. Call with the
+        lock held.
+        """
+        tag, key = entry
+        table = self.buckets if tag == BUCKET else self.histograms
+        value = table.get(key)
         
-    def delete(self, key):
+        if value is None or value['deadline'] is None:
+            return
+        
+        if now >= value['deadline']:
+            del table[key]
+        else:
+            self.wheel.schedule(entry, value['deadline'])
+    
+    def sweep(self):
+        """
+        Remove the breakers that have expired now, instead of waiting for the
+        next read or write. Returns the number of breakers removed.
+        """
+        with self._locked():
+            return self._expire_due()
+    
+    def stats(self):
+        """
+        Counts, and an estimate of the memory used by the breakers (the 
+        state, and the timing wheel) in bytes. Walks the whole state, for 
+        monitoring rather than every call.
+        """
+        with self._locked():
+            memory = sys.getsizeof(self.state)
+            
+            for key, info in self.state.items():
+                memory += sys.getsizeof(key) + sys.getsizeof(info) + sum(sys.getsizeof(value) for value in info.values())
+                
+            memory += sys.getsizeof(self.wheel.where) + sum(sys.getsizeof(slot) for ring in self.wheel.rings for slot in ring)
+                
+            return {
+                'breakers': len(self.state),
+                'buckets': len(self.buckets),
+                'histograms': len(self.histograms),
+                'max_entries': self.max_entries,
+                'scheduled': len(self.wheel),
+                'evicted': self.evicted,
+                'expired': self.expired,
+                'memory': memory
+            }
+    
+    def _start_saver(self):
+        """
+        Start the thread that saves the snapshot periodically.
+        """
+        self._stop = threading.Event()
+        self._saver = threading.Thread(
+            target=self._run_saver,
+            name=f"{self.__class__.__name__}-snapshot",
+            daemon=True)
+        self._saver.start()
+    
+    def _run_saver(self):
+        """
+        Body of the snapshot thread.
+        """
+        while not self._stop.wait(self.snapshot_interval):
+            if self._dirty:
+                try:
+                    self.save_snapshot()
+                except (OSError, struct.error, snapshots.SnapshotError) as e:
+                    self.logger.error("Unable to save snapshot to %s: %s", self.snapshot, e)
+    
+    def save_snapshot(self):
+        """
+        Write the state to the snapshot file now.
+        """
+        with self._locked():
+            self._dirty = False
+            state = {key: dict(info) for key, info in self.state.items()}
+            
+        size = snapshots.dump(state, self.snapshot, self.now())
+        self.logger.debug("Saved %s breakers to %s (%s bytes)", len(state), self.snapshot, size)
+        
+    def load_snapshot(self):
+        """
+        Add the breakers in the snapshot file to the state, skipping expired 
+        ones. A missing or damaged file is logged, and otherwise ignored.
+        
+        Returns the number of breakers loaded.
+        """
         try:
-            del self.state[key]
-        except KeyError:
-            raise BackendKeyNotFound(f"{key} not in internal store")
+            state, skipped = snapshots.load(self.snapshot, self.now(), self.expires)
+        except FileNotFoundError:
+            self.logger.info("No snapshot at %s, starting empty", self.snapshot)
+            return 0
+        except (OSError, snapshots.SnapshotError) as e:
+            self.logger.error("Unable to load snapshot from %s, starting empty: %s", self.snapshot, e)
+            return 0
+        
+        with self._locked():
+            dirty = self._dirty
+            
+            for key, info in state.items():
+                if key not in self.state:
+                    self._add(key, info)
+                    
+            # nothing new to save
+            self._dirty = dirty
+            
+        self.logger.info("Loaded %s breakers from %s, skipped %s expired", len(state), self.snapshot, skipped)
+        
+        return len(state)
+    
+    def stop(self):
+        """
+        Stop the snapshot thread, and save the snapshot one last time. Called 
+        when the process exits.
+        """
+        if self._saver is None:
+            return
+        
+        self._stop.set()
+        self._saver.join()
+        self._saver = None
+        
+        try:
+            self.save_snapshot()
+        except (OSError, struct.error, snapshots.SnapshotError) as e:
+            self.logger.error("Unable to save snapshot to %s: %s", self.snapshot, e)
+        
+    def new(self, key):
+        """
+        Create the breaker, unless another thread just did: then its info is 
+        returned instead of being overwritten.
+        """
+        with self._locked():
+            self._expire_due()
+            
+            info = self.state.get(key)
+            
+            if info is None:
+                info = self._add(key, self.default())
+            elif self.max_entries is not None:
+                self._touch(key)
+                
+            return info
+    
+    def store(self, key, info):
+        """
+        Store a copy of a breaker's info, e.g. mirrored from another driver. 
+        Breakers that aren't stored yet are added (and may evict others).
+        """
+        with self._locked():
+            self._expire_due()
+            
+            current = self.state.get(key)
+            
+            if current is None:
+                self._add(key, dict(info))
+            else:
+                current.update(info)
+                
+                if self.max_entries is not None:
+                    self._touch(key)
+                    
+            self._dirty = True
+    
+    def failure(self, key, amount=1):
+        with self._locked():
+            self._expire_due()
+            
+            try:
+                info = self.state[key]
+            except KeyError:
+                raise BackendKeyNotFound(f"{key} not in internal store")
+            
+            if self.max_entries is not None:
+                self._touch(key)
+                
+            info['failures'] += amount
+            self._dirty = True
+            
+            return info['failures']
+        
+    def delete(self, key):
+        with self._locked():
+            try:
+                del self.state[key]
+            except KeyError:
+                raise BackendKeyNotFound(f"{key} not in internal store")
+            
+            self.wheel.cancel(key)
+            self._dirty = True
         
     def update(self, key, failures=None, status=None, checkin=None):
         to_update = {}
@@ -41,14 +435,111 @@ class MemoryDriver(Driver):
         if checkin is not None:
             to_update['checkin'] = checkin
                 
-        try:
-            self.state[key].update(to_update)
-        except KeyError:
-            self.state[key] = self.default()
-            self.state[key].update(to_update)
+        with self._locked():
+            self._expire_due()
+            
+            try:
+                self.state[key].update(to_update)
+            except KeyError:
+                info = self.default()
+                info.update(to_update)
+                self._add(key, info)
+            else:
+                if self.max_entries is not None:
+                    self._touch(key)
+                
+            self._dirty = True
+    
+    def transition(self, key, expected, status, failures=None):
+        """
+        Atomic: the check and the change are made under the driver's lock.
+        """
+        with self._locked():
+            self._expire_due()
+            
+            info = self.state.get(key)
+            
+            if info is None:
+                info = self._add(key, self.default())
+            elif self.max_entries is not None:
+                self._touch(key)
+                
+            if info['status'] not in expected:
+                return False
+            
+            info['status'] = status
+            info['checkin'] = self.now()
+            
+            if failures is not None:
+                info['failures'] = failures
+                
+            self._dirty = True
+            
+            return True
         
     def load(self, key):
-        try:
-            return self.state[key]
-        except KeyError:
-            raise BackendKeyNotFound(f"{key} not in internal store")
\ No newline at end of file
+        with self._locked():
+            self._expire_due()
+            
+            try:
+                info = self.state[key]
+            except KeyError:
+                raise BackendKeyNotFound(f"{key} not in internal store")
+            
+            if self.max_entries is not None:
+                self._touch(key)
+                
+            return info
+    
+    def keys(self, pattern="*"):
+        with self._locked():
+            self._expire_due()
+            keys = list(self.state)
+            
+        for key in keys:
+            if fnmatch.fnmatchcase(key, pattern):
+                yield key
+                
+    def take_tokens(self, key, requested, capacity, rate=0, deposit=0):
+        with self._locked():
+            self._expire_due()
+            
+            bucket = self.buckets.setdefault(key, {})
+            granted, tokens = take_from_bucket(bucket, self.now(), requested, capacity, rate, deposit)
+            
+            # a full bucket is the same as a new one
+            if rate > 0:
+                deadline = bucket['updated'] + (capacity - tokens) / rate
+            elif self.expires is not None:
+                deadline = bucket['updated'] + self.expires
+            else:
+                deadline = None
+                
+            self._keep(self.buckets, BUCKET, key, deadline)
+            
+            return granted, tokens
+            
+    def merge_histogram(self, key, counts, window):
+        current = self.histogram_window(window)
+        
+        with self._locked():
+            self._expire_due()
+            
+            histogram = self.histograms.get(key)
+            
+            if histogram is None or histogram['window'] != current:
+                histogram = self.histograms[key] = {'window': current, 'counts': {}}
+                
+            # the next window starts empty
+            self._keep(self.histograms, HISTOGRAM, key, (current + 1) * window)
+            
+            merged = histogram['counts']
+            for bucket, count in counts.items():
+                merged[bucket] = merged.get(bucket, 0) + count
+                
+            return dict(merged)
+    
+    def clear_histogram(self, key, window):
+        with self._locked():
+            self.histograms.pop(key, None)
+            self.wheel.cancel((HISTOGRAM, key))
\ No newline at end of file
@@ -1,26 +1,258 @@
 """
 Redis-backed Driver for the CircuitBreaker.
+
+Breakers can be stored in one of two encodings:
+
+    - "hash" (the default): a hash with failures, status and checkin fields.
+    - "packed": a 13-byte string, read with GET and updated in place with 
+      BITFIELD. Uses less memory in redis, and is cheaper to decode.
+      
+The packed layout is big-endian, at these bit offsets:
+
+    failures  i32  0
+    status    u8   32
+    checkin   i64  40   (microseconds since the epoch)
+    
+A driver can read keys in either encoding: when a command hits a key stored in
+the other one (a WRONGTYPE error), the key is converted and the command is
+retried. RedisDriver.migrate() converts keys in bulk.
+
+Loads can be spread over read replicas of the primary server (see the 
+replica_urls parameter). Everything else, including the token bucket and 
+transition scripts, runs on the primary. Replicas are used in turn, and only 
+while they look up to date:
+
+    - every `replica_check_interval` seconds, INFO replication is checked: a
+      replica whose link to the primary is down, that is syncing, or that 
+      hasn't heard from the primary in more than `max_lag` seconds is skipped 
+      until the next check.
+    - a replica that raises an error is skipped until the next check, and the
+      load is retried on the primary.
+    - breakers this driver wrote in the last `stick_to_primary` seconds are 
+      read from the primary, so a client always sees its own writes.
+    - breakers that a replica doesn't have (yet) are read from the primary.
 """
 
 from .base import Driver, STATUS_OPEN, STATUS_CLOSED
+import itertools
+import struct
 import time
 from ..errors import DistributedBackendProblem, BackendKeyNotFound
 import redis
 
+ENCODING_HASH = "hash"
+ENCODING_PACKED = "packed"
+
+PACKED = struct.Struct(">iBq")
+
+# Token bucket, see Driver.take_tokens(). The client's clock is passed in, so 
+# the script stays deterministic. Returns the tokens granted, and the tokens left 
+# (as a string, redis truncates numbers returned by scripts to integers).
+TAKE_TOKENS = """
+local requested = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local rate = tonumber(ARGV[3])
+local deposit = tonumber(ARGV[4])
+local now = tonumber(ARGV[5])
+local ttl = tonumber(ARGV[6])
+
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(state[1])
+local updated = tonumber(state[2])
+
+if tokens == nil or updated == nil then
+    tokens = capacity
+    updated = now
+end
+
+if now > updated then
+    tokens = tokens + (now - updated) * rate
+    updated = now
+end
+
+tokens = math.min(capacity, tokens + deposit)
+
+local granted = math.max(0, math.min(requested, math.floor(tokens)))
+tokens = tokens - granted
+
+redis.call("HMSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(updated))
+
+if ttl > 0 then
+    redis.call("PEXPIRE", KEYS[1], ttl)
+end
+
+return {granted, tostring(tokens)}
+"""
+
+# Compare-and-set of a breaker's status, see Driver.transition(). Returns 1 if 
+# the status was changed, 0 if it wasn't in one of the expected statuses, and -1
+# if the key is stored in the other encoding.
+TRANSITION = """
+local packed = ARGV[1] == "packed"
+local status = ARGV[2]
+local checkin = ARGV[3]
+local checkin_us = ARGV[4]
+local failures = ARGV[5]
+local ttl = tonumber(ARGV[6])
+local closed = tonumber(ARGV[7])
+
+local kind = redis.call("TYPE", KEYS[1])["ok"]
+local current = closed
+
+if kind == "none" then
+    if failures == "" then
+        failures = "0"
+    end
+elseif packed and kind == "string" then
+    current = redis.call("BITFIELD", KEYS[1], "GET", "u8", 32)[1]
+elseif not packed and kind == "hash" then
+    current = tonumber(redis.call("HGET", KEYS[1], "status")) or closed
+else
+    return -1
+end
+
+local allowed = false
+
+for i = 8, #ARGV do
+    if tonumber(ARGV[i]) == current then
+        allowed = true
+    end
+end
+
+if not allowed then
+    return 0
+end
+
+if packed then
+    if failures == "" then
+        redis.call("BITFIELD", KEYS[1], "SET", "u8", 32, status, "SET", "i64", 40, checkin_us)
+    else
+        redis.call("BITFIELD", KEYS[1], "SET", "u8", 32, status, "SET", "i64", 40, checkin_us, "SET", "i32", 0, failures)
+    end
+else
+    if failures == "" then
+        redis.call("HSET", KEYS[1], "status", status, "checkin", checkin)
+    else
+        redis.call("HSET", KEYS[1], "status", status, "checkin", checkin, "failures", failures)
+    end
+end
+
+if kind == "none" and ttl > 0 then
+    redis.call("PEXPIRE", KEYS[1], ttl)
+end
+
+return 1
+"""
+
+# Add ARGV[2] to a breaker's failures, in either encoding (ARGV[1]). Returns 
+# {1, the new count}, {0, 0} if the breaker isn't stored, and {-1, 0} if it's
+# stored in the other encoding. A missing breaker isn't created: BITFIELD or 
+# HINCRBY would only write the failures, and leave the rest of it unset.
+FAILURE = """
+local kind = redis.call("TYPE", KEYS[1])["ok"]
+
+if kind == "none" then
+    return {0, 0}
+end
+
+if ARGV[1] == "packed" then
+    if kind ~= "string" then
+        return {-1, 0}
+    end
+    return {1, redis.call("BITFIELD", KEYS[1], "INCRBY", "i32", 0, ARGV[2])[1]}
+end
+
+if kind ~= "hash" then
+    return {-1, 0}
+end
+
+return {1, redis.call("HINCRBY", KEYS[1], "failures", ARGV[2])}
+"""
+
+class Replica:
+    """
+    A read replica of the primary server, and what the driver knows about its
+    health.
+    """
+    def __init__(self, connection, name):
+        """
+        connection: a redis connection object for the replica.
+        name: string, used in logs (e.g. the replica's URL).
+        """
+        self.redis = connection
+        self.name = name
+        self.healthy = True
+        self.checked = None
+        self.lag = None
+        self.reads = 0
+        self.errors = 0
+        
+    def dict(self):
+        """
+        A representation of this object as a dictionary of simple values.
+        """
+        return {
+            'name': self.name,
+            'healthy': self.healthy,
+            'lag': self.lag,
+            'reads': self.reads,
+            'errors': self.errors
+        }
+        
+    def __repr__(self):
+        return f"<Replica {self.name} healthy={self.healthy} lag={self.lag}>"
+
 class RedisDriver(Driver):
     """
     A back-end for CircuitBreaker that uses the Redis key-value store.
     """
+    coalesce_loads = True
     
-    def __init__(self, expires=None, redis_connection=None, redis_url=None, prefix="rcb:"):
+    def __init__(self, expires=None, redis_connection=None, redis_url=None, prefix="rcb:", clock=None, encoding=ENCODING_HASH, bucket_prefix=None, histogram_prefix=None, replica_urls=None, replica_connections=None, max_lag=10, replica_check_interval=5, stick_to_primary=1):
         """
         redis_connection: a redis connection object (or one that follows its API)
         redis_url: string, connection info for a redis server.
         prefix: string, used to group circuit breaker keys in redis.
+        clock: Clock object, see Driver.
+        encoding: string, how breakers are stored, "hash" or "packed". See the
+                  module documentation.
+        bucket_prefix: string, used to group token bucket keys (see 
+                       take_tokens()). Defaults to "bucket:" followed by the 
+                       prefix, so buckets never match a breaker key pattern.
+        histogram_prefix: string, used to group latency histogram keys (see
+                          merge_histogram()). Defaults to "latency:" followed
+                          by the prefix.
+        replica_urls: list of strings, connection info for read replicas of 
+                      the server. Loads are spread over them (see the module 
+                      documentation).
+        replica_connections: list of redis connection objects, for replicas 
+                             that are already connected.
+        max_lag: number, seconds since a replica last heard from the primary
+                 after which it isn't used. Redis pings replicas every 10 
+                 seconds when there are no writes (repl-ping-replica-period),
+                 lower values need a lower ping period.
+        replica_check_interval: number, seconds between replication checks of 
+                                each replica.
+        stick_to_primary: number, seconds after this driver writes a breaker
+                          during which it's read from the primary.
         """
-        Driver.__init__(self, expires=expires)
+        Driver.__init__(self, expires=expires, clock=clock)
+        
+        if encoding not in (ENCODING_HASH, ENCODING_PACKED):
+            raise AttributeError(f"Unknown encoding '{encoding}'")
         
         self.prefix = prefix
+        self.encoding = encoding
+        
+        if bucket_prefix is None:
+            self.bucket_prefix = f"bucket:{prefix}"
+        else:
+            self.bucket_prefix = bucket_prefix
+            
+        if histogram_prefix is None:
+            self.histogram_prefix = f"latency:{prefix}"
+        else:
+            self.histogram_prefix = histogram_prefix
         
         if redis_connection is None:
             if redis_url is None:
@@ -30,6 +262,140 @@ class RedisDriver(Driver):
             self.redis = redis_connection
             
         self.redis.connection_pool.decode_responses = True
+        
+        self._take_tokens = self.redis.register_script(TAKE_TOKENS)
+        self._transition = self.redis.register_script(TRANSITION)
+        self._failure = self.redis.register_script(FAILURE)
+        
+        self.replicas = [Replica(redis.StrictRedis.from_url(url), url) for url in replica_urls or []]
+        self.replicas.extend(Replica(connection, f"replica{i}") for i, connection in enumerate(replica_connections or []))
+        
+        for replica in self.replicas:
+            replica.redis.connection_pool.decode_responses = True
+            
+        self.max_lag = max_lag
+        self.replica_check_interval = replica_check_interval
+        self.stick_to_primary = stick_to_primary
+        
+        self._turn = itertools.count()
+        self._written = {}
+        self._pruned = time.monotonic()
+    
+    def after_fork(self):
+        """
+        Drop the connections inherited from the parent, the child opens its own.
+        
+        (redis-py also checks for a PID change lazily, when a connection is 
+        taken from the pool.)
+        """
+        Driver.after_fork(self)
+        self.redis.connection_pool.reset()
+        
+        for replica in self.replicas:
+            replica.redis.connection_pool.reset()
+            
+    def _check_replica(self, replica):
+        """
+        Decide whether a replica is up to date enough to read from, with INFO 
+        replication.
+        """
+        replica.checked = time.monotonic()
+        
+        try:
+            info = replica.redis.info("replication")
+        except redis.RedisError as e:
+            self._replica_failed(replica, e)
+            return
+        
+        replica.lag = info.get("master_last_io_seconds_ago")
+        
+        healthy = (
+            info.get("master_link_status") == "up" and 
+            not info.get("master_sync_in_progress") and 
+            replica.lag is not None and 0 <= replica.lag <= self.max_lag)
+        
+        if healthy != replica.healthy:
+            self.logger.warning("Replica %s is %s (link %s, lag %s)", replica.name, "back" if healthy else "stale", info.get("master_link_status"), replica.lag)
+            
+        replica.healthy = healthy
+        
+    def _replica_failed(self, replica, error):
+        """
+        Stop reading from a replica until its next check.
+        """
+        self.logger.warning("Replica %s failed, reading from the primary: %s", replica.name, error)
+        replica.errors += 1
+        replica.healthy = False
+        replica.checked = time.monotonic()
+        
+    def _replica(self):
+        """
+        Pick the next healthy replica, or return None if there isn't one.
+        """
+        now = time.monotonic()
+        
+        for replica in self.replicas:
+            if replica.checked is None or now - replica.checked >= self.replica_check_interval:
+                self._check_replica(replica)
+                
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        
+        if healthy:
+            return healthy[next(self._turn) % len(healthy)]
+        
+    def _wrote(self, *keys):
+        """
+        Remember that breakers were written, so they're read from the primary
+        for the next `stick_to_primary` seconds.
+        """
+        if not self.replicas:
+            return
+        
+        now = time.monotonic()
+        
+        for key in keys:
+            self._written[key] = now
+            
+        if now - self._pruned > self.stick_to_primary:
+            cutoff = now - self.stick_to_primary
+            self._written = {key: when for key, when in list(self._written.items()) if when > cutoff}
+            self._pruned = now
+            
+    def _read_replica(self, keys):
+        """
+        Read breakers from a replica, in one round trip. Returns a dictionary 
+        of key -> raw info, for the keys the replica has in this driver's 
+        encoding.
+        
+        Breakers written recently are left out, and so is everything when no
+        replica is healthy or the replica fails: they're read from the primary.
+        """
+        replica = self._replica()
+        
+        if replica is None:
+            return {}
+        
+        cutoff = time.monotonic() - self.stick_to_primary
+        keys = [key for key in keys if self._written.get(key, cutoff) <= cutoff]
+        
+        if not keys:
+            return {}
+        
+        pipeline = replica.redis.pipeline(transaction=False)
+        
+        for key in keys:
+            self._queue_load(pipeline, key)
+                
+        try:
+            replies = pipeline.execute(raise_on_error=False)
+        except redis.RedisError as e:
+            self._replica_failed(replica, e)
+            return {}
+        
+        replica.reads += 1
+        
+        # errors are keys in the other encoding, the primary converts them
+        return {key: info for key, info in zip(keys, replies) if self._stored(info)}
     
     def key(self, key):
         """
@@ -46,14 +412,36 @@ class RedisDriver(Driver):
             self._catch_redis_error("expire", self.key(key), self.expires)
     
     def new(self, key):
-        info = Driver.new(self, key)
-        self._set_expiry(key)
+        self.check_fork()
+        
+        self._wrote(key)
+        
+        if self.encoding == ENCODING_HASH:
+            info = Driver.new(self, key)
+            self._set_expiry(key)
+        else:
+            info = self.default()
+            self._catch_redis_error("set", self.key(key), self._pack(info), px=self._ttl())
             
         return info
     
     def reset(self, key):
-        Driver.reset(self, key)
-        self._set_expiry(key)
+        self.check_fork()
+        
+        self._wrote(key)
+        
+        if self.encoding == ENCODING_HASH:
+            Driver.reset(self, key)
+            self._set_expiry(key)
+        else:
+            self.new(key)
+    
+    def _ttl(self):
+        """
+        The expiry in milliseconds, or None.
+        """
+        if self.expires is not None:
+            return int(self.expires * 1000)
     
     def expire(self, key, checkin):
         """
@@ -71,28 +459,345 @@ class RedisDriver(Driver):
             self.logger.error(str(e))
             raise DistributedBackendProblem()
         
+    def _wrong_type(self, error):
+        """
+        Return True if the error is redis complaining that a key is stored in 
+        the other encoding.
+        """
+        return isinstance(error, redis.ResponseError) and str(error).startswith("WRONGTYPE")
+        
+    def _converting(self, key, command, *args, **kwargs):
+        """
+        Like _catch_redis_error(), for commands that depend on the encoding. If 
+        the key is stored in the other encoding, it's converted and the command
+        is retried.
+        """
+        try:
+            self.logger.debug("Attempting to execute command '%s'", command)
+            return getattr(self.redis, command)(*args, **kwargs)
+        except redis.RedisError as e:
+            if not self._wrong_type(e):
+                self.logger.error(str(e))
+                raise DistributedBackendProblem()
+        
+        self.convert(key)
+        return self._catch_redis_error(command, *args, **kwargs)
+        
     def load(self, key):
+        self.check_fork()
+        
         self.logger.debug("Loading %s...", key)
         
-        info = self._catch_redis_error('hgetall', self.key(key))
+        if self.replicas:
+            info = self._read_replica([key]).get(key)
+            
+            if info:
+                return self._decode(info)
+        
+        if self.encoding == ENCODING_HASH:
+            info = self._converting(key, 'hgetall', self.key(key))
+        else:
+            info = self._converting(key, 'get', self.key(key))
         
         if not info:
             self.logger.debug("Could not find '%s'", key)
             raise BackendKeyNotFound(f"{key} not in database")
             
-        output = {
+        return self._decode(info)
+    
+    def _queue_load(self, pipeline, key):
+        """
+        Queue the command that reads a breaker on a pipeline. The reply is 
+        converted with _decode().
+        """
+        if self.encoding == ENCODING_HASH:
+            pipeline.hgetall(self.key(key))
+        else:
+            pipeline.get(self.key(key))
+    
+    def _stored(self, info):
+        """
+        Return True if a reply to the command queued by _queue_load() holds a
+        breaker.
+        """
+        return bool(info) and not isinstance(info, redis.RedisError)
+    
+    def _decode(self, info):
+        """
+        Convert the raw output of HGETALL or GET into a breaker info dictionary.
+        """
+        if isinstance(info, dict):
+            return self._parse(info)
+        return self._unpack(info)
+    
+    def _parse(self, info):
+        """
+        Convert the raw output of HGETALL into a breaker info dictionary.
+        """
+        return {
             'failures': int(info[b'failures']),
             'status': int(info[b'status']),
             'checkin': float(info[b'checkin'])
         }
+    
+    def _pack(self, info):
+        """
+        Convert a breaker info dictionary into the packed encoding.
+        """
+        return PACKED.pack(info['failures'], info['status'], int(info['checkin'] * 1000000))
+    
+    def _unpack(self, raw):
+        """
+        Convert a packed string into a breaker info dictionary.
+        
+        Strings can be shorter than the full layout (BITFIELD on a missing key 
+        only creates the bytes it touches, see _queue_defaults()); missing 
+        bytes are zeros.
+        """
+        if len(raw) < PACKED.size:
+            raw = raw.ljust(PACKED.size, b"\0")
+            
+        failures, status, checkin = PACKED.unpack_from(raw)
+        
+        return {
+            'failures': failures,
+            'status': status,
+            'checkin': checkin / 1000000
+        }
+    
+    def convert(self, key):
+        """
+        Rewrite a breaker stored in the other encoding in this driver's 
+        encoding, keeping its time to live. 
+        
+        Runs as a WATCH/MULTI transaction, so concurrent updates aren't lost. 
+        Returns True if the key was converted.
+        """
+        self.check_fork()
+        
+        name = self.key(key)
+        
+        def transaction(pipeline):
+            kind = pipeline.type(name)
+            
+            if isinstance(kind, bytes):
+                kind = kind.decode()
+                
+            if self.encoding == ENCODING_PACKED and kind == "hash":
+                info = self._parse(pipeline.hgetall(name))
+            elif self.encoding == ENCODING_HASH and kind == "string":
+                info = self._unpack(pipeline.get(name))
+            else:
+                return False
+            
+            ttl = pipeline.pttl(name)
+            
+            pipeline.multi()
+            pipeline.delete(name)
+            
+            if self.encoding == ENCODING_PACKED:
+                pipeline.set(name, self._pack(info))
+            else:
+                pipeline.hmset(name, info)
+                
+            if ttl is not None and ttl > 0:
+                pipeline.pexpire(name, ttl)
+                
+            return True
+        
+        self.logger.debug("Converting '%s' to the %s encoding", key, self.encoding)
+        
+        return self._catch_redis_error("transaction", transaction, name, value_from_callable=True)
+    
+    def migrate(self, pattern="*"):
+        """
+        Convert every breaker matching the pattern to this driver's encoding. 
+        Returns the number of breakers converted.
+        
+        Only keys in the other encoding are touched, so it's safe to run more 
+        than once, and while clients are using the breakers.
+        """
+        self.check_fork()
+        
+        count = 0
+        
+        for key in self.keys(pattern):
+            if self.convert(key):
+                count += 1
+                
+        return count
+    
+    def keys(self, pattern="*"):
+        """
+        Iterate over breaker keys with SCAN (never KEYS), so enumerating a large 
+        prefix doesn't block the server.
+        """
+        self.check_fork()
+        
+        prefix_length = len(self.prefix)
+        
+        try:
+            for key in self.redis.scan_iter(match=self.key(pattern), count=1000):
+                if isinstance(key, bytes):
+                    key = key.decode()
+                yield key[prefix_length:]
+        except redis.RedisError as e:
+            self.logger.error(str(e))
+            raise DistributedBackendProblem()
+    
+    def load_many(self, keys):
+        """
+        Fetch many breakers with a single pipelined round trip of HGETALLs (or
+        GETs). With replicas, breakers the replica doesn't have take a second
+        round trip, to the primary.
+        """
+        self.check_fork()
+        
+        keys = list(keys)
+        found = {}
+        
+        if self.replicas:
+            found = {key: self._decode(info) for key, info in self._read_replica(keys).items()}
+            keys = [key for key in keys if key not in found]
+        
+        results = self._pipeline(keys, self._queue_load) if keys else {}
+        
+        found.update((key, self._decode(info)) for key, info in results.items() if self._stored(info))
+        
+        return found
+    
+    def _pipeline(self, keys, queue):
+        """
+        Helper for the *_many() methods. 
+        
+        Calls queue(pipeline, key) for every key, then sends everything in one 
+        round trip. Keys stored in the other encoding are converted, and sent 
+        again in a second round trip.
+        
+        Returns a dictionary of key: result of the last command queued for it.
+        """
+        keys = list(keys)
+        results = {}
+        
+        for attempt in range(2):
+            pipeline = self.redis.pipeline(transaction=False)
+            lengths = []
+            
+            for key in keys:
+                before = len(pipeline)
+                queue(pipeline, key)
+                lengths.append(len(pipeline) - before)
+                
+            try:
+                replies = pipeline.execute(raise_on_error=False)
+            except redis.RedisError as e:
+                self.logger.error(str(e))
+                raise DistributedBackendProblem()
+            
+            retry = []
+            position = 0
+            
+            for key, length in zip(keys, lengths):
+                replies_for_key = replies[position:position + length]
+                position += length
+                
+                errors = [reply for reply in replies_for_key if isinstance(reply, redis.RedisError)]
+                
+                if not errors:
+                    results[key] = replies_for_key[-1] if replies_for_key else None
+                elif attempt == 0 and all(self._wrong_type(error) for error in errors):
+                    retry.append(key)
+                else:
+                    self.logger.error(str(errors[0]))
+                    raise DistributedBackendProblem()
+            
+            if not retry:
+                break
+                
+            for key in retry:
+                self.convert(key)
+                
+            keys = retry
+            
+        return results
+    
+    def reset_many(self, keys):
+        self.check_fork()
+        
+        keys = list(keys)
+        self._wrote(*keys)
+        
+        info = {'failures': 0, 'status': STATUS_CLOSED, 'checkin': self.now()}
+        
+        if self.encoding == ENCODING_PACKED:
+            packed = self._pack(info)
+            self._pipeline(keys, lambda pipeline, key: pipeline.set(self.key(key), packed, px=self._ttl()))
+            return
+        
+        def queue(pipeline, key):
+            pipeline.hmset(self.key(key), info)
+            if self.expires is not None:
+                pipeline.expire(self.key(key), self.expires)
+        
+        self._pipeline(keys, queue)
+        
+    def open_many(self, keys):
+        self.check_fork()
+        
+        keys = list(keys)
+        self._wrote(*keys)
+        
+        checkin = self.now()
+        
+        if self.encoding == ENCODING_PACKED:
+            def queue(pipeline, key):
+                self._queue_defaults(pipeline, key)
+                pipeline.execute_command(*self._bitfield(key, status=STATUS_OPEN, checkin=checkin))
+        else:
+            info = {'status': STATUS_OPEN, 'checkin': checkin}
+            
+            def queue(pipeline, key):
+                self._queue_defaults(pipeline, key)
+                pipeline.hset(self.key(key), mapping=info)
+        
+        self._pipeline(keys, queue)
+    
+    def _queue_defaults(self, pipeline, key):
+        """
+        Queue the commands that store a whole default breaker if there is none,
+        ahead of a command that only sets some of its values. Otherwise a 
+        breaker that has expired would come back with only those values: in 
+        the packed encoding, the others would read as zeros (OPEN, since the
+        epoch).
+        """
+        name = self.key(key)
+        
+        if self.encoding == ENCODING_PACKED:
+            pipeline.set(name, self._pack(self.default()), nx=True, px=self._ttl())
+        else:
+            for field, value in self.default().items():
+                pipeline.hsetnx(name, field, value)
+        
+    def delete_many(self, keys):
+        self.check_fork()
         
-        return output
+        keys = list(keys)
+        self._wrote(*keys)
+        
+        keys = [self.key(key) for key in keys]
+        if keys:
+            self._catch_redis_error('delete', *keys)
         
     def delete(self, key):
+        self.check_fork()
+        
         self.logger.debug("Deleting '%s'...", key)
+        self._wrote(key)
         self._catch_redis_error('delete', self.key(key))
         
     def update(self, key, failures=None, status=None, checkin=None):
+        self.check_fork()
+        
         self.logger.debug("Updating '%s'...", key)
         to_update = {}
         
@@ -105,14 +810,233 @@ class RedisDriver(Driver):
         if checkin is not None:
             to_update['checkin'] = checkin
             
-        if to_update:
-            self.logger.debug("Updating [%s] for '%s'", to_update.keys(), key)
-            self._catch_redis_error('hmset', self.key(key), to_update)
-        else:
+        if not to_update:
             raise ValueError("You must specify one of failures, status, or checkin")
+            
+        self.logger.debug("Updating [%s] for '%s'", to_update.keys(), key)
+        self._wrote(key)
+        
+        if self.encoding == ENCODING_HASH:
+            def queue(pipeline, key):
+                self._queue_defaults(pipeline, key)
+                pipeline.hset(self.key(key), mapping=to_update)
+        else:
+            def queue(pipeline, key):
+                self._queue_defaults(pipeline, key)
+                pipeline.execute_command(*self._bitfield(key, **to_update))
+        
+        self._pipeline([key], queue)
+        
+    def transition(self, key, expected, status, failures=None):
+        """
+        Runs a lua script, so the check and the change are atomic, and take 
+        one round trip. A breaker that isn't stored is created (with the 
+        driver's expiry).
+        """
+        self.check_fork()
+        
+        checkin = self.now()
+        self._wrote(key)
+        
+        args = [
+            self.encoding, 
+            status, 
+            checkin, 
+            int(checkin * 1000000), 
+            "" if failures is None else failures,
+            self._ttl() or 0,
+            STATUS_CLOSED,
+            *expected]
+        
+        for attempt in range(2):
+            try:
+                changed = self._transition(keys=[self.key(key)], args=args)
+            except redis.RedisError as e:
+                self.logger.error(str(e))
+                raise DistributedBackendProblem()
+            
+            if changed >= 0:
+                return changed == 1
+            
+            self.convert(key)
+        
+        self.logger.error("'%s' is still stored in the wrong encoding", key)
+        raise DistributedBackendProblem()
+        
+    def _bitfield(self, key, failures=None, status=None, checkin=None):
+        """
+        Build a BITFIELD command that sets the given fields of a packed breaker.
+        """
+        command = ["BITFIELD", self.key(key)]
+        
+        if failures is not None:
+            command.extend(["SET", "i32", 0, failures])
+            
+        if status is not None:
+            command.extend(["SET", "u8", 32, status])
+            
+        if checkin is not None:
+            command.extend(["SET", "i64", 40, int(checkin * 1000000)])
+            
+        return command
+        
+    def failure(self, key, amount=1):
+        """
+        Runs a lua script, so a breaker that has expired isn't brought back 
+        with only its failures set. Raises BackendKeyNotFound instead.
+        """
+        self.check_fork()
+        
+        self._wrote(key)
+        
+        for attempt in range(2):
+            try:
+                found, failures = self._failure(keys=[self.key(key)], args=[self.encoding, amount])
+            except redis.RedisError as e:
+                self.logger.error(str(e))
+                raise DistributedBackendProblem()
+            
+            if found == 0:
+                raise BackendKeyNotFound(f"{key} not in database")
+            
+            if found == 1:
+                self.logger.debug("Failure. Count for %s: %s", key, failures)
+                return int(failures)
+            
+            self.convert(key)
+        
+        self.logger.error("'%s' is still stored in the wrong encoding", key)
+        raise DistributedBackendProblem()
+        
+    def ping(self):
+        self.check_fork()
+        
+        return self._catch_redis_error("ping")
+    
+    def _bucket_args(self, key, requested, capacity, rate, deposit):
+        """
+        Build the keys and arguments for the TAKE_TOKENS script.
+        
+        An idle bucket expires once it would have refilled completely, which 
+        is the same as starting over with a new bucket. Buckets that don't 
+        refill on their own use the driver's expiry.
+        """
+        if rate > 0:
+            ttl = int(capacity / rate * 1000) + 1000
+        elif self.expires is not None:
+            ttl = int(self.expires * 1000)
+        else:
+            ttl = 0
+            
+        return [f"{self.bucket_prefix}{key}"], [requested, capacity, rate, deposit, self.now(), ttl]
+        
+    def take_tokens(self, key, requested, capacity, rate=0, deposit=0):
+        """
+        Runs a lua script, so the whole operation is atomic and takes one round
+        trip.
+        """
+        self.check_fork()
+        
+        keys, args = self._bucket_args(key, requested, capacity, rate, deposit)
+        
+        try:
+            granted, tokens = self._take_tokens(keys=keys, args=args)
+        except redis.RedisError as e:
+            self.logger.error(str(e))
+            raise DistributedBackendProblem()
+        
+        return int(granted), float(tokens)
+    
+    def load_and_take(self, key, bucket, requested, capacity, rate=0):
+        """
+        Pipelines the breaker read with the token bucket script. Both run on 
+        the primary, even with replicas.
+        """
+        self.check_fork()
+        
+        keys, args = self._bucket_args(bucket, requested, capacity, rate, 0)
+        
+        pipeline = self.redis.pipeline(transaction=False)
+        
+        self._queue_load(pipeline, key)
+            
+        pipeline.evalsha(self._take_tokens.sha, len(keys), *keys, *args)
+        
+        try:
+            info, taken = pipeline.execute(raise_on_error=False)
+        except redis.RedisError as e:
+            self.logger.error(str(e))
+            raise DistributedBackendProblem()
+        
+        if isinstance(taken, redis.exceptions.NoScriptError):
+            # first use on this server, the script loads itself
+            granted = self.take_tokens(bucket, requested, capacity, rate)[0]
+        elif isinstance(taken, redis.RedisError):
+            self.logger.error(str(taken))
+            raise DistributedBackendProblem()
+        else:
+            granted = int(taken[0])
+            
+        if isinstance(info, redis.RedisError):
+            if not self._wrong_type(info):
+                self.logger.error(str(info))
+                raise DistributedBackendProblem()
+            
+            try:
+                info = self.load(key)
+            except BackendKeyNotFound:
+                info = None
+        elif self._stored(info):
+            info = self._decode(info)
+        else:
+            info = None
+            
+        return info, granted
+    
+    def _histogram_key(self, key, window):
+        """
+        Generate the redis key for the current window of a histogram.
+        """
+        return f"{self.histogram_prefix}{key}:{self.histogram_window(window)}"
+    
+    def merge_histogram(self, key, counts, window):
+        """
+        Histograms are hashes of bucket -> count, one per window, that expire
+        after two windows. The counts are added with HINCRBY and read back in 
+        the same round trip.
+        """
+        self.check_fork()
+        
+        name = self._histogram_key(key, window)
+        
+        pipeline = self.redis.pipeline(transaction=False)
+        
+        for bucket, count in counts.items():
+            pipeline.hincrby(name, bucket, count)
+            
+        if counts:
+            pipeline.pexpire(name, int(window * 2000))
+            
+        pipeline.hgetall(name)
+        
+        try:
+            merged = pipeline.execute()[-1]
+        except redis.RedisError as e:
+            self.logger.error(str(e))
+            raise DistributedBackendProblem()
+        
+        return {int(bucket): int(count) for bucket, count in merged.items()}
+    
+    def clear_histogram(self, key, window):
+        self.check_fork()
+        
+        self._catch_redis_error("delete", self._histogram_key(key, window))
+    
+    def server_time(self):
+        """
+        Use the redis TIME command.
+        """
+        self.check_fork()
         
-    def failure(self, key):
-        failures = self._catch_redis_error("hincrby", self.key(key), "failures", 1)
-        self.logger.debug("Failure. Count for %s: %s", key, failures)
-        return int(failures)
-        
\ No newline at end of file
+        seconds, microseconds = self._catch_redis_error("time")
+        return seconds + microseconds / 1000000
@@ -0,0 +1,119 @@
+"""
+Snapshot files for the MemoryDriver.
+
+A snapshot is the state of every breaker, in a compact binary format that is
+written and read through a memory map:
+
+    header    magic "RCBS", version u8, saved at f64, count u32
+    records   failures i32, status u8, checkin f64, key length u16, key (utf-8)
+
+All numbers are big-endian. A snapshot is written to a temporary file that is
+renamed over the old one, so a reader never sees half a snapshot.
+"""
+
+import mmap
+import os
+import struct
+
+MAGIC = b"RCBS"
+VERSION = 1
+
+HEADER = struct.Struct(">4sBdI")
+RECORD = struct.Struct(">iBdH")
+
+class SnapshotError(ValueError):
+    """
+    The file isn't a snapshot, or is damaged.
+    """
+
+def dump(state, path, now):
+    """
+    Write the given state (a dictionary of key -> info, like
+    MemoryDriver.state) to a snapshot file. Returns the size of the file.
+
+    Entries the format can't hold (a key longer than 65535 bytes, a failure
+    count that isn't a 32-bit int) are left out.
+
+    now: number, the time the snapshot is taken.
+    """
+    parts = [None]
+    count = 0
+
+    for key, info in list(state.items()):
+        try:
+            encoded = key.encode("utf-8")
+            record = RECORD.pack(info['failures'], info['status'], info['checkin'], len(encoded))
+        except (struct.error, UnicodeEncodeError):
+            continue
+
+        parts.append(record)
+        parts.append(encoded)
+        count += 1
+
+    parts[0] = HEADER.pack(MAGIC, VERSION, now, count)
+    data = b"".join(parts)
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+
+    with open(temporary, "wb+") as f:
+        f.truncate(len(data))
+        with mmap.mmap(f.fileno(), len(data)) as mapped:
+            mapped[:] = data
+            mapped.flush()
+
+    os.replace(temporary, path)
+
+    return len(data)
+
+def load(path, now, expires=None):
+    """
+    Read a snapshot file. Returns a tuple: the state, as a dictionary of
+    key -> info, and the number of expired entries that were skipped.
+
+    Entries are expired when they are at least `expires` seconds older than
+    `now` (see Driver.expire()).
+
+    Raises FileNotFoundError if there is no snapshot, and SnapshotError if the
+    file can't be read.
+    """
+    state = {}
+    skipped = 0
+
+    with open(path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise SnapshotError(f"{path} is empty")
+
+    with mapped:
+        try:
+            magic, version, saved, count = HEADER.unpack_from(mapped, 0)
+        except struct.error:
+            raise SnapshotError(f"{path} is too short")
+
+        if magic != MAGIC or version != VERSION:
+            raise SnapshotError(f"{path} is not a version {VERSION} snapshot")
+
+        offset = HEADER.size
+        unpack = RECORD.unpack_from
+        size = RECORD.size
+
+        try:
+            for i in range(count):
+                failures, status, checkin, length = unpack(mapped, offset)
+                offset += size
+
+                if expires is not None and now - checkin >= expires:
+                    skipped += 1
+                else:
+                    key = mapped[offset:offset+length].decode("utf-8")
+                    state[key] = {'failures': failures, 'status': status, 'checkin': checkin}
+
+                offset += length
+        except (struct.error, UnicodeDecodeError):
+            raise SnapshotError(f"{path} is damaged")
+
+        if offset > len(mapped):
+            raise SnapshotError(f"{path} is truncated")
+
+    return state, skipped
@@ -0,0 +1,128 @@
+"""
+A Driver that records a tracing span for every operation (see the tracing
+module).
+"""
+
+from .base import Driver
+
+class TracedDriver(Driver):
+    """
+    Wraps another Driver, running each of its operations in a
+    "circuitbreaker.driver.<method>" span, with the key and the wrapped
+    driver's class name as attributes.
+
+    Operations made during a breaker call are part of the call's trace. Other
+    operations (from the dashboard, for example) start traces of their own.
+    """
+    @property
+    def coalesce_loads(self):
+        return self.driver.coalesce_loads
+
+    def __init__(self, driver, tracer):
+        """
+        driver: Driver object, the driver to trace.
+        tracer: Tracer object, used to start the spans.
+        """
+        if not isinstance(driver, Driver):
+            raise AttributeError("'driver' parameter must be derived from the Driver base class")
+
+        Driver.__init__(self, expires=driver.expires, clock=driver.clock)
+
+        self.driver = driver
+        self.tracer = tracer
+
+        self._attributes = {"circuitbreaker.driver": driver.__class__.__name__}
+
+    def _traced(self, name, key, *args, **kwargs):
+        """
+        Run the named method of the wrapped driver in a span.
+        """
+        method = getattr(self.driver, name)
+
+        if self.tracer.skipping():
+            return method(*args, **kwargs)
+
+        with self.tracer.span(f"circuitbreaker.driver.{name}", key, self._attributes):
+            return method(*args, **kwargs)
+
+    def now(self):
+        return self.driver.now()
+
+    def server_time(self):
+        return self.driver.server_time()
+
+    def sync_clock(self, interval=60):
+        # now() reads the wrapped driver's clock, so that's the one to sync
+        self.clock = self.driver.sync_clock(interval=interval)
+        return self.clock
+
+    def load(self, key):
+        return self._traced("load", key, key)
+
+    def load_shared(self, key):
+        # coalesced by the wrapped driver, so traced and untraced callers share loads
+        return self._traced("load_shared", key, key)
+
+    def new(self, key):
+        return self._traced("new", key, key)
+
+    def update(self, key, failures=None, status=None, checkin=None):
+        return self._traced("update", key, key, failures=failures, status=status, checkin=checkin)
+
+    def failure(self, key, amount=1):
+        return self._traced("failure", key, key, amount)
+
+    def delete(self, key):
+        return self._traced("delete", key, key)
+
+    def expire(self, key, checkin):
+        return self._traced("expire", key, key, checkin)
+
+    def open(self, key):
+        return self._traced("open", key, key)
+
+    def close(self, key):
+        return self._traced("close", key, key)
+
+    def ramp(self, key):
+        return self._traced("ramp", key, key)
+
+    def reset(self, key):
+        return self._traced("reset", key, key)
+
+    def transition(self, key, expected, status, failures=None):
+        return self._traced("transition", key, key, expected, status, failures)
+
+    def keys(self, pattern="*"):
+        # a lazy iterator, a span would only time its creation
+        return self.driver.keys(pattern)
+
+    def load_many(self, keys):
+        return self._traced("load_many", None, keys)
+
+    def reset_many(self, keys):
+        return self._traced("reset_many", None, keys)
+
+    def open_many(self, keys):
+        return self._traced("open_many", None, keys)
+
+    def delete_many(self, keys):
+        return self._traced("delete_many", None, keys)
+
+    def ping(self):
+        return self._traced("ping", None)
+
+    def take_tokens(self, key, requested, capacity, rate=0, deposit=0):
+        return self._traced("take_tokens", key, key, requested, capacity, rate, deposit)
+
+    def load_and_take(self, key, bucket, requested, capacity, rate=0):
+        return self._traced("load_and_take", key, key, bucket, requested, capacity, rate)
+
+    def histogram_window(self, window):
+        return self.driver.histogram_window(window)
+
+    def merge_histogram(self, key, counts, window):
+        return self._traced("merge_histogram", key, key, counts, window)
+
+    def clear_histogram(self, key, window):
+        return self._traced("clear_histogram", key, key, window)
@@ -0,0 +1,158 @@
+"""
+A hierarchical timing wheel, used by the MemoryDriver to expire breakers.
+
+Time is cut into ticks. The wheel has `levels` rings of `slots` slots each: a
+slot of the first ring holds the keys due at one tick, a slot of the second
+ring the keys due in one run of `slots` ticks, and so on. Keys are put in the
+lowest ring that reaches their deadline; when the first ring wraps around, the
+next slot of the ring above is emptied into the rings below it.
+
+Scheduling and cancelling a key are O(1). Each key moves down at most
+`levels` times before it fires, so the work to fire it is O(1) too, however
+many keys are waiting.
+"""
+
+import math
+
+class TimingWheel:
+    """
+    Fires keys at (or within one tick after) their deadline.
+    """
+    def __init__(self, tick=1, slots=64, levels=4, now=0):
+        """
+        tick: number, seconds per tick.
+        slots: int, number of slots in each ring.
+        levels: int, number of rings. Deadlines further away than
+                slots ** levels ticks fire early, at the end of the range.
+        now: number, the current time.
+        """
+        if tick <= 0:
+            raise ValueError("'tick' must be greater than 0")
+
+        if slots < 2 or levels < 1:
+            raise ValueError("A wheel needs at least 2 slots and 1 level")
+
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.span = slots ** levels
+
+        self.rings = [[set() for slot in range(slots)] for level in range(levels)]
+        self.where = {}
+        self.current = int(now // tick)
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, key):
+        return key in self.where
+
+    def _place(self, key, deadline):
+        """
+        Put a key in the slot for its deadline, given in ticks.
+        """
+        delta = deadline - self.current
+        level = 0
+        reach = self.slots
+
+        while delta >= reach and level < self.levels - 1:
+            level += 1
+            reach *= self.slots
+
+        if delta >= reach:
+            deadline = self.current + reach - 1
+
+        slot = (deadline // (reach // self.slots)) % self.slots
+
+        self.rings[level][slot].add(key)
+        self.where[key] = (level, slot, deadline)
+
+    def schedule(self, key, deadline):
+        """
+        Fire the key at the given time. A key that is already scheduled is
+        moved.
+        """
+        self.cancel(key)
+        self._place(key, max(math.ceil(deadline / self.tick), self.current + 1))
+
+    def cancel(self, key):
+        """
+        Forget a key. Returns True if it was scheduled.
+        """
+        found = self.where.pop(key, None)
+
+        if found is None:
+            return False
+
+        level, slot, deadline = found
+        self.rings[level][slot].discard(key)
+
+        return True
+
+    def advance(self, now):
+        """
+        Move the wheel to the given time. Returns the keys that are due, they
+        aren't scheduled anymore.
+        """
+        target = int(now // self.tick)
+
+        if target <= self.current:
+            return []
+
+        if not self.where or target - self.current >= self.span:
+            fired = list(self.where)
+            self.clear()
+            self.current = target
+            return fired
+
+        fired = []
+
+        while self.current < target:
+            self.current += 1
+            self._cascade()
+
+            slot = self.rings[0][self.current % self.slots]
+
+            if slot:
+                for key in slot:
+                    del self.where[key]
+
+                fired.extend(slot)
+                slot.clear()
+
+        return fired
+
+    def _cascade(self):
+        """
+        When rings wrap around, empty the next slot of each ring above them
+        into the rings below, starting from the top, so keys can move down
+        more than one ring at once.
+        """
+        top = 0
+        size = self.slots
+
+        while top < self.levels - 1 and self.current % size == 0:
+            top += 1
+            size *= self.slots
+
+        for level in range(top, 0, -1):
+            size = self.slots ** level
+            slot = self.rings[level][(self.current // size) % self.slots]
+
+            if slot:
+                keys = list(slot)
+                slot.clear()
+
+                for key in keys:
+                    deadline = self.where.pop(key)[2]
+                    self._place(key, deadline)
+
+    def clear(self):
+        """
+        Forget every key.
+        """
+        for ring in self.rings:
+            for slot in ring:
+                slot.clear()
+
+        self.where.clear()
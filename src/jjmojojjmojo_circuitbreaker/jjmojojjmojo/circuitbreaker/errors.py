@@ -29,4 +29,20 @@ class DistributedBackendProblem(CircuitBreakerOpen):
 	Raised when there is some problem with the back-end (redis is down, etc). 
 	
 	This state is the same as CircuitBreakerOpen, in functional terms.
-	"""
\ No newline at end of file
+	"""
+
+class BackendUnsupportedOperation(DistributedBackendProblem):
+    """
+    Raised when a driver doesn't support an operation (token buckets, 
+    histograms).
+    
+    Handled like any other back-end problem, but it doesn't mean the back-end
+    is unhealthy (see GuardedDriver).
+    """
+
+class RateLimitExceeded(CircuitBreakerOpen):
+    """
+    Raised when a call is rejected by a RateLimiter.
+    
+    Like an open breaker, the call wasn't made, and can be tried again later.
+    """
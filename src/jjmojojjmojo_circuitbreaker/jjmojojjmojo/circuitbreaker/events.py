@@ -0,0 +1,305 @@
+"""
+Audit log of circuit breaker transitions.
+
+Every time a CircuitBreaker opens, closes, starts ramping up (see its ramp
+option) or is reset, an event is recorded with the key, a timestamp, the
+failure count and the host name. Events are queued and written in batches from
+a background thread, so recording one never waits on the back-end.
+
+Two implementations are provided: RedisStreamEventLog, which writes to a capped
+redis stream, and FileEventLog, a JSON-lines file for use with the MemoryDriver
+(or anywhere redis isn't available).
+"""
+
+from . import fork
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+
+EVENT_OPEN = "open"
+EVENT_CLOSE = "close"
+EVENT_RESET = "reset"
+EVENT_RAMP = "ramp"
+
+class EventLog:
+    """
+    Base class for event logs. Handles queueing and the background batcher.
+
+    Sub-classes implement write(), tail() and range().
+    """
+    def __init__(self, batch_size=100, flush_interval=1, queue_size=10000):
+        """
+        batch_size: int, maximum number of events written at once.
+        flush_interval: number, maximum seconds an event waits in the queue
+                        before it is written.
+        queue_size: int, maximum number of queued events. When the queue is full,
+                    new events are dropped (and counted in self.dropped) rather
+                    than blocking the caller.
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.host = socket.gethostname()
+        self.logger = logging.getLogger(f"CircuitBreaker:{self.__class__.__name__}")
+
+        self._reset()
+        fork.register(self)
+
+    def _reset(self):
+        """
+        Create the queue and locks. The batcher thread is started lazily.
+        """
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.pid = os.getpid()
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    def after_fork(self):
+        """
+        Called in the child process after a fork (see the fork module).
+
+        The batcher thread doesn't survive the fork, and the events already
+        queued are the parent's to write, so the child starts over with an
+        empty queue.
+        """
+        self._reset()
+
+    def record(self, event, key, failures, timestamp):
+        """
+        Queue an event for writing. Never blocks.
+
+        event: string, one of EVENT_OPEN, EVENT_CLOSE, EVENT_RESET or 
+               EVENT_RAMP.
+        key: string, the breaker's key.
+        failures: int, the failure count at the time of the transition.
+        timestamp: number, when the transition happened.
+        """
+        if self.pid != os.getpid():
+            self.after_fork()
+
+        if self._thread is None:
+            self._start()
+
+        try:
+            self.queue.put_nowait({
+                'event': event,
+                'key': key,
+                'timestamp': timestamp,
+                'failures': failures,
+                'host': self.host
+            })
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        """
+        Start the background batcher thread, if it hasn't been already.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name=f"{self.__class__.__name__}-batcher",
+                    daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        """
+        Body of the batcher thread.
+
+        Waits for an event, then collects as many as are waiting (up to
+        batch_size) and writes them all at once.
+        """
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                if self._stopping:
+                    return
+                continue
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self.write(batch)
+            except Exception as e:
+                self.logger.error("Unable to write %s events: %s", len(batch), e)
+            finally:
+                for event in batch:
+                    self.queue.task_done()
+
+    def flush(self):
+        """
+        Block until every queued event has been written.
+        """
+        if self._thread is not None:
+            self.queue.join()
+
+    def stop(self):
+        """
+        Write any queued events, and stop the batcher thread.
+        """
+        self.flush()
+        self._stopping = True
+
+    def write(self, events):
+        """
+        Write a batch of events (a list of dictionaries) to storage.
+        """
+        pass
+
+    def tail(self, count=10):
+        """
+        Return the most recent events, oldest first.
+        """
+        pass
+
+    def range(self, start=None, end=None, count=None):
+        """
+        Return events with timestamps between start and end (inclusive), oldest
+        first.
+
+        start: number, timestamp. If None, start from the oldest event.
+        end: number, timestamp. If None, continue to the newest event.
+        count: int, maximum number of events to return.
+        """
+        pass
+
+class RedisStreamEventLog(EventLog):
+    """
+    Writes events to a redis stream, capped with MAXLEN ~.
+
+    Each batch is sent in a single pipeline. Stream entry ids are assigned by
+    redis when the batch is written, so range() queries are accurate to within
+    flush_interval.
+    """
+    def __init__(self, redis_connection=None, redis_url=None, stream="rcb:events", maxlen=10000, **kwargs):
+        """
+        redis_connection: a redis connection object (or one that follows its API)
+        redis_url: string, connection info for a redis server.
+        stream: string, the key of the redis stream.
+        maxlen: int, approximate maximum number of events kept in the stream.
+
+        Other keyword arguments are passed to EventLog.
+        """
+        EventLog.__init__(self, **kwargs)
+
+        import redis
+
+        if redis_connection is None:
+            if redis_url is None:
+                raise AttributeError("You must specify one of redis or redis_url")
+            self.redis = redis.StrictRedis.from_url(redis_url)
+        else:
+            self.redis = redis_connection
+
+        self.stream = stream
+        self.maxlen = maxlen
+
+    def after_fork(self):
+        EventLog.after_fork(self)
+        self.redis.connection_pool.reset()
+
+    def write(self, events):
+        pipeline = self.redis.pipeline(transaction=False)
+
+        for event in events:
+            pipeline.xadd(self.stream, event, maxlen=self.maxlen, approximate=True)
+
+        pipeline.execute()
+
+    def _decode(self, fields):
+        """
+        Convert a raw stream entry back into an event dictionary.
+        """
+        fields = {
+            (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+            for k, v in fields.items()
+        }
+
+        fields['timestamp'] = float(fields['timestamp'])
+        fields['failures'] = int(fields['failures'])
+
+        return fields
+
+    def tail(self, count=10):
+        entries = self.redis.xrevrange(self.stream, count=count)
+        return [self._decode(fields) for entry_id, fields in reversed(entries)]
+
+    def range(self, start=None, end=None, count=None):
+        min_id = "-" if start is None else int(start*1000)
+        max_id = "+" if end is None else int(end*1000)
+
+        entries = self.redis.xrange(self.stream, min=min_id, max=max_id, count=count)
+
+        return [self._decode(fields) for entry_id, fields in entries]
+
+class FileEventLog(EventLog):
+    """
+    Writes events to a file, one JSON object per line.
+
+    To keep it bounded, the file is rotated when it grows past max_bytes. Only
+    one previous file is kept (with ".1" appended to its name).
+    """
+    def __init__(self, path, max_bytes=10*1024*1024, **kwargs):
+        """
+        path: string, location of the log file.
+        max_bytes: int, size at which the file is rotated.
+
+        Other keyword arguments are passed to EventLog.
+        """
+        EventLog.__init__(self, **kwargs)
+
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def write(self, events):
+        lines = "".join(json.dumps(event) + "\n" for event in events)
+
+        with open(self.path, "a") as fp:
+            fp.write(lines)
+            size = fp.tell()
+
+        if size >= self.max_bytes:
+            self.logger.debug("Rotating %s", self.path)
+            os.replace(self.path, self.path + ".1")
+
+    def _read(self):
+        """
+        Read every event still on disk, oldest first.
+        """
+        events = []
+
+        for path in (self.path + ".1", self.path):
+            try:
+                with open(path) as fp:
+                    events.extend(json.loads(line) for line in fp if line.strip())
+            except FileNotFoundError:
+                pass
+
+        return events
+
+    def tail(self, count=10):
+        return self._read()[-count:]
+
+    def range(self, start=None, end=None, count=None):
+        events = [
+            event for event in self._read()
+            if (start is None or event['timestamp'] >= start)
+            and (end is None or event['timestamp'] <= end)
+        ]
+
+        if count is not None:
+            events = events[:count]
+
+        return events
@@ -0,0 +1,40 @@
+"""
+Fork safety for objects that hold sockets, threads or per-process state.
+
+Pre-fork servers (gunicorn with --preload, for example) create objects in a
+parent process and then fork workers, which inherit copies of them. Sockets
+shared between processes get their replies mixed up, background threads don't
+exist in the child, and locks held by those threads stay held forever.
+
+Objects passed to register() have their after_fork() method called in the child
+process after every os.fork(). Drivers, event logs and synced clocks register
+themselves.
+"""
+
+import logging
+import os
+import weakref
+
+logger = logging.getLogger("CircuitBreaker:fork")
+
+_registered = weakref.WeakSet()
+
+def register(obj):
+    """
+    Call obj.after_fork() in the child after every fork, for as long as obj
+    exists.
+    """
+    _registered.add(obj)
+
+def _after_fork_in_child():
+    """
+    The os.register_at_fork() hook.
+    """
+    for obj in list(_registered):
+        try:
+            obj.after_fork()
+        except Exception:
+            logger.exception("after_fork() failed for %r", obj)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,133 @@
+"""
+One breaker per host, for protecting outbound HTTP.
+
+A service usually talks to a handful of hosts, and when one of them goes down
+the others shouldn't be cut off with it. HostBreakers creates a CircuitBreaker
+for each origin (scheme, host and port) the first time it's seen, all sharing
+one driver, and keeps it for every later request:
+
+    breakers = HostBreakers(driver, send, failures=5, timeout=10)
+
+    response = breakers.for_url("https://partner.example.com/v1/orders")(request)
+
+The breakers are stored under "<prefix><scheme>://<host>:<port>", e.g.
+"http:https://partner.example.com:443", so every process talking to the same
+host shares its state.
+
+This is the machinery behind the transport adapter for requests (see the
+adapters module) and the transport for httpx (see the transports module).
+The breakers are never forgotten, so it's meant for a service's known
+partners, not for crawling arbitrary hosts.
+"""
+
+import threading
+import urllib.parse
+
+from .base import CircuitBreaker
+from .drivers import Driver
+
+DEFAULT_PORTS = {
+    "http": 80,
+    "https": 443
+}
+
+class HostBreakers:
+    """
+    Creates and keeps a CircuitBreaker for each origin.
+    """
+    def __init__(self, driver, subject, failures=5, timeout=10, prefix="http:", policy=None, **options):
+        """
+        driver: Driver object, or a driver URL (see the registry module). One
+                driver is shared by all the breakers.
+        subject: callable, what every breaker calls (e.g. the method that
+                 sends a request).
+        failures: int, number of failures that open a host's breaker.
+        timeout: int, seconds a host's breaker stays open.
+        prefix: string, put in front of the origin to make the breaker keys.
+        policy: FailurePolicy object, decides which responses and errors
+                count as failures.
+
+        Other keyword arguments are passed to every CircuitBreaker (jitter,
+        ramp, events, tracer...).
+        """
+        if isinstance(driver, str):
+            from .registry import from_url
+            driver = from_url(driver)
+
+        if not isinstance(driver, Driver):
+            raise AttributeError("'driver' parameter must be derived from the Driver base class, or a driver URL")
+
+        self.driver = driver
+        self.subject = subject
+        self.failures = failures
+        self.timeout = timeout
+        self.prefix = prefix
+        self.policy = policy
+        self.options = options
+
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.breakers)
+
+    def __iter__(self):
+        return iter(self.breakers.values())
+
+    def origin(self, scheme, host, port=None):
+        """
+        Return the origin string for the given parts, with the default port
+        for the scheme filled in.
+        """
+        scheme = scheme.lower()
+        host = host.lower()
+
+        if port is None:
+            port = DEFAULT_PORTS.get(scheme)
+
+        if ":" in host:
+            host = f"[{host}]"
+
+        return f"{scheme}://{host}:{port}"
+
+    def breaker(self, scheme, host, port=None):
+        """
+        Return the breaker for the given origin, creating it the first time.
+        """
+        origin = self.origin(scheme, host, port)
+
+        try:
+            return self.breakers[origin]
+        except KeyError:
+            pass
+
+        with self._lock:
+            if origin not in self.breakers:
+                self.breakers[origin] = CircuitBreaker(
+                    driver=self.driver,
+                    subject=self.subject,
+                    key=f"{self.prefix}{origin}",
+                    failures=self.failures,
+                    timeout=self.timeout,
+                    policy=self.policy,
+                    **self.options)
+
+            return self.breakers[origin]
+
+    def for_url(self, url):
+        """
+        Return the breaker for the origin of the given URL.
+        """
+        parts = urllib.parse.urlsplit(url)
+
+        if not parts.hostname:
+            raise ValueError(f"'{url}' has no host")
+
+        return self.breaker(parts.scheme, parts.hostname, parts.port)
+
+    def dict(self):
+        """
+        A representation of this object as a dictionary of simple values, one
+        entry per origin.
+        """
+        return {origin: breaker.dict() for origin, breaker in self.breakers.items()}
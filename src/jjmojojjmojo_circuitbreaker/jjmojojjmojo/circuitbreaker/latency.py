@@ -0,0 +1,259 @@
+"""
+Latency tracking.
+
+A dependency whose calls slow down from 50ms to 5s does as much harm as one
+that raises exceptions. A LatencyMonitor times every call made through a
+breaker, and opens it when a quantile of the call times goes over a threshold:
+
+    monitor = LatencyMonitor(driver, "partner-api", threshold=0.5, quantile=0.99)
+
+    breaker = CircuitBreaker(driver, call_partner, "partner-api", latency=monitor)
+
+Call times are kept in a LatencySketch, a histogram with logarithmically sized
+buckets, so its memory use is fixed no matter how many calls are made, and any
+quantile can be read back within a known relative error.
+
+Every `merge_interval` seconds, the calls timed since the last merge are added
+to a histogram shared through the driver (see Driver.merge_histogram()), and
+the quantile is checked against the combined histogram, so the decision is
+based on the calls made by every client. Histograms are kept per `window`
+seconds: each window starts empty.
+"""
+
+from .errors import DistributedBackendProblem
+import logging
+import math
+import threading
+
+class LatencySketch:
+    """
+    A streaming quantile sketch: a histogram with logarithmically sized
+    buckets.
+
+    Values are counted in bucket i when they are between minimum * gamma^(i-1)
+    and minimum * gamma^i, where gamma is (1 + accuracy) / (1 - accuracy), so a
+    quantile read back from the sketch is within `accuracy` of the true value
+    (relatively). Values outside the range are clamped to it, which bounds the
+    number of buckets.
+
+    Sketches can be merged by adding their counts, as long as they were created
+    with the same parameters.
+    """
+    def __init__(self, accuracy=0.01, minimum=0.00001, maximum=3600):
+        """
+        accuracy: number, relative error of quantiles (0.01 is 1%).
+        minimum: number, smallest value told apart from 0.
+        maximum: number, largest value told apart from larger ones.
+        """
+        if not 0 < accuracy < 1:
+            raise ValueError("'accuracy' must be between 0 and 1")
+
+        self.accuracy = accuracy
+        self.minimum = minimum
+        self.maximum = maximum
+
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self.gamma)
+
+        self.buckets = self.index(maximum) + 1
+
+        self.counts = {}
+        self.count = 0
+
+    def index(self, value):
+        """
+        Return the number of the bucket the given value is counted in.
+        """
+        value = min(max(value, self.minimum), self.maximum)
+        return max(0, math.ceil(math.log(value / self.minimum) / self._log_gamma))
+
+    def value(self, index):
+        """
+        Return the value that represents the given bucket (the point with the
+        same relative error to both of its bounds).
+        """
+        value = self.minimum * 2 * self.gamma ** index / (self.gamma + 1)
+        return min(max(value, self.minimum), self.maximum)
+
+    def add(self, value, count=1):
+        """
+        Count a value.
+        """
+        index = self.index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+
+    def merge(self, counts):
+        """
+        Add bucket counts from another sketch (its counts attribute) or from a
+        back-end. Bucket numbers can be strings.
+        """
+        for index, count in counts.items():
+            index = int(index)
+            count = int(count)
+            self.counts[index] = self.counts.get(index, 0) + count
+            self.count += count
+
+    def quantile(self, q):
+        """
+        Return the value at the given quantile (0.99 for the 99th percentile),
+        or None if the sketch is empty.
+        """
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen > rank:
+                return self.value(index)
+
+        return self.value(max(self.counts))
+
+    def clear(self):
+        """
+        Forget every value.
+        """
+        self.counts = {}
+        self.count = 0
+
+    def empty(self):
+        """
+        Return a new, empty sketch with the same parameters.
+        """
+        return LatencySketch(self.accuracy, self.minimum, self.maximum)
+
+class LatencyMonitor:
+    """
+    Times the calls made through a breaker, and tells it to open when they
+    get too slow.
+    """
+    def __init__(self, driver, key, threshold, quantile=0.99, window=60, merge_interval=5, minimum=20, accuracy=0.01):
+        """
+        driver: Driver object, where the shared histogram is kept.
+        key: string, name of the histogram. Usually the same as the breaker's.
+        threshold: number, seconds. The breaker opens when the quantile goes
+                   over it.
+        quantile: number, the quantile to check (0.99 for the 99th percentile).
+        window: number, seconds of calls each shared histogram covers.
+        merge_interval: number, seconds between merges with the shared
+                        histogram. The quantile is only checked when merging.
+        minimum: int, calls that must be counted in the window before the
+                 quantile is trusted.
+        accuracy: number, relative error of the quantile, see LatencySketch.
+        """
+        if not 0 < quantile <= 1:
+            raise ValueError("'quantile' must be between 0 and 1")
+
+        self.driver = driver
+        self.key = key
+        self.threshold = threshold
+        self.quantile = quantile
+        self.window = window
+        self.merge_interval = merge_interval
+        self.minimum = minimum
+
+        # calls timed since the last merge, and the last shared histogram seen
+        self.pending = LatencySketch(accuracy)
+        self.merged = self.pending.empty()
+
+        self.merges = 0
+        self.errors = 0
+
+        self._merged_at = None
+        self._lock = threading.Lock()
+
+        self.logger = logging.getLogger(f"CircuitBreaker:{self.__class__.__name__}")
+
+    def _exceeded(self, sketch):
+        """
+        Check the quantile of the given sketch against the threshold.
+        """
+        if sketch.count < self.minimum:
+            return False
+
+        value = sketch.quantile(self.quantile)
+
+        if value > self.threshold:
+            self.logger.info("p%s for %s is %.3fs, over %ss", self.quantile * 100, self.key, value, self.threshold)
+            return True
+
+        return False
+
+    def record(self, seconds):
+        """
+        Count a call that took the given number of seconds.
+
+        Returns True if the quantile is over the threshold, which is only
+        checked when the histogram is merged.
+        """
+        with self._lock:
+            self.pending.add(seconds)
+
+            now = self.driver.now()
+
+            if self._merged_at is not None and now - self._merged_at < self.merge_interval:
+                return False
+
+            self._merged_at = now
+
+            # merged without the lock, so other threads can keep recording
+            # while the back-end is slow
+            batch = self.pending
+            self.pending = batch.empty()
+
+        try:
+            counts = self.driver.merge_histogram(self.key, batch.counts, self.window)
+        except DistributedBackendProblem:
+            self.logger.warning("Unable to merge latency histogram for %s", self.key)
+
+            # keep the calls for the next merge, decide on what this client saw
+            with self._lock:
+                self.errors += 1
+                self.pending.merge(batch.counts)
+                return self._exceeded(self.pending)
+
+        merged = batch.empty()
+        merged.merge(counts)
+
+        with self._lock:
+            self.merges += 1
+            self.merged = merged
+
+        return self._exceeded(merged)
+
+    def reset(self):
+        """
+        Forget the calls timed so far, here and in the shared histogram. Called
+        when the breaker closes, so calls made before it opened don't trip it
+        again.
+        """
+        with self._lock:
+            self.pending.clear()
+            self.merged = self.pending.empty()
+            self._merged_at = None
+
+        try:
+            self.driver.clear_histogram(self.key, self.window)
+        except DistributedBackendProblem:
+            self.logger.warning("Unable to clear latency histogram for %s", self.key)
+
+            with self._lock:
+                self.errors += 1
+
+    def dict(self):
+        """
+        A representation of this object as a dictionary of simple values.
+        """
+        return {
+            'key': self.key,
+            'threshold': self.threshold,
+            'quantile': self.quantile,
+            'window': self.window,
+            'latency': self.merged.quantile(self.quantile),
+            'calls': self.merged.count,
+            'pending': self.pending.count,
+            'merges': self.merges
+        }
@@ -0,0 +1,124 @@
+"""
+Failure classification.
+
+By default, every exception raised by a breaker's subject is counted as a
+failure. Not all of them mean the service is in trouble: a ValueError from a
+bug in the caller, or a 404, costs a write to the back-end and can trip the
+breaker for everyone. A FailurePolicy decides which outcomes count, and how
+much:
+
+    policy = FailurePolicy(
+        exclude=(ValueError, KeyError),
+        weights={TimeoutError: 3},
+        exception=lambda e: getattr(e, "status", 500) >= 500,
+        result=lambda response: response.status_code == 503)
+
+    breaker = CircuitBreaker(driver, call_partner, "partner-api", policy=policy)
+
+Outcomes the policy ignores don't touch the back-end at all: the exception is
+re-raised (or the result returned) and the breaker's state is left alone.
+
+The weight of each exception class is worked out from the include, exclude and
+weights rules the first time it is seen, and cached, so classifying an
+exception is a single dictionary lookup. The exception and result predicates
+run on every call they apply to, so they should be cheap, and free of side
+effects.
+"""
+
+class FailurePolicy:
+    """
+    Decides how much each outcome of a call counts as a failure.
+    """
+    def __init__(self, include=(Exception,), exclude=(), weights=None, exception=None, result=None, result_weight=1):
+        """
+        include: tuple of exception classes that count as failures (with a
+                 weight of 1, unless weights says otherwise). Sub-classes are
+                 included too.
+        exclude: tuple of exception classes that never count, even when a
+                 parent class is included.
+        weights: dictionary, exception class -> int, how much the class (and
+                 its sub-classes) counts for. 0 ignores it.
+        exception: callable, optional. Takes an exception that would count,
+                   returns False to ignore it anyway (e.g. an HTTP error with
+                   a 4xx status).
+        result: callable, optional. Takes the value returned by a call that
+                didn't raise, returns True if it's a failure (e.g. an HTTP 503
+                response).
+        result_weight: int, how much a failed result counts for.
+
+        When an exception matches more than one rule, the rule for the closest
+        class in its method resolution order wins.
+        """
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.weights = dict(weights or {})
+        self.exception = exception
+        self.result = result
+        self.result_weight = result_weight
+
+        for cls in self.include + self.exclude + tuple(self.weights):
+            if not (isinstance(cls, type) and issubclass(cls, BaseException)):
+                raise AttributeError(f"{cls!r} is not an exception class")
+
+        self._rules = {}
+
+        for cls in self.include:
+            self._rules[cls] = 1
+
+        self._rules.update(self.weights)
+
+        for cls in self.exclude:
+            self._rules[cls] = 0
+
+        self._cache = {}
+
+    def _compile(self, cls):
+        """
+        Work out the weight of an exception class from the rules, and cache it.
+        """
+        weight = 0
+
+        for base in cls.__mro__:
+            if base in self._rules:
+                weight = self._rules[base]
+                break
+
+        self._cache[cls] = weight
+
+        return weight
+
+    def weight(self, exception):
+        """
+        Return how much the given exception counts as a failure. 0 means it
+        doesn't count at all.
+        """
+        try:
+            weight = self._cache[type(exception)]
+        except KeyError:
+            weight = self._compile(type(exception))
+
+        if weight and self.exception is not None and not self.exception(exception):
+            return 0
+
+        return weight
+
+    def result_failure(self, value):
+        """
+        Return how much the given return value counts as a failure. 0 means
+        it's a success.
+        """
+        if self.result is not None and self.result(value):
+            return self.result_weight
+
+        return 0
+
+    def dict(self):
+        """
+        A representation of this object as a dictionary of simple values.
+        """
+        return {
+            'include': [cls.__name__ for cls in self.include],
+            'exclude': [cls.__name__ for cls in self.exclude],
+            'weights': {cls.__name__: weight for cls, weight in self.weights.items()},
+            'cached': len(self._cache)
+        }
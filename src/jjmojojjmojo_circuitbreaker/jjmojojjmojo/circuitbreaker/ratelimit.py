@@ -0,0 +1,191 @@
+"""
+Distributed rate limiting.
+
+A RateLimiter is a token bucket kept by a Driver (see Driver.take_tokens()),
+so it shares the breakers' back-end and connections: a lua script with the
+RedisDriver, a dictionary with the MemoryDriver.
+
+    limiter = RateLimiter(driver, "partner-api", rate=50, burst=100)
+
+    if limiter.acquire():
+        ...
+
+To cut round trips, tokens are leased from the back-end `lease` at a time and
+spent locally. Leased tokens are dropped after `lease_time` seconds, so an idle
+client can't save them up for a burst later. Leasing trades precision for
+speed: with N clients, up to N * lease tokens can be out at once.
+
+Pass a limiter to a CircuitBreaker to check both on every call. When a new
+lease is needed, the breaker's state and the tokens are fetched together, in
+one round trip (see Driver.load_and_take()):
+
+    breaker = CircuitBreaker(driver, call_partner, "partner-api", limiter=limiter)
+
+Calls over the limit raise RateLimitExceeded, a kind of CircuitBreakerOpen.
+Calls the breaker rejects (because it is open) give their token back.
+"""
+
+from .errors import RateLimitExceeded
+import logging
+import threading
+
+class RateLimiter:
+    """
+    A token bucket per key, shared by every client using the same driver.
+    """
+    def __init__(self, driver, key, rate, burst=None, lease=1, lease_time=1):
+        """
+        driver: Driver object, where the bucket is kept.
+        key: string, name of the bucket. Don't share it with a RetryBudget.
+        rate: number, calls allowed per second. 0 makes a bucket that is
+              never refilled.
+        burst: number, maximum calls allowed at once (the bucket's capacity).
+               Defaults to one second's worth, or 1, whichever is larger.
+        lease: int, tokens taken from the back-end per round trip.
+        lease_time: number, seconds leased tokens can be kept before they are
+                    dropped.
+        """
+        if rate < 0:
+            raise ValueError("'rate' can't be negative")
+
+        self.driver = driver
+        self.key = key
+        self.rate = rate
+
+        if burst is None:
+            self.burst = max(1, rate)
+        else:
+            self.burst = burst
+
+        self.lease = lease
+        self.lease_time = lease_time
+
+        self.tokens = 0
+        self.allowed = 0
+        self.denied = 0
+        self.round_trips = 0
+
+        self._leased_at = None
+        self._lock = threading.Lock()
+
+        self.logger = logging.getLogger(f"CircuitBreaker:{self.__class__.__name__}")
+
+    def _spend(self):
+        """
+        Spend a leased token, if there is one. Called with the lock held.
+        """
+        if self.tokens > 0 and self.driver.now() - self._leased_at >= self.lease_time:
+            self.logger.debug("Dropping %s stale tokens for %s", self.tokens, self.key)
+            self.tokens = 0
+
+        if self.tokens > 0:
+            self.tokens -= 1
+            self.allowed += 1
+            return True
+
+        return False
+
+    def _leased(self, granted):
+        """
+        Add newly leased tokens, and spend one.
+        """
+        with self._lock:
+            self.round_trips += 1
+            self.tokens += granted
+            self._leased_at = self.driver.now()
+
+            if not self._spend():
+                self.denied += 1
+                return False
+
+            return True
+
+    def _spend_local(self):
+        """
+        Spend a leased token, if there is one.
+        """
+        with self._lock:
+            return self._spend()
+
+    def try_acquire(self):
+        """
+        Take a token. Returns True if the call can go ahead.
+
+        The lock isn't held during the round trip, so threads that run out of
+        leased tokens at the same time may each take a new lease.
+        """
+        if self._spend_local():
+            return True
+
+        granted, left = self.driver.take_tokens(self.key, self.lease, self.burst, rate=self.rate)
+
+        return self._leased(granted)
+
+    def refund(self):
+        """
+        Give back a token taken for a call that wasn't made. It is added to the
+        local lease.
+        """
+        with self._lock:
+            self.tokens += 1
+            self.allowed -= 1
+
+    def acquire(self, timeout=0):
+        """
+        Take a token, waiting up to timeout seconds for one. Returns True if
+        the call can go ahead. With a rate of 0, doesn't wait.
+        """
+        deadline = self.driver.now() + timeout
+
+        while True:
+            if self.try_acquire():
+                return True
+
+            if not self.rate:
+                # the bucket is never refilled, so there is no point waiting
+                return False
+
+            wait = min(1 / self.rate, deadline - self.driver.now())
+
+            if wait <= 0:
+                return False
+
+            self.driver.clock.sleep(wait)
+
+    def check(self):
+        """
+        Take a token, raise RateLimitExceeded if there isn't one.
+        """
+        if not self.try_acquire():
+            raise RateLimitExceeded(f"Rate limit for {self.key} exceeded")
+
+    def load_breaker(self, breaker):
+        """
+        Take a token and load the breaker's state. If a lease is needed, both
+        are done in one round trip.
+
+        Raises RateLimitExceeded if there isn't a token. If the breaker then
+        turns the call away, it gives the token back (see refund()).
+        """
+        if self._spend_local():
+            breaker.load()
+            return
+
+        granted = breaker._load_and_take(self)
+
+        if not self._leased(granted):
+            raise RateLimitExceeded(f"Rate limit for {self.key} exceeded")
+
+    def dict(self):
+        """
+        A representation of this object as a dictionary of simple values.
+        """
+        return {
+            'key': self.key,
+            'rate': self.rate,
+            'burst': self.burst,
+            'tokens': self.tokens,
+            'allowed': self.allowed,
+            'denied': self.denied,
+            'round_trips': self.round_trips
+        }
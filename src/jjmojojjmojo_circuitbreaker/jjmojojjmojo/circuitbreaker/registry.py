@@ -0,0 +1,217 @@
+"""
+Create drivers from URLs.
+
+    from jjmojojjmojo.circuitbreaker.registry import from_url
+
+    driver = from_url("memory://?expires=180")
+    driver = from_url("redis://localhost:6379/0?prefix=rcb:&encoding=packed", expires=180)
+
+The scheme picks the driver. "memory", "redis", "rediss" and "unix" are built
+in. Other packages can add schemes with register(), or through the
+"jjmojojjmojo.circuitbreaker.drivers" entry point group, with a factory that
+takes the URL and keyword arguments and returns a Driver:
+
+    # setup.py
+    entry_points={
+        "jjmojojjmojo.circuitbreaker.drivers": [
+            "etcd = mypackage.breakers:etcd_driver_from_url"
+        ]
+    }
+
+Driver modules (and the libraries they need) are only imported when a URL that
+uses them is opened, and entry points are only looked up for schemes that
+aren't already known.
+"""
+
+import logging
+import threading
+import urllib.parse
+
+GROUP = "jjmojojjmojo.circuitbreaker.drivers"
+
+logger = logging.getLogger("CircuitBreaker:registry")
+
+# options only the GroupedRedisDriver takes
+GROUPED_OPTIONS = ('separator', 'sweep_interval', 'sweep_batch')
+
+_factories = {}
+_entry_points_loaded = False
+_lock = threading.Lock()
+
+def _number(value):
+    """
+    Convert a query string value to an int or a float.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+def _options(url, names):
+    """
+    Split the query string options named in `names` (a dictionary of name ->
+    conversion function) out of the url. Returns the url without them, and a
+    dictionary of the converted options.
+    """
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+
+    options = {name: names[name](value) for name, value in query if name in names}
+    rest = [(name, value) for name, value in query if name not in names]
+
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(rest))), options
+
+def _repeated(url, name):
+    """
+    Split every value of a query string option that can be given more than
+    once out of the url. Returns the url without them, and a list of the
+    values.
+    """
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+
+    values = [value for option, value in query if option == name]
+    rest = [(option, value) for option, value in query if option != name]
+
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(rest))), values
+
+def memory_from_url(url, **kwargs):
+    """
+    memory://, a MemoryDriver. Query string options: expires, fork, snapshot,
+    snapshot_interval, max_entries and expiry_tick.
+    """
+    from .drivers.memory import MemoryDriver
+
+    url, options = _options(url, {
+        'expires': _number,
+        'fork': str,
+        'snapshot': str,
+        'snapshot_interval': _number,
+        'max_entries': int,
+        'expiry_tick': _number})
+    options.update(kwargs)
+
+    return MemoryDriver(**options)
+
+def redis_from_url(url, **kwargs):
+    """
+    redis://, rediss:// and unix://, a RedisDriver, or a GroupedRedisDriver
+    with layout=grouped. Query string options: expires, prefix, encoding,
+    max_lag, replica_check_interval, stick_to_primary, separator,
+    sweep_interval and sweep_batch (grouped only), and replica, once for each read replica:
+
+        redis://primary:6379/0?replica=redis://replica1:6379/0&replica=redis://replica2:6379/0
+
+    Other options are passed along to redis (e.g. socket_timeout).
+    """
+    url, options = _options(url, {
+        'layout': str,
+        'expires': _number,
+        'prefix': str,
+        'encoding': str,
+        'separator': str,
+        'sweep_interval': _number,
+        'sweep_batch': int,
+        'max_lag': _number,
+        'replica_check_interval': _number,
+        'stick_to_primary': _number})
+    url, replicas = _repeated(url, 'replica')
+
+    if replicas:
+        options['replica_urls'] = replicas
+
+    options.update(kwargs)
+
+    if options.pop('layout', 'keys') == 'grouped':
+        from .drivers.grouped import GroupedRedisDriver as driver_class
+    else:
+        grouped = [name for name in GROUPED_OPTIONS if name in options]
+
+        if grouped:
+            raise ValueError(f"{grouped} can only be used with layout=grouped")
+
+        from .drivers.redis import RedisDriver as driver_class
+
+    return driver_class(redis_url=url, **options)
+
+def register(scheme, factory):
+    """
+    Use factory(url, **kwargs) to create drivers for URLs with the given
+    scheme. Replaces any existing factory for the scheme.
+    """
+    _factories[scheme.lower()] = factory
+
+def _load_entry_points():
+    """
+    Register the factories advertised by installed packages. Schemes that are
+    already registered are left alone.
+    """
+    global _entry_points_loaded
+
+    with _lock:
+        if _entry_points_loaded:
+            return
+
+        _entry_points_loaded = True
+
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            return
+
+        try:
+            found = entry_points(group=GROUP)
+        except TypeError:
+            # python < 3.10
+            found = entry_points().get(GROUP, [])
+
+        for entry_point in found:
+            if entry_point.name.lower() not in _factories:
+                logger.debug("Found driver '%s' in %s", entry_point.name, entry_point.value)
+                _factories[entry_point.name.lower()] = entry_point
+
+def get_factory(scheme):
+    """
+    Return the factory for the given scheme.
+
+    Raises ValueError if the scheme isn't known.
+    """
+    scheme = scheme.lower()
+
+    if scheme not in _factories:
+        _load_entry_points()
+
+    try:
+        factory = _factories[scheme]
+    except KeyError:
+        raise ValueError(f"No driver is registered for '{scheme}://' URLs, known schemes are {schemes()}")
+
+    if not callable(factory):
+        # an entry point, load it on first use
+        factory = _factories[scheme] = factory.load()
+
+    return factory
+
+def schemes():
+    """
+    Return the known schemes, sorted.
+    """
+    _load_entry_points()
+    return sorted(_factories)
+
+def from_url(url, **kwargs):
+    """
+    Create a driver from a URL. Keyword arguments are passed to the driver,
+    and take precedence over options in the URL.
+    """
+    scheme = urllib.parse.urlsplit(url).scheme
+
+    if not scheme:
+        raise ValueError(f"'{url}' has no scheme, e.g. memory:// or redis://")
+
+    return get_factory(scheme)(url, **kwargs)
+
+register("memory", memory_from_url)
+
+for scheme in ("redis", "rediss", "unix"):
+    register(scheme, redis_from_url)
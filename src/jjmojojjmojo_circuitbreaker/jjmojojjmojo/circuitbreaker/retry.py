@@ -0,0 +1,175 @@
+"""
+Retry budgets.
+
+While a breaker is still closed, every caller that retries a failed call adds
+load to a service that is already struggling, and a burst of failures turns
+into a retry storm. A RetryBudget caps retries at a fraction of the successful
+calls, shared by every client using the same driver and key:
+
+    budget = RetryBudget(driver, "payments", ratio=0.1)
+
+    result = budget.call(breaker, order, attempts=3)
+
+Every success deposits `ratio` tokens in a token bucket kept by the driver (see
+Driver.take_tokens()), and every retry takes one. The bucket also refills at
+`minimum` tokens per second, so a quiet service can still retry now and then.
+
+Tokens are leased from the back-end `prefetch` at a time, and deposits are sent
+in batches, so most calls to can_retry() and success() cost no round trip. The
+price is that a client can hold up to `prefetch` tokens the others can't use.
+"""
+
+from .errors import DistributedBackendProblem, CircuitBreakerOpen
+import logging
+import threading
+
+class RetryBudget:
+    """
+    A token bucket per key that limits retries to a fraction of successful
+    calls.
+    """
+    def __init__(self, driver, key, ratio=0.1, minimum=1, capacity=None, prefetch=5, deposit_batch=10):
+        """
+        driver: Driver object, where the bucket is kept.
+        key: string, name of the budget. Usually the same as the breaker's.
+        ratio: number, retries allowed per successful call (0.1 is 10%).
+        minimum: number, retries per second allowed regardless of traffic.
+        capacity: number, maximum tokens that can be banked. Defaults to ten
+                  seconds' worth of the minimum, or 10, whichever is larger.
+        prefetch: int, tokens leased from the back-end at once.
+        deposit_batch: int, successes counted locally before their tokens are
+                       deposited. Deposits are also sent along with every lease.
+        """
+        self.driver = driver
+        self.key = key
+        self.ratio = ratio
+        self.minimum = minimum
+
+        if capacity is None:
+            self.capacity = max(10, minimum * 10)
+        else:
+            self.capacity = capacity
+
+        self.prefetch = prefetch
+        self.deposit_batch = deposit_batch
+
+        self.tokens = 0
+        self.successes = 0
+        self.retries = 0
+        self.denied = 0
+        self.round_trips = 0
+
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        self.logger = logging.getLogger(f"CircuitBreaker:{self.__class__.__name__}")
+
+    def _take(self, requested):
+        """
+        Send the pending deposit and take up to `requested` tokens. Returns the
+        number of tokens granted. Called with the lock held.
+        """
+        deposit = self._pending * self.ratio
+        self._pending = 0
+        self.round_trips += 1
+
+        granted, left = self.driver.take_tokens(
+            self.key,
+            requested,
+            self.capacity,
+            rate=self.minimum,
+            deposit=deposit)
+
+        self.logger.debug("Leased %s tokens for %s, %s left", granted, self.key, left)
+
+        return granted
+
+    def success(self):
+        """
+        Record a successful call.
+        """
+        with self._lock:
+            self.successes += 1
+            self._pending += 1
+
+            if self._pending >= self.deposit_batch:
+                try:
+                    self._take(0)
+                except DistributedBackendProblem:
+                    self.logger.warning("Unable to deposit retry tokens for %s", self.key)
+
+    def can_retry(self):
+        """
+        Spend a token if one is available. Returns True if the caller may retry.
+
+        If the back-end can't be reached, no retries are allowed.
+        """
+        with self._lock:
+            if self.tokens <= 0:
+                try:
+                    self.tokens = self._take(self.prefetch)
+                except DistributedBackendProblem:
+                    self.logger.warning("Unable to lease retry tokens for %s", self.key)
+                    self.tokens = 0
+
+            if self.tokens <= 0:
+                self.denied += 1
+                return False
+
+            self.tokens -= 1
+            self.retries += 1
+            return True
+
+    def flush(self):
+        """
+        Deposit the tokens for successes that haven't been sent yet.
+        """
+        with self._lock:
+            if self._pending:
+                self._take(0)
+
+    def call(self, subject, *args, attempts=3, **kwargs):
+        """
+        Call subject (a CircuitBreaker, or any callable) with the given
+        arguments, retrying on any exception as long as attempts remain and the
+        budget allows it.
+
+        CircuitBreakerOpen (and RateLimitExceeded) is raised right away: the
+        breaker has already decided the call shouldn't be made, and retrying
+        it would only spend the budget.
+
+        attempts: int, the most times subject is called. At least 1.
+
+        The last exception is raised when the call can't be retried.
+        """
+        if attempts < 1:
+            raise ValueError("'attempts' must be at least 1")
+
+        for attempt in range(attempts):
+            try:
+                result = subject(*args, **kwargs)
+            except CircuitBreakerOpen:
+                raise
+            except Exception:
+                if attempt + 1 >= attempts or not self.can_retry():
+                    raise
+                self.logger.debug("Retrying %s, attempt %s", self.key, attempt + 2)
+            else:
+                self.success()
+                return result
+
+    def dict(self):
+        """
+        A representation of this object as a dictionary of simple values.
+        """
+        return {
+            'key': self.key,
+            'ratio': self.ratio,
+            'minimum': self.minimum,
+            'capacity': self.capacity,
+            'tokens': self.tokens,
+            'successes': self.successes,
+            'retries': self.retries,
+            'denied': self.denied,
+            'round_trips': self.round_trips
+        }
@@ -0,0 +1,321 @@
+"""
+Discrete-event simulator for circuit breaker configurations.
+
+Drives many virtual clients, each with its own CircuitBreaker instance, against
+a shared MemoryDriver in virtual time (see clock.ManualClock). The service
+they call fails according to a trace: either a synthetic Outage, or a
+RecordedTrace replayed from real data.
+
+Nothing sleeps, so an hour-long outage replays in a fraction of a second. Use
+it to see how a change to failures/timeout/expires/jitter would behave before
+deploying it:
+
+    $ python -m jjmojojjmojo.circuitbreaker.simulation --outage 600 2400 --failures 10 --timeout 30
+"""
+
+from .base import CircuitBreaker, STATUS_OPEN, STATUS_CLOSED, STATUS_RAMPING
+from .clock import ManualClock
+from .drivers import MemoryDriver
+from .errors import CircuitBreakerOpen
+import argparse
+import bisect
+import csv
+import heapq
+import logging
+import random
+
+# names of the transitions to each status
+TRANSITIONS = {STATUS_OPEN: "open", STATUS_CLOSED: "close", STATUS_RAMPING: "ramp"}
+
+class SimulatedFailure(Exception):
+    """
+    Raised by the simulated service when the trace says it should fail.
+    """
+
+class Outage:
+    """
+    A synthetic failure trace: the service fails at error_rate between start
+    and end, and at base_error_rate the rest of the time.
+    """
+    def __init__(self, start, end, error_rate=1.0, base_error_rate=0.0):
+        """
+        start: number, seconds into the simulation the outage begins.
+        end: number, seconds into the simulation the outage ends.
+        error_rate: number between 0 and 1, fraction of calls that fail during
+                    the outage.
+        base_error_rate: number between 0 and 1, fraction of calls that fail
+                         outside of the outage.
+        """
+        self.start = start
+        self.end = end
+        self.error_rate = error_rate
+        self.base_error_rate = base_error_rate
+
+    def __call__(self, t, rng):
+        """
+        Return True if a call made at time t (seconds into the simulation) fails.
+        """
+        if self.start <= t < self.end:
+            rate = self.error_rate
+        else:
+            rate = self.base_error_rate
+
+        return rate >= 1 or (rate > 0 and rng.random() < rate)
+
+class RecordedTrace:
+    """
+    A failure trace replayed from recorded samples.
+
+    Each sample is a (timestamp, error_rate) pair. The error rate applies from
+    its timestamp until the next sample. Timestamps are shifted so the first
+    sample lines up with the start of the simulation.
+    """
+    def __init__(self, samples):
+        """
+        samples: iterable of (timestamp, error_rate) pairs.
+        """
+        samples = sorted(samples)
+
+        if samples:
+            offset = samples[0][0]
+        else:
+            offset = 0
+
+        self.times = [t - offset for t, rate in samples]
+        self.rates = [rate for t, rate in samples]
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Load samples from a CSV file with two columns: timestamp and error rate.
+        """
+        with open(path, newline="") as fp:
+            return cls((float(t), float(rate)) for t, rate in csv.reader(fp))
+
+    def __call__(self, t, rng):
+        index = bisect.bisect_right(self.times, t) - 1
+
+        if index < 0:
+            return False
+
+        rate = self.rates[index]
+
+        return rate >= 1 or (rate > 0 and rng.random() < rate)
+
+class RecordingDriver(MemoryDriver):
+    """
+    A MemoryDriver that keeps a list of (timestamp, event) transitions.
+    """
+    def __init__(self, expires=None, clock=None):
+        MemoryDriver.__init__(self, expires, clock)
+        self.transitions = []
+
+    def transition(self, key, expected, status, failures=None):
+        changed = MemoryDriver.transition(self, key, expected, status, failures)
+        if changed:
+            self.transitions.append((self.now(), TRANSITIONS[status]))
+        return changed
+
+class SimulationResult:
+    """
+    The outcome of a simulation run.
+
+    Times are in seconds since the start of the simulation.
+    """
+    def __init__(self, duration, bucket):
+        self.duration = duration
+        self.bucket = bucket
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.transitions = []
+        self.timeline = [
+            {'calls': 0, 'successes': 0, 'failures': 0, 'rejected': 0}
+            for i in range(int(duration // bucket) + 1)
+        ]
+
+    def first(self, event, after=0):
+        """
+        Return the time of the first transition of the given type ("open",
+        "close" or "ramp") at or after the given time, or None.
+        """
+        for t, e in self.transitions:
+            if e == event and t >= after:
+                return t
+
+    def dict(self):
+        """
+        A representation of this object as a dictionary of simple values.
+        """
+        return {
+            'duration': self.duration,
+            'calls': self.calls,
+            'successes': self.successes,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'transitions': len(self.transitions)
+        }
+
+    def __repr__(self):
+        return f"<SimulationResult calls={self.calls} successes={self.successes} failures={self.failures} rejected={self.rejected} transitions={len(self.transitions)}>"
+
+class Simulation:
+    """
+    A single simulated scenario.
+
+    Every client has its own CircuitBreaker instance (as separate hosts or
+    workers would), all sharing one driver and one key. Clients call the
+    service at exponentially distributed intervals averaging `interval` seconds.
+    """
+    def __init__(self, trace, clients=1000, interval=60, duration=3600, failures=5, timeout=10, expires=180, jitter=None, seed=None, bucket=60, ramp=0, ramp_mode="linear"):
+        """
+        trace: callable taking (t, rng), returns True if a call at time t fails.
+               See Outage and RecordedTrace.
+        clients: int, number of virtual clients.
+        interval: number, average seconds between calls, per client.
+        duration: number, seconds of virtual time to simulate.
+        failures, timeout, expires, ramp, ramp_mode: breaker configuration,
+                                    see CircuitBreaker and Driver.
+        jitter: jitter for the breakers. Defaults to the same range as
+                rand_int_jitter(), drawn from the simulation's random generator.
+        seed: random seed, for repeatable runs.
+        bucket: number, width in seconds of each entry in the result timeline.
+        """
+        self.trace = trace
+        self.clients = clients
+        self.interval = interval
+        self.duration = duration
+        self.bucket = bucket
+
+        self.rng = random.Random(seed)
+        self.clock = ManualClock(0.0)
+        self.driver = RecordingDriver(expires=expires, clock=self.clock)
+
+        if jitter is None:
+            jitter = lambda: self.rng.randint(0, 10)
+
+        self.breakers = [
+            CircuitBreaker(
+                driver=self.driver,
+                subject=self.service,
+                key="simulation",
+                failures=failures,
+                timeout=timeout,
+                jitter=jitter,
+                ramp=ramp,
+                ramp_mode=ramp_mode,
+                # single-threaded: there are never concurrent loads to share
+                coalesce=False)
+            for i in range(clients)
+        ]
+
+        for breaker in self.breakers:
+            breaker._random = self.rng.random
+
+    def service(self):
+        """
+        The simulated service. Fails when the trace says so.
+        """
+        if self.trace(self.clock.time, self.rng):
+            raise SimulatedFailure()
+        return True
+
+    def run(self):
+        """
+        Run the simulation, return a SimulationResult.
+
+        Logging is disabled while the simulation runs: every simulated failure
+        would otherwise be logged as an error.
+        """
+        previous = logging.root.manager.disable
+        logging.disable(logging.CRITICAL)
+
+        try:
+            return self._run()
+        finally:
+            logging.disable(previous)
+
+    def _run(self):
+        """
+        The body of run().
+        """
+        result = SimulationResult(self.duration, self.bucket)
+        rng = self.rng
+        rate = 1.0 / self.interval
+
+        events = [(rng.uniform(0, self.interval), i) for i in range(self.clients)]
+        heapq.heapify(events)
+
+        while events:
+            t, client = heapq.heappop(events)
+
+            if t >= self.duration:
+                break
+
+            self.clock.time = t
+            bucket = result.timeline[int(t // self.bucket)]
+
+            try:
+                self.breakers[client]()
+            except CircuitBreakerOpen:
+                result.rejected += 1
+                bucket['rejected'] += 1
+            except SimulatedFailure:
+                result.failures += 1
+                bucket['failures'] += 1
+            else:
+                result.successes += 1
+                bucket['successes'] += 1
+
+            bucket['calls'] += 1
+
+            heapq.heappush(events, (t + rng.expovariate(rate), client))
+
+        result.calls = result.successes + result.failures + result.rejected
+        result.transitions = list(self.driver.transitions)
+
+        return result
+
+parser = argparse.ArgumentParser(description='Simulate a circuit breaker configuration in virtual time.')
+parser.add_argument('--outage', type=float, nargs=2, metavar=("START", "END"), default=(600, 2400), help="Outage window, in seconds")
+parser.add_argument('--error-rate', type=float, default=1.0, help="Fraction of calls that fail during the outage")
+parser.add_argument('--base-error-rate', type=float, default=0.0, help="Fraction of calls that fail outside of the outage")
+parser.add_argument('--trace', type=str, default=None, help="CSV file of (timestamp, error rate) samples to replay instead of --outage")
+parser.add_argument('-c', '--clients', type=int, default=1000, help="Number of virtual clients")
+parser.add_argument('-i', '--interval', type=float, default=60, help="Average seconds between calls, per client")
+parser.add_argument('-d', '--duration', type=float, default=3600, help="Seconds of virtual time to simulate")
+parser.add_argument('-f', '--failures', type=int, default=5, help="Breaker failure threshold")
+parser.add_argument('-t', '--timeout', type=float, default=10, help="Breaker timeout")
+parser.add_argument('-e', '--expires', type=float, default=180, help="Failure window")
+parser.add_argument('-r', '--ramp', type=float, default=0, help="Seconds to ramp traffic back up after recovery")
+parser.add_argument('--ramp-mode', type=str, default="linear", choices=["linear", "exponential"], help="How traffic ramps up")
+parser.add_argument('-s', '--seed', type=int, default=None, help="Random seed")
+
+if __name__ == '__main__':
+    opts = parser.parse_args()
+
+    if opts.trace is not None:
+        trace = RecordedTrace.from_file(opts.trace)
+    else:
+        trace = Outage(opts.outage[0], opts.outage[1], opts.error_rate, opts.base_error_rate)
+
+    simulation = Simulation(
+        trace,
+        clients=opts.clients,
+        interval=opts.interval,
+        duration=opts.duration,
+        failures=opts.failures,
+        timeout=opts.timeout,
+        expires=opts.expires,
+        seed=opts.seed,
+        ramp=opts.ramp,
+        ramp_mode=opts.ramp_mode)
+
+    result = simulation.run()
+
+    print(result)
+
+    for index, bucket in enumerate(result.timeline):
+        if bucket['calls']:
+            print(f"{index*simulation.bucket:>8.0f}s  calls={bucket['calls']:<6} ok={bucket['successes']:<6} failed={bucket['failures']:<6} rejected={bucket['rejected']}")
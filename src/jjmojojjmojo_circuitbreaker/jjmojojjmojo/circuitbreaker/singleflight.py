@@ -0,0 +1,155 @@
+"""
+Request coalescing.
+
+When many threads call the same breaker at once, each of them loads its state
+from the back-end, and a burst of N calls costs N identical reads. A
+SingleFlight lets the first caller for a key do the work, while the callers
+that arrive before it finishes wait for its result instead of asking again:
+
+    flights = SingleFlight()
+
+    info = flights.do(key, driver.load, key)
+
+Every driver has one, used by Driver.load_shared(), which CircuitBreaker.load()
+calls. AsyncSingleFlight does the same for coroutines, for callers running in
+an asyncio event loop.
+
+Callers that wait get the same result object (or exception) as the one that did
+the work, so it shouldn't be modified.
+"""
+
+import threading
+
+class _Call:
+    """
+    A call in flight, and its outcome once it's done.
+
+    The lock is held until the call is done, waiters block on it. (A plain
+    lock is much cheaper to create than an Event, and most calls have no
+    waiters at all.)
+    """
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Lock()
+        self.done.acquire()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.acquire()
+        self.done.release()
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key, across threads.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Call func with the given arguments and return its result, unless a call
+        for the same key is already in flight, in which case wait for it and
+        return its result (or raise its exception) instead.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            call.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.release()
+
+    def dict(self):
+        """
+        A representation of this object as a dictionary of simple values.
+        """
+        return {
+            'calls': self.calls,
+            'shared': self.shared,
+            'in_flight': len(self._calls)
+        }
+
+class AsyncSingleFlight:
+    """
+    Coalesces concurrent calls with the same key, across the tasks of one
+    event loop.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+
+        self._calls = {}
+
+    async def do(self, key, func, *args, **kwargs):
+        """
+        Await func(*args, **kwargs) and return its result, unless a call for
+        the same key is already in flight, in which case wait for that one.
+
+        A waiting task can be cancelled without cancelling the call it waits
+        for. If the task doing the call is cancelled, the waiting tasks are too.
+        """
+        # asyncio is slow to import, and only callers of this class need it
+        import asyncio
+
+        future = self._calls.get(key)
+
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future)
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self.calls += 1
+
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # nobody may be waiting, don't warn about an unretrieved exception
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def dict(self):
+        """
+        A representation of this object as a dictionary of simple values.
+        """
+        return {
+            'calls': self.calls,
+            'shared': self.shared,
+            'in_flight': len(self._calls)
+        }
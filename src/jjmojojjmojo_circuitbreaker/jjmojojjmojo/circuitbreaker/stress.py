@@ -0,0 +1,356 @@
+"""
+Contention harness for drivers.
+
+Runs many workers (threads, or processes) against a single key of a driver at
+once, and records every operation they make, with timestamps. The history is
+then checked for the anomalies that concurrent clients cause in a driver that
+isn't safe:
+
+    - lost increments: the final failure count is lower than the number of
+      failure() calls, or two calls returned the same count.
+    - double transitions: two workers both changed the breaker from the same
+      status (see Driver.transition()), so there are more successful opens
+      than closes can account for, or the other way around.
+
+Each worker makes `operations` calls, picked at random: mostly failure(), and
+transitions from closed to open and from open to closed. Transitions don't
+reset the failure count, so every increment can be accounted for.
+
+Use it to validate a driver (or a change to one) before trusting it in
+production, and to compare throughput at each concurrency level:
+
+    $ python -m jjmojojjmojo.circuitbreaker.stress --url memory:// --workers 1 2 4 8 16
+    $ python -m jjmojojjmojo.circuitbreaker.stress --url redis://localhost:6379/0 --processes --workers 1 4 16
+
+Processes need a driver that is shared between them, so they can't be used
+with the memory driver. Each process creates its own driver from the URL.
+"""
+
+from .base import STATUS_OPEN, STATUS_CLOSED, STATUS_NAMES
+from . import registry
+import argparse
+import concurrent.futures
+import logging
+import random
+import sys
+import threading
+import time
+import urllib.parse
+
+OP_FAILURE = "failure"
+OP_OPEN = "open"
+OP_CLOSE = "close"
+
+# relative weights of the operations each worker makes
+DEFAULT_MIX = {OP_FAILURE: 8, OP_OPEN: 1, OP_CLOSE: 1}
+
+class Operation:
+    """
+    One call made by a worker. The result is the driver's return value, or the
+    exception it raised.
+    """
+    __slots__ = ("worker", "name", "start", "end", "result")
+
+    def __init__(self, worker, name, start, end, result):
+        self.worker = worker
+        self.name = name
+        self.start = start
+        self.end = end
+        self.result = result
+
+    @property
+    def failed(self):
+        return isinstance(self.result, Exception)
+
+    def __repr__(self):
+        return f"<Operation worker={self.worker} {self.name} -> {self.result!r}>"
+
+def _work(driver, key, worker, operations, mix, seed, start=None):
+    """
+    The body of a worker: make the operations, return them as a list.
+
+    start: threading.Barrier, optional, waited on before the first operation.
+    """
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    # system-wide, so timestamps from different processes can be compared
+    now = time.perf_counter
+
+    history = []
+
+    if start is not None:
+        start.wait()
+
+    for i in range(operations):
+        name = rng.choices(names, weights)[0]
+        began = now()
+
+        try:
+            if name == OP_FAILURE:
+                result = driver.failure(key, 1)
+            elif name == OP_OPEN:
+                result = driver.transition(key, (STATUS_CLOSED,), STATUS_OPEN)
+            else:
+                result = driver.transition(key, (STATUS_OPEN,), STATUS_CLOSED)
+        except Exception as e:
+            result = e
+
+        history.append(Operation(worker, name, began, now(), result))
+
+    return history
+
+def _process_worker(url, key, worker, operations, mix, seed):
+    """
+    Entry point of a worker process. Operations are sent back as tuples, and
+    exceptions as their repr().
+    """
+    driver = registry.from_url(url)
+
+    history = _work(driver, key, worker, operations, mix, seed)
+
+    return [
+        (op.worker, op.name, op.start, op.end, RuntimeError(repr(op.result)) if op.failed else op.result)
+        for op in history
+    ]
+
+class History:
+    """
+    Every operation made during a run, and the breaker's info at the end.
+    """
+    def __init__(self, workers, operations, final):
+        """
+        workers: int, number of workers that made the operations.
+        operations: list of Operation objects.
+        final: dictionary, the breaker's info after the last operation.
+        """
+        self.workers = workers
+        self.operations = sorted(operations, key=lambda op: op.start)
+        self.final = final
+
+    @property
+    def duration(self):
+        """
+        Seconds from the first operation to the end of the last one.
+        """
+        if not self.operations:
+            return 0
+        return max(op.end for op in self.operations) - self.operations[0].start
+
+    @property
+    def throughput(self):
+        """
+        Operations per second, across all workers.
+        """
+        if not self.duration:
+            return 0
+        return len(self.operations) / self.duration
+
+    @property
+    def errors(self):
+        """
+        The number of operations that raised an exception.
+        """
+        return sum(1 for op in self.operations if op.failed)
+
+    def latency(self, quantile):
+        """
+        The given quantile (0 to 1) of the time taken by each operation, in
+        seconds.
+        """
+        times = sorted(op.end - op.start for op in self.operations)
+        if not times:
+            return 0
+        return times[min(len(times) - 1, int(quantile * len(times)))]
+
+    def check(self):
+        """
+        Look for lost increments and double transitions. Returns a list of
+        descriptions of the anomalies found, empty if there are none.
+
+        Operations that raised may or may not have been applied, so they
+        widen the range of acceptable outcomes instead of being anomalies.
+        """
+        anomalies = []
+
+        done = [op for op in self.operations if not op.failed]
+        unknown = [op for op in self.operations if op.failed]
+
+        increments = sum(1 for op in done if op.name == OP_FAILURE)
+        maybe = sum(1 for op in unknown if op.name == OP_FAILURE)
+        failures = self.final['failures']
+
+        if not increments <= failures <= increments + maybe:
+            anomalies.append(f"lost increments: {increments} failure() calls succeeded, the count is {failures}")
+
+        counts = [op.result for op in done if op.name == OP_FAILURE]
+        repeated = len(counts) - len(set(counts))
+
+        if repeated:
+            anomalies.append(f"lost increments: {repeated} failure() calls returned a count another call also returned")
+
+        opens = sum(1 for op in done if op.name == OP_OPEN and op.result)
+        closes = sum(1 for op in done if op.name == OP_CLOSE and op.result)
+        maybe = sum(1 for op in unknown if op.name in (OP_OPEN, OP_CLOSE))
+
+        # the breaker starts closed, so it's open at the end if it was opened once more than closed
+        expected = 1 if self.final['status'] == STATUS_OPEN else 0
+
+        if abs(opens - closes - expected) > maybe:
+            status = STATUS_NAMES.get(self.final['status'], "UNKNOWN")
+            anomalies.append(f"double transitions: opened {opens} times, closed {closes} times, ended {status}")
+        elif not maybe:
+            doubled = self._doubled([op for op in done if op.name in (OP_OPEN, OP_CLOSE) and op.result])
+
+            if doubled:
+                anomalies.append(f"double transitions: {doubled} transitions repeated the one before, with no other transition in between")
+
+        return anomalies
+
+    def _doubled(self, transitions):
+        """
+        Count the successful transitions that follow one of the same kind
+        (two opens, or two closes, in a row), with no transition of the other
+        kind that could have happened in between. Catches doubled opens and
+        closes that cancel out in the totals.
+
+        Each operation took effect at some point between its start and its
+        end, so another transition could have happened between two others if
+        it overlaps the time between the first start and the last end.
+
+        transitions: list of successful transition Operations, sorted by start.
+        """
+        doubled = 0
+
+        for before, after in zip(transitions, transitions[1:]):
+            if before.name != after.name:
+                continue
+
+            first = before.start
+            last = max(before.end, after.end)
+
+            if not any(op.name != before.name and op.start <= last and op.end >= first for op in transitions):
+                doubled += 1
+
+        return doubled
+
+    def dict(self):
+        """
+        A representation of this object as a dictionary of simple values.
+        """
+        return {
+            'workers': self.workers,
+            'operations': len(self.operations),
+            'errors': self.errors,
+            'duration': self.duration,
+            'throughput': self.throughput,
+            'p50': self.latency(0.5),
+            'p99': self.latency(0.99),
+            'anomalies': self.check()
+        }
+
+    def __repr__(self):
+        return f"<History workers={self.workers} operations={len(self.operations)} throughput={self.throughput:.0f}/s anomalies={len(self.check())}>"
+
+class Stress:
+    """
+    Runs workers against a driver, and collects their history.
+    """
+    def __init__(self, url=None, driver=None, key="stress", operations=1000, mix=None, seed=None):
+        """
+        url: string, a driver URL (see the registry module). Required to run
+             workers in processes.
+        driver: Driver object, used by the worker threads instead of one
+                created from the URL.
+        key: string, the breaker the workers contend for.
+        operations: int, number of operations each worker makes.
+        mix: dictionary, operation name -> relative weight. See DEFAULT_MIX.
+        seed: random seed, for repeatable sequences of operations (the
+              interleaving of the workers is never repeatable).
+        """
+        if url is None and driver is None:
+            raise AttributeError("You must specify one of url or driver")
+
+        if driver is None:
+            driver = registry.from_url(url)
+
+        self.url = url
+        self.driver = driver
+        self.key = key
+        self.operations = operations
+        self.mix = dict(DEFAULT_MIX if mix is None else mix)
+        self.rng = random.Random(seed)
+
+    def run(self, workers, processes=False):
+        """
+        Reset the breaker, run the given number of workers at once, and return
+        their History.
+
+        processes: boolean, run the workers in processes instead of threads.
+        """
+        if processes:
+            if self.url is None:
+                raise AttributeError("Workers can only run in processes with a driver url")
+
+            if urllib.parse.urlsplit(self.url).scheme.lower() == "memory":
+                raise ValueError("The memory driver isn't shared between processes")
+
+        self.driver.reset(self.key)
+
+        seeds = [self.rng.getrandbits(32) for i in range(workers)]
+
+        if processes:
+            operations = self._run_processes(workers, seeds)
+        else:
+            operations = self._run_threads(workers, seeds)
+
+        return History(workers, operations, dict(self.driver.load(self.key)))
+
+    def _run_threads(self, workers, seeds):
+        start = threading.Barrier(workers)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_work, self.driver, self.key, i, self.operations, self.mix, seeds[i], start)
+                for i in range(workers)
+            ]
+
+            return [op for future in futures for op in future.result()]
+
+    def _run_processes(self, workers, seeds):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_process_worker, self.url, self.key, i, self.operations, self.mix, seeds[i])
+                for i in range(workers)
+            ]
+
+            return [Operation(*op) for future in futures for op in future.result()]
+
+parser = argparse.ArgumentParser(description='Check a driver for lost updates and double transitions under contention, and measure its throughput.')
+parser.add_argument('-u', '--url', type=str, default="memory://", help="Driver URL")
+parser.add_argument('-w', '--workers', type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Concurrency levels to run")
+parser.add_argument('-n', '--operations', type=int, default=1000, help="Operations per worker")
+parser.add_argument('-k', '--key', type=str, default="stress", help="Breaker key to contend for")
+parser.add_argument('-p', '--processes', action="store_true", help="Run workers in processes instead of threads")
+parser.add_argument('-s', '--seed', type=int, default=None, help="Random seed")
+
+if __name__ == '__main__':
+    opts = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    stress = Stress(url=opts.url, key=opts.key, operations=opts.operations, seed=opts.seed)
+
+    sys.stdout.write(f"{'workers':>8} {'ops':>8} {'errors':>7} {'ops/s':>10} {'p50 ms':>8} {'p99 ms':>8}  anomalies\n")
+
+    found = False
+
+    for workers in opts.workers:
+        history = stress.run(workers, processes=opts.processes)
+        anomalies = history.check()
+        found = found or bool(anomalies)
+
+        sys.stdout.write(f"{workers:>8} {len(history.operations):>8} {history.errors:>7} {history.throughput:>10.0f} {history.latency(0.5) * 1000:>8.3f} {history.latency(0.99) * 1000:>8.3f}  {'; '.join(anomalies) or 'none'}\n")
+
+    sys.exit(1 if found else 0)
@@ -2,8 +2,9 @@
 Unit Tests for the CircuitBreaker class.
 """
 
-from ..base import STATUS_CLOSED, STATUS_OPEN, CircuitBreaker
+from ..base import STATUS_CLOSED, STATUS_OPEN, STATUS_RAMPING, CircuitBreaker, request_scope
 from ..drivers import MemoryDriver
+from ..clock import ManualClock
 from .. import errors
 import time
 import pytest
@@ -26,12 +27,14 @@ def test_basic_breaker():
     # then fail two times in a row.
     failer = util.IntermittentFailer(frequency=2, fail_count=2)
     
+    clock = ManualClock(1000.0)
+    
     # the breaker opens after 2 failures, and tries again
     # after 5 seconds.
     breaker = CircuitBreaker(
         key="test",
         subject=failer,
-        driver=util.MemoryDriver(),
+        driver=util.MemoryDriver(clock=clock),
         failures=2,
         timeout=5,
         jitter=lambda: 0)
@@ -60,7 +63,7 @@ def test_basic_breaker():
         breaker()
     
     # cause the timeout to happen
-    time.sleep(6)
+    clock.advance(6)
     
     # it's working again.
     assert breaker() == True
@@ -143,6 +146,25 @@ def test_backend_problem_failure():
     with pytest.raises(errors.DistributedBackendProblem):
         breaker("hello")
         
+def test_failure_after_removal():
+    """
+    A breaker removed from the back-end between its load and its failure is
+    created again, and the subject's exception is what the caller sees.
+    """
+    driver = MemoryDriver()
+    
+    def remove_and_fail(x):
+        driver.delete("boo")
+        raise ValueError(x)
+    
+    breaker = CircuitBreaker(subject=remove_and_fail, key="boo", driver=driver)
+    
+    with pytest.raises(ValueError):
+        breaker("hello")
+        
+    assert driver.load("boo")['failures'] == 1
+    assert breaker.failures == 1
+    
 def test_backend_problem_load():
     """
     Ensure that the CircuitBreaker class performs as expected when a driver 
@@ -221,4 +243,341 @@ def test_repr(fixed_random):
     
     expected = f"<CircuitBreaker [test2] status=UNKNOWN failures=0 checkin={breaker.checkin}, jitter={breaker.jitter}>"
     
-    assert expected == repr(breaker)
\ No newline at end of file
+    assert expected == repr(breaker)
+
+class LoadCountingDriver(util.MemoryDriver):
+    """
+    Keeps track of how many times each key was loaded.
+    """
+    def __init__(self, expires=None):
+        util.MemoryDriver.__init__(self, expires)
+        self.loads = {}
+        
+    def load(self, key):
+        self.loads[key] = self.loads.get(key, 0) + 1
+        return util.MemoryDriver.load(self, key)
+
+def test_bad_parent():
+    """
+    Make sure the parent must be a CircuitBreaker.
+    """
+    with pytest.raises(AttributeError):
+        CircuitBreaker(subject=util.succeed, key="boo", driver=util.MemoryDriver(), parent="host")
+
+def test_parent_rollup():
+    """
+    Failures of any child count against the parent, and an open parent rejects 
+    calls to every child without loading the child's state.
+    """
+    driver = LoadCountingDriver()
+    
+    host = CircuitBreaker(subject=None, key="svc", driver=driver, failures=3, timeout=5, jitter=0)
+    users = CircuitBreaker(subject=fail, key="svc/users", driver=driver, failures=10, parent=host)
+    orders = CircuitBreaker(subject=fail, key="svc/orders", driver=driver, failures=10, parent=host)
+    
+    with pytest.raises(Exception):
+        users(1)
+    with pytest.raises(Exception):
+        orders(1)
+    with pytest.raises(Exception):
+        users(1)
+        
+    assert driver.state["svc"]["failures"] == 3
+    assert driver.state["svc/users"]["failures"] == 2
+    assert driver.state["svc/orders"]["failures"] == 1
+    
+    # the parent trips on the next call, for every child
+    with pytest.raises(errors.CircuitBreakerOpen):
+        orders(1)
+    
+    assert driver.state["svc"]["status"] == STATUS_OPEN
+    
+    loads = dict(driver.loads)
+    
+    for i in range(10):
+        with pytest.raises(errors.CircuitBreakerOpen):
+            users(1)
+        with pytest.raises(errors.CircuitBreakerOpen):
+            orders(1)
+    
+    assert driver.loads["svc/users"] == loads["svc/users"]
+    assert driver.loads["svc/orders"] == loads["svc/orders"]
+    
+    # once the parent times out, a successful child call closes it
+    driver.state["svc"]["checkin"] -= 6
+    users.subject = util.succeed
+    
+    assert users(1) == True
+    assert driver.state["svc"]["status"] == STATUS_CLOSED
+    assert driver.state["svc"]["failures"] == 0
+    
+def test_request_scope():
+    """
+    Within a request_scope(), the parent is loaded once for all of its children.
+    """
+    driver = LoadCountingDriver()
+    
+    host = CircuitBreaker(subject=None, key="svc", driver=driver)
+    children = [
+        CircuitBreaker(subject=util.succeed, key=f"svc/{i}", driver=driver, parent=host)
+        for i in range(5)]
+    
+    with request_scope():
+        for child in children:
+            assert child() == True
+        
+        with request_scope():
+            assert children[0]() == True
+    
+    # first load raises BackendKeyNotFound, so there is only one.
+    assert driver.loads["svc"] == 1
+    
+    for child in children:
+        child()
+        
+    assert driver.loads["svc"] == 6
+    
+def test_guard():
+    """
+    A guard loads the state once per refresh interval, not once per call.
+    """
+    clock = ManualClock(1000.0)
+    driver = LoadCountingDriver()
+    driver.clock = clock
+    
+    breaker = CircuitBreaker(subject=lambda x: x * 2, key="batch", driver=driver)
+    
+    with breaker.guard(refresh=10) as guard:
+        results = [guard(i) for i in range(100)]
+        
+        assert results == [i * 2 for i in range(100)]
+        assert driver.loads["batch"] == 1
+        
+        clock.advance(10)
+        guard(1)
+        
+        assert driver.loads["batch"] == 2
+        assert guard.loads == 2
+        
+def test_guard_retry():
+    """
+    Only one call retries an open breaker. If it succeeds, the batch goes on, if 
+    it fails, the guard stops.
+    """
+    clock = ManualClock(1000.0)
+    driver = MemoryDriver(clock=clock)
+    outcomes = util.Cycle([True, True, False])
+    
+    def subject():
+        if not next(outcomes):
+            raise util.Failure()
+    
+    breaker = CircuitBreaker(subject=subject, key="batch", driver=driver, timeout=5, jitter=0)
+    breaker.load()
+    breaker.open()
+    
+    with breaker.guard() as guard:
+        with pytest.raises(errors.CircuitBreakerOpen):
+            guard()
+        assert guard.tripped
+        
+    clock.advance(5)
+    
+    with breaker.guard() as guard:
+        guard()
+        guard()
+        assert driver.state["batch"]["status"] == STATUS_CLOSED
+    
+    breaker.open()
+    clock.advance(5)
+    
+    with breaker.guard() as guard:
+        with pytest.raises(util.Failure):
+            guard()
+        with pytest.raises(errors.CircuitBreakerOpen):
+            guard()
+            
+def test_map():
+    """
+    Results and exceptions come back in order, and nothing more is called once
+    the breaker opens.
+    """
+    calls = []
+    
+    def subject(x):
+        calls.append(x)
+        if x >= 3:
+            raise util.Failure()
+        return x
+    
+    breaker = CircuitBreaker(subject=subject, key="batch", driver=MemoryDriver(), failures=3)
+    
+    results = breaker.map(((i,) for i in range(20)))
+    
+    assert results[:3] == [0, 1, 2]
+    assert all(isinstance(r, util.Failure) for r in results[3:6])
+    assert all(isinstance(r, errors.CircuitBreakerOpen) for r in results[6:])
+    assert len(results) == 20
+    assert calls == [0, 1, 2, 3, 4, 5]
+    assert breaker.driver.state["batch"]["status"] == STATUS_OPEN
+    
+def test_map_concurrent():
+    """
+    Run the calls from a thread pool.
+    """
+    driver = LoadCountingDriver()
+    
+    def subject(x, y):
+        time.sleep(random.random() / 1000)
+        return x + y
+    
+    breaker = CircuitBreaker(subject=subject, key="batch", driver=driver)
+    
+    results = breaker.map([(i, 1) for i in range(500)], concurrency=8, refresh=60)
+    
+    assert results == [i + 1 for i in range(500)]
+    assert driver.loads["batch"] == 1
+    
+    breaker.subject = util.fail
+    
+    results = breaker.map([(i,) for i in range(500)], concurrency=8)
+    
+    failures = [r for r in results if not isinstance(r, errors.CircuitBreakerOpen)]
+    
+    assert 5 <= len(failures) < 5 + 8
+    assert isinstance(results[-1], errors.CircuitBreakerOpen)
+    
+def test_map_concurrent_failures():
+    """
+    Concurrent calls through a guard record their outcomes one at a time, so 
+    the breaker's state matches the back-end.
+    """
+    class OverlapDriver(MemoryDriver):
+        inside = 0
+        overlaps = 0
+        
+        def failure(self, key, amount=1):
+            self.inside += 1
+            if self.inside > 1:
+                self.overlaps += 1
+            time.sleep(0.001)
+            try:
+                return MemoryDriver.failure(self, key, amount)
+            finally:
+                self.inside -= 1
+    
+    driver = OverlapDriver()
+    breaker = CircuitBreaker(subject=util.fail, key="batch", driver=driver, failures=50)
+    
+    breaker.map([() for i in range(40)], concurrency=8)
+    
+    assert driver.overlaps == 0
+    assert breaker.failures == driver.state["batch"]["failures"] == 40
+
+def test_ramp(fixed_random):
+    """
+    After a successful retry, traffic ramps back up. Calls turned away while 
+    ramping don't touch the back-end.
+    """
+    clock = ManualClock(1000.0)
+    driver = LoadCountingDriver()
+    driver.clock = clock
+    
+    failer = util.IntermittentFailer(frequency=1, fail_count=1, pattern=[False, True])
+    breaker = CircuitBreaker(subject=failer, key="ramp", driver=driver, failures=1, timeout=10, jitter=0, ramp=100)
+    
+    with pytest.raises(util.Failure):
+        breaker()
+    with pytest.raises(errors.CircuitBreakerOpen):
+        breaker()
+    
+    clock.advance(10)
+    breaker()
+    
+    assert driver.state["ramp"]["status"] == STATUS_RAMPING
+    assert driver.state["ramp"]["checkin"] == 1010
+    
+    breaker.subject = util.succeed
+    clock.advance(25)
+    
+    loads = driver.loads["ramp"]
+    admitted = 0
+    
+    for i in range(1000):
+        try:
+            breaker()
+            admitted += 1
+        except errors.CircuitBreakerOpen:
+            pass
+    
+    assert 200 < admitted < 300
+    assert driver.loads["ramp"] - loads == admitted
+    assert driver.state["ramp"]["status"] == STATUS_RAMPING
+    
+    clock.advance(75)
+    breaker()
+    
+    assert driver.state["ramp"]["status"] == STATUS_CLOSED
+    
+def test_ramp_failure():
+    """
+    Any failure while ramping opens the breaker again.
+    """
+    clock = ManualClock(1000.0)
+    driver = MemoryDriver(clock=clock)
+    
+    breaker = CircuitBreaker(subject=fail, key="ramp", driver=driver, failures=5, ramp=60, ramp_mode=lambda progress: 1)
+    breaker.load()
+    breaker.open()
+    breaker.ramp_up()
+    
+    with pytest.raises(Exception):
+        breaker(1)
+    
+    assert driver.state["ramp"]["status"] == STATUS_OPEN
+    assert driver.state["ramp"]["checkin"] == 1000
+    
+    with pytest.raises(errors.CircuitBreakerOpen):
+        breaker(1)
+
+def test_ramp_up_stale():
+    """
+    A client that still sees the breaker open doesn't undo a close made by 
+    another one.
+    """
+    driver = MemoryDriver()
+    
+    class Recorder:
+        def __init__(self):
+            self.events = []
+        
+        def record(self, event, key, failures, timestamp):
+            self.events.append(event)
+    
+    events = Recorder()
+    
+    breaker = CircuitBreaker(subject=util.succeed, key="ramp", driver=driver, ramp=60, events=events)
+    breaker.load()
+    breaker.open()
+    
+    driver.update("ramp", status=STATUS_CLOSED, failures=0)
+    
+    breaker.ramp_up()
+    
+    assert driver.state["ramp"]["status"] == STATUS_CLOSED
+    assert breaker.status == STATUS_CLOSED
+    assert events.events == ["open"]
+    
+def test_ramp_modes(fixed_random):
+    """
+    Exponential ramps start slower than linear ones.
+    """
+    from ..base import linear_ramp, exponential_ramp
+    
+    assert linear_ramp(0.5) == 0.5
+    assert exponential_ramp(0) == 0.01
+    assert exponential_ramp(0.5) == pytest.approx(0.1)
+    assert exponential_ramp(1) == 1
+    
+    with pytest.raises(AttributeError):
+        CircuitBreaker(subject=fail, key="ramp", driver=MemoryDriver(), ramp=60, ramp_mode="cubic")
@@ -0,0 +1,123 @@
+"""
+Unit Tests for the command-line tool.
+"""
+
+from ..cli import main, expand
+from ..drivers import MemoryDriver
+from ..base import STATUS_OPEN, STATUS_CLOSED
+import io
+import json
+import pytest
+
+@pytest.fixture
+def driver():
+    """
+    A MemoryDriver with a mix of breakers.
+    """
+    driver = MemoryDriver()
+    
+    for i in range(30):
+        driver.new(f"payments-{i}")
+        driver.open(f"payments-{i}")
+        
+    for i in range(5):
+        driver.new(f"search-{i}")
+        
+    return driver
+
+def run(driver, *argv):
+    """
+    Run the tool, return the exit status and the output.
+    """
+    out = io.StringIO()
+    status = main(list(argv), driver=driver, out=out)
+    return status, out.getvalue()
+
+def test_expand(driver):
+    """
+    Patterns are expanded, de-duplicated and batched. Literal keys pass through.
+    """
+    batches = list(expand(driver, ["payments-1*", "payments-1", "new-key"], 4))
+    
+    keys = [key for batch in batches for key in batch]
+    
+    assert sorted(keys) == sorted(["payments-1"] + [f"payments-1{i}" for i in range(10)] + ["new-key"])
+    assert [len(batch) for batch in batches] == [4, 4, 4]
+
+def test_list(driver):
+    """
+    List as text and JSON.
+    """
+    status, out = run(driver, "list", "search-*")
+    
+    assert status == 0
+    assert len(out.splitlines()) == 5
+    assert out.startswith("search-0\tCLOSED\t0\t")
+    
+    status, out = run(driver, "--json", "list")
+    
+    rows = json.loads(out)
+    
+    assert len(rows) == 35
+    assert rows[0] == {
+        'key': "payments-0",
+        'status': "OPEN",
+        'failures': 0,
+        'checkin': driver.state["payments-0"]["checkin"]}
+
+def test_show(driver):
+    """
+    Show specific breakers, missing ones are an error.
+    """
+    status, out = run(driver, "-j", "show", "search-1")
+    
+    assert status == 0
+    assert json.loads(out)[0]['key'] == "search-1"
+    
+    status, out = run(driver, "show", "search-1", "nope")
+    
+    assert status == 1
+    assert len(out.splitlines()) == 1
+
+def test_bulk_commands(driver):
+    """
+    Reset, open and delete with glob patterns.
+    """
+    status, out = run(driver, "--batch-size", "7", "reset", "payments-*")
+    
+    assert status == 0
+    assert out == "reset 30 breakers\n"
+    assert all(info['status'] == STATUS_CLOSED for info in driver.state.values())
+    
+    status, out = run(driver, "-j", "open", "search-[0-2]")
+    
+    assert json.loads(out) == {'opened': 3}
+    assert driver.state["search-2"]["status"] == STATUS_OPEN
+    assert driver.state["search-3"]["status"] == STATUS_CLOSED
+    
+    status, out = run(driver, "delete", "payments-*", "search-4")
+    
+    assert out == "deleted 31 breakers\n"
+    assert sorted(driver.state) == ["search-0", "search-1", "search-2", "search-3"]
+    
+def test_migrate_memory(driver):
+    """
+    The memory back-end has nothing to migrate.
+    """
+    status, out = run(driver, "migrate")
+    
+    assert status == 1
+    assert out == ""
+    
+def test_sweep(driver):
+    """
+    Expired breakers are removed, with back-ends that don't do it on their own.
+    """
+    status, out = run(driver, "sweep")
+    
+    assert status == 0
+    assert out == "swept 0 breakers\n"
+    
+    status, out = run(object(), "sweep")
+    
+    assert status == 1
@@ -0,0 +1,274 @@
+"""
+Unit Tests for the status dashboard WSGI app.
+"""
+
+from ..dashboard import Dashboard
+from ..drivers import MemoryDriver
+from ..base import STATUS_OPEN, STATUS_CLOSED
+from .. import errors
+from . import util
+import io
+import json
+import threading
+import time
+import wsgiref.util
+import pytest
+
+def request(app, path="/", method="GET", query="", script_name="", headers=None, data=b""):
+    """
+    Call the WSGI app, return the status, headers and body.
+
+    headers: dictionary, extra WSGI environ entries (e.g. HTTP_ORIGIN).
+    data: bytes, the request body.
+    """
+    environ = {}
+    wsgiref.util.setup_testing_defaults(environ)
+    environ["PATH_INFO"] = path
+    environ["REQUEST_METHOD"] = method
+    environ["QUERY_STRING"] = query
+    environ["SCRIPT_NAME"] = script_name
+    environ["CONTENT_LENGTH"] = str(len(data))
+    environ["wsgi.input"] = io.BytesIO(data)
+    environ.update(headers or {})
+
+    out = {}
+
+    def start_response(status, headers):
+        out['status'] = status
+        out['headers'] = dict(headers)
+
+    body = b"".join(app(environ, start_response))
+
+    return out['status'], out['headers'], body
+
+@pytest.fixture
+def driver():
+    """
+    A MemoryDriver with a few breakers in it.
+    """
+    driver = MemoryDriver()
+
+    for i in range(5):
+        driver.new(f"svc/{i}")
+
+    driver.new("other")
+    driver.open("svc/3")
+    driver.failure("svc/3")
+
+    return driver
+
+def test_json(driver):
+    """
+    List breakers as JSON, with and without a pattern.
+    """
+    app = Dashboard(driver, timeout=10)
+
+    status, headers, body = request(app, "/breakers.json")
+
+    assert status == "200 OK"
+
+    rows = json.loads(body)
+
+    assert [row['key'] for row in rows] == ["other", "svc/0", "svc/1", "svc/2", "svc/3", "svc/4"]
+    assert rows[4]['status'] == "OPEN"
+    assert rows[4]['failures'] == 1
+    assert 9 < rows[4]['time_to_probe'] <= 10
+    assert rows[0]['time_to_probe'] is None
+
+    status, headers, body = request(app, "/breakers.json", query="pattern=svc/*")
+
+    assert len(json.loads(body)) == 5
+
+def test_html(driver):
+    """
+    The HTML page is rendered, and respects the mount point.
+    """
+    app = Dashboard(driver, limit=3)
+
+    status, headers, body = request(app, "/", script_name="/admin/breakers")
+
+    assert status == "200 OK"
+    assert headers["Content-Type"].startswith("text/html")
+
+    body = body.decode()
+
+    assert "6 breakers, 1 open. Showing the first 3." in body
+    assert 'action="/admin/breakers/reset/svc%2F0"' in body
+
+def test_actions(driver):
+    """
+    Reset and force-open a breaker.
+    """
+    app = Dashboard(driver)
+
+    status, headers, body = request(app, "/open/svc%2F1", method="POST", script_name="/admin")
+
+    assert status == "303 See Other"
+    assert headers["Location"] == "/admin/"
+    assert driver.state["svc/1"]["status"] == STATUS_OPEN
+
+    request(app, "/reset/svc%2F3", method="POST")
+
+    assert driver.state["svc/3"]["status"] == STATUS_CLOSED
+    assert driver.state["svc/3"]["failures"] == 0
+
+    status, headers, body = request(app, "/reset/svc%2F3")
+
+    assert status == "404 Not Found"
+
+def test_cache(driver):
+    """
+    Enumeration is cached for cache_ttl seconds, and actions invalidate it.
+    """
+    class CountingDriver(MemoryDriver):
+        scans = 0
+        def keys(self, pattern="*"):
+            self.scans += 1
+            return MemoryDriver.keys(self, pattern)
+
+    counting = CountingDriver()
+    counting.state = driver.state
+
+    app = Dashboard(counting, cache_ttl=60)
+
+    for i in range(10):
+        request(app, "/breakers.json")
+
+    assert counting.scans == 1
+
+    request(app, "/reset/other", method="POST")
+    request(app, "/breakers.json")
+
+    assert counting.scans == 2
+
+def test_cache_patterns(driver):
+    """
+    Each pattern is cached separately, and stale patterns are dropped.
+    """
+    class CountingDriver(MemoryDriver):
+        scans = 0
+        def keys(self, pattern="*"):
+            self.scans += 1
+            return MemoryDriver.keys(self, pattern)
+
+    counting = CountingDriver()
+    counting.state = driver.state
+
+    app = Dashboard(counting, cache_ttl=60)
+
+    for i in range(3):
+        assert len(app.breakers("svc/*")) == 5
+        assert len(app.breakers("other")) == 1
+
+    assert counting.scans == 2
+    assert sorted(app._cache) == ["other", "svc/*"]
+
+    app.cache_ttl = 0
+    app.breakers("svc/*")
+
+    assert list(app._cache) == ["svc/*"]
+
+def test_single_flight(driver):
+    """
+    Requests that miss the cache at the same time share one enumeration.
+    """
+    class SlowDriver(MemoryDriver):
+        scans = 0
+        def keys(self, pattern="*"):
+            self.scans += 1
+            time.sleep(0.2)
+            return MemoryDriver.keys(self, pattern)
+
+    slow = SlowDriver()
+    slow.state = driver.state
+
+    app = Dashboard(slow, cache_ttl=60)
+    results = []
+
+    threads = [threading.Thread(target=lambda: results.append(app.breakers())) for i in range(5)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert slow.scans == 1
+    assert len(results) == 5
+    assert all(len(rows) == 6 for rows in results)
+
+def test_cross_origin(driver):
+    """
+    POSTs from another origin are refused, same-origin ones are allowed.
+    """
+    app = Dashboard(driver)
+
+    for headers in ({"HTTP_ORIGIN": "https://evil.example.com"},
+                    {"HTTP_ORIGIN": "null"},
+                    {"HTTP_REFERER": "http://evil.example.com/page"},
+                    {"HTTP_ORIGIN": "https://127.0.0.1"}):
+        status, _, _ = request(app, "/open/svc%2F1", method="POST", headers=headers)
+
+        assert status == "403 Forbidden"
+        assert driver.state["svc/1"]["status"] == STATUS_CLOSED
+
+    status, _, _ = request(app, "/open/svc%2F1", method="POST", headers={"HTTP_ORIGIN": "http://127.0.0.1:80"})
+
+    assert status == "303 See Other"
+    assert driver.state["svc/1"]["status"] == STATUS_OPEN
+
+    status, _, _ = request(app, "/reset/svc%2F1", method="POST", headers={"HTTP_REFERER": "http://127.0.0.1/?pattern=svc"})
+
+    assert status == "303 See Other"
+    assert driver.state["svc/1"]["status"] == STATUS_CLOSED
+
+def test_token(driver):
+    """
+    With a token set, POSTs must carry it, and the page only puts it in the
+    forms when it was requested with it.
+    """
+    app = Dashboard(driver, token="s3cret")
+
+    status, _, _ = request(app, "/open/svc%2F1", method="POST")
+
+    assert status == "403 Forbidden"
+
+    status, _, _ = request(app, "/open/svc%2F1", method="POST", data=b"token=wrong")
+
+    assert status == "403 Forbidden"
+    assert driver.state["svc/1"]["status"] == STATUS_CLOSED
+
+    status, headers, _ = request(app, "/open/svc%2F1", method="POST", data=b"token=s3cret")
+
+    assert status == "303 See Other"
+    assert headers["Location"] == "/?token=s3cret"
+    assert driver.state["svc/1"]["status"] == STATUS_OPEN
+
+    status, _, _ = request(app, "/reset/svc%2F1", method="POST", headers={"HTTP_X_DASHBOARD_TOKEN": "s3cret"})
+
+    assert status == "303 See Other"
+    assert driver.state["svc/1"]["status"] == STATUS_CLOSED
+
+    _, _, body = request(app, "/")
+
+    assert b"s3cret" not in body
+
+    _, _, body = request(app, "/", query="token=wrong")
+
+    assert b"wrong" not in body
+
+    _, _, body = request(app, "/", query="token=s3cret")
+
+    assert b'<input type="hidden" name="token" value="s3cret">' in body
+
+def test_backend_problem():
+    """
+    Back-end problems are reported as a 503.
+    """
+    class BrokenDriver(MemoryDriver):
+        def keys(self, pattern="*"):
+            raise errors.DistributedBackendProblem()
+
+    status, headers, body = request(Dashboard(BrokenDriver()), "/")
+
+    assert status == "503 Service Unavailable"
@@ -0,0 +1,119 @@
+"""
+Unit Tests for the GroupedRedisDriver back-end.
+
+For tests against a redis server, see the func/ directory in the main source
+distribution.
+"""
+from ..drivers import GroupedRedisDriver
+from ..drivers import grouped
+from ..clock import ManualClock
+from .. import errors
+from ..base import STATUS_OPEN
+from .. import registry
+import pytest
+
+def test_groups():
+    """
+    Breakers are grouped by the start of their key, or by a function.
+    """
+    driver = GroupedRedisDriver(redis_url="redis://")
+    
+    assert driver.key("payments:tenant-1") == "rcbg:payments"
+    assert driver.key("payments:eu:tenant-1") == "rcbg:payments"
+    assert driver.key("search") == "rcbg:search"
+    assert driver._by_group(["a:1", "b:1", "a:2"]) == {"rcbg:a": ["a:1", "a:2"], "rcbg:b": ["b:1"]}
+    
+    driver = GroupedRedisDriver(redis_url="redis://", prefix="x:", separator="/")
+    
+    assert driver.key("payments/tenant-1") == "x:payments"
+    
+    driver = GroupedRedisDriver(redis_url="redis://", group=lambda key: key[-1])
+    
+    assert driver.key("tenant-1") == "rcbg:1"
+    
+def test_decode():
+    """
+    Each breaker is one field, with its values separated by spaces.
+    """
+    driver = GroupedRedisDriver(redis_url="redis://")
+    info = {'failures': 2, 'status': STATUS_OPEN, 'checkin': 1500000000.123456}
+    
+    assert driver._encode(info) == f"2 {STATUS_OPEN} 1500000000.123456"
+    assert driver._decode(driver._encode(info).encode()) == info
+    
+    assert driver._stored(b"0 1 10.0")
+    assert not driver._stored(None)
+    
+    with pytest.raises(ValueError):
+        driver.update("payments:tenant-1")
+        
+def test_sweep_on_write(monkeypatch):
+    """
+    A write that's due sweeps one batch of one group, and the cursor is kept
+    for the next write. Sweep progress is kept for a bounded number of groups.
+    """
+    monkeypatch.setattr(grouped, "SWEPT_GROUPS", 3)
+    
+    clock = ManualClock(1000)
+    driver = GroupedRedisDriver(redis_url="redis://localhost:6379/3", clock=clock, expires=60, sweep_interval=30, sweep_batch=10)
+    
+    calls = []
+    cursors = [5, 9, 0]
+    
+    def run(script, keys, args):
+        calls.append((keys[0], args))
+        return [cursors.pop(0), 1]
+    
+    driver._run = run
+    
+    # first seen: due in sweep_interval seconds
+    driver._wrote_groups(["rcbg:a", "rcbg:b"])
+    assert calls == []
+    
+    clock.advance(30)
+    
+    for i in range(3):
+        driver._wrote_groups(["rcbg:a", "rcbg:b"])
+    
+    # one batch per write, all from the first group due, resuming at the cursor
+    assert calls == [("rcbg:a", [0, 10, 970]), ("rcbg:a", [5, 10, 970]), ("rcbg:a", [9, 10, 970])]
+    assert driver._swept["rcbg:a"] == (0, 1030)
+    
+    cursors.append(0)
+    driver._wrote_groups(["rcbg:a", "rcbg:b"])
+    
+    assert calls[-1][0] == "rcbg:b"
+    
+    for name in ("rcbg:c", "rcbg:d"):
+        driver._wrote_groups([name])
+    
+    assert list(driver._swept) == ["rcbg:b", "rcbg:c", "rcbg:d"]
+    
+    # a failed sweep doesn't fail the write
+    def broken(script, keys, args):
+        raise errors.DistributedBackendProblem()
+    
+    driver._run = broken
+    clock.advance(30)
+    driver._wrote_groups(["rcbg:c"])
+    
+    assert driver._swept["rcbg:c"] == (0, 1030)
+    assert not driver._sweeping
+        
+def test_url():
+    driver = registry.from_url("redis://localhost:6379/3?layout=grouped&separator=/&prefix=app:&sweep_interval=30", expires=60)
+    
+    assert isinstance(driver, GroupedRedisDriver)
+    assert driver.key("payments/tenant-1") == "app:payments"
+    assert driver.encoding == "grouped"
+    assert driver.expires == 60
+    assert driver.redis.connection_pool.connection_kwargs['db'] == 3
+    assert driver.sweep_interval == 30
+    assert registry.from_url("redis://localhost:6379/3?layout=grouped&sweep_batch=500").sweep_batch == 500
+    
+    # only the grouped layout has groups
+    with pytest.raises(ValueError):
+        registry.from_url("redis://localhost:6379/3?separator=/")
+        
+    with pytest.raises(ValueError):
+        registry.from_url("redis://localhost:6379/3", sweep_interval=10)
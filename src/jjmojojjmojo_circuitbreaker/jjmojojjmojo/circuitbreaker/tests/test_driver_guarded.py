@@ -0,0 +1,235 @@
+"""
+Unit Tests for the GuardedDriver wrapper.
+"""
+
+from ..drivers import GuardedDriver, MemoryDriver
+from ..drivers.guarded import POLICY_FAIL_OPEN, POLICY_FAIL_CLOSED
+from ..base import STATUS_OPEN, STATUS_CLOSED, CircuitBreaker
+from ..clock import ManualClock, SyncedClock
+from .. import errors
+from . import util
+import time
+import pytest
+
+def test_bad_arguments():
+    """
+    Make sure bad drivers and policies are rejected.
+    """
+    with pytest.raises(AttributeError):
+        GuardedDriver(True)
+
+    with pytest.raises(ValueError):
+        GuardedDriver(MemoryDriver(), policy="maybe")
+
+def test_healthy_passthrough():
+    """
+    While the back-end is healthy, operations go to the wrapped driver, and
+    the last-known state is mirrored locally.
+    """
+    backend = util.SlowDriver()
+    driver = GuardedDriver(backend)
+
+    driver.new("hello")
+    driver.failure("hello")
+    driver.open("hello")
+
+    assert backend.state["hello"]["failures"] == 1
+    assert backend.state["hello"]["status"] == STATUS_OPEN
+    assert driver.load("hello")["status"] == STATUS_OPEN
+    assert driver.local.state["hello"]["failures"] == 1
+    assert driver.healthy
+
+    driver.delete("hello")
+
+    with pytest.raises(errors.BackendKeyNotFound):
+        driver.load("hello")
+
+    driver.stop()
+
+def test_deadline_last_known():
+    """
+    A slow back-end is abandoned after the deadline, and the last known state
+    is used from then on without touching the back-end.
+    """
+    backend = util.SlowDriver()
+    driver = GuardedDriver(backend, deadline=0.05, fail_fast=60)
+
+    driver.new("hello")
+    driver.failure("hello")
+
+    backend.delay = 1
+    calls = backend.calls
+
+    start = time.time()
+    info = driver.load("hello")
+    assert time.time() - start < 0.5
+
+    assert info["failures"] == 1
+    assert not driver.healthy
+    assert driver.trips == 1
+
+    start = time.time()
+    for i in range(100):
+        driver.load("hello")
+    assert driver.failure("hello") == 2
+    assert time.time() - start < 0.1
+
+    assert backend.calls == calls + 1
+
+    driver.stop()
+
+def test_fail_open():
+    """
+    With the fail-open policy, breakers look closed while the back-end is down.
+    """
+    driver = GuardedDriver(util.AlwaysFailDriver(fail_on="all"), policy=POLICY_FAIL_OPEN, fail_fast=60)
+
+    info = driver.load("hello")
+
+    assert info["status"] == STATUS_CLOSED
+    assert info["failures"] == 0
+    assert driver.failure("hello") == 0
+    assert not driver.healthy
+
+    driver.stop()
+
+def test_fail_closed():
+    """
+    With the fail-closed policy, every operation raises DistributedBackendProblem
+    while the back-end is down.
+    """
+    driver = GuardedDriver(util.AlwaysFailDriver(fail_on="all"), policy=POLICY_FAIL_CLOSED, fail_fast=60)
+
+    breaker = CircuitBreaker(subject=util.succeed, key="hello", driver=driver)
+
+    with pytest.raises(errors.DistributedBackendProblem):
+        breaker()
+
+    with pytest.raises(errors.DistributedBackendProblem):
+        driver.failure("hello")
+
+    driver.stop()
+
+def test_recovery():
+    """
+    The back-end is checked in the background, and used again once it responds.
+    """
+    backend = util.AlwaysFailDriver(fail_on="all")
+    driver = GuardedDriver(backend, fail_fast=0.1, recovery_interval=0.05)
+
+    breaker = CircuitBreaker(subject=util.succeed, key="hello", driver=driver)
+
+    assert breaker() == True
+    assert not driver.healthy
+
+    backend.fail_on = None
+
+    time.sleep(0.5)
+
+    assert driver.healthy
+    assert breaker() == True
+    assert "hello" in backend.state
+
+    driver.stop()
+
+def test_recovery_with_hung_workers():
+    """
+    The recovery ping doesn't wait behind operations that are still hanging.
+    """
+    backend = util.SlowDriver()
+    driver = GuardedDriver(backend, deadline=0.05, workers=1, fail_fast=0.1, recovery_interval=0.05)
+
+    driver.new("hello")
+
+    # the only worker is stuck in this load for a second
+    backend.delay = 1
+    driver.load("hello")
+    assert not driver.healthy
+
+    time.sleep(0.4)
+
+    assert driver.healthy
+
+    driver.stop()
+
+def test_mirror_size():
+    """
+    The last-known copy goes through the MemoryDriver, so it's bounded.
+    """
+    driver = GuardedDriver(MemoryDriver(), mirror_size=2)
+
+    for key in ("a", "b", "c"):
+        driver.new(key)
+
+    driver.load("a")
+    driver.new("d")
+
+    assert list(driver.local.state) == ["a", "d"]
+    assert driver.local.evicted == 3
+
+    driver.delete("b")
+    driver.delete("d")
+
+    assert list(driver.local.state) == ["a"]
+
+    driver.stop()
+
+def test_keys_deadline():
+    """
+    keys() is held to the deadline like every other operation, including the
+    scan itself, and falls back to the in-memory copy.
+    """
+    class SlowKeys(util.SlowDriver):
+        def keys(self, pattern="*"):
+            for key in MemoryDriver.keys(self, pattern):
+                self._wait()
+                yield key
+
+    backend = SlowKeys()
+    driver = GuardedDriver(backend, deadline=0.05, fail_fast=60)
+
+    driver.new("hello")
+    driver.new("world")
+
+    assert sorted(driver.keys()) == ["hello", "world"]
+
+    backend.delay = 1
+
+    start = time.time()
+    assert sorted(driver.keys("h*")) == ["hello"]
+    assert time.time() - start < 0.5
+    assert not driver.healthy
+
+    driver.stop()
+
+def test_sync_clock():
+    """
+    The clock is synced to the wrapped driver's server_time(), and now() reads
+    the synced clock.
+    """
+    backend_clock = ManualClock(1000)
+
+    class Backend(MemoryDriver):
+        def server_time(self):
+            return backend_clock.now()
+
+    backend = Backend(clock=ManualClock(995))
+    driver = GuardedDriver(backend)
+
+    clock = driver.sync_clock(interval=30)
+
+    assert isinstance(clock, SyncedClock)
+    assert driver.server_time() == 1000
+    assert driver.now() == 1000
+    assert clock.skew == 5
+
+    driver.new("hello")
+    assert backend.state["hello"]["checkin"] == 1000
+    assert driver.local.state["hello"]["checkin"] == 1000
+
+    driver._trip()
+
+    with pytest.raises(errors.DistributedBackendProblem):
+        driver.server_time()
+
+    driver.stop()
@@ -3,8 +3,9 @@ Unit Tests for the MemoryDriver back-end.
 """
 
 from ..drivers import MemoryDriver
-from ..base import STATUS_OPEN, STATUS_CLOSED
+from ..base import STATUS_OPEN, STATUS_CLOSED, STATUS_RAMPING
 from ..errors import BackendKeyNotFound
+from ..clock import ManualClock
 from . import util
 import time
 import pytest
@@ -61,12 +62,302 @@ def test_expiry():
     Make sure that the storage expires.
     """
     
-    driver = MemoryDriver(expires=1)
+    clock = ManualClock(1000.0)
+    
+    driver = MemoryDriver(expires=1, clock=clock)
     
     driver.state["hello"] = driver.default()
     
-    time.sleep(1)
+    clock.advance(1)
     
     driver.expire("hello", driver.state["hello"]["checkin"])
     
-    assert "hello" not in driver.state
\ No newline at end of file
+    assert "hello" not in driver.state
+
+def test_snapshot(tmp_path):
+    """
+    The state survives a restart, minus the breakers that have expired.
+    """
+    path = str(tmp_path / "breakers.snapshot")
+    clock = ManualClock(1000.0)
+    
+    driver = MemoryDriver(expires=60, clock=clock, snapshot=path, snapshot_interval=60)
+    
+    assert driver.state == {}
+    
+    driver.new("down")
+    driver.failure("down", 5)
+    driver.open("down")
+    driver.new("stale")
+    driver.new("ünïcode")
+    
+    clock.advance(30)
+    driver.new("fresh")
+    
+    driver.stop()
+    driver.stop()
+    
+    restarted = MemoryDriver(expires=60, clock=clock, snapshot=path)
+    
+    assert restarted.state["down"] == {'failures': 5, 'status': STATUS_OPEN, 'checkin': 1000.0}
+    assert sorted(restarted.state) == ["down", "fresh", "stale", "ünïcode"]
+    
+    restarted.stop()
+    
+    clock.advance(30)
+    
+    restarted = MemoryDriver(expires=60, clock=clock, snapshot=path)
+    
+    assert sorted(restarted.state) == ["fresh"]
+    
+    restarted.stop()
+
+def test_snapshot_saver(tmp_path):
+    """
+    Changes are saved in the background, and nothing is written when nothing
+    has changed.
+    """
+    path = tmp_path / "breakers.snapshot"
+    
+    driver = MemoryDriver(snapshot=str(path), snapshot_interval=0.01)
+    driver.new("hello")
+    
+    deadline = time.time() + 5
+    while not path.exists() and time.time() < deadline:
+        time.sleep(0.01)
+    
+    reader = MemoryDriver(snapshot=str(path), snapshot_interval=60)
+    assert reader.state.keys() == {"hello"}
+    
+    modified = path.stat().st_mtime_ns
+    time.sleep(0.05)
+    assert path.stat().st_mtime_ns == modified
+    
+    driver.stop()
+    reader.stop()
+
+def test_snapshot_unsaveable(tmp_path):
+    """
+    Breakers the snapshot format can't hold are left out, and don't stop the
+    background saver.
+    """
+    path = tmp_path / "breakers.snapshot"
+    
+    driver = MemoryDriver(snapshot=str(path), snapshot_interval=0.01)
+    driver.new("x" * 70000)
+    driver.new("float")
+    driver.update("float", failures=1.5)
+    driver.new("hello")
+    
+    deadline = time.time() + 5
+    while not path.exists() and time.time() < deadline:
+        time.sleep(0.01)
+    
+    reader = MemoryDriver(snapshot=str(path), snapshot_interval=60)
+    assert reader.state.keys() == {"hello"}
+    
+    driver.new("world")
+    
+    deadline = time.time() + 5
+    while reader.load_snapshot() < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    
+    assert reader.state.keys() == {"hello", "world"}
+    assert driver._saver.is_alive()
+    
+    driver.stop()
+    reader.stop()
+
+def test_snapshot_damaged(tmp_path):
+    """
+    A missing or damaged snapshot is ignored.
+    """
+    path = tmp_path / "breakers.snapshot"
+    
+    driver = MemoryDriver(snapshot=str(path))
+    assert driver.load_snapshot() == 0
+    
+    driver.new("hello")
+    driver.stop()
+    
+    data = path.read_bytes()
+    
+    for damaged in (b"", b"RCBS", b"XXXX" + data[4:], data[:-2]):
+        path.write_bytes(damaged)
+        driver = MemoryDriver(snapshot=str(path))
+        assert driver.state == {}
+        driver.stop()
+
+def test_transition():
+    """
+    Transitions only happen from the expected statuses, and concurrent 
+    failures are all counted.
+    """
+    driver = MemoryDriver()
+    
+    assert driver.transition("hello", (STATUS_OPEN,), STATUS_CLOSED) is False
+    assert driver.load("hello")['status'] == STATUS_CLOSED
+    
+    assert driver.transition("hello", (STATUS_CLOSED, STATUS_RAMPING), STATUS_OPEN) is True
+    assert driver.transition("hello", (STATUS_CLOSED, STATUS_RAMPING), STATUS_OPEN) is False
+    
+    driver.failure("hello", 3)
+    
+    assert driver.transition("hello", (STATUS_OPEN,), STATUS_RAMPING, failures=0) is True
+    assert driver.load("hello") == {'failures': 0, 'status': STATUS_RAMPING, 'checkin': pytest.approx(time.time(), abs=1)}
+    
+    # new() doesn't overwrite a breaker another thread created
+    driver.failure("hello")
+    assert driver.new("hello")['failures'] == 1
+    
+def test_expiry_sweeping():
+    """
+    Breakers that are never loaded again are removed by later writes.
+    """
+    clock = ManualClock(100)
+    driver = MemoryDriver(expires=10, clock=clock)
+    
+    for i in range(100):
+        driver.new(f"tenant-{i}")
+        
+    clock.advance(5)
+    driver.new("recent")
+    driver.transition("tenant-0", (STATUS_CLOSED,), STATUS_OPEN)
+    
+    clock.advance(6)
+    driver.new("another")
+    
+    # tenant-0 checked in later, it gets another 10 seconds
+    assert sorted(driver.state) == ["another", "recent", "tenant-0"]
+    assert driver.expired == 99
+    
+    clock.advance(9)
+    
+    assert driver.sweep() == 2
+    assert sorted(driver.state) == ["another"]
+    assert driver.stats()['scheduled'] == 1
+    
+    driver.delete("another")
+    
+    assert driver.stats()['scheduled'] == 0
+    
+def test_expiry_without_inserts():
+    """
+    Reads and writes of other breakers remove the expired ones, when no new 
+    breakers are created.
+    """
+    clock = ManualClock(100)
+    driver = MemoryDriver(expires=10, clock=clock)
+    
+    for i in range(10):
+        driver.new(f"tenant-{i}")
+        
+    clock.advance(5)
+    driver.update("tenant-0", checkin=clock.now())
+    
+    clock.advance(6)
+    
+    assert driver.load("tenant-0")['checkin'] == 105
+    assert sorted(driver.state) == ["tenant-0"]
+    assert driver.expired == 9
+    
+    clock.advance(10)
+    
+    assert list(driver.keys()) == []
+    
+def test_max_entries():
+    """
+    The least recently used breakers are evicted.
+    """
+    driver = MemoryDriver(max_entries=3)
+    
+    for key in ("a", "b", "c"):
+        driver.new(key)
+        
+    driver.load("a")
+    driver.failure("b")
+    driver.new("d")
+    
+    assert list(driver.state) == ["a", "b", "d"]
+    
+    driver.update("e", status=STATUS_OPEN)
+    driver.transition("f", (STATUS_CLOSED,), STATUS_OPEN)
+    
+    assert list(driver.state) == ["d", "e", "f"]
+    
+    stats = driver.stats()
+    
+    assert stats['breakers'] == 3
+    assert stats['evicted'] == 3
+    assert stats['expired'] == 0
+    assert stats['memory'] > 0
+    
+    with pytest.raises(ValueError):
+        MemoryDriver(max_entries=0)
+    
+def test_bucket_expiry():
+    """
+    Idle token buckets are dropped once they would be full again, or after 
+    the expiry if they don't refill, and there are never more than 
+    max_entries of them.
+    """
+    clock = ManualClock(100)
+    driver = MemoryDriver(expires=60, clock=clock, max_entries=2)
+    
+    assert driver.take_tokens("refills", 10, 10, rate=2) == (10, 0)
+    assert driver.take_tokens("deposits", 10, 10) == (10, 0)
+    
+    clock.advance(4)
+    assert driver.take_tokens("refills", 0, 10, rate=2) == (0, 8)
+    
+    clock.advance(2)
+    driver.sweep()
+    assert sorted(driver.buckets) == ["deposits"]
+    
+    clock.advance(60)
+    driver.sweep()
+    assert driver.buckets == {}
+    assert driver.stats()['scheduled'] == 0
+    
+    for key in ("a", "b", "c"):
+        driver.take_tokens(key, 1, 10)
+        
+    assert list(driver.buckets) == ["b", "c"]
+    assert driver.stats()['buckets'] == 2
+    assert driver.stats()['scheduled'] == 2
+    
+    driver = MemoryDriver(clock=clock)
+    driver.take_tokens("forever", 1, 10)
+    clock.advance(3600)
+    driver.sweep()
+    
+    assert driver.take_tokens("forever", 10, 10) == (9, 0)
+    
+def test_histogram_expiry():
+    """
+    Histograms are dropped when their window ends, and there are never more 
+    than max_entries of them.
+    """
+    clock = ManualClock(100)
+    driver = MemoryDriver(clock=clock, max_entries=2)
+    
+    assert driver.merge_histogram("slow", {1: 2}, 10) == {1: 2}
+    
+    clock.advance(5)
+    assert driver.merge_histogram("slow", {1: 1}, 10) == {1: 3}
+    assert driver.merge_histogram("fast", {0: 1}, 60) == {0: 1}
+    
+    clock.advance(5)
+    driver.sweep()
+    assert list(driver.histograms) == ["fast"]
+    
+    for key in ("a", "b"):
+        driver.merge_histogram(key, {0: 1}, 60)
+        
+    assert list(driver.histograms) == ["a", "b"]
+    assert driver.stats()['histograms'] == 2
+    
+    driver.clear_histogram("a", 60)
+    driver.clear_histogram("b", 60)
+    
+    assert driver.stats()['scheduled'] == 0
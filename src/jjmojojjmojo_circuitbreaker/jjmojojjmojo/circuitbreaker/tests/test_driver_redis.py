@@ -6,6 +6,7 @@ distribution.
 """
 from ..drivers.redis import RedisDriver
 from ..errors import DistributedBackendProblem
+from ..base import STATUS_OPEN
 import pytest
 import redis
 
@@ -56,4 +57,150 @@ def test_update_without_params():
     """
     driver = RedisDriver(redis_url="redis://", prefix="test:")
     with pytest.raises(ValueError):
-        driver.update("mykey")
\ No newline at end of file
+        driver.update("mykey")
+
+def test_encoding_argument():
+    """
+    Raise an error for an unknown encoding.
+    """
+    with pytest.raises(AttributeError):
+        RedisDriver(redis_url="redis://", encoding="json")
+        
+def test_packed_encoding():
+    """
+    Round-trip breaker info through the packed encoding.
+    """
+    driver = RedisDriver(redis_url="redis://", encoding="packed")
+    
+    info = {'failures': 12, 'status': STATUS_OPEN, 'checkin': 1500000000.25}
+    packed = driver._pack(info)
+    
+    assert len(packed) == 13
+    assert driver._decode(packed) == info
+    
+    # BITFIELD INCRBY on a missing key only creates the failures bytes
+    assert driver._decode(b"\x00\x00\x00\x03") == {'failures': 3, 'status': 0, 'checkin': 0}
+    
+    assert driver._bitfield("test", status=STATUS_OPEN, checkin=2.5) == [
+        "BITFIELD", "rcb:test", "SET", "u8", 32, STATUS_OPEN, "SET", "i64", 40, 2500000]
+    
+class FakeReplica:
+    """
+    Just enough of a redis connection to stand in for a read replica.
+    """
+    class connection_pool:
+        @staticmethod
+        def reset():
+            pass
+        
+    def __init__(self, data, link="up", lag=0):
+        self.data = data
+        self.link = link
+        self.lag = lag
+        self.broken = False
+        self.commands = []
+        
+    def info(self, section=None):
+        if self.broken:
+            raise redis.ConnectionError("replica is down")
+        return {'role': 'slave', 'master_link_status': self.link, 'master_last_io_seconds_ago': self.lag, 'master_sync_in_progress': 0}
+    
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+    
+class FakePipeline:
+    def __init__(self, replica):
+        self.replica = replica
+        self.queued = []
+        
+    def hgetall(self, name):
+        self.queued.append(name)
+        
+    def __len__(self):
+        return len(self.queued)
+        
+    def execute(self, raise_on_error=True):
+        if self.replica.broken:
+            raise redis.ConnectionError("replica is down")
+        self.replica.commands.extend(self.queued)
+        return [self.replica.data.get(name, {}) for name in self.queued]
+    
+class DownPrimary(FakeReplica):
+    """
+    A primary that fails every command, so reads that reach it fail fast.
+    """
+    def __init__(self):
+        FakeReplica.__init__(self, {})
+        self.broken = True
+        
+    def register_script(self, script):
+        return self.__getattr__("script")
+    
+    def __getattr__(self, command):
+        def fail(*args, **kwargs):
+            self.commands.append(command)
+            raise redis.ConnectionError("primary is down")
+        return fail
+    
+def test_replica_loads():
+    """
+    Loads are spread over healthy replicas, and fall back to the primary.
+    """
+    stored = {b'failures': b'2', b'status': str(STATUS_OPEN).encode(), b'checkin': b'10.5'}
+    
+    first = FakeReplica({"rcb:a": stored, "rcb:b": stored})
+    second = FakeReplica({"rcb:a": stored})
+    
+    driver = RedisDriver(redis_connection=DownPrimary(), replica_connections=[first, second])
+    
+    assert driver.load("a") == {'failures': 2, 'status': STATUS_OPEN, 'checkin': 10.5}
+    assert driver.load("a")['failures'] == 2
+    assert first.commands == ["rcb:a"]
+    assert second.commands == ["rcb:a"]
+    
+    # the primary is asked for anything a replica doesn't have
+    assert driver.load_many(["a", "b"]) == {'a': driver._decode(stored), 'b': driver._decode(stored)}
+    
+    with pytest.raises(DistributedBackendProblem):
+        driver.load_many(["a", "b"])
+        
+    # stale and failed replicas are skipped until their next check
+    second.lag = 60
+    driver.replicas[1].checked = None
+    first.broken = True
+    
+    with pytest.raises(DistributedBackendProblem):
+        driver.load("a")
+        
+    assert [replica.healthy for replica in driver.replicas] == [False, False]
+    assert driver.replicas[0].errors == 1
+    assert driver.replicas[1].lag == 60
+    assert driver.replicas[1].dict()['reads'] == 2
+    
+    first.broken = False
+    driver.replica_check_interval = 0
+    
+    assert driver.load("a")['failures'] == 2
+    assert driver.replicas[0].healthy
+    
+def test_replica_sees_own_writes():
+    """
+    Breakers written by the driver are read from the primary for a while.
+    """
+    stored = {b'failures': b'0', b'status': str(STATUS_OPEN).encode(), b'checkin': b'10.5'}
+    replica = FakeReplica({"rcb:a": stored})
+    
+    driver = RedisDriver(redis_connection=DownPrimary(), replica_connections=[replica], stick_to_primary=60)
+    
+    with pytest.raises(DistributedBackendProblem):
+        driver.failure("a")
+        
+    with pytest.raises(DistributedBackendProblem):
+        driver.load("a")
+        
+    assert replica.commands == []
+    assert driver.redis.commands == ["script", "hgetall"]
+    
+    driver.stick_to_primary = 0
+    
+    assert driver.load("a")['failures'] == 0
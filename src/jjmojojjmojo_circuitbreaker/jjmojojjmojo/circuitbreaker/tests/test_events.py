@@ -0,0 +1,131 @@
+"""
+Unit Tests for the transition event logs.
+
+The RedisStreamEventLog is exercised in the func/ directory.
+"""
+
+from ..events import FileEventLog, EventLog, EVENT_OPEN, EVENT_CLOSE, EVENT_RESET
+from ..base import CircuitBreaker, STATUS_CLOSED
+from .. import errors
+from . import util
+import time
+import pytest
+
+def test_breaker_transitions(tmp_path):
+    """
+    Open, close and reset are all recorded.
+    """
+    log = FileEventLog(str(tmp_path / "events.log"), flush_interval=0.05)
+
+    breaker = CircuitBreaker(
+        key="test",
+        subject=util.fail,
+        driver=util.MemoryDriver(),
+        failures=1,
+        timeout=0,
+        jitter=0,
+        events=log)
+
+    with pytest.raises(Exception):
+        breaker()
+
+    with pytest.raises(errors.CircuitBreakerOpen):
+        breaker()
+
+    breaker.subject = util.succeed
+
+    assert breaker() == True
+
+    breaker.reset()
+
+    log.flush()
+
+    events = log.tail()
+
+    assert [e['event'] for e in events] == [EVENT_OPEN, EVENT_CLOSE, EVENT_RESET]
+    assert events[0]['key'] == "test"
+    assert events[0]['failures'] == 1
+    assert events[0]['timestamp'] <= events[1]['timestamp'] <= events[2]['timestamp']
+    assert events[0]['host'] == log.host
+
+    log.stop()
+
+def test_tail_and_range(tmp_path):
+    """
+    Check the reader API.
+    """
+    log = FileEventLog(str(tmp_path / "events.log"), flush_interval=0.05, batch_size=7)
+
+    for i in range(20):
+        log.record(EVENT_OPEN, f"key{i}", i, 1000+i)
+
+    log.flush()
+
+    assert [e['key'] for e in log.tail(3)] == ["key17", "key18", "key19"]
+    assert [e['failures'] for e in log.range(1005, 1008)] == [5, 6, 7, 8]
+    assert [e['failures'] for e in log.range(start=1010, count=2)] == [10, 11]
+    assert len(log.range(end=1004)) == 5
+
+    log.stop()
+
+def test_file_bounded(tmp_path):
+    """
+    The file is rotated, so the log stays bounded.
+    """
+    path = tmp_path / "events.log"
+    log = FileEventLog(str(path), max_bytes=1024, flush_interval=0.05, batch_size=1)
+
+    for i in range(200):
+        log.record(EVENT_OPEN, "key", i, i)
+
+    log.flush()
+
+    assert path.stat().st_size < 1024 + 200
+    assert 0 < len(log.tail(500)) < 200
+    assert log.tail(1)[0]['failures'] == 199
+
+    log.stop()
+
+def test_never_blocks():
+    """
+    When the queue is full, events are dropped instead of blocking the caller.
+    """
+    class StuckEventLog(EventLog):
+        def write(self, events):
+            time.sleep(10)
+
+    log = StuckEventLog(queue_size=5, batch_size=1)
+
+    for i in range(20):
+        log.record(EVENT_OPEN, "key", i, i)
+
+    assert log.dropped >= 14
+
+def test_transitions_recorded_once(tmp_path):
+    """
+    When several clients open (or close) the same breaker, only the one that
+    changed it records the event.
+    """
+    log = FileEventLog(str(tmp_path / "events.log"), flush_interval=0.05)
+    driver = util.MemoryDriver()
+
+    breakers = [
+        CircuitBreaker(key="shared", subject=util.succeed, driver=driver, events=log)
+        for i in range(3)
+    ]
+
+    for breaker in breakers:
+        breaker.load()
+
+    for breaker in breakers:
+        breaker.open()
+
+    for breaker in breakers:
+        breaker.close()
+
+    log.flush()
+
+    assert [event['event'] for event in log.tail(10)] == [EVENT_OPEN, EVENT_CLOSE]
+    assert all(breaker.status == STATUS_CLOSED for breaker in breakers)
+
+    log.stop()
@@ -0,0 +1,223 @@
+"""
+Unit Tests for fork safety.
+"""
+
+from ..drivers import MemoryDriver, GuardedDriver
+from ..drivers.memory import FORK_KEEP
+from ..drivers.redis import RedisDriver
+from ..errors import BackendKeyNotFound, DistributedBackendProblem
+from ..events import EventLog, EVENT_OPEN
+from .. import fork
+from . import util
+import json
+import os
+import threading
+import pytest
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "register_at_fork"), reason="requires os.fork()")
+
+def in_child(func):
+    """
+    Run func in a forked child process, return its (JSON-serializable) result.
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(read)
+        try:
+            result = json.dumps(func()).encode()
+        except BaseException as e:
+            result = json.dumps({'error': repr(e)}).encode()
+        os.write(write, result)
+        os._exit(0)
+
+    os.close(write)
+
+    chunks = []
+    while True:
+        chunk = os.read(read, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+
+    os.close(read)
+    os.waitpid(pid, 0)
+
+    return json.loads(b"".join(chunks))
+
+def test_memory_driver():
+    """
+    The child starts with an empty MemoryDriver by default, or a copy of the
+    parent's state if asked.
+    """
+    reset = MemoryDriver()
+    keep = MemoryDriver(fork=FORK_KEEP)
+
+    for driver in (reset, keep):
+        driver.new("test")
+        driver.open("test")
+
+    assert in_child(lambda: [list(reset.state), list(keep.state), reset.pid == os.getpid()]) == [[], ["test"], True]
+
+    assert list(reset.state) == ["test"]
+
+    with pytest.raises(ValueError):
+        MemoryDriver(fork="share")
+
+def test_check_fork():
+    """
+    A fork that skipped the at-fork hooks is noticed lazily.
+    """
+    driver = MemoryDriver()
+    driver.new("test")
+    driver.pid = -1
+
+    driver.check_fork()
+
+    assert driver.pid == os.getpid()
+    assert driver.state == {}
+
+def test_pid_change():
+    """
+    Driver methods notice a PID change without the at-fork hooks, before they
+    take a lock the child may have inherited while it was held.
+    """
+    driver = MemoryDriver()
+    driver.new("test")
+    
+    # as if another thread held the lock when the process forked
+    driver._lock.acquire()
+    driver.pid = -1
+    
+    errors = []
+    
+    def load():
+        try:
+            driver.load_shared("test")
+        except Exception as e:
+            errors.append(e)
+    
+    # in a daemon thread, so a regression fails instead of hanging
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+    thread.join(5)
+    
+    assert not thread.is_alive()
+    assert [type(e) for e in errors] == [BackendKeyNotFound]
+        
+    assert driver.pid == os.getpid()
+    
+    driver.new("child")
+    
+    assert list(driver.state) == ["child"]
+
+def test_pid_change_redis():
+    """
+    The RedisDriver calls after_fork() from its methods, too.
+    """
+    class ForkCountingDriver(RedisDriver):
+        forks = 0
+        def after_fork(self):
+            RedisDriver.after_fork(self)
+            self.forks += 1
+    
+    # nothing listening, the calls fail after the check
+    driver = ForkCountingDriver(redis_url="redis://127.0.0.1:1/0")
+    driver.pid = -1
+    
+    with pytest.raises(DistributedBackendProblem):
+        driver.ping()
+        
+    with pytest.raises(DistributedBackendProblem):
+        driver.load("test")
+    
+    assert driver.forks == 1
+    assert driver.pid == os.getpid()
+
+def test_guarded_driver():
+    """
+    The thread pool is replaced in the child, so calls still meet their deadline.
+    """
+    driver = util.SlowDriver()
+    driver.fork = FORK_KEEP
+
+    guarded = GuardedDriver(driver, deadline=1, workers=1)
+    guarded.new("test")
+
+    def child():
+        guarded.failure("test")
+        return [guarded.healthy, guarded.load("test")['failures']]
+
+    # the parent's only worker thread doesn't exist in the child
+    assert in_child(child) == [True, 1]
+
+    guarded.stop()
+
+def test_event_log():
+    """
+    Events queued in the parent are left for the parent to write, and the child
+    starts its own batcher.
+    """
+    class ListEventLog(EventLog):
+        def write(self, events):
+            self.written.extend(events)
+
+    log = ListEventLog(flush_interval=0.05)
+    log.written = []
+
+    log.record(EVENT_OPEN, "parent", 1, 0)
+    log.flush()
+
+    def child():
+        log.record(EVENT_OPEN, "child", 2, 0)
+        log.flush()
+        return [event['key'] for event in log.written]
+
+    assert in_child(child) == ["parent", "child"]
+
+    log.stop()
+
+def test_register():
+    """
+    Registered objects are only held weakly.
+    """
+    class Thing:
+        forks = 0
+        def after_fork(self):
+            self.forks += 1
+
+    thing = Thing()
+    fork.register(thing)
+
+    assert in_child(lambda: thing.forks) == 1
+    assert thing.forks == 0
+
+    del thing
+
+    assert not any(isinstance(obj, Thing) for obj in fork._registered)
+
+def test_memory_driver_snapshot(tmp_path):
+    """
+    With a snapshot, the child starts from the snapshot, and saves its own.
+    """
+    path = str(tmp_path / "breakers.snapshot")
+    
+    driver = MemoryDriver(snapshot=path, snapshot_interval=60)
+    driver.new("saved")
+    driver.save_snapshot()
+    driver.new("unsaved")
+    
+    def child():
+        keys = sorted(driver.state)
+        driver.new("child")
+        driver.stop()
+        return [keys, driver._saver is None]
+    
+    assert in_child(child) == [["saved"], True]
+    
+    reader = MemoryDriver(snapshot=path, snapshot_interval=60)
+    assert sorted(reader.state) == ["child", "saved"]
+    
+    reader.stop()
+    driver.stop()
@@ -0,0 +1,171 @@
+"""
+Unit tests for the per-host breakers, the requests adapter and the httpx
+transport.
+"""
+
+from ..hosts import HostBreakers
+from ..drivers import MemoryDriver
+from ..base import STATUS_OPEN
+from ..errors import CircuitBreakerOpen
+import http.server
+import socket
+import threading
+import pytest
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Responds with the status in the path (e.g. /503), over keep-alive
+    connections. Records the client address of each request.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.seen.append(self.client_address)
+
+        body = b"ok"
+        self.send_response(int(self.path.strip("/") or 200))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    """
+    A local HTTP server, yields its base URL and the list of client addresses
+    it has seen.
+    """
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.seen = []
+    httpd.daemon_threads = True
+
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{httpd.server_port}", httpd.seen
+
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture
+def closed_port():
+    """
+    A port nothing is listening on.
+    """
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+def test_host_breakers():
+    """
+    One breaker per origin, created once, with default ports filled in.
+    """
+    driver = MemoryDriver()
+    breakers = HostBreakers(driver, lambda: True, failures=2, jitter=0)
+
+    breaker = breakers.for_url("https://Example.com/a?b=c")
+
+    assert breaker.key == "http:https://example.com:443"
+    assert breaker.max_failures == 2
+    assert breaker.driver is driver
+    assert breakers.for_url("https://example.com:443/other") is breaker
+    assert breakers.for_url("http://example.com/").key == "http:http://example.com:80"
+    assert breakers.breaker("http", "::1", 8080).key == "http:http://[::1]:8080"
+    assert len(breakers) == 3
+    assert sorted(breakers.dict()) == ["http://[::1]:8080", "http://example.com:80", "https://example.com:443"]
+
+    with pytest.raises(ValueError):
+        breakers.for_url("/relative")
+
+    with pytest.raises(AttributeError):
+        HostBreakers(object(), lambda: True)
+
+    assert isinstance(HostBreakers("memory://", lambda: True).driver, MemoryDriver)
+
+def test_requests_adapter(server, closed_port):
+    """
+    5xx responses and connection errors open a host's breaker, other hosts are
+    left alone, and connections are re-used.
+    """
+    requests = pytest.importorskip("requests")
+    from ..adapters import mount
+
+    url, seen = server
+    session = requests.Session()
+    adapter = mount(session, MemoryDriver(), failures=2, breaker_options={'jitter': 0})
+
+    assert session.get_adapter("https://example.com") is adapter
+
+    for i in range(3):
+        assert session.get(f"{url}/200").status_code == 200
+
+    # one socket for all of them
+    assert len(set(seen)) == 1
+
+    assert session.get(f"{url}/404").status_code == 404
+    assert session.get(f"{url}/503").status_code == 503
+    assert session.get(f"{url}/500").status_code == 500
+
+    with pytest.raises(CircuitBreakerOpen):
+        session.get(f"{url}/200")
+
+    # rejected without reaching the server
+    assert len(seen) == 6
+    assert adapter.breaker(url).status == STATUS_OPEN
+
+    down = f"http://127.0.0.1:{closed_port}/"
+
+    for i in range(2):
+        with pytest.raises(requests.ConnectionError):
+            session.get(down)
+
+    with pytest.raises(CircuitBreakerOpen):
+        session.get(down)
+
+    assert len(adapter.breakers) == 2
+
+def test_httpx_transport():
+    """
+    5xx responses and transport errors open a host's breaker, and the wrapped
+    transport isn't called while it's open.
+    """
+    httpx = pytest.importorskip("httpx")
+    from ..transports import BreakerTransport
+
+    sent = []
+
+    def handler(request):
+        sent.append(request.url)
+
+        if request.url.host == "down.example.com":
+            raise httpx.ConnectError("refused", request=request)
+
+        return httpx.Response(int(request.url.path.strip("/")))
+
+    transport = BreakerTransport(MemoryDriver(), httpx.MockTransport(handler), failures=2, breaker_options={'jitter': 0})
+    client = httpx.Client(transport=transport)
+
+    assert client.get("https://up.example.com/404").status_code == 404
+    assert client.get("https://up.example.com/502").status_code == 502
+    assert client.get("https://up.example.com/503").status_code == 503
+
+    with pytest.raises(CircuitBreakerOpen):
+        client.get("https://up.example.com/200")
+
+    for i in range(2):
+        with pytest.raises(httpx.ConnectError):
+            client.get("https://down.example.com/200")
+
+    with pytest.raises(CircuitBreakerOpen):
+        client.get("https://down.example.com/200")
+
+    assert len(sent) == 5
+    assert transport.breaker("https://up.example.com").key == "http:https://up.example.com:443"
+
+    with pytest.raises(ValueError):
+        BreakerTransport(MemoryDriver(), httpx.MockTransport(handler), retries=2)
@@ -0,0 +1,242 @@
+"""
+Unit Tests for latency tracking.
+"""
+
+from ..latency import LatencySketch, LatencyMonitor
+from ..base import CircuitBreaker, STATUS_OPEN, STATUS_CLOSED
+from ..drivers import MemoryDriver, GuardedDriver
+from ..drivers.base import Driver
+from ..drivers.guarded import POLICY_FAIL_OPEN
+from ..clock import ManualClock
+from .. import errors
+import random
+import threading
+import time
+import pytest
+
+def test_sketch():
+    """
+    Quantiles are within the relative accuracy, and memory is bounded.
+    """
+    rng = random.Random(1)
+    values = sorted(rng.lognormvariate(-3, 1) for i in range(10000))
+
+    sketch = LatencySketch(accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    assert sketch.count == 10000
+
+    for q in (0.5, 0.9, 0.99, 0.999):
+        exact = values[int(q * 9999)]
+        assert abs(sketch.quantile(q) - exact) / exact <= 0.011
+
+    assert len(sketch.counts) <= sketch.buckets
+
+    # out of range values are clamped
+    sketch.add(0)
+    sketch.add(1000000)
+    assert sketch.quantile(1) == sketch.maximum
+    assert len(sketch.counts) <= sketch.buckets
+
+    assert LatencySketch().quantile(0.5) is None
+
+    with pytest.raises(ValueError):
+        LatencySketch(accuracy=1)
+
+def test_sketch_merge():
+    """
+    Merging counts is the same as adding the values to one sketch.
+    """
+    first = LatencySketch()
+    second = first.empty()
+    both = first.empty()
+
+    for i in range(1, 101):
+        first.add(i / 1000)
+        both.add(i / 1000)
+        second.add(i / 10)
+        both.add(i / 10)
+
+    first.merge({str(index): str(count) for index, count in second.counts.items()})
+
+    assert first.counts == both.counts
+    assert first.count == 200
+    assert first.quantile(0.99) == both.quantile(0.99)
+
+def test_monitor():
+    """
+    Calls are merged every merge_interval, across monitors, and the quantile
+    is only checked once there are enough calls in the window.
+    """
+    clock = ManualClock(1000)
+    driver = MemoryDriver(clock=clock)
+
+    first = LatencyMonitor(driver, "partner", threshold=0.5, quantile=0.9, window=60, merge_interval=5, minimum=20)
+    second = LatencyMonitor(driver, "partner", threshold=0.5, quantile=0.9, window=60, merge_interval=5, minimum=20)
+
+    # the first call merges right away, but there aren't enough calls
+    assert not first.record(1)
+    assert first.merges == 1
+
+    for i in range(9):
+        assert not first.record(1)
+        assert not second.record(1)
+
+    assert first.merges == 1
+    assert first.pending.count == 9
+    assert second.merges == 1
+
+    clock.advance(5)
+
+    assert not first.record(1)
+    assert first.merged.count == 12
+
+    # the shared histogram is over the threshold
+    assert second.record(1)
+    assert second.dict()['calls'] == 21
+    assert second.dict()['latency'] == pytest.approx(1, rel=0.01)
+
+    # a new window starts empty
+    clock.advance(60)
+    assert not first.record(0.1)
+    assert first.merged.count == 1
+
+    first.reset()
+    assert driver.merge_histogram("partner", {}, 60) == {}
+
+    with pytest.raises(ValueError):
+        LatencyMonitor(driver, "partner", threshold=1, quantile=0)
+
+class BrokenHistogramDriver(MemoryDriver):
+    """
+    A driver that can't reach its histograms.
+    """
+    def merge_histogram(self, key, counts, window):
+        raise errors.DistributedBackendProblem()
+
+def test_monitor_backend_down():
+    """
+    If the histogram can't be merged, the calls seen locally are used, and kept
+    for the next merge. With the fail-open policy, nothing trips.
+    """
+    monitor = LatencyMonitor(BrokenHistogramDriver(), "partner", threshold=0.5, merge_interval=0, minimum=2)
+
+    assert not monitor.record(1)
+    assert monitor.record(1)
+    assert monitor.errors == 2
+    assert monitor.pending.count == 2
+
+    guarded = GuardedDriver(BrokenHistogramDriver(), policy=POLICY_FAIL_OPEN, fail_fast=60)
+    monitor = LatencyMonitor(guarded, "partner", threshold=0.5, merge_interval=0, minimum=2)
+
+    assert not monitor.record(1)
+    assert not monitor.record(1)
+    assert not guarded.healthy
+
+    guarded.stop()
+
+def test_monitor_unsupported():
+    """
+    A driver without histograms is handled like a back-end problem, but a 
+    GuardedDriver doesn't mark the back-end unhealthy for it, and keeps the 
+    histogram in its in-memory copy instead.
+    """
+    class NoHistogramDriver(MemoryDriver):
+        merge_histogram = Driver.merge_histogram
+        clear_histogram = Driver.clear_histogram
+
+    monitor = LatencyMonitor(NoHistogramDriver(), "partner", threshold=0.5, merge_interval=0, minimum=2)
+
+    assert not monitor.record(1)
+    assert monitor.record(1)
+    assert monitor.errors == 2
+
+    monitor.reset()
+    assert monitor.errors == 3
+
+    guarded = GuardedDriver(NoHistogramDriver(), fail_fast=60)
+    monitor = LatencyMonitor(guarded, "partner", threshold=0.5, merge_interval=0, minimum=2)
+
+    assert not monitor.record(1)
+    assert monitor.record(1)
+    assert monitor.errors == 0
+    assert guarded.healthy
+    assert guarded.local.histograms["partner"]["counts"]
+
+    guarded.stop()
+
+def test_monitor_unlocked_merge():
+    """
+    Other threads keep recording while a merge is waiting on the back-end, and
+    their calls are counted in the next merge.
+    """
+    merging = threading.Event()
+    release = threading.Event()
+    held = []
+    
+    class SlowDriver(MemoryDriver):
+        def merge_histogram(self, key, counts, window):
+            held.append(monitor._lock.locked())
+            merging.set()
+            release.wait(5)
+            return MemoryDriver.merge_histogram(self, key, counts, window)
+    
+    clock = ManualClock(0)
+    monitor = LatencyMonitor(SlowDriver(clock=clock), "partner", threshold=1, merge_interval=5, minimum=1)
+    
+    thread = threading.Thread(target=monitor.record, args=(0.1,))
+    thread.start()
+    merging.wait(5)
+    
+    # doesn't wait for the merge in flight
+    assert not monitor.record(0.2)
+    assert monitor.dict()['pending'] == 1
+    
+    release.set()
+    thread.join(5)
+    
+    assert held == [False]
+    assert monitor.merges == 1
+    assert monitor.dict()['calls'] == 1
+    
+    clock.advance(5)
+    monitor.record(0.3)
+    
+    assert monitor.dict()['calls'] == 3
+
+def test_breaker():
+    """
+    A breaker whose calls are too slow opens, and the histogram is cleared
+    when it closes again.
+    """
+    driver = MemoryDriver()
+    monitor = LatencyMonitor(driver, "slow", threshold=0.005, merge_interval=0, minimum=3)
+
+    delay = [0.01]
+
+    def subject():
+        time.sleep(delay[0])
+        return "done"
+
+    breaker = CircuitBreaker(driver, subject, "slow", failures=5, timeout=0, jitter=0, latency=monitor)
+
+    assert breaker() == "done"
+    assert breaker() == "done"
+    assert breaker.status == STATUS_CLOSED
+
+    # the call that trips the breaker still returns its result
+    assert breaker() == "done"
+    assert breaker.status == STATUS_OPEN
+    assert breaker.dict()['latency'] == "slow"
+
+    delay[0] = 0
+
+    assert breaker() == "done"
+    assert breaker.status == STATUS_CLOSED
+    assert monitor.merged.count == 1
+
+    for i in range(5):
+        assert breaker() == "done"
+
+    assert breaker.status == STATUS_CLOSED
@@ -0,0 +1,195 @@
+"""
+Unit Tests for failure policies.
+"""
+
+from ..policy import FailurePolicy
+from ..base import CircuitBreaker, STATUS_OPEN, STATUS_CLOSED
+from ..drivers import MemoryDriver
+from .. import errors
+import pytest
+
+class CountingDriver(MemoryDriver):
+    """
+    Counts failure writes.
+    """
+    def __init__(self, expires=None, clock=None):
+        MemoryDriver.__init__(self, expires, clock)
+        self.writes = 0
+        
+    def failure(self, key, amount=1):
+        self.writes += 1
+        return MemoryDriver.failure(self, key, amount)
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        Exception.__init__(self, status)
+        self.status = status
+
+class Response:
+    def __init__(self, status):
+        self.status = status
+
+def raises(exception):
+    def subject(*args, **kwargs):
+        raise exception
+    return subject
+
+def test_weights():
+    """
+    The closest class in the MRO wins, and the result is cached per type.
+    """
+    policy = FailurePolicy(
+        include=(Exception,),
+        exclude=(LookupError,),
+        weights={KeyError: 2, TimeoutError: 3, ConnectionError: 0})
+    
+    assert policy.weight(RuntimeError()) == 1
+    assert policy.weight(IndexError()) == 0
+    assert policy.weight(KeyError()) == 2
+    assert policy.weight(TimeoutError()) == 3
+    assert policy.weight(ConnectionRefusedError()) == 0
+    assert policy.weight(KeyboardInterrupt()) == 0
+    
+    assert policy._cache[IndexError] == 0
+    assert policy.dict()['cached'] == 6
+    
+    policy._rules = {}
+    assert policy.weight(KeyError()) == 2
+    
+    with pytest.raises(AttributeError):
+        FailurePolicy(exclude=(ValueError, "TypeError"))
+
+def test_predicates():
+    """
+    Predicates can ignore exceptions, and fail on return values.
+    """
+    policy = FailurePolicy(
+        exception=lambda e: getattr(e, "status", 500) >= 500,
+        result=lambda response: response.status == 503,
+        result_weight=2)
+    
+    assert policy.weight(HTTPError(404)) == 0
+    assert policy.weight(HTTPError(502)) == 1
+    assert policy.weight(ValueError()) == 1
+    
+    assert policy.result_failure(Response(503)) == 2
+    assert policy.result_failure(Response(200)) == 0
+    
+    assert FailurePolicy().result_failure(None) == 0
+
+def test_ignored():
+    """
+    Ignored exceptions never reach the driver.
+    """
+    driver = CountingDriver()
+    policy = FailurePolicy(exclude=(ValueError,))
+    
+    breaker = CircuitBreaker(driver, raises(ValueError("bad input")), "partner", failures=2, policy=policy)
+    
+    for i in range(5):
+        with pytest.raises(ValueError):
+            breaker()
+    
+    assert driver.writes == 0
+    assert breaker.failures == 0
+    assert breaker.status == STATUS_CLOSED
+
+def test_weighted():
+    """
+    Weighted failures trip the breaker sooner, including parents.
+    """
+    driver = CountingDriver()
+    policy = FailurePolicy(weights={TimeoutError: 3})
+    
+    parent = CircuitBreaker(driver, None, "host", failures=10)
+    breaker = CircuitBreaker(driver, raises(TimeoutError()), "partner", failures=5, parent=parent, policy=policy)
+    
+    for i in range(2):
+        with pytest.raises(TimeoutError):
+            breaker()
+    
+    assert breaker.failures == 6
+    assert parent.failures == 6
+    assert driver.writes == 4
+    
+    with pytest.raises(errors.CircuitBreakerOpen):
+        breaker()
+        
+    assert breaker.status == STATUS_OPEN
+
+def test_result():
+    """
+    A failed result is counted, and still returned.
+    """
+    driver = CountingDriver()
+    policy = FailurePolicy(result=lambda response: response.status == 503)
+    
+    responses = iter([Response(503), Response(503), Response(200)])
+    
+    breaker = CircuitBreaker(driver, lambda: next(responses), "partner", failures=2, timeout=0, jitter=0, policy=policy)
+    
+    assert breaker().status == 503
+    assert breaker().status == 503
+    assert breaker.failures == 2
+    
+    with pytest.raises(errors.CircuitBreakerOpen):
+        breaker()
+        
+    assert breaker().status == 200
+    assert breaker.status == STATUS_CLOSED
+
+def test_guard():
+    """
+    Ignored exceptions don't stop a guard, failed results do.
+    """
+    driver = MemoryDriver()
+    policy = FailurePolicy(exclude=(ValueError,), result=lambda value: value is None)
+    
+    def subject(value):
+        if value < 0:
+            raise ValueError(value)
+        if value == 0:
+            return None
+        return value
+    
+    breaker = CircuitBreaker(driver, subject, "partner", failures=2, policy=policy)
+    
+    results = breaker.map([(-1,), (1,), (0,), (-2,), (0,), (3,), (4,)])
+    
+    assert isinstance(results[0], ValueError)
+    assert results[1] == 1
+    assert results[2] is None
+    assert isinstance(results[3], ValueError)
+    assert results[4] is None
+    assert [type(result) for result in results[5:]] == [errors.CircuitBreakerOpen] * 2
+
+def test_guard_predicates_once():
+    """
+    A guard consults the policy once per call.
+    """
+    seen = {'exception': 0, 'result': 0}
+    
+    def exception(e):
+        seen['exception'] += 1
+        return True
+    
+    def result(value):
+        seen['result'] += 1
+        return value is None
+    
+    def subject(value):
+        if value < 0:
+            raise HTTPError(value)
+        return value or None
+    
+    policy = FailurePolicy(exception=exception, result=result)
+    breaker = CircuitBreaker(MemoryDriver(), subject, "partner", failures=10, policy=policy)
+    
+    with breaker.guard() as guard:
+        assert guard(1) == 1
+        assert guard(0) is None
+        with pytest.raises(HTTPError):
+            guard(-1)
+    
+    assert seen == {'exception': 1, 'result': 2}
+    assert breaker.failures == 2
@@ -0,0 +1,188 @@
+"""
+Unit Tests for the rate limiter.
+"""
+
+from ..ratelimit import RateLimiter
+from ..base import CircuitBreaker, STATUS_OPEN
+from ..drivers import MemoryDriver
+from ..clock import ManualClock
+from .. import errors
+from . import util
+import pytest
+
+class CountingDriver(MemoryDriver):
+    """
+    Counts round trips: loads, token takes, and both at once.
+    """
+    def __init__(self, expires=None, clock=None):
+        MemoryDriver.__init__(self, expires, clock)
+        self.calls = {'load': 0, 'take_tokens': 0, 'load_and_take': 0}
+        
+    def load(self, key):
+        self.calls['load'] += 1
+        return MemoryDriver.load(self, key)
+    
+    def take_tokens(self, key, requested, capacity, rate=0, deposit=0):
+        self.calls['take_tokens'] += 1
+        return MemoryDriver.take_tokens(self, key, requested, capacity, rate, deposit)
+    
+    def load_and_take(self, key, bucket, requested, capacity, rate=0):
+        self.calls['load_and_take'] += 1
+        return MemoryDriver.load_and_take(self, key, bucket, requested, capacity, rate)
+
+def test_rate():
+    """
+    Allow the burst, then the rate.
+    """
+    clock = ManualClock(0)
+    limiter = RateLimiter(MemoryDriver(clock=clock), "partner", rate=4, burst=20)
+    
+    assert sum(limiter.try_acquire() for i in range(30)) == 20
+    
+    clock.advance(0.5)
+    
+    assert sum(limiter.try_acquire() for i in range(30)) == 2
+    
+    with pytest.raises(errors.RateLimitExceeded):
+        limiter.check()
+        
+    with pytest.raises(errors.CircuitBreakerOpen):
+        limiter.check()
+        
+    assert limiter.acquire(timeout=1)
+    assert clock.now() == 0.75
+    
+def test_lease():
+    """
+    Tokens are leased in batches, and leases go stale.
+    """
+    clock = ManualClock(0)
+    driver = CountingDriver(clock=clock)
+    limiter = RateLimiter(driver, "partner", rate=0, burst=100, lease=10, lease_time=1)
+    
+    assert all(limiter.try_acquire() for i in range(50))
+    assert driver.calls['take_tokens'] == 5
+    
+    limiter.try_acquire()
+    clock.advance(1)
+    limiter.try_acquire()
+    
+    # 9 tokens were dropped
+    assert driver.buckets["partner"]['tokens'] == 100 - 70
+    assert limiter.dict()['round_trips'] == 7
+    
+def test_breaker():
+    """
+    A breaker with a limiter loads its state and leases tokens together.
+    """
+    clock = ManualClock(0)
+    driver = CountingDriver(clock=clock)
+    limiter = RateLimiter(driver, "partner", rate=1, burst=5, lease=5)
+    
+    breaker = CircuitBreaker(driver=driver, subject=util.succeed, key="partner", limiter=limiter)
+    
+    for i in range(5):
+        assert breaker()
+        
+    # one combined round trip, then four plain loads
+    assert driver.calls['load_and_take'] == 1
+    assert driver.calls['take_tokens'] == 1
+    assert driver.calls['load'] == 1 + 4
+    assert breaker.dict()['limiter'] == "partner"
+    
+    with pytest.raises(errors.RateLimitExceeded):
+        breaker()
+        
+    assert driver.calls['load_and_take'] == 2
+    
+    clock.advance(1)
+    
+    assert breaker()
+    
+def test_guard():
+    """
+    Calls over the limit are rejected, but don't stop a guard.
+    """
+    clock = ManualClock(0)
+    driver = MemoryDriver(clock=clock)
+    limiter = RateLimiter(driver, "partner", rate=2, burst=2)
+    
+    breaker = CircuitBreaker(driver=driver, subject=lambda x: x, key="partner", limiter=limiter)
+    
+    results = breaker.map([(i,) for i in range(4)])
+    
+    assert results[:2] == [0, 1]
+    assert all(isinstance(r, errors.RateLimitExceeded) for r in results[2:])
+    
+    with breaker.guard() as guard:
+        clock.advance(0.5)
+        assert guard(1) == 1
+        assert not guard.tripped
+
+def test_zero_rate():
+    """
+    A rate of 0 is a bucket that's never refilled: acquire() doesn't wait.
+    Negative rates are refused.
+    """
+    clock = ManualClock(0)
+    limiter = RateLimiter(MemoryDriver(clock=clock), "partner", rate=0, burst=1)
+    
+    assert limiter.acquire(timeout=5)
+    assert not limiter.acquire(timeout=5)
+    assert clock.now() == 0
+    
+    with pytest.raises(ValueError):
+        RateLimiter(MemoryDriver(), "partner", rate=-1)
+
+def test_unlocked_round_trips():
+    """
+    The limiter's lock isn't held while the driver is called.
+    """
+    held = []
+    
+    class CheckingDriver(MemoryDriver):
+        def take_tokens(self, key, requested, capacity, rate=0, deposit=0):
+            held.append(limiter._lock.locked())
+            return MemoryDriver.take_tokens(self, key, requested, capacity, rate, deposit)
+        
+        def load_and_take(self, key, bucket, requested, capacity, rate=0):
+            held.append(limiter._lock.locked())
+            return MemoryDriver.load_and_take(self, key, bucket, requested, capacity, rate)
+    
+    driver = CheckingDriver()
+    limiter = RateLimiter(driver, "partner", rate=10)
+    breaker = CircuitBreaker(driver=driver, subject=util.succeed, key="partner", limiter=limiter)
+    
+    assert limiter.try_acquire()
+    assert breaker()
+    assert held and not any(held)
+
+def test_open_breaker_refund():
+    """
+    Calls turned away by an open breaker give their token back.
+    """
+    clock = ManualClock(0)
+    driver = MemoryDriver(clock=clock)
+    limiter = RateLimiter(driver, "partner", rate=0, burst=3, lease=3, lease_time=60)
+    
+    breaker = CircuitBreaker(driver=driver, subject=util.succeed, key="partner", limiter=limiter, timeout=10, jitter=0)
+    breaker.load()
+    breaker.open()
+    
+    for i in range(5):
+        with pytest.raises(errors.CircuitBreakerOpen):
+            breaker()
+    
+    with breaker.guard() as guard:
+        for i in range(5):
+            with pytest.raises(errors.CircuitBreakerOpen):
+                guard()
+    
+    assert limiter.allowed == 0
+    assert limiter.tokens == 3
+    
+    clock.advance(10)
+    
+    # the retry after the timeout takes one
+    assert breaker()
+    assert limiter.allowed == 1
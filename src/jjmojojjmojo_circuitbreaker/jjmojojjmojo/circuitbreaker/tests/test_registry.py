@@ -0,0 +1,131 @@
+"""
+Unit Tests for the driver registry and lazy imports.
+"""
+
+from .. import registry
+from ..cli import parser, make_driver
+from ..drivers import MemoryDriver, RedisDriver
+import os
+import subprocess
+import sys
+import pytest
+
+def test_memory_url():
+    """
+    Options can come from the query string, keyword arguments win.
+    """
+    driver = registry.from_url("memory://?expires=180&snapshot_interval=0.5&fork=keep")
+
+    assert isinstance(driver, MemoryDriver)
+    assert driver.expires == 180
+    assert driver.snapshot_interval == 0.5
+    assert driver.fork == "keep"
+    assert driver.max_entries is None
+
+    driver = registry.from_url("memory://?expires=60&max_entries=1000&expiry_tick=0.5")
+
+    assert driver.max_entries == 1000
+    assert driver.wheel.tick == 0.5
+
+    assert registry.from_url("MEMORY://?expires=180", expires=5).expires == 5
+
+def test_redis_url():
+    """
+    Driver options are taken out of the query string, the rest is left for
+    redis.
+    """
+    driver = registry.from_url("redis://localhost:6379/3?prefix=app:&encoding=packed&socket_timeout=0.5", expires=60)
+
+    assert isinstance(driver, RedisDriver)
+    assert driver.prefix == "app:"
+    assert driver.encoding == "packed"
+    assert driver.expires == 60
+
+    kwargs = driver.redis.connection_pool.connection_kwargs
+    assert kwargs['db'] == 3
+    assert kwargs['socket_timeout'] == 0.5
+    assert driver.replicas == []
+
+def test_redis_replica_urls():
+    """
+    Replicas are given with a repeated option.
+    """
+    driver = registry.from_url("redis://primary:6379/0?replica=redis://replica1:6379/0&replica=redis://replica2:6380/0&max_lag=2")
+
+    assert [replica.name for replica in driver.replicas] == ["redis://replica1:6379/0", "redis://replica2:6380/0"]
+    assert driver.replicas[1].redis.connection_pool.connection_kwargs['port'] == 6380
+    assert driver.max_lag == 2
+    assert 'replica' not in driver.redis.connection_pool.connection_kwargs
+
+def test_unknown_scheme():
+    with pytest.raises(ValueError):
+        registry.from_url("nosuchdriver://somewhere")
+
+    with pytest.raises(ValueError):
+        registry.from_url("localhost:6379")
+
+def test_register():
+    """
+    Third-party schemes, registered directly or as (lazily loaded) entry points.
+    """
+    made = []
+
+    def factory(url, **kwargs):
+        made.append((url, kwargs))
+        return MemoryDriver()
+
+    class EntryPoint:
+        loads = 0
+        def load(self):
+            self.loads += 1
+            return factory
+
+    entry_point = EntryPoint()
+
+    registry.register("custom", factory)
+    registry._factories["plugin"] = entry_point
+
+    try:
+        registry.from_url("custom://host/path", option=1)
+        registry.from_url("plugin://host")
+        registry.from_url("plugin://other")
+
+        assert made == [("custom://host/path", {'option': 1}), ("plugin://host", {}), ("plugin://other", {})]
+        assert entry_point.loads == 1
+        assert {"custom", "memory", "plugin", "redis"} <= set(registry.schemes())
+    finally:
+        del registry._factories["custom"]
+        del registry._factories["plugin"]
+
+def test_cli_url():
+    """
+    The command-line tool accepts any driver URL.
+    """
+    opts = parser.parse_args(["--url", "memory://?expires=30", "list"])
+    assert make_driver(opts).expires == 30
+
+    opts = parser.parse_args(["-b", "memory", "-e", "10", "list"])
+    assert isinstance(make_driver(opts), MemoryDriver)
+
+    opts = parser.parse_args(["-r", "redis://localhost:6379/2", "-p", "x:", "list"])
+    assert make_driver(opts).prefix == "x:"
+
+def test_lazy_import():
+    """
+    Importing the package, and using the memory driver, doesn't import redis.
+    """
+    code = "; ".join([
+        "import sys",
+        "import jjmojojjmojo.circuitbreaker as cb",
+        "from jjmojojjmojo.circuitbreaker.registry import from_url",
+        "cb.MemoryCircuitBreaker('key', print)",
+        "from_url('memory://')",
+        "assert 'redis' not in sys.modules, 'redis imported'",
+        "cb.RedisDriver",
+        "assert 'redis' in sys.modules"
+    ])
+
+    # the directory jjmojojjmojo/ is in
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(registry.__file__))))
+
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=root)
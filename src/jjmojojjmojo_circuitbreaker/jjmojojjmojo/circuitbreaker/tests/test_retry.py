@@ -0,0 +1,150 @@
+"""
+Unit Tests for retry budgets and the token bucket driver primitive.
+"""
+
+from ..retry import RetryBudget
+from ..drivers import MemoryDriver, GuardedDriver
+from ..drivers.base import Driver
+from ..clock import ManualClock
+from .. import errors
+from . import util
+import threading
+import pytest
+
+class CountingDriver(MemoryDriver):
+    """
+    Counts calls to take_tokens().
+    """
+    takes = 0
+    
+    def take_tokens(self, key, requested, capacity, rate=0, deposit=0):
+        self.takes += 1
+        return MemoryDriver.take_tokens(self, key, requested, capacity, rate, deposit)
+
+def test_take_tokens():
+    """
+    Buckets start full, refill at the given rate, and accept deposits, up to
+    their capacity.
+    """
+    clock = ManualClock(0)
+    driver = MemoryDriver(clock=clock)
+    
+    assert driver.take_tokens("b", 3, 5) == (3, 2)
+    assert driver.take_tokens("b", 3, 5) == (2, 0)
+    assert driver.take_tokens("b", 3, 5) == (0, 0)
+    
+    clock.advance(1.5)
+    
+    assert driver.take_tokens("b", 3, 5, rate=1) == (1, 0.5)
+    assert driver.take_tokens("b", 0, 5, deposit=100) == (0, 5)
+    
+    with pytest.raises(errors.BackendUnsupportedOperation):
+        Driver().take_tokens("b", 1, 5)
+
+def test_take_tokens_threads():
+    """
+    Tokens are never handed out twice.
+    """
+    driver = MemoryDriver()
+    granted = []
+    
+    def take():
+        for i in range(1000):
+            granted.append(driver.take_tokens("b", 1, 5000)[0])
+            
+    threads = [threading.Thread(target=take) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+        
+    assert sum(granted) == 5000
+
+def test_budget():
+    """
+    Retries are limited to the ratio of successes, plus what's in the bucket.
+    """
+    clock = ManualClock(0)
+    driver = CountingDriver(clock=clock)
+    
+    budget = RetryBudget(driver, "svc", ratio=0.1, minimum=0, capacity=10, prefetch=5, deposit_batch=10)
+    
+    # the bucket starts full
+    assert sum(budget.can_retry() for i in range(20)) == 10
+    
+    for i in range(100):
+        budget.success()
+        
+    assert sum(budget.can_retry() for i in range(20)) == 10
+    assert budget.denied == 20
+    
+    # a lease per 5 tokens, a lease per denial, and a deposit per 10 successes
+    assert driver.takes == (2 + 10) + 10 + (2 + 10)
+    
+def test_budget_call():
+    """
+    call() retries failures while the budget allows.
+    """
+    driver = MemoryDriver()
+    budget = RetryBudget(driver, "svc", minimum=0, capacity=2, prefetch=1)
+    
+    failer = util.IntermittentFailer(to_return="ok", pattern=[False, False, True])
+    
+    assert budget.call(failer, attempts=3) == "ok"
+    assert budget.retries == 2
+    
+    with pytest.raises(Exception):
+        budget.call(util.fail, attempts=5)
+        
+    assert budget.retries == 2
+    assert budget.denied == 1
+    
+def test_budget_call_open():
+    """
+    An open breaker fails fast: it isn't retried, and spends no tokens.
+    """
+    budget = RetryBudget(MemoryDriver(), "svc", minimum=0, capacity=5, prefetch=1)
+    calls = []
+    
+    def subject():
+        calls.append(1)
+        raise errors.CircuitBreakerOpen()
+    
+    with pytest.raises(errors.CircuitBreakerOpen):
+        budget.call(subject, attempts=3)
+        
+    assert len(calls) == 1
+    assert budget.retries == 0
+    assert budget.round_trips == 0
+
+def test_budget_call_attempts():
+    """
+    At least one attempt is required.
+    """
+    budget = RetryBudget(MemoryDriver(), "svc")
+    
+    for attempts in (0, -1):
+        with pytest.raises(ValueError):
+            budget.call(util.succeed, attempts=attempts)
+    
+    assert budget.call(util.succeed, attempts=1)
+
+def test_budget_backend_problem():
+    """
+    No retries without the back-end.
+    """
+    class BrokenDriver(MemoryDriver):
+        def take_tokens(self, key, requested, capacity, rate=0, deposit=0):
+            raise errors.DistributedBackendProblem()
+    
+    budget = RetryBudget(BrokenDriver(), "svc", deposit_batch=1)
+    
+    assert not budget.can_retry()
+    
+    budget.success()
+    
+    guarded = GuardedDriver(BrokenDriver(), deadline=None, policy="fail-open")
+    
+    assert RetryBudget(guarded, "svc").can_retry()
+    
+    guarded.stop()
@@ -0,0 +1,201 @@
+"""
+Unit Tests for the clock module and the discrete-event simulator.
+"""
+
+from ..clock import Clock, ManualClock, SyncedClock, SYSTEM_CLOCK
+from ..simulation import Simulation, Outage, RecordedTrace
+from ..drivers import MemoryDriver
+from ..base import CircuitBreaker
+import random
+import time
+import pytest
+
+def test_clocks():
+    """
+    The system clock follows time.time(), the manual clock only moves when told.
+    """
+    assert abs(Clock().now() - time.time()) < 1
+    assert MemoryDriver().clock is SYSTEM_CLOCK
+    
+    clock = ManualClock(10)
+    
+    assert clock.now() == 10
+    
+    clock.sleep(5)
+    clock.advance(0.5)
+    
+    assert clock.now() == 15.5
+
+def test_synced_clock():
+    """
+    A synced clock applies the offset to the reference, and only re-syncs once
+    per interval.
+    """
+    local = ManualClock(100)
+    calls = []
+    
+    def source():
+        calls.append(local.now())
+        return local.now() + 3.5
+    
+    clock = SyncedClock(source, interval=60, samples=2, local=local)
+    
+    assert clock.now() == 103.5
+    assert clock.skew == 3.5
+    assert len(calls) == 2
+    
+    for i in range(50):
+        local.advance(1)
+        clock.now()
+    
+    assert len(calls) == 2
+    
+    local.advance(10)
+    clock.now()
+    
+    assert len(calls) == 4
+    assert clock.stats()['syncs'] == 2
+    
+def test_synced_clock_error():
+    """
+    When the reference can't be read, the last offset is kept, and the sync
+    isn't retried until the next interval.
+    """
+    local = ManualClock(0)
+    reference = {'offset': -2, 'broken': False}
+    
+    def source():
+        if reference['broken']:
+            raise RuntimeError("no time for you")
+        return local.now() + reference['offset']
+    
+    clock = SyncedClock(source, interval=10, local=local)
+    
+    assert clock.now() == -2
+    
+    reference['broken'] = True
+    local.advance(10)
+    
+    assert clock.now() == 8
+    assert clock.now() == 8
+    assert clock.stats()['errors'] == 1
+    
+def test_driver_sync_clock():
+    """
+    A driver's clock can be synced to the back-end. Breakers on hosts with
+    skewed clocks then agree on when the timeout has passed.
+    """
+    backend = ManualClock(1000)
+    
+    class SkewedDriver(MemoryDriver):
+        def server_time(self):
+            return backend.now()
+    
+    fast = SkewedDriver(clock=ManualClock(1005))
+    fast.state = {}
+    slow = SkewedDriver(clock=ManualClock(995))
+    slow.state = fast.state
+    
+    breaker = CircuitBreaker(driver=slow, subject=None, key="test", timeout=10, jitter=lambda: 0)
+    breaker.open()
+    
+    # unsynced, the fast host thinks the timeout has already passed
+    assert fast.now() - fast.state["test"]["checkin"] == 10
+    
+    for driver in (fast, slow):
+        clock = driver.sync_clock(interval=30)
+        assert isinstance(clock, SyncedClock)
+    
+    slow.open("test")
+    
+    assert fast.now() - fast.state["test"]["checkin"] == 0
+    assert fast.clock.skew == -5
+    assert slow.clock.skew == 5
+    
+def test_breaker_uses_driver_clock():
+    """
+    The breaker's initial checkin comes from the driver's clock.
+    """
+    clock = ManualClock(42)
+    breaker = CircuitBreaker(driver=MemoryDriver(clock=clock), subject=None, key="test")
+    
+    assert breaker.checkin == 42
+
+def test_traces():
+    """
+    Check the synthetic and recorded failure traces.
+    """
+    rng = random.Random(1)
+    
+    outage = Outage(10, 20)
+    
+    assert not outage(9.9, rng)
+    assert outage(10, rng)
+    assert not outage(20, rng)
+    
+    recorded = RecordedTrace([(1000, 0), (1010, 1), (1020, 0.5), (1030, 0)])
+    
+    assert not recorded(-1, rng)
+    assert not recorded(5, rng)
+    assert recorded(15, rng)
+    assert 400 < sum(recorded(25, rng) for i in range(1000)) < 600
+    assert not recorded(100, rng)
+
+def test_recorded_from_file(tmp_path):
+    """
+    Load a trace from a CSV file.
+    """
+    path = tmp_path / "trace.csv"
+    path.write_text("100,0\n110,1\n120,0\n")
+    
+    trace = RecordedTrace.from_file(str(path))
+    
+    assert trace.times == [0, 10, 20]
+    assert trace.rates == [0, 1, 0]
+
+def test_hour_long_outage():
+    """
+    A 30 minute outage in an hour of traffic from 1000 clients. How long the
+    replay takes is measured by func/benchmark_simulation.py.
+    """
+    simulation = Simulation(Outage(600, 2400), clients=1000, interval=60, duration=3600, seed=1)
+    
+    result = simulation.run()
+    
+    assert 55000 < result.calls < 65000
+    assert result.calls == result.successes + result.failures + result.rejected
+    
+    # trips shortly after the outage starts
+    assert 600 <= result.first("open") < 610
+    
+    # nothing fails or is rejected before the outage, or after it has ended
+    assert sum(b['failures'] + b['rejected'] for b in result.timeline[:10]) == 0
+    assert sum(b['failures'] + b['rejected'] for b in result.timeline[41:]) == 0
+    
+    # most calls during the outage are rejected by the breaker
+    during = result.timeline[10:40]
+    assert sum(b['rejected'] for b in during) > sum(b['failures'] for b in during)
+
+def test_repeatable():
+    """
+    The same seed produces the same run.
+    """
+    first = Simulation(Outage(60, 120), clients=50, duration=300, seed=7).run()
+    second = Simulation(Outage(60, 120), clients=50, duration=300, seed=7).run()
+    
+    assert first.dict() == second.dict()
+    assert first.transitions == second.transitions
+
+def test_ramp():
+    """
+    With a ramp, breakers ease back into traffic after the outage instead of
+    closing at once, and the run is still repeatable.
+    """
+    first = Simulation(Outage(60, 120), clients=50, duration=300, seed=7, ramp=30).run()
+    second = Simulation(Outage(60, 120), clients=50, duration=300, seed=7, ramp=30).run()
+    
+    assert first.first("ramp") >= 120
+    assert first.first("close") >= first.first("ramp") + 30
+    
+    assert first.dict() == second.dict()
+    assert first.transitions == second.transitions
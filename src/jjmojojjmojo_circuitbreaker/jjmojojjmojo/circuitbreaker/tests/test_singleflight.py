@@ -0,0 +1,176 @@
+"""
+Unit Tests for request coalescing.
+"""
+
+from ..singleflight import SingleFlight, AsyncSingleFlight
+from ..base import CircuitBreaker
+from ..drivers import MemoryDriver, GuardedDriver
+from ..drivers.redis import RedisDriver
+from . import util
+import asyncio
+import threading
+import time
+import pytest
+
+class GatedDriver(MemoryDriver):
+    """
+    A driver whose loads don't return until `waiting` other threads have
+    joined the load in flight (or a second has passed), and are counted.
+    """
+    def __init__(self, waiting=0):
+        MemoryDriver.__init__(self)
+        self.waiting = waiting
+        self.loads = 0
+
+    def load(self, key):
+        self.loads += 1
+
+        deadline = time.time() + 1
+        while self.flights.shared < self.waiting and time.time() < deadline:
+            time.sleep(0.001)
+
+        return MemoryDriver.load(self, key)
+
+def burst(count, func):
+    """
+    Call func from count threads at once, return the results.
+    """
+    results = [None] * count
+    barrier = threading.Barrier(count)
+
+    def run(index):
+        barrier.wait()
+        try:
+            results[index] = func()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+def test_single_flight():
+    """
+    Concurrent calls for a key share one call, and its exception.
+    """
+    flights = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def work(value):
+        calls.append(value)
+        release.wait(1)
+        if value == "error":
+            raise util.Failure("shared")
+        return value
+
+    def release_when_joined():
+        while flights.shared < 7:
+            time.sleep(0.001)
+        release.set()
+
+    threading.Thread(target=release_when_joined).start()
+
+    assert burst(8, lambda: flights.do("key", work, "value")) == ["value"] * 8
+    assert calls == ["value"]
+    assert flights.dict() == {'calls': 1, 'shared': 7, 'in_flight': 0}
+
+    release.clear()
+    flights.shared = 0
+    threading.Thread(target=release_when_joined).start()
+
+    results = burst(8, lambda: flights.do("key", work, "error"))
+
+    assert all(isinstance(result, util.Failure) for result in results)
+    assert calls == ["value", "error"]
+
+    # calls that don't overlap aren't shared
+    release.set()
+    assert flights.do("key", work, "again") == "again"
+    assert flights.do("other", work, "other") == "other"
+    assert flights.calls == 4
+
+def test_breaker_burst():
+    """
+    A burst of calls to one breaker reads its state from the back-end once.
+    """
+    driver = GatedDriver(waiting=31)
+    driver.new("partner")
+
+    breaker = CircuitBreaker(driver, util.succeed, "partner", coalesce=True)
+
+    results = burst(32, breaker)
+
+    assert not any(isinstance(result, Exception) for result in results)
+    assert driver.loads == 1
+
+    # without coalescing, every call reads
+    driver = GatedDriver()
+    driver.new("partner")
+    breaker = CircuitBreaker(driver, util.succeed, "partner", coalesce=False)
+
+    burst(32, breaker)
+
+    assert driver.loads == 32
+
+def test_breaker_default():
+    """
+    Breakers coalesce loads by default only for drivers that do I/O.
+    """
+    redis_driver = RedisDriver(redis_url="redis://127.0.0.1:1/0")
+    guarded = GuardedDriver(redis_driver)
+
+    assert not CircuitBreaker(MemoryDriver(), util.succeed, "partner").coalesce
+    assert CircuitBreaker(redis_driver, util.succeed, "partner").coalesce
+    assert CircuitBreaker(guarded, util.succeed, "partner").coalesce
+    assert not CircuitBreaker(redis_driver, util.succeed, "partner", coalesce=False).coalesce
+
+    guarded.stop()
+
+def test_async_single_flight():
+    """
+    Concurrent tasks share one call, and cancelling a waiting task doesn't
+    cancel the call.
+    """
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        if value == "error":
+            raise util.Failure("shared")
+        return value
+
+    async def main():
+        results = await asyncio.gather(*[flights.do("key", work, "value") for i in range(10)])
+        assert results == ["value"] * 10
+
+        results = await asyncio.gather(*[flights.do("key", work, "error") for i in range(3)], return_exceptions=True)
+        assert all(isinstance(result, util.Failure) for result in results)
+
+        leader = asyncio.ensure_future(flights.do("key", work, "cancel"))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flights.do("key", work, "cancel"))
+        await asyncio.sleep(0)
+
+        waiter.cancel()
+        assert await leader == "cancel"
+
+        leader = asyncio.ensure_future(flights.do("key", work, "cancel"))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flights.do("key", work, "cancel"))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(main())
+
+    assert calls == ["value", "error", "cancel", "cancel"]
+    assert flights.dict() == {'calls': 4, 'shared': 13, 'in_flight': 0}
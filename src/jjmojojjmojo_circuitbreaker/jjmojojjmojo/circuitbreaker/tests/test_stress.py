@@ -0,0 +1,115 @@
+"""
+Unit Tests for the driver contention harness.
+
+Runs against redis (threads and processes) are in the func/ directory.
+"""
+
+from ..stress import Stress, History, Operation, OP_FAILURE, OP_OPEN, OP_CLOSE
+from ..base import STATUS_OPEN, STATUS_CLOSED
+from ..drivers import MemoryDriver
+import time
+import pytest
+
+class RacyDriver(MemoryDriver):
+    """
+    Reads, then writes, without a lock: concurrent calls overwrite each other.
+    """
+    def failure(self, key, amount=1):
+        failures = self.state[key]['failures'] + amount
+        time.sleep(0.0001)
+        self.state[key]['failures'] = failures
+        return failures
+
+    def transition(self, key, expected, status, failures=None):
+        if self.state[key]['status'] not in expected:
+            return False
+        time.sleep(0.0001)
+        self.state[key]['status'] = status
+        return True
+
+def test_memory_driver():
+    """
+    The memory driver doesn't lose updates, or transition twice.
+    """
+    stress = Stress(url="memory://", operations=300, seed=1)
+
+    for workers in (1, 8):
+        history = stress.run(workers)
+
+        assert len(history.operations) == 300 * workers
+        assert history.errors == 0
+        assert history.check() == []
+        assert history.throughput > 0
+        assert history.latency(0.5) <= history.latency(0.99)
+        assert history.dict()['anomalies'] == []
+
+    with pytest.raises(ValueError):
+        stress.run(2, processes=True)
+
+def test_racy_driver():
+    """
+    A driver that isn't safe is caught.
+    """
+    stress = Stress(driver=RacyDriver(), operations=200, seed=1)
+
+    anomalies = stress.run(8).check()
+
+    assert any(anomaly.startswith("lost increments") for anomaly in anomalies)
+
+    # without closes, any second open is one too many
+    stress = Stress(driver=RacyDriver(), operations=20, mix={OP_OPEN: 1}, seed=1)
+
+    anomalies = stress.run(8).check()
+
+    assert any(anomaly.startswith("double transitions") for anomaly in anomalies)
+
+    with pytest.raises(AttributeError):
+        stress.run(2, processes=True)
+
+def test_check():
+    """
+    Operations that raised widen what's acceptable.
+    """
+    operations = [
+        Operation(0, OP_FAILURE, 0, 1, 1),
+        Operation(1, OP_FAILURE, 0, 1, 2),
+        Operation(0, OP_OPEN, 1, 2, True),
+        Operation(1, OP_OPEN, 1, 2, False),
+        Operation(2, OP_FAILURE, 1, 2, RuntimeError("timeout")),
+        Operation(2, OP_CLOSE, 2, 3, RuntimeError("timeout"))
+    ]
+
+    assert History(3, operations, {'failures': 3, 'status': STATUS_OPEN}).check() == []
+    assert History(3, operations, {'failures': 2, 'status': STATUS_CLOSED}).check() == []
+
+    assert History(3, operations, {'failures': 1, 'status': STATUS_OPEN}).check() == [
+        "lost increments: 2 failure() calls succeeded, the count is 1"]
+
+    operations[1].result = 1
+    operations[3].result = True
+    operations[5].result = False
+
+    assert History(3, operations, {'failures': 2, 'status': STATUS_OPEN}).check() == [
+        "lost increments: 1 failure() calls returned a count another call also returned",
+        "double transitions: opened 2 times, closed 0 times, ended OPEN"]
+
+    # doubled opens and closes that cancel out
+    operations = [
+        Operation(0, OP_OPEN, 0, 1, True),
+        Operation(1, OP_OPEN, 0.5, 1.5, True),
+        Operation(0, OP_CLOSE, 2, 3, True),
+        Operation(1, OP_CLOSE, 4, 5, True),
+        Operation(2, OP_OPEN, 6, 7, True)
+    ]
+
+    assert History(3, operations, {'failures': 0, 'status': STATUS_OPEN}).check() == [
+        "double transitions: 2 transitions repeated the one before, with no other transition in between"]
+
+    # overlapping calls can be ordered open, close, open
+    operations = [
+        Operation(0, OP_OPEN, 0, 2, True),
+        Operation(1, OP_OPEN, 0.5, 1, True),
+        Operation(2, OP_CLOSE, 0.8, 0.9, True)
+    ]
+
+    assert History(3, operations, {'failures': 0, 'status': STATUS_OPEN}).check() == []
@@ -0,0 +1,139 @@
+"""
+Unit Tests for tracing.
+"""
+
+from ..tracing import Tracer, SpanRecorder
+from ..base import CircuitBreaker
+from ..clock import ManualClock
+from ..drivers import MemoryDriver, TracedDriver
+from ..errors import CircuitBreakerOpen
+from . import util
+import pytest
+
+@pytest.fixture
+def recorder():
+    return SpanRecorder()
+
+def names(recorder):
+    return [(span.name, span.parent) for span in recorder.spans]
+
+def test_call_spans(recorder):
+    """
+    A call is a span, with the subject and each driver operation inside it.
+    """
+    tracer = Tracer(recorder)
+    driver = TracedDriver(MemoryDriver(), tracer)
+    breaker = CircuitBreaker(driver, util.succeed, "traced", failures=1, tracer=tracer)
+
+    assert breaker() is True
+
+    assert names(recorder) == [
+        ("circuitbreaker.driver.expire", "circuitbreaker.call"),
+        ("circuitbreaker.driver.load", "circuitbreaker.call"),
+        ("circuitbreaker.driver.new", "circuitbreaker.call"),
+        ("circuitbreaker.subject", "circuitbreaker.call"),
+        ("circuitbreaker.call", None)]
+
+    call = recorder.spans[-1]
+    assert call.attributes == {"circuitbreaker.key": "traced", "circuitbreaker.status": "CLOSED"}
+    assert recorder.spans[0].attributes == {"circuitbreaker.key": "traced", "circuitbreaker.driver": "MemoryDriver"}
+    assert call.duration >= sum(span.duration for span in list(recorder.spans)[:-1])
+
+    recorder.clear()
+    breaker.subject = util.fail
+
+    with pytest.raises(Exception):
+        breaker()
+
+    assert names(recorder)[-3:] == [
+        ("circuitbreaker.subject", "circuitbreaker.call"),
+        ("circuitbreaker.driver.failure", "circuitbreaker.call"),
+        ("circuitbreaker.call", None)]
+    assert recorder.spans[-3].error == "Exception()"
+
+    recorder.clear()
+
+    with pytest.raises(CircuitBreakerOpen):
+        breaker()
+
+    assert ("circuitbreaker.driver.transition", "circuitbreaker.call") in names(recorder)
+    assert recorder.spans[-1].attributes["circuitbreaker.status"] == "OPEN"
+    assert "CircuitBreakerOpen" in recorder.spans[-1].error
+
+def test_sampling(recorder):
+    """
+    A trace is recorded completely, or not at all.
+    """
+    tracer = Tracer(recorder, sample_rate=0.5)
+    tracer._random = util.cycle([0.1, 0.9]).__next__
+
+    driver = TracedDriver(MemoryDriver(), tracer)
+    breaker = CircuitBreaker(driver, util.succeed, "sampled", tracer=tracer)
+
+    for i in range(4):
+        breaker()
+
+    assert tracer.sampled == 2
+    assert tracer.skipped == 2
+    assert [span.name for span in recorder.spans].count("circuitbreaker.call") == 2
+    assert [span.name for span in recorder.spans].count("circuitbreaker.subject") == 2
+    assert not tracer.recording()
+
+    # driver operations outside a call are traces of their own
+    recorder.clear()
+    driver.reset("sampled")
+    driver.reset("sampled")
+
+    assert names(recorder) == [("circuitbreaker.driver.reset", None)]
+
+    with pytest.raises(ValueError):
+        Tracer(recorder, sample_rate=2)
+
+def test_disabled():
+    """
+    Without a tracer, nothing is traced, and the driver isn't wrapped.
+    """
+    driver = MemoryDriver()
+    breaker = CircuitBreaker(driver, util.succeed, "untraced")
+
+    assert breaker() is True
+    assert breaker.driver is driver
+    assert breaker.dict()['tracer'] is None
+
+    tracer = Tracer(SpanRecorder(), sample_rate=0)
+    breaker = CircuitBreaker(driver, util.succeed, "untraced", tracer=tracer)
+
+    assert breaker() is True
+    assert not tracer.backend.spans
+    assert breaker.dict()['tracer']['skipped'] == 1
+
+def test_sync_clock(recorder):
+    """
+    Syncing the clock syncs the wrapped driver's, which now() reads.
+    """
+    backend = ManualClock(1000)
+
+    class Backend(MemoryDriver):
+        def server_time(self):
+            return backend.now()
+
+    driver = TracedDriver(Backend(clock=ManualClock(995)), Tracer(recorder))
+    clock = driver.sync_clock(interval=30)
+
+    assert driver.now() == 1000
+    assert driver.driver.clock is clock
+    assert clock.skew == 5
+
+def test_opentelemetry():
+    """
+    Spans go to the global OpenTelemetry tracer by default.
+    """
+    trace = pytest.importorskip("opentelemetry.trace")
+
+    tracer = Tracer()
+
+    assert callable(tracer.backend.start_as_current_span)
+
+    breaker = CircuitBreaker(MemoryDriver(), util.succeed, "otel", tracer=tracer)
+
+    assert breaker() is True
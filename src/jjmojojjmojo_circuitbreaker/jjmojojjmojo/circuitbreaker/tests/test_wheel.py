@@ -0,0 +1,86 @@
+"""
+Unit Tests for the timing wheel.
+"""
+
+from ..drivers.wheel import TimingWheel
+import random
+import pytest
+
+def test_fire():
+    """
+    Keys fire at their deadline, however far away it is.
+    """
+    wheel = TimingWheel(tick=1, slots=4, levels=3, now=10)
+    
+    wheel.schedule("soon", 12)
+    wheel.schedule("later", 25)
+    wheel.schedule("much later", 60)
+    wheel.schedule("past", 5)
+    
+    assert len(wheel) == 4
+    
+    assert wheel.advance(10) == []
+    assert wheel.advance(11) == ["past"]
+    assert wheel.advance(12.5) == ["soon"]
+    assert wheel.advance(24) == []
+    assert wheel.advance(25) == ["later"]
+    assert wheel.advance(59) == []
+    assert wheel.advance(60) == ["much later"]
+    assert len(wheel) == 0
+    
+def test_cancel():
+    wheel = TimingWheel(tick=0.5, slots=4, levels=2)
+    
+    wheel.schedule("a", 3)
+    wheel.schedule("b", 3)
+    wheel.schedule("a", 5)
+    
+    assert wheel.cancel("b")
+    assert not wheel.cancel("b")
+    assert "a" in wheel
+    
+    assert wheel.advance(4.5) == []
+    assert wheel.advance(5) == ["a"]
+    
+def test_range():
+    """
+    Deadlines beyond the wheel's range fire at the end of it. A long jump
+    fires everything.
+    """
+    wheel = TimingWheel(tick=1, slots=2, levels=2)
+    
+    wheel.schedule("far", 100)
+    
+    assert wheel.advance(3) == ["far"]
+    
+    wheel.schedule("a", 4)
+    wheel.schedule("b", 6)
+    
+    assert sorted(wheel.advance(1000)) == ["a", "b"]
+    
+    with pytest.raises(ValueError):
+        TimingWheel(tick=0)
+        
+def test_random():
+    """
+    Nothing fires early or late, whatever the order of operations.
+    """
+    rng = random.Random(1)
+    wheel = TimingWheel(tick=1, slots=4, levels=3)
+    due = {}
+    now = 0
+    
+    for i in range(5000):
+        if rng.random() < 0.5:
+            key = rng.randint(0, 100)
+            due[key] = now + rng.randint(1, 63)
+            wheel.schedule(key, due[key])
+        else:
+            now += rng.randint(0, 6)
+            
+            for key in wheel.advance(now):
+                assert due.pop(key) <= now
+                
+            assert all(deadline > now for deadline in due.values())
+            
+    assert len(wheel) == len(due)
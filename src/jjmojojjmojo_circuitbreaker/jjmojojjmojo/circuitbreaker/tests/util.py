@@ -138,7 +138,7 @@ class AlwaysFailDriver(MemoryDriver):
         """
         fail_on: string, indicates when the driver should fail. Possible values are:
                     - "load", when the load() method is called
-                    - "update", when the update() method is called
+                    - "update", when the update() or transition() method is called
                     - "failure", when the failure() method is called
                     - "all" when any of the three above methods are called.
         """
@@ -158,8 +158,50 @@ class AlwaysFailDriver(MemoryDriver):
         else:
             return MemoryDriver.update(self, key, failures=failures, status=status, checkin=checkin)
         
-    def failure(self, key):
+    def transition(self, key, expected, status, failures=None):
+        if self.fail_on in ("update", "all"):
+            raise errors.DistributedBackendProblem()
+        else:
+            return MemoryDriver.transition(self, key, expected, status, failures)
+        
+    def failure(self, key, amount=1):
         if self.fail_on in ("failure", "all"):
             raise errors.DistributedBackendProblem()
         else:
-            return MemoryDriver.failure(self, key)
\ No newline at end of file
+            return MemoryDriver.failure(self, key, amount)
+
+class SlowDriver(MemoryDriver):
+    """
+    A driver that takes a configurable amount of time to respond, and counts
+    the calls made to it.
+    """
+    def __init__(self, expires=None, delay=0):
+        """
+        delay: number, seconds to sleep before every load(), update(), 
+               transition() or failure().
+        """
+        MemoryDriver.__init__(self, expires)
+        
+        self.delay = delay
+        self.calls = 0
+        
+    def _wait(self):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+    
+    def load(self, key):
+        self._wait()
+        return MemoryDriver.load(self, key)
+        
+    def update(self, key, failures=None, status=None, checkin=None):
+        self._wait()
+        return MemoryDriver.update(self, key, failures=failures, status=status, checkin=checkin)
+        
+    def transition(self, key, expected, status, failures=None):
+        self._wait()
+        return MemoryDriver.transition(self, key, expected, status, failures)
+        
+    def failure(self, key, amount=1):
+        self._wait()
+        return MemoryDriver.failure(self, key, amount)
@@ -0,0 +1,250 @@
+"""
+Tracing spans for breaker calls and driver operations.
+
+When a call through a breaker is slow, the time could have gone to the
+back-end (expire, load, failure...), to the subject, or to the breaker itself.
+A Tracer records a span for each of them:
+
+    tracer = Tracer(sample_rate=0.01)
+
+    driver = TracedDriver(RedisDriver(redis_url="redis://localhost"), tracer)
+    breaker = CircuitBreaker(driver, call_partner, "partner-api", tracer=tracer)
+
+Every breaker call is a "circuitbreaker.call" span, with the subject in a
+"circuitbreaker.subject" span, and each driver operation (see TracedDriver) in
+a "circuitbreaker.driver.<method>" span inside it.
+
+Spans are started through an OpenTelemetry tracer: anything with a
+start_as_current_span(name, attributes=None) method that returns a context
+manager. By default the global OpenTelemetry tracer provider is used, which
+needs opentelemetry-api installed. SpanRecorder keeps spans in memory instead,
+for tests and for quick measurements without a collector.
+
+Whether a trace is recorded is decided once, when its outermost span starts:
+the spans inside it follow that decision, so a trace is recorded completely or
+not at all. Breakers without a tracer pay for a single `is None` check per call.
+"""
+
+import collections
+import contextlib
+import random
+import threading
+import time
+
+NAME = "jjmojojjmojo.circuitbreaker"
+
+# entering it does nothing, and it can be entered any number of times
+_NOTHING = contextlib.nullcontext()
+
+class Span:
+    """
+    A span recorded by a SpanRecorder.
+    """
+    __slots__ = ("name", "attributes", "parent", "start", "end", "error")
+
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self):
+        """
+        Seconds the span lasted, or None if it hasn't ended.
+        """
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    def set_attribute(self, name, value):
+        self.attributes[name] = value
+
+    def dict(self):
+        """
+        A representation of this object as a dictionary of simple values.
+        """
+        return {
+            'name': self.name,
+            'attributes': self.attributes,
+            'parent': self.parent,
+            'duration': self.duration,
+            'error': self.error
+        }
+
+class SpanRecorder:
+    """
+    A stand-in for an OpenTelemetry tracer, that keeps the last `size` finished
+    spans in memory.
+    """
+    def __init__(self, size=1000):
+        """
+        size: int, number of finished spans to keep.
+        """
+        self.spans = collections.deque(maxlen=size)
+
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        """
+        Start a span, and record it when the block ends. The parent of a span
+        is the name of the span it was started in, on the same thread.
+        """
+        stack = self._local.__dict__.setdefault("stack", [])
+
+        span = Span(name, attributes, stack[-1].name if stack else None)
+        stack.append(span)
+
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.end = time.perf_counter()
+            stack.pop()
+            self.spans.append(span)
+
+    def clear(self):
+        """
+        Forget the recorded spans.
+        """
+        self.spans.clear()
+
+class _Trace:
+    """
+    The outermost span of a trace. Records the sampling decision for the spans
+    started inside it, on the same thread.
+    """
+    __slots__ = ("local", "span")
+
+    def __init__(self, local, span):
+        self.local = local
+        self.span = span
+
+    def __enter__(self):
+        self.local.sampled = self.span is not None
+
+        if self.span is not None:
+            return self.span.__enter__()
+
+    def __exit__(self, *exc_info):
+        self.local.sampled = None
+
+        if self.span is not None:
+            return self.span.__exit__(*exc_info)
+
+class Tracer:
+    """
+    Starts spans for breakers and drivers, and decides which traces are
+    recorded.
+    """
+    def __init__(self, backend=None, sample_rate=1, name=NAME):
+        """
+        backend: an OpenTelemetry tracer, or anything else with a
+                 start_as_current_span() method, like a SpanRecorder. Defaults
+                 to the tracer from the global OpenTelemetry tracer provider.
+        sample_rate: number, fraction of traces that are recorded, from 0 to 1.
+        name: string, name given to the OpenTelemetry tracer.
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("'sample_rate' must be between 0 and 1")
+
+        if backend is None:
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                raise ImportError("opentelemetry-api is needed for the default backend, install it or pass a backend (e.g. a SpanRecorder)")
+
+            backend = trace.get_tracer(name)
+
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self.sampled = 0
+        self.skipped = 0
+
+        self._local = threading.local()
+        self._random = random.random
+
+    def _sample(self):
+        """
+        Decide whether a new trace is recorded.
+        """
+        if self.sample_rate >= 1 or self._random() < self.sample_rate:
+            self.sampled += 1
+            return True
+
+        self.skipped += 1
+        return False
+
+    def recording(self):
+        """
+        Return True if the current thread is inside a trace that is recorded.
+        """
+        return getattr(self._local, "sampled", None) is True
+
+    def skipping(self):
+        """
+        Return True if the current thread is inside a trace that isn't
+        recorded. Callers can skip starting spans altogether.
+        """
+        return getattr(self._local, "sampled", None) is False
+
+    def span(self, name, key=None, attributes=None):
+        """
+        Return a context manager for a span. Entering it returns the span, or
+        None if it isn't recorded.
+
+        Inside a trace, the span is recorded if the trace is. Otherwise it
+        starts a new trace, and the sample rate decides.
+
+        key: string, the breaker (or bucket, histogram) the span is about,
+             recorded as the "circuitbreaker.key" attribute.
+        attributes: dictionary, more attributes for the span.
+        """
+        sampled = getattr(self._local, "sampled", None)
+
+        if sampled is False:
+            return _NOTHING
+
+        if sampled is None:
+            if not self._sample():
+                return _Trace(self._local, None)
+
+        if key is not None:
+            attributes = dict(attributes or {}, **{"circuitbreaker.key": key})
+
+        span = self.backend.start_as_current_span(name, attributes=attributes)
+
+        if sampled is None:
+            return _Trace(self._local, span)
+
+        return span
+
+    def wrap(self, func, name, key=None, attributes=None):
+        """
+        Return a function that calls func in a span, if the current trace is
+        recorded. Otherwise func is returned as it is.
+        """
+        if not self.recording():
+            return func
+
+        def traced(*args, **kwargs):
+            with self.span(name, key, attributes):
+                return func(*args, **kwargs)
+
+        return traced
+
+    def dict(self):
+        """
+        A representation of this object as a dictionary of simple values.
+        """
+        return {
+            'backend': self.backend.__class__.__name__,
+            'sample_rate': self.sample_rate,
+            'sampled': self.sampled,
+            'skipped': self.skipped
+        }
@@ -0,0 +1,89 @@
+"""
+A transport for httpx, that puts every request behind a breaker for its host.
+
+    import httpx
+    from jjmojojjmojo.circuitbreaker.transports import BreakerTransport
+
+    client = httpx.Client(transport=BreakerTransport("redis://localhost:6379/0"))
+
+    client.get("https://partner.example.com/v1/orders")
+
+It works like the requests adapter (see the adapters module): a breaker per
+origin, one shared driver, 5xx responses and transport errors (connection,
+read and write errors, timeouts, protocol errors) counted as failures, and
+CircuitBreakerOpen raised before the wrapped transport is called. The wrapped
+transport (an httpx.HTTPTransport by default) keeps its connection pool.
+
+Breakers are synchronous, so there is no AsyncClient transport.
+"""
+
+import httpx
+
+from .hosts import HostBreakers
+from .policy import FailurePolicy
+
+def server_error(response):
+    """
+    Return True if the response has a 5xx status.
+    """
+    return response.status_code >= 500
+
+def default_policy():
+    """
+    Count transport errors and 5xx responses as failures.
+    """
+    return FailurePolicy(
+        include=(httpx.NetworkError, httpx.TimeoutException, httpx.ProxyError, httpx.RemoteProtocolError),
+        result=server_error)
+
+class BreakerTransport(httpx.BaseTransport):
+    """
+    Wraps an httpx transport, and sends every request through the breaker for
+    its host.
+    """
+    def __init__(self, driver, transport=None, failures=5, timeout=10, prefix="http:", policy=None, breaker_options=None, **kwargs):
+        """
+        driver: Driver object, or a driver URL (see the registry module).
+        transport: httpx.BaseTransport object, the transport that sends the
+                   requests. Defaults to an httpx.HTTPTransport, created with
+                   the other keyword arguments.
+        failures: int, number of failures that open a host's breaker.
+        timeout: int, seconds a host's breaker stays open.
+        prefix: string, put in front of the origin to make the breaker keys.
+        policy: FailurePolicy object, defaults to default_policy().
+        breaker_options: dictionary, other arguments for every CircuitBreaker
+                         (jitter, ramp, events, tracer...).
+        """
+        if transport is None:
+            transport = httpx.HTTPTransport(**kwargs)
+        elif kwargs:
+            raise ValueError("Transport arguments can't be used with a 'transport'")
+
+        self.transport = transport
+
+        self.breakers = HostBreakers(
+            driver,
+            transport.handle_request,
+            failures=failures,
+            timeout=timeout,
+            prefix=prefix,
+            policy=default_policy() if policy is None else policy,
+            **(breaker_options or {}))
+
+    def breaker(self, url):
+        """
+        Return the breaker for the origin of the given URL.
+        """
+        return self.breakers.for_url(str(url))
+
+    def handle_request(self, request):
+        """
+        Send the request through its host's breaker. Raises CircuitBreakerOpen
+        if the breaker is open.
+        """
+        url = request.url
+
+        return self.breakers.breaker(url.scheme, url.host, url.port)(request)
+
+    def close(self):
+        self.transport.close()